@@ -2,19 +2,151 @@
 import streamlit as st
 import asyncio
 import logging
-from datetime import datetime
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
 
-# 导入自定义模块
+# 导入自定义模块（页面组件、审核相关服务、营销服务和客户接入端点在首次用到时才导入，缩短冷启动时间）
 from config.settings import AppConfig
 from services.dify_api import DifyAPIService
-from services.marketing_service import MarketingService
-from services.state_manager import StateManager
-from components.layout import create_main_layout, create_sidebar
-from components.user_chat import create_user_interface, validate_user_input
-from components.supervisor_chat import create_supervisor_interface
-from components.marketing_generator import create_marketing_interface, create_marketing_page
-from utils.helpers import setup_logging, handle_error, log_user_action, generate_session_id
-from utils.constants import UI_TEXT
+from services.dify_transport import create_transport
+from services.llm_scheduler import LLMScheduler
+from services.state_manager import StateManager, TRANSITION_CONFLICT
+from services.session_store import SessionStore, SESSION_ROLE_CUSTOMER, SESSION_ROLE_SUPERVISOR
+from services.state_backend import StateBackend, create_state_backend
+from utils.helpers import (
+    setup_logging, handle_error, log_user_action, generate_session_id, rerun_fragment
+)
+from utils.render_timing import timed_render, get_render_stats
+from utils.logging_pipeline import set_log_context
+from utils.pii_masker import PIIMasker, create_pii_masker
+from utils.constants import UI_TEXT, METRICS_SIDEBAR_WINDOW
+
+if TYPE_CHECKING:
+    from services.admission_control import AdmissionController
+    from services.answer_library import AnswerLibrary
+    from services.audit_log import AuditLog
+    from services.chat_pipeline import ChatPipeline
+    from services.event_bus import EventBus
+    from services.generation_registry import GenerationRegistry
+    from services.review_metrics import ReviewMetrics
+    from services.search_index import MessageSearchIndex
+    from services.speculative_drafts import SpeculativeDrafter
+
+@st.cache_resource
+def get_audit_log(directory: str, segment_max_bytes: int, commit_interval_ms: int) -> "AuditLog":
+    """获取进程级审计日志实例（所有会话共享同一个写入线程）"""
+    from services.audit_log import AuditLog
+    return AuditLog(directory, segment_max_bytes, commit_interval_ms / 1000)
+
+@st.cache_resource
+def get_dify_transport(mode: str, archive: str, base_url: str, time_scale: float, strict: bool,
+                       _secrets: tuple = ()):
+    """获取进程级Dify传输层（录制模式下所有会话写入同一个存档段文件）"""
+    return create_transport(mode, archive, base_url, time_scale, strict, _secrets)
+
+@st.cache_resource
+def get_llm_scheduler(max_concurrency: int) -> LLMScheduler:
+    """获取进程级LLM请求调度器（在线客服与批量营销共用Dify并发）"""
+    return LLMScheduler(max_concurrency)
+
+@st.cache_resource
+def get_pii_masker(enabled: bool, kinds: tuple, _secret: str = "") -> Optional[PIIMasker]:
+    """获取进程级敏感信息脱敏器（未开启时为None，占位符在所有会话间保持一致）"""
+    return create_pii_masker(enabled, kinds, _secret)
+
+@st.cache_resource
+def get_state_backend(kind: str, path: str) -> Optional[StateBackend]:
+    """获取进程级共享状态后端（未配置时为None）"""
+    return create_state_backend(kind, path)
+
+@st.cache_resource
+def get_session_store(idle_timeout: int, max_sessions: int, max_memory_mb: int,
+                      _backend: Optional[StateBackend] = None) -> SessionStore:
+    """获取进程级会话存储（同一进程内的所有浏览器会话共享；配置共享后端时为后端的本地缓存）"""
+    return SessionStore(idle_timeout=idle_timeout, max_sessions=max_sessions,
+                        max_memory_bytes=max_memory_mb * 1024 * 1024, backend=_backend)
+
+@st.cache_resource
+def get_event_bus(broker_address: str, broker_authkey: str) -> "EventBus":
+    """获取进程级事件总线（配置了事件代理时与其他进程共享事件）"""
+    from services.event_bus import EventBus, parse_broker_address
+    
+    event_bus = EventBus()
+    if broker_address:
+        event_bus.attach_broker(parse_broker_address(broker_address), broker_authkey.encode('utf-8'))
+    return event_bus
+
+@st.cache_resource
+def get_generation_registry(_event_bus: "EventBus", _session_store: SessionStore) -> "GenerationRegistry":
+    """获取进程级草稿生成登记表（拒绝、清空对话、会话驱逐时取消进行中的生成）"""
+    from services.generation_registry import GenerationRegistry
+    
+    generations = GenerationRegistry()
+    generations.attach(_event_bus, _session_store)
+    return generations
+
+@st.cache_resource
+def get_admission_controller(enabled: bool, max_limit: int, target_latency: float, max_waiting: int,
+                             max_review_queue: int, token_budget: int, _config: AppConfig,
+                             _review_metrics: Optional["ReviewMetrics"] = None) -> Optional["AdmissionController"]:
+    """获取进程级准入控制器（未开启时为None，控制台与客户接入端点共用并发上限和排队）"""
+    from services.admission_control import create_admission_controller
+    return create_admission_controller(_config.admission, _review_metrics)
+
+@st.cache_resource
+def get_speculative_drafter(enabled: bool, token_budget: int, variant: str, api_key: str, timeout: int,
+                            _config: AppConfig, _transport, _scheduler: LLMScheduler,
+                            _generations: "GenerationRegistry", _event_bus: "EventBus",
+                            _masker: Optional[PIIMasker] = None,
+                            _admission: Optional["AdmissionController"] = None) -> Optional["SpeculativeDrafter"]:
+    """获取进程级备选草稿预生成器（未开启时为None，所有会话共享预算和后台线程）"""
+    from services.speculative_drafts import create_speculative_drafter
+    return create_speculative_drafter(_config.speculative, _config.dify, _transport, _scheduler,
+                                      _generations, _event_bus, timeout, _masker, _admission)
+
+@st.cache_resource
+def get_search_index(_event_bus: "EventBus", _audit_log: "AuditLog") -> "MessageSearchIndex":
+    """获取进程级对话历史检索索引（订阅事件增量更新，后台从审计日志回填历史）"""
+    from services.conversation_export import iter_audit_messages
+    from services.search_index import MessageSearchIndex
+
+    search_index = MessageSearchIndex()
+    search_index.attach(_event_bus)
+    threading.Thread(target=search_index.backfill, args=(iter_audit_messages(_audit_log),),
+                     name="search-backfill", daemon=True).start()
+    return search_index
+
+@st.cache_resource
+def get_answer_library(_event_bus: "EventBus", _audit_log: "AuditLog",
+                       _backend: Optional[StateBackend] = None) -> "AnswerLibrary":
+    """获取进程级已批准回复知识库（订阅批准事件收录，后台从审计日志回填）"""
+    from services.answer_library import AnswerLibrary
+    
+    answer_library = AnswerLibrary(_backend)
+    answer_library.attach(_event_bus)
+    threading.Thread(target=answer_library.backfill, args=(_audit_log.scan(),),
+                     name="library-backfill", daemon=True).start()
+    return answer_library
+
+@st.cache_resource
+def get_review_metrics(_event_bus: "EventBus", _audit_log: "AuditLog") -> "ReviewMetrics":
+    """获取进程级审核指标引擎（订阅审核事件增量汇总，后台从审计日志回填）"""
+    from services.review_metrics import ReviewMetrics
+    
+    review_metrics = ReviewMetrics()
+    review_metrics.attach(_event_bus)
+    # 订阅之后的事件由事件总线计入，回填只读取此前的审计记录，避免重复计数
+    threading.Thread(target=review_metrics.backfill, args=(_audit_log.scan(end=time.time()),),
+                     name="metrics-backfill", daemon=True).start()
+    return review_metrics
+
+@st.cache_resource
+def get_customer_gateway(host: str, port: int, _pipeline: "ChatPipeline", _secret: str = "") -> "CustomerGateway":
+    """启动进程级客户接入端点（与控制台共享会话存储和审核流水线）"""
+    from services.customer_gateway import CustomerGateway
+    return CustomerGateway(_pipeline, _pipeline.session_store,
+                           secret=_secret.encode('utf-8') or None).start(host, port)
 
 class AICustomerServiceApp:
     """人在回路自动营销系统主应用类"""
@@ -22,8 +154,25 @@ class AICustomerServiceApp:
     def __init__(self):
         self.config = None
         self.dify_service = None
+        self.dify_transport = None
+        self.llm_scheduler = None
+        self.pii_masker = None
         self.marketing_service = None
         self.state_manager = None
+        self.review_manager = None
+        self.session_store = None
+        self.state_backend = None
+        self.supervisor_id = None
+        self.context_manager = None
+        self.audit_log = None
+        self.event_bus = None
+        self.pipeline = None
+        self.generations = None
+        self.admission = None
+        self.speculator = None
+        self.search_index = None
+        self.answer_library = None
+        self.review_metrics = None
         self.logger = None
         
     def initialize(self):
@@ -33,13 +182,76 @@ class AICustomerServiceApp:
             self.config = AppConfig.load()
             
             # 设置日志
-            setup_logging(self.config.log_level)
+            setup_logging(self.config.log_level, self.config.logging)
             self.logger = logging.getLogger(__name__)
             
             # 初始化服务
-            self.dify_service = DifyAPIService(self.config.dify)
-            self.marketing_service = MarketingService(self.config.dify)
-            self.state_manager = StateManager()
+            self.dify_transport = get_dify_transport(
+                self.config.traffic.mode,
+                self.config.traffic.archive,
+                self.config.dify.base_url,
+                self.config.traffic.time_scale,
+                self.config.traffic.strict,
+                _secrets=(self.config.dify.api_key,)
+            )
+            self.llm_scheduler = get_llm_scheduler(self.config.scheduler.max_concurrency)
+            self.pii_masker = get_pii_masker(
+                self.config.privacy.enabled,
+                self.config.privacy.kinds,
+                _secret=self.config.privacy.secret
+            )
+            self.dify_service = DifyAPIService(self.config.dify, self.dify_transport, self.llm_scheduler,
+                                               self.pii_masker)
+            
+            # 当前浏览器的客户会话与监督者会话都保存在进程级会话存储中
+            self.state_backend = get_state_backend(
+                self.config.state_backend.kind,
+                self.config.state_backend.path
+            )
+            self.session_store = get_session_store(
+                self.config.session_idle_timeout,
+                self.config.session_max_count,
+                self.config.session_max_memory_mb,
+                _backend=self.state_backend
+            )
+            
+            # 初始化会话ID（使用共享后端时写入URL，连接切换到其他副本后仍能恢复会话）
+            if 'session_id' not in st.session_state:
+                session_id = st.query_params.get('sid') if self.state_backend else None
+                st.session_state.session_id = session_id or generate_session_id()
+                if self.state_backend:
+                    st.query_params['sid'] = st.session_state.session_id
+            session_id = st.session_state.session_id
+            set_log_context(session_id=session_id, correlation_id=None)
+            
+            self.state_manager = StateManager(
+                self.session_store.get_or_create(session_id, SESSION_ROLE_CUSTOMER)
+            )
+            self.supervisor_id = f"supervisor-{session_id}"
+            self.session_store.get_or_create(self.supervisor_id, SESSION_ROLE_SUPERVISOR)
+            self.review_manager = self.state_manager
+            
+            # 准入控制按待审核队列深度限流，开启时才需要审核指标引擎
+            self.admission = get_admission_controller(
+                self.config.admission.enabled,
+                self.config.admission.max_limit,
+                self.config.admission.target_latency,
+                self.config.admission.max_waiting,
+                self.config.admission.max_review_queue,
+                self.config.admission.token_budget,
+                _config=self.config,
+                _review_metrics=self._get_review_metrics() if self.config.admission.enabled else None
+            )
+            
+            # 客户接入端点与控制台共享审核流水线，开启时在启动阶段创建
+            if self.config.customer_api.enabled:
+                self._init_review_services()
+                get_customer_gateway(
+                    self.config.customer_api.host,
+                    self.config.customer_api.port,
+                    _pipeline=self._create_pipeline(),
+                    _secret=self.config.customer_api.secret
+                )
             
             # 设置页面配置
             st.set_page_config(
@@ -49,10 +261,6 @@ class AICustomerServiceApp:
                 initial_sidebar_state="expanded"
             )
             
-            # 初始化会话ID
-            if 'session_id' not in st.session_state:
-                st.session_state.session_id = generate_session_id()
-            
             # 测试API连接
             self._test_api_connection()
             
@@ -63,6 +271,77 @@ class AICustomerServiceApp:
             self.logger.error(f"应用初始化失败: {e}")
             st.stop()
     
+    def _init_event_services(self):
+        """初始化审计日志、事件总线和草稿生成登记表"""
+        if self.event_bus is not None:
+            return
+        self.audit_log = get_audit_log(
+            self.config.audit.directory,
+            self.config.audit.segment_max_bytes,
+            self.config.audit.commit_interval_ms
+        )
+        self.event_bus = get_event_bus(
+            self.config.events.broker_address,
+            self.config.events.broker_authkey
+        )
+        self.generations = get_generation_registry(self.event_bus, self.session_store)
+    
+    def _get_review_metrics(self) -> "ReviewMetrics":
+        """获取审核指标引擎（首次用到时订阅事件并从审计日志回填）"""
+        if self.review_metrics is None:
+            self._init_event_services()
+            self.review_metrics = get_review_metrics(self.event_bus, self.audit_log)
+        return self.review_metrics
+    
+    def _init_review_services(self):
+        """初始化审核相关服务
+        
+        事件总线、审核指标、备选草稿预生成器和对话处理流水线只在客服对话页、
+        监督效率看板或客户接入端点首次用到时创建，营销页面不加载这些模块。
+        """
+        if self.pipeline is not None:
+            return
+        from services.context_manager import ConversationContextManager
+        
+        self._get_review_metrics()
+        self.context_manager = ConversationContextManager(
+            token_budget=self.config.context_token_budget,
+            keep_turns=self.config.context_keep_turns
+        )
+        self.speculator = get_speculative_drafter(
+            self.config.speculative.enabled,
+            self.config.speculative.token_budget,
+            self.config.speculative.variant,
+            self.config.speculative.api_key,
+            self.config.generation_timeout,
+            _config=self.config,
+            _transport=self.dify_transport,
+            _scheduler=self.llm_scheduler,
+            _generations=self.generations,
+            _event_bus=self.event_bus,
+            _masker=self.pii_masker,
+            _admission=self.admission
+        )
+        self.pipeline = self._create_pipeline()
+    
+    def _create_pipeline(self) -> "ChatPipeline":
+        """创建对话处理流水线"""
+        from services.chat_pipeline import ChatPipeline
+        
+        return ChatPipeline(
+            self.dify_service,
+            self.context_manager,
+            self.session_store,
+            self.audit_log,
+            self.event_bus,
+            max_message_length=self.config.max_message_length,
+            max_prompt_tokens=self.config.max_prompt_tokens,
+            generations=self.generations,
+            generation_timeout=self.config.generation_timeout,
+            speculator=self.speculator,
+            admission=self.admission
+        )
+    
     def _test_api_connection(self):
         """测试API连接"""
         try:
@@ -83,6 +362,9 @@ class AICustomerServiceApp:
         Args:
             user_input: 用户输入内容
         """
+        from components.user_chat import validate_user_input
+        from services.admission_control import ADMISSION_QUEUED
+        
         # 验证输入
         is_valid, error_msg = validate_user_input(user_input, self.config.max_message_length)
         if not is_valid:
@@ -92,49 +374,54 @@ class AICustomerServiceApp:
         # 记录用户操作
         log_user_action("send_message", {"content_length": len(user_input)})
         
-        # 添加用户消息
-        user_message = self.state_manager.add_user_message(user_input)
-        self.logger.info(f"用户消息已添加: {user_message.id}")
-        
-        # 设置输入状态
-        self.state_manager.set_typing_status(True)
+        # 添加用户消息（含token上限检查）
+        result, error_msg = self.pipeline.accept(self.state_manager, user_input)
+        if result is None:
+            st.error(error_msg)
+            return
         
-        # 调用AI服务
-        conversation_id = self.state_manager.get_conversation_id()
-        ai_response = await self.dify_service.chat_completion(user_input, conversation_id)
+        # 过载时消息排队等待生成，告知客户排队位置；提示保存在会话中，
+        # 重跑后继续显示，直到这条消息得到回复
+        if result.admission and result.admission['status'] == ADMISSION_QUEUED:
+            st.session_state.admission_notice = {
+                'message_id': result.message.id,
+                'notice': result.admission['notice'],
+            }
+            st.info(result.admission['notice'])
         
-        if ai_response['success']:
-            # 保存会话ID
-            if ai_response.get('conversation_id'):
-                self.state_manager.set_conversation_id(ai_response['conversation_id'])
-            
-            # 设置待审核消息
-            self.state_manager.set_pending_review(ai_response['content'], user_message.id)
-            self.logger.info(f"AI回复已生成，等待审核")
-            
-        else:
-            # 处理错误
-            self.state_manager.set_typing_status(False)
+        # 调用AI服务生成待审核回复
+        ai_response = await self.pipeline.generate(self.state_manager, result.message)
+        if not ai_response['success'] and ai_response.get('error') != 'cancelled':
             st.error(f"AI服务调用失败: {ai_response.get('content', '未知错误')}")
-            self.logger.error(f"AI服务调用失败: {ai_response}")
         
-        # 刷新界面
+        # 刷新用户面板（监督者面板通过事件总线定时刷新；未开启自动刷新时重跑整页）
+        if self._refresh_interval():
+            rerun_fragment()
         st.rerun()
     
-    def approve_message(self, final_content: str):
+    def approve_message(self, final_content: str, pending_id: Optional[str] = None,
+                        version: Optional[int] = None):
         """批准消息
         
         Args:
             final_content: 最终内容
+            pending_id: 监督者看到的待审核消息ID
+            version: 监督者看到的待审核消息版本号
         """
         try:
             # 记录监督者操作
             log_user_action("approve_message", {"content_length": len(final_content)})
             
-            # 批准消息
-            message = self.state_manager.approve_message(final_content)
-            if message:
-                self.logger.info(f"消息已批准发送: {message.id}")
+            # 批准消息（通过客户接入端点连接的客户会实时收到回复）；
+            # 重复点击按幂等键返回首次结果，其他监督者已处理或修改时不覆盖
+            result = self.pipeline.approve(
+                self.review_manager, final_content, self.supervisor_id,
+                expected_id=pending_id, expected_version=version,
+                idempotency_key=f"approve:{pending_id}" if pending_id else None
+            )
+            if result.status == TRANSITION_CONFLICT:
+                st.warning("该回复已被其他监督者处理或修改，请查看最新内容")
+            elif result.message:
                 st.success("消息已发送给用户")
             
             # 刷新界面
@@ -144,16 +431,29 @@ class AICustomerServiceApp:
             st.error(f"批准消息失败: {str(e)}")
             self.logger.error(f"批准消息失败: {e}")
     
-    def reject_message(self):
-        """拒绝消息"""
+    def reject_message(self, pending_id: Optional[str] = None, version: Optional[int] = None):
+        """拒绝消息
+        
+        Args:
+            pending_id: 监督者看到的待审核消息ID
+            version: 监督者看到的待审核消息版本号
+        """
         try:
             # 记录监督者操作
             log_user_action("reject_message")
             
             # 拒绝消息
-            self.state_manager.reject_message()
-            self.logger.info("消息已被拒绝")
-            st.warning("消息已拒绝，请重新生成回复")
+            result = self.pipeline.reject(
+                self.review_manager, self.supervisor_id,
+                expected_id=pending_id, expected_version=version,
+                idempotency_key=f"reject:{pending_id}" if pending_id else None
+            )
+            if result.status == TRANSITION_CONFLICT:
+                st.warning("该回复已被其他监督者处理或修改，请查看最新内容")
+            elif result.replacement:
+                st.info("消息已拒绝，已换入备选回复")
+            else:
+                st.warning("消息已拒绝，请重新生成回复")
             
             # 刷新界面
             st.rerun()
@@ -162,8 +462,34 @@ class AICustomerServiceApp:
             st.error(f"拒绝消息失败: {str(e)}")
             self.logger.error(f"拒绝消息失败: {e}")
     
+    def show_alternative(self, pending_id: Optional[str] = None, version: Optional[int] = None):
+        """切换查看备选回复
+        
+        Args:
+            pending_id: 监督者看到的待审核消息ID
+            version: 监督者看到的待审核消息版本号
+        """
+        try:
+            log_user_action("show_alternative")
+            
+            result = self.pipeline.show_alternative(self.review_manager, pending_id, version)
+            if result.status == TRANSITION_CONFLICT:
+                st.warning("该回复已被其他监督者处理或修改，请查看最新内容")
+            
+            # 刷新界面
+            st.rerun()
+            
+        except Exception as e:
+            st.error(f"切换备选回复失败: {str(e)}")
+            self.logger.error(f"切换备选回复失败: {e}")
+    
     def render_interface(self):
         """渲染界面"""
+        from components.layout import load_custom_css, render_timing_panel
+        
+        # 注入页面样式（进程级缓存，局部片段重跑时不会重复发送）
+        load_custom_css(self.config.static_asset_mode)
+        
         # 创建页面导航
         page = self.create_navigation()
         
@@ -171,6 +497,13 @@ class AICustomerServiceApp:
             self.render_chat_interface()
         elif page == "营销文案生成":
             self.render_marketing_interface()
+        elif page == "监督效率看板":
+            self.render_metrics_dashboard()
+        
+        # 调试模式下显示各面板的重绘耗时
+        if self.config.debug:
+            with st.sidebar:
+                render_timing_panel(get_render_stats())
     
     def create_navigation(self) -> str:
         """创建页面导航
@@ -181,44 +514,83 @@ class AICustomerServiceApp:
         st.sidebar.markdown("### 🧭 功能导航")
         page = st.sidebar.radio(
             "选择功能",
-            ["AI客服对话", "营销文案生成"],
+            ["AI客服对话", "营销文案生成", "监督效率看板"],
             index=0
         )
         st.sidebar.markdown("---")
         return page
     
     def render_chat_interface(self):
-        """渲染AI客服对话界面"""
+        """渲染AI客服对话界面
+        
+        用户面板、监督者面板、监督者控制面板和侧边栏状态面板都是独立的局部片段，
+        各自从状态管理器读取数据，交互时只重跑所在片段。
+        检索索引和已批准回复知识库在首次打开本页时创建并回填。
+        """
+        from components.layout import (
+            create_main_layout, create_sidebar, render_session_selector, render_review_queue
+        )
+        from components.search_panel import render_search_panel
+        
+        self._init_review_services()
+        self.search_index = get_search_index(self.event_bus, self.audit_log)
+        self.answer_library = get_answer_library(self.event_bus, self.audit_log, self.state_backend)
+        
         # 创建主布局
-        user_container, supervisor_container, user_input, supervisor_controls = create_main_layout()
+        user_container, supervisor_container = create_main_layout()
         
-        # 创建侧边栏
-        create_sidebar(self.state_manager)
+        # 选择监督者审核的客户会话（默认为本页的客户会话）
+        review_session_id = render_session_selector(self.session_store, self.state_manager.get_session_id())
+        review_session = self.session_store.get(review_session_id)
+        if review_session is not None:
+            self.review_manager = StateManager(review_session)
         
-        # 获取当前状态
-        messages = self.state_manager.get_messages()
-        pending_review = self.state_manager.get_pending_review()
-        is_typing = self.state_manager.is_typing()
-        message_count = self.state_manager.get_message_count()
+        with st.sidebar:
+            # 待审核队列提醒（局部定时刷新）
+            st.fragment(render_review_queue, run_every=self._refresh_interval())(
+                self.session_store, self.event_bus, review_session_id, self.event_bus.version()
+            )
+            
+            # 创建侧边栏
+            create_sidebar(self.review_manager, self.state_manager.is_api_connected(),
+                           on_clear=lambda: self.pipeline.clear(self.review_manager))
+            
+            # 审核效率统计（局部定时刷新）
+            st.fragment(self.render_metrics_summary, run_every=self._refresh_interval())()
         
         # 渲染用户界面
+        with user_container:
+            st.fragment(timed_render("user_panel")(self.render_user_panel))()
+        
+        # 渲染监督者界面（订阅事件总线，局部定时刷新）
+        with supervisor_container:
+            st.fragment(timed_render("supervisor_panel")(self.render_supervisor_panel),
+                        run_every=self._refresh_interval())()
+            
+            # 历史对话检索（局部片段）
+            render_search_panel(self.search_index)
+    
+    def render_user_panel(self):
+        """渲染用户面板并处理用户输入（局部片段）"""
+        from components.user_chat import create_user_interface
+        
+        messages = self.state_manager.get_messages()
         create_user_interface(
-            user_container,
+            st.container(),
             messages,
-            is_typing,
-            message_count
+            self.state_manager.is_typing(),
+            self.state_manager.get_message_count()
         )
         
-        # 渲染监督者界面
-        create_supervisor_interface(
-            supervisor_container,
-            supervisor_controls,
-            messages,
-            pending_review,
-            message_count,
-            self.approve_message,
-            self.reject_message
-        )
+        # 排队提示：消息仍是最后一条（还没有回复）时继续显示
+        admission_notice = st.session_state.get('admission_notice')
+        if admission_notice:
+            if messages and messages[-1]['id'] == admission_notice['message_id']:
+                st.info(admission_notice['notice'])
+            else:
+                st.session_state.admission_notice = None
+        
+        user_input = st.chat_input("请输入您的问题...", key="user_input")
         
         # 处理用户输入
         if user_input:
@@ -232,17 +604,78 @@ class AICustomerServiceApp:
             # 使用asyncio运行异步函数
             asyncio.run(self.process_user_message(preset_prompt))
     
+    def render_supervisor_panel(self):
+        """渲染监督者面板
+        
+        作为局部刷新片段运行：定时检查审核会话在事件总线上的版本号，
+        有新草稿时提示监督者，只重绘本面板。
+        """
+        from components.supervisor_chat import create_supervisor_interface
+        from services.event_bus import EVENT_ALTERNATIVE_READY
+        
+        session_id = self.review_manager.get_session_id()
+        version = self.event_bus.version(session_id)
+        seen = st.session_state.get('supervisor_panel_version', {})
+        if session_id in seen and version > seen[session_id] and self.review_manager.get_pending_review():
+            new_types = {event.event_type for event in self.event_bus.events_since(seen[session_id], session_id)}
+            if new_types - {EVENT_ALTERNATIVE_READY}:
+                st.toast("🔍 收到新的待审核回复")
+            else:
+                st.toast("🔀 备选回复已就绪")
+        st.session_state.supervisor_panel_version = {session_id: version}
+        
+        create_supervisor_interface(
+            st.container(),
+            st.container(),
+            self.review_manager,
+            self.approve_message,
+            self.reject_message,
+            answer_library=self.answer_library,
+            on_swap=self.show_alternative if self.speculator is not None else None
+        )
+    
+    def render_metrics_summary(self):
+        """渲染侧边栏审核效率统计（局部片段）"""
+        from components.supervisor_chat import render_supervisor_metrics
+        from components.metrics_dashboard import format_seconds
+        
+        snapshot = self.review_metrics.snapshot(METRICS_SIDEBAR_WINDOW)
+        render_supervisor_metrics(snapshot.reviews, snapshot.queue_depth, snapshot.approval_rate)
+        st.caption(f"{METRICS_SIDEBAR_WINDOW} · 修改率 {snapshot.edit_rate:.1%} · "
+                   f"拒绝率 {snapshot.reject_rate:.1%} · P90审核耗时 {format_seconds(snapshot.latency_p90)}")
+    
+    def render_metrics_dashboard(self):
+        """渲染监督效率看板"""
+        from components.metrics_dashboard import create_metrics_page, create_metrics_dashboard
+        
+        self._init_review_services()
+        create_metrics_page()
+        create_metrics_dashboard(self.review_metrics, self.llm_scheduler, self.generations,
+                                 self.speculator, self.pii_masker, self.admission)
+    
+    def _refresh_interval(self) -> Optional[float]:
+        """监督者面板的自动刷新间隔（0表示关闭）"""
+        return self.config.events.refresh_interval or None
+    
     def render_marketing_interface(self):
         """渲染营销文案生成界面"""
+        from components.marketing_generator import create_marketing_interface, create_marketing_page
+        from services.marketing_service import MarketingService
+        
+        if self.marketing_service is None:
+            self.marketing_service = MarketingService(self.config.dify, self.dify_transport,
+                                                     self.llm_scheduler, self.pii_masker, self.admission)
+        
         # 创建营销文案生成页面
         create_marketing_page()
         
-        # 创建营销文案生成界面
-        marketing_container = st.container()
-        create_marketing_interface(marketing_container, self.marketing_service)
+        # 创建营销文案生成界面（模板缓存在配置共享后端时跨副本共享）
+        create_marketing_interface(self.marketing_service, self.config.max_prompt_tokens,
+                                   self.state_backend)
     
+    @timed_render("app")
     def run(self):
-        """运行应用"""
+        """运行应用（整页重跑）"""
         self.initialize()
         self.render_interface()
 
@@ -1,57 +1,34 @@
 """布局组件"""
 import streamlit as st
-from typing import Tuple
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+from services.event_bus import EVENT_MESSAGE_ADDED, EVENT_DRAFT_READY
+from services.session_store import SESSION_ROLE_CUSTOMER
+from utils.constants import STYLESHEETS
+from utils.render_timing import timed_render
+from utils.static_assets import STATIC_MODE_INLINE, get_asset_registry
 
-def load_custom_css():
-    """加载自定义CSS样式"""
-    try:
-        with open("static/style.css", "r", encoding="utf-8") as f:
-            css = f.read()
-        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
-    except FileNotFoundError:
-        # 如果CSS文件不存在，使用内联样式
-        st.markdown("""
-        <style>
-        .main { padding-top: 1rem; }
-        .user-panel {
-            background: linear-gradient(135deg, #e3f2fd 0%, #f3e5f5 100%);
-            border-radius: 10px;
-            padding: 1rem;
-            margin-bottom: 1rem;
-        }
-        .supervisor-panel {
-            background: linear-gradient(135deg, #fff3e0 0%, #f1f8e9 100%);
-            border-radius: 10px;
-            padding: 1rem;
-            margin-bottom: 1rem;
-        }
-        .chat-container {
-            border: 1px solid #ddd;
-            border-radius: 8px;
-            padding: 1rem;
-            background: white;
-            margin-bottom: 1rem;
-        }
-        .welcome-message {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 1.5rem;
-            border-radius: 12px;
-            text-align: center;
-            margin-bottom: 1rem;
-        }
-        </style>
-        """, unsafe_allow_html=True)
+def load_custom_css(mode: str = STATIC_MODE_INLINE):
+    """加载自定义CSS样式
+    
+    样式文件在进程内只读取、压缩一次；注入的片段按内容哈希缓存。
+    link模式需开启server.enableStaticServing，页面只注入@import，浏览器缓存样式文件。
+    
+    Args:
+        mode: 注入方式（inline/link）
+    """
+    snippet = get_asset_registry().style_snippet(STYLESHEETS, mode)
+    if snippet:
+        st.markdown(snippet, unsafe_allow_html=True)
 
-def create_main_layout() -> Tuple[st.container, st.container, str, st.container]:
+def create_main_layout() -> Tuple[st.container, st.container]:
     """创建主要布局
     
+    两栏内容各自作为局部片段渲染，这里只创建标题和容器。
+    
     Returns:
-        用户容器, 监督者容器, 用户输入, 监督者控制容器
+        用户容器, 监督者容器
     """
-    # 加载自定义样式
-    load_custom_css()
-    
     # 创建标题
     st.markdown("""
     <div class="main-title">
@@ -71,7 +48,6 @@ def create_main_layout() -> Tuple[st.container, st.container, str, st.container]
         </div>
         """, unsafe_allow_html=True)
         user_container = st.container()
-        user_input = st.chat_input("请输入您的问题...", key="user_input")
     
     with col2:
         st.markdown("""
@@ -80,83 +56,174 @@ def create_main_layout() -> Tuple[st.container, st.container, str, st.container]
         </div>
         """, unsafe_allow_html=True)
         supervisor_container = st.container()
-        supervisor_controls = st.container()
     
-    return user_container, supervisor_container, user_input, supervisor_controls
+    return user_container, supervisor_container
 
-def create_sidebar(state_manager):
-    """创建侧边栏
+def render_session_selector(session_store, own_session_id: str) -> str:
+    """渲染监督者审核会话选择器
     
     Args:
-        state_manager: 状态管理器实例
+        session_store: 会话存储实例
+        own_session_id: 当前浏览器的客户会话ID
+        
+    Returns:
+        选中的审核会话ID
     """
+    sessions = session_store.list_sessions(SESSION_ROLE_CUSTOMER)
+    # 有待审核回复的会话排在前面，当前浏览器的会话始终可选
+    session_ids = [own_session_id] + sorted(
+        (session.session_id for session in sessions if session.session_id != own_session_id),
+        key=lambda session_id: not (session_store.get(session_id) or {}).get('pending_review')
+    )
+    
+    def format_session(session_id: str) -> str:
+        session = session_store.get(session_id) or {}
+        marker = "🔍" if session.get('pending_review') else "💬"
+        suffix = "（本页）" if session_id == own_session_id else ""
+        return f"{marker} {session_id[:8]} · {len(session.get('messages', []))}条{suffix}"
+    
     with st.sidebar:
-        st.markdown("### 📊 系统状态")
-        
-        # 显示连接状态
-        if state_manager.is_api_connected():
-            st.success("✅ API连接正常")
-        else:
-            st.error("❌ API连接异常")
-        
-        # 显示统计信息
-        message_count = state_manager.get_message_count()
-        st.metric("消息总数", message_count)
-        
-        pending_count = state_manager.get_pending_count()
-        st.metric("待审核消息", pending_count)
-        
-        # 显示会话信息
-        conversation_id = state_manager.get_conversation_id()
-        if conversation_id:
-            st.info(f"会话ID: {conversation_id[:8]}...")
-        
+        st.markdown("### 👥 审核会话")
+        selected = st.selectbox("选择客户会话", session_ids, format_func=format_session,
+                                key="review_session_id")
+        stats = session_store.stats()
+        st.caption(f"活跃客户会话 {stats['customers']} · 监督者 {stats['supervisors']} · "
+                   f"内存约 {stats['memory_bytes'] / 1024 / 1024:.1f} MB")
         st.markdown("---")
-        
-        # 操作按钮
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if st.button("🗑️ 清空对话", use_container_width=True):
+    return selected
+
+def render_review_queue(session_store, event_bus, review_session_id: str, seen_version: int):
+    """渲染待审核队列提醒
+    
+    作为侧边栏中的局部刷新片段调用：定时检查事件总线，其他客户会话有新消息或新草稿时
+    提示监督者刷新会话列表，不重绘整个页面。
+    
+    Args:
+        session_store: 会话存储实例
+        event_bus: 事件总线实例
+        review_session_id: 当前审核的会话ID
+        seen_version: 上次整页渲染时的事件总线版本号
+    """
+    pending_count = sum(1 for session in session_store.list_sessions(SESSION_ROLE_CUSTOMER)
+                        if session.get('pending_review'))
+    st.caption(f"🔔 待审核会话 {pending_count} 个")
+    
+    new_events = event_bus.events_since(seen_version, event_types=[EVENT_MESSAGE_ADDED, EVENT_DRAFT_READY])
+    updated_sessions = {event.session_id for event in new_events if event.session_id != review_session_id}
+    if updated_sessions:
+        st.info(f"{len(updated_sessions)} 个其他会话有新消息")
+        if st.button("🔄 刷新会话列表", key="refresh_review_sessions", use_container_width=True):
+            st.rerun(scope="app")
+
+@st.fragment
+@timed_render("sidebar")
+def create_sidebar(state_manager, api_connected: Optional[bool] = None,
+                   on_clear: Optional[Callable[[], None]] = None):
+    """创建侧边栏系统状态面板
+    
+    作为局部片段运行（需在with st.sidebar中调用）：切换导出格式、导出对话只重绘本面板。
+    
+    Args:
+        state_manager: 状态管理器实例
+        api_connected: API连接状态（默认读取state_manager）
+        on_clear: 清空对话的回调（默认直接清空state_manager）
+    """
+    from services.conversation_export import available_export_formats
+    
+    if api_connected is None:
+        api_connected = state_manager.is_api_connected()
+    
+    st.markdown("### 📊 系统状态")
+    
+    # 显示连接状态
+    if api_connected:
+        st.success("✅ API连接正常")
+    else:
+        st.error("❌ API连接异常")
+    
+    # 显示统计信息
+    message_count = state_manager.get_message_count()
+    st.metric("消息总数", message_count)
+    
+    pending_count = state_manager.get_pending_count()
+    st.metric("待审核消息", pending_count)
+    
+    # 显示会话信息
+    conversation_id = state_manager.get_conversation_id()
+    if conversation_id:
+        st.info(f"会话ID: {conversation_id[:8]}...")
+    
+    st.markdown("---")
+    
+    export_format = st.selectbox("导出格式", available_export_formats(), index=0, key="export_format")
+    
+    # 操作按钮
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        if st.button("🗑️ 清空对话", use_container_width=True):
+            if on_clear is not None:
+                on_clear()
+            else:
                 state_manager.clear_all()
-                st.rerun()
-        
-        with col2:
-            if st.button("📥 导出对话", use_container_width=True):
-                export_conversation(state_manager)
+            st.rerun()
+    
+    with col2:
+        if st.button("📥 导出对话", use_container_width=True):
+            export_conversation(state_manager, export_format)
+
+def render_timing_panel(stats: Dict[str, Dict[str, float]]):
+    """渲染界面重绘耗时统计（调试模式）
+    
+    Args:
+        stats: 重绘范围 -> 耗时统计（app为整页重跑，其余为局部片段重跑）
+    """
+    with st.expander("⏱️ 重绘耗时", expanded=False):
+        if not stats:
+            st.caption("暂无数据")
+            return
+        for scope, item in sorted(stats.items()):
+            st.caption(
+                f"**{scope}** · {item['count']}次 · 平均 {item['avg_ms']:.1f}ms · "
+                f"p95 {item['p95_ms']:.1f}ms · 最近 {item['last_ms']:.1f}ms"
+            )
 
-def export_conversation(state_manager):
+def export_conversation(state_manager, export_format: str = "markdown"):
     """导出对话记录
     
+    记录逐条流式写入临时文件（超过内存阈值自动落盘），不在内存中拼接整段文本。
+    
     Args:
         state_manager: 状态管理器实例
+        export_format: 导出格式（markdown/jsonl/csv/parquet）
     """
+    from services.conversation_export import EXPORT_FORMATS, export_to_spooled_file, iter_session_messages
+    
     messages = state_manager.get_messages()
     if not messages:
         st.warning("没有对话记录可导出")
         return
     
-    # 生成导出内容
-    export_content = "# 对话记录导出\n\n"
-    export_content += f"导出时间: {st.session_state.get('export_time', '未知')}\n"
-    export_content += f"消息总数: {len(messages)}\n\n"
+    conversation_id = state_manager.get_conversation_id() or 'unknown'
+    extension, mime = EXPORT_FORMATS[export_format]
     
-    for i, msg in enumerate(messages, 1):
-        sender = "用户" if msg['sender'] == 'user' else "AI助手"
-        timestamp = msg['timestamp']
-        content = msg['content']
-        
-        export_content += f"## 消息 {i}\n"
-        export_content += f"**发送者**: {sender}\n"
-        export_content += f"**时间**: {timestamp}\n"
-        export_content += f"**内容**: {content}\n\n"
+    try:
+        # st.download_button只接受字符串/字节数据，不接受文件对象
+        with export_to_spooled_file(
+            iter_session_messages(messages, state_manager.get_session_id() or conversation_id),
+            export_format
+        ) as export_file:
+            data = export_file.read()
+    except RuntimeError as e:
+        st.error(f"导出失败: {str(e)}")
+        return
     
     # 提供下载
     st.download_button(
         label="📄 下载对话记录",
-        data=export_content,
-        file_name=f"conversation_{st.session_state.get('conversation_id', 'unknown')}.md",
-        mime="text/markdown",
+        data=data,
+        file_name=f"conversation_{conversation_id}{extension}",
+        mime=mime,
         use_container_width=True
     )
 
@@ -188,7 +255,6 @@ def format_timestamp(timestamp_str: str) -> str:
         格式化后的时间字符串
     """
     try:
-        from datetime import datetime
         dt = datetime.fromisoformat(timestamp_str)
         return dt.strftime("%H:%M:%S")
     except:
@@ -1,78 +1,105 @@
 """营销文案生成组件"""
 import streamlit as st
 import asyncio
-from typing import Dict, Any, Optional
+import json
+import tempfile
+from typing import IO, Dict, Any, Optional
 from datetime import datetime
 from services.marketing_service import MarketingService
+from services.marketing_template import TemplateCache
+from services.signal_ingest import SignalIngestor
+from services.state_backend import StateBackend
+from utils.constants import DEFAULT_MAX_PROMPT_TOKENS
+from utils.helpers import rerun_fragment
+from utils.render_timing import timed_render
+from utils.token_estimator import check_prompt_tokens, estimate_request_tokens, estimate_tokens
 
-def create_marketing_interface(container: st.container, marketing_service: MarketingService):
+@st.fragment
+@timed_render("marketing")
+def create_marketing_interface(marketing_service: MarketingService,
+                               max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+                               state_backend: Optional[StateBackend] = None):
     """创建营销文案生成界面
     
+    作为局部片段运行：选择预置提示词、生成文案、审批模板只重绘本界面。
+    
     Args:
-        container: Streamlit容器
         marketing_service: 营销服务实例
+        max_prompt_tokens: 提示词token上限
+        state_backend: 共享状态后端（模板缓存跨副本共享，默认只在当前会话内缓存）
     """
-    with container:
-        # 标题和说明
-        # st.markdown("""
-        # <div class="marketing-header">
-        #     <h3 style="color: #e91e63; margin-bottom: 1rem;">✨ 营销文案生成器</h3>
-        #     <p style="color: #666; margin-bottom: 1.5rem;">
-        #         输入您的营销文案生成提示词，AI将为您生成专业的营销文案
-        #     </p>
-        # </div>
-        # """, unsafe_allow_html=True)
-        
-        # 添加预置prompt快捷按钮
-        show_marketing_preset_prompts()
+    # 标题和说明
+    # st.markdown("""
+    # <div class="marketing-header">
+    #     <h3 style="color: #e91e63; margin-bottom: 1rem;">✨ 营销文案生成器</h3>
+    #     <p style="color: #666; margin-bottom: 1.5rem;">
+    #         输入您的营销文案生成提示词，AI将为您生成专业的营销文案
+    #     </p>
+    # </div>
+    # """, unsafe_allow_html=True)
+    
+    # 添加预置prompt快捷按钮
+    show_marketing_preset_prompts()
+    
+    # 初始化表单状态
+    if 'marketing_form_prompt' not in st.session_state:
+        st.session_state.marketing_form_prompt = ""
+    
+    # 检查预置prompt
+    if hasattr(st.session_state, 'marketing_preset_prompt') and st.session_state.marketing_preset_prompt:
+        st.session_state.marketing_form_prompt = st.session_state.marketing_preset_prompt
+        del st.session_state.marketing_preset_prompt
+    
+    # 创建输入表单
+    with st.form("marketing_form", clear_on_submit=False):
+        # 提示词输入
+        prompt = st.text_area(
+            "📝 营销文案生成提示词",
+            value=st.session_state.marketing_form_prompt,
+            placeholder="输入营销信号",
+            height=150,
+            help="包含tags与event",
+            key="marketing_prompt_input"
+        )
         
-        # 初始化表单状态
-        if 'marketing_form_prompt' not in st.session_state:
-            st.session_state.marketing_form_prompt = ""
+        # 生成按钮
+        submitted = st.form_submit_button(
+            "🚀 生成营销文案",
+            type="primary",
+            use_container_width=True
+        )
+    
+    # 更新表单状态
+    if prompt != st.session_state.marketing_form_prompt:
+        st.session_state.marketing_form_prompt = prompt
+    
+    # 显示预计token数（与提交时的超限检查使用同一估算）
+    if prompt.strip():
+        st.caption(f"📏 预计输入Token: {estimate_tokens(prompt)} / 上限 {max_prompt_tokens}")
+    
+    # 处理表单提交
+    if submitted:
+        if not prompt.strip():
+            st.error("请输入营销文案生成提示词")
+            return
         
-        # 检查预置prompt
-        if hasattr(st.session_state, 'marketing_preset_prompt') and st.session_state.marketing_preset_prompt:
-            st.session_state.marketing_form_prompt = st.session_state.marketing_preset_prompt
-            del st.session_state.marketing_preset_prompt
+        is_valid, error_msg = check_prompt_tokens(prompt, max_prompt_tokens)
+        if not is_valid:
+            st.error(error_msg)
+            return
         
-        # 创建输入表单
-        with st.form("marketing_form", clear_on_submit=False):
-            # 提示词输入
-            prompt = st.text_area(
-                "📝 营销文案生成提示词",
-                value=st.session_state.marketing_form_prompt,
-                placeholder="输入营销信号",
-                height=150,
-                help="包含tags与event",
-                key="marketing_prompt_input"
-            )
-            
-            # 生成按钮
-            submitted = st.form_submit_button(
-                "🚀 生成营销文案",
-                type="primary",
-                use_container_width=True
+        # 显示生成中状态
+        with st.spinner("🤖 AI正在为您生成营销文案..."):
+            # 异步生成文案
+            result = asyncio.run(
+                marketing_service.generate_marketing_copy(prompt)
             )
         
-        # 更新表单状态
-        if prompt != st.session_state.marketing_form_prompt:
-            st.session_state.marketing_form_prompt = prompt
-        
-        # 处理表单提交
-        if submitted:
-            if not prompt.strip():
-                st.error("请输入营销文案生成提示词")
-                return
-            
-            # 显示生成中状态
-            with st.spinner("🤖 AI正在为您生成营销文案..."):
-                # 异步生成文案
-                result = asyncio.run(
-                    marketing_service.generate_marketing_copy(prompt)
-                )
-            
-            # 显示结果
-            display_marketing_result(result)
+        # 显示结果
+        display_marketing_result(result)
+    
+    # 批量信号文件生成
+    show_batch_generation(marketing_service, state_backend)
 
 def display_marketing_result(result: Dict[str, Any]):
     """显示营销文案生成结果
@@ -121,7 +148,7 @@ def display_marketing_result(result: Dict[str, Any]):
         with col3:
             # 重新生成按钮
             if st.button("🔄 重新生成", use_container_width=True):
-                st.rerun()
+                rerun_fragment()
         
         # 显示使用统计（如果有）
         if 'usage' in result and result['usage']:
@@ -140,7 +167,164 @@ def display_marketing_result(result: Dict[str, Any]):
         
         # 显示重试按钮
         if st.button("🔄 重试", type="primary"):
-            st.rerun()
+            rerun_fragment()
+
+def show_batch_generation(marketing_service: MarketingService,
+                          state_backend: Optional[StateBackend] = None):
+    """显示批量信号文件生成界面
+    
+    Args:
+        marketing_service: 营销服务实例
+        state_backend: 共享状态后端
+    """
+    with st.expander("📂 批量信号文件生成", expanded=False):
+        uploaded_file = st.file_uploader(
+            "上传信号文件（JSON Lines，每行一个信号）",
+            type=["jsonl", "json", "txt"],
+            help='每行格式: {"tags":[...],"event":"...","customer_id":"..."}',
+            key="marketing_signal_file"
+        )
+        
+        if uploaded_file is None:
+            return
+        
+        # 流式导入并去重（同一文件只解析一次；不保留客户ID，下载时重新读取文件逐行分发）
+        if st.session_state.get('marketing_work_set_file') != uploaded_file.file_id:
+            uploaded_file.seek(0)
+            st.session_state.marketing_work_set = SignalIngestor(keep_customer_ids=False).ingest(uploaded_file)
+            st.session_state.marketing_work_set_file = uploaded_file.file_id
+            st.session_state.marketing_batch_results = None
+        work_set = st.session_state.marketing_work_set
+        stats = work_set.stats.to_dict()
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("有效信号", stats['valid'])
+        with col2:
+            st.metric("唯一信号", stats['unique'])
+        with col3:
+            st.metric("无效记录", stats['invalid'])
+        
+        if work_set.stats.errors:
+            st.warning("部分记录校验失败: " + "; ".join(
+                f"第{line_no}行 {error}" for line_no, error in work_set.stats.errors[:5]
+            ))
+        
+        if not len(work_set):
+            return
+        
+        # 模板模式：数值不同的信号共用一份文案
+        use_templates = st.checkbox("按标签组合生成模板文案（数值本地填充）", value=True,
+                                    key="marketing_use_templates")
+        template_cache = get_template_cache(state_backend)
+        template_cache.require_approval = st.checkbox("模板需合规审批后使用", value=False,
+                                                      key="marketing_require_approval")
+        
+        if use_templates:
+            groups = {}
+            for signal in work_set:
+                groups.setdefault(TemplateCache.group_key(signal)[0], signal)
+            planned = list(groups.values())
+        else:
+            planned = list(work_set)
+        call_count = len(planned)
+        st.caption(f"📏 预计输入Token: {sum(estimate_request_tokens(signal.to_prompt()) for signal in planned)}")
+        
+        if st.button(f"🚀 批量生成（最多调用 {call_count} 次）", type="primary",
+                     use_container_width=True, key="marketing_batch_generate"):
+            with st.spinner("🤖 AI正在批量生成营销文案..."):
+                if use_templates:
+                    asyncio.run(template_cache.generate(work_set, marketing_service))
+                    st.session_state.marketing_batch_results = None
+                else:
+                    st.session_state.marketing_batch_results = asyncio.run(
+                        marketing_service.generate_for_work_set(work_set)
+                    )
+        
+        if use_templates:
+            render_template_approvals(template_cache)
+            results = template_cache.results_for(work_set)
+        else:
+            results = st.session_state.get('marketing_batch_results') or {}
+        
+        if results:
+            with format_batch_results_for_download(uploaded_file, results) as download_file:
+                data = download_file.read()
+            st.download_button(
+                label=f"💾 下载批量文案（{len(results)} 个唯一信号）",
+                data=data,
+                file_name=f"批量营销文案_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+                mime="application/jsonl",
+                use_container_width=True
+            )
+
+def get_template_cache(state_backend: Optional[StateBackend] = None) -> TemplateCache:
+    """获取当前会话的模板缓存
+    
+    Args:
+        state_backend: 共享状态后端（配置后模板文案和审批结果在所有会话、副本间共享）
+        
+    Returns:
+        模板缓存实例
+    """
+    if 'marketing_template_cache' not in st.session_state:
+        st.session_state.marketing_template_cache = TemplateCache(backend=state_backend)
+    return st.session_state.marketing_template_cache
+
+def render_template_approvals(template_cache: TemplateCache):
+    """渲染待审批的模板文案
+    
+    Args:
+        template_cache: 模板缓存实例
+    """
+    pending_groups = template_cache.pending_groups() if template_cache.require_approval else []
+    if not pending_groups:
+        return
+    
+    st.markdown(f"#### 🔍 待审批模板（{len(pending_groups)} 个）")
+    for group in pending_groups:
+        # 按分组键区分控件，审批后列表变化时各分组的编辑内容不会错位
+        st.caption(f"标签: {'、'.join(group.tags)} | 事件: {group.event_template} | "
+                   f"覆盖客户: {group.customer_count}")
+        content = st.text_area("模板文案", value=group.content, height=100,
+                               key=f"template_content_{group.key}")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("✅ 批准模板", use_container_width=True, key=f"template_approve_{group.key}"):
+                template_cache.approve(group.key, content)
+                rerun_fragment()
+        with col2:
+            if st.button("❌ 拒绝模板", use_container_width=True, key=f"template_reject_{group.key}"):
+                template_cache.reject(group.key)
+                rerun_fragment()
+
+def format_batch_results_for_download(source: IO, results: Dict[str, Dict[str, Any]],
+                                      max_memory: int = 4 * 1024 * 1024) -> IO:
+    """格式化批量生成结果用于下载（信号文件中每个有效行一行）
+    
+    逐行写入临时文件，超过max_memory后落盘，不在内存中拼接完整内容。
+    
+    Args:
+        source: 信号文件（重新从头读取，按行分发唯一信号的结果）
+        results: 规范键 -> 生成结果
+        max_memory: 内存缓冲上限（字节）
+        
+    Returns:
+        已回到开头的JSON Lines临时文件对象
+    """
+    source.seek(0)
+    target = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    for record, result in SignalIngestor().fan_out(source, results):
+        line = json.dumps({
+            'customer_id': record.customer_id,
+            'tags': list(record.tags),
+            'event': record.event,
+            'success': result['success'],
+            'content': result['content'],
+        }, ensure_ascii=False)
+        target.write((line + "\n").encode('utf-8'))
+    target.seek(0)
+    return target
 
 def format_marketing_copy_for_download(result: Dict[str, Any]) -> str:
     """格式化营销文案用于下载
@@ -191,14 +375,14 @@ def show_marketing_preset_prompts():
                      use_container_width=True, key="marketing_preset_1"):
             # 将预置prompt设置到session state中
             st.session_state.marketing_preset_prompt = preset_prompts[0]['prompt']
-            st.rerun()
+            rerun_fragment()
     
     with col2:
         if st.button(f"{preset_prompts[1]['icon']} {preset_prompts[1]['label']}",
                      use_container_width=True, key="marketing_preset_2"):
             # 将预置prompt设置到session state中
             st.session_state.marketing_preset_prompt = preset_prompts[1]['prompt']
-            st.rerun()
+            rerun_fragment()
     
     st.markdown("---")
 
@@ -221,49 +405,8 @@ def show_marketing_examples():
         目标受众是职场新人和创业者，需要包含明确的行动号召和优惠信息。"
         """)
 
-def load_marketing_css():
-    """加载营销文案生成器的自定义CSS"""
-    st.markdown("""
-    <style>
-    .marketing-header {
-        background: linear-gradient(135deg, #e91e63 0%, #f06292 100%);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 12px;
-        margin-bottom: 1.5rem;
-        text-align: center;
-    }
-    
-    .marketing-result {
-        background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%);
-        border-radius: 12px;
-        padding: 1.5rem;
-        margin: 1rem 0;
-        border-left: 4px solid #e91e63;
-    }
-    
-    .marketing-content {
-        font-size: 1.1rem;
-        line-height: 1.6;
-        color: #333;
-        white-space: pre-wrap;
-    }
-    
-    .stForm {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 12px;
-        border: 1px solid #e0e0e0;
-        margin-bottom: 1rem;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
 def create_marketing_page():
     """创建完整的营销文案生成页面"""
-    # 加载自定义样式
-    load_marketing_css()
-    
     # 页面标题
     st.markdown("""
     <div class="marketing-header">
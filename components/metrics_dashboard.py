@@ -0,0 +1,209 @@
+"""监督效率看板组件"""
+import streamlit as st
+from datetime import datetime
+from typing import Optional
+from services.admission_control import (
+    AdmissionController, ADMISSION_ADMITTED, ADMISSION_QUEUED, ADMISSION_SHED, REASON_LABELS
+)
+from services.generation_registry import GenerationRegistry, CANCEL_REASON_LABELS
+from services.llm_scheduler import LLMScheduler, LANE_LABELS
+from services.review_metrics import ReviewMetrics
+from services.speculative_drafts import SpeculativeDrafter
+from utils.pii_masker import PIIMasker, PII_LABELS
+from utils.constants import METRICS_RETENTION_DAYS, METRICS_SIDEBAR_WINDOW, METRICS_WINDOWS
+from utils.render_timing import timed_render
+
+def format_seconds(seconds: Optional[float]) -> str:
+    """格式化审核耗时"""
+    if seconds is None:
+        return "-"
+    if seconds < 60:
+        return f"{seconds:.1f}秒"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}分钟"
+    return f"{seconds / 3600:.1f}小时"
+
+def create_metrics_page():
+    """创建监督效率看板页面标题"""
+    st.markdown("## 📈 监督效率看板")
+    st.caption("审核事件实时增量汇总：批准/修改/拒绝率、审核耗时分位数、队列深度和各监督者的处理速度")
+
+@st.fragment
+@timed_render("metrics_dashboard")
+def create_metrics_dashboard(review_metrics: ReviewMetrics, scheduler: Optional[LLMScheduler] = None,
+                             generations: Optional[GenerationRegistry] = None,
+                             speculator: Optional[SpeculativeDrafter] = None,
+                             masker: Optional[PIIMasker] = None,
+                             admission: Optional[AdmissionController] = None):
+    """渲染监督效率看板
+
+    作为局部片段运行：切换时间窗口、历史天数只重绘看板。
+
+    Args:
+        review_metrics: 审核指标引擎
+        scheduler: LLM请求调度器（可选，显示各通道排队情况）
+        generations: 草稿生成登记表（可选，显示取消与回收统计）
+        speculator: 备选草稿预生成器（可选，显示预生成与预算统计）
+        masker: 敏感信息脱敏器（可选，显示脱敏统计）
+        admission: 准入控制器（可选，显示自适应并发上限和准入决定）
+    """
+    window = st.radio("时间窗口", list(METRICS_WINDOWS), horizontal=True,
+                      index=list(METRICS_WINDOWS).index(METRICS_SIDEBAR_WINDOW), key="metrics_window")
+    snapshot = review_metrics.snapshot(window)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("审核数", snapshot.reviews)
+    col2.metric("批准率", f"{snapshot.approval_rate:.1%}")
+    col3.metric("修改率", f"{snapshot.edit_rate:.1%}", help="修改后批准占批准数的比例")
+    col4.metric("拒绝率", f"{snapshot.reject_rate:.1%}")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("审核耗时 P50", format_seconds(snapshot.latency_p50))
+    col2.metric("审核耗时 P90", format_seconds(snapshot.latency_p90))
+    col3.metric("审核耗时 P99", format_seconds(snapshot.latency_p99))
+    col4.metric("待审核队列", snapshot.queue_depth, help=f"窗口内峰值 {snapshot.queue_peak}")
+
+    st.markdown("### 👥 监督者处理速度")
+    if snapshot.throughput:
+        hours = snapshot.window_seconds / 3600
+        st.dataframe(
+            [{'监督者': reviewer, '审核数': round(rate * hours), '每小时审核数': round(rate, 1)}
+             for reviewer, rate in snapshot.throughput.items()],
+            use_container_width=True, hide_index=True
+        )
+    else:
+        st.caption("该时间窗口内暂无审核记录")
+
+    if admission is not None:
+        render_admission_stats(admission)
+    if scheduler is not None:
+        render_scheduler_stats(scheduler)
+    if generations is not None:
+        render_generation_stats(generations)
+    if speculator is not None:
+        render_speculative_stats(speculator)
+    if masker is not None:
+        render_privacy_stats(masker)
+
+    st.markdown("### 🕒 按小时趋势")
+    days = st.slider("最近天数", 1, METRICS_RETENTION_DAYS, 7, key="metrics_days")
+    series = review_metrics.timeseries(days)
+    if not series:
+        st.caption("暂无历史数据")
+        return
+    times = [datetime.fromtimestamp(item['hour']) for item in series]
+    st.line_chart({
+        '时间': times,
+        '批准': [item['approved'] for item in series],
+        '修改后批准': [item['edited'] for item in series],
+        '拒绝': [item['rejected'] for item in series],
+    }, x='时间')
+    st.line_chart({
+        '时间': times,
+        '队列峰值': [item['queue_peak'] for item in series],
+        'P90审核耗时(秒)': [item['latency_p90'] or 0 for item in series],
+    }, x='时间')
+
+def render_admission_stats(admission: AdmissionController):
+    """渲染消息入口准入控制的状态和决定计数
+
+    Args:
+        admission: 准入控制器
+    """
+    stats = admission.stats()
+    st.markdown("### 🛂 入口准入控制")
+    review_queue = "-" if stats['review_queue'] is None else stats['review_queue']
+    token_budget = f" / {stats['token_budget']}" if stats['token_budget'] else ""
+    st.caption(f"Dify延迟 {format_seconds(stats['latency'])}（目标 {format_seconds(stats['target_latency'])}），"
+               f"错误率 {stats['error_rate']:.0%}，待审核 {review_queue} / {stats['max_review_queue']}，"
+               f"本分钟token {stats['token_spent']}{token_budget}")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("并发上限", f"{stats['limit']:.1f}", help=f"最大 {stats['max_limit']}，上调 {stats['increased']} 次，"
+                                                          f"下调 {stats['decreased']} 次")
+    col2.metric("生成中", stats['inflight'])
+    col3.metric("排队中", stats['waiting'], help=f"排队后撤回 {stats['withdrawn']}")
+    col4.metric("Dify失败", stats['failed'], help=f"成功 {stats['completed']}")
+    if stats['decisions']:
+        st.dataframe(
+            [{'通道': LANE_LABELS.get(lane, lane), '放行': counts[ADMISSION_ADMITTED],
+              '排队': counts[ADMISSION_QUEUED], '拒绝/暂缓': counts[ADMISSION_SHED]}
+             for lane, counts in stats['decisions'].items()],
+            use_container_width=True, hide_index=True
+        )
+    if stats['reasons']:
+        st.caption("排队/暂缓原因：" + "，".join(
+            f"{REASON_LABELS.get(reason, reason)} {count}" for reason, count in stats['reasons'].items()
+        ))
+
+def render_scheduler_stats(scheduler: LLMScheduler):
+    """渲染LLM请求调度通道的排队情况
+
+    Args:
+        scheduler: LLM请求调度器
+    """
+    st.markdown("### 🚦 Dify请求调度")
+    st.caption(f"总并发上限 {scheduler.max_concurrency}，当前占用 {scheduler.utilization():.0%}；"
+               "排队耗时为最近的请求")
+    st.dataframe(
+        [{'通道': LANE_LABELS[lane], '排队': item['queued'], '运行': item['running'],
+          '并发上限': item['cap'], '权重': item['weight'], '请求数': item['submitted'],
+          '排队超时': item['expired'], '让出次数': item['preempted'],
+          '排队P50': format_seconds(item['wait_p50']), '排队P95': format_seconds(item['wait_p95']),
+          '平均处理': format_seconds(item['service_avg'])}
+         for lane, item in scheduler.stats().items()],
+        use_container_width=True, hide_index=True
+    )
+
+def render_generation_stats(generations: GenerationRegistry):
+    """渲染草稿生成的取消与回收统计
+
+    Args:
+        generations: 草稿生成登记表
+    """
+    stats = generations.stats()
+    st.markdown("### ♻️ 草稿生成取消")
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("进行中", stats['active'])
+    col2.metric("已取消", stats['cancelled'], help=f"共发起 {stats['started']} 次生成")
+    col3.metric("排队中取消", stats['reclaimed_queued'],
+                help=f"未发往Dify，节省约 {stats['reclaimed_tokens']} 输入token")
+    col4.metric("提前停止", stats['stopped'], help="流式生成调用Dify停止接口提前结束")
+    col5.metric("丢弃结果", stats['abandoned'] + stats['discarded'],
+                help="已发出的阻塞请求被取消，或返回时会话状态已变化")
+    if stats['reasons']:
+        st.caption("取消原因：" + "，".join(
+            f"{CANCEL_REASON_LABELS.get(reason, reason)} {count}" for reason, count in stats['reasons'].items()
+        ))
+
+def render_speculative_stats(speculator: SpeculativeDrafter):
+    """渲染备选草稿预生成与预算统计
+
+    Args:
+        speculator: 备选草稿预生成器
+    """
+    stats = speculator.stats()
+    st.markdown("### 🔀 备选草稿预生成")
+    st.caption(f"本周期token预算已用 {stats['spent']} / {stats['budget']}，"
+               f"{format_seconds(stats['window_remaining'])}后重置")
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("预生成", stats['scheduled'],
+                help=f"失败 {stats['failed']}，取消 {stats['cancelled']}，过期丢弃 {stats['discarded']}")
+    col2.metric("已就绪", stats['ready'])
+    col3.metric("拒绝后换入", stats['promoted'])
+    col4.metric("备选被批准", stats['approved'], help=f"监督者切换查看 {stats['shown']} 次")
+    col5.metric("跳过", stats['skipped_budget'] + stats['skipped_pressure'],
+                help=f"预算不足 {stats['skipped_budget']}，排队压力 {stats['skipped_pressure']}")
+
+def render_privacy_stats(masker: PIIMasker):
+    """渲染发往Dify前的敏感信息脱敏统计
+
+    Args:
+        masker: 敏感信息脱敏器
+    """
+    stats = masker.stats()
+    st.markdown("### 🔒 敏感信息脱敏")
+    st.caption(f"已扫描 {stats['texts']} 段文本，回复中还原占位符 {stats['restored']} 个，"
+               f"未能还原 {stats['unresolved']} 个")
+    columns = st.columns(len(PII_LABELS))
+    for column, (kind, label) in zip(columns, PII_LABELS.items()):
+        column.metric(label, stats[kind])
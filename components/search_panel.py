@@ -0,0 +1,49 @@
+"""监督者历史对话检索组件"""
+import streamlit as st
+from datetime import datetime
+from services.search_index import MessageSearchIndex
+from utils.render_timing import timed_render
+
+SENDER_LABELS = {'user': "👤 用户", 'assistant': "🤖 客服"}
+STATUS_LABELS = {'sent': "已发送", 'draft': "草稿", 'rejected': "已拒绝"}
+
+@st.fragment
+@timed_render("search_panel")
+def render_search_panel(search_index: MessageSearchIndex):
+    """渲染历史对话检索面板
+
+    作为局部片段运行：输入查询只重绘本面板。支持"短语"以及
+    sender:/status:/session:/after:/before: 字段过滤。
+
+    Args:
+        search_index: 对话历史检索索引
+    """
+    with st.expander("🔎 历史对话检索", expanded=False):
+        query = st.text_input(
+            "检索历史消息",
+            key="history_search_query",
+            placeholder='如：退款 "到账时间" sender:assistant after:2024-01-01',
+            help="多个关键词同时命中；引号内为短语；字段过滤：sender:user|assistant、"
+                 "status:sent|draft|rejected、session:会话ID前缀、after:/before:日期"
+        )
+        if not query.strip():
+            st.caption(f"已索引 {len(search_index)} 条消息")
+            return
+
+        try:
+            result = search_index.search(query)
+        except ValueError as e:
+            st.error(f"查询条件有误: {e}")
+            return
+
+        more = "+" if result.truncated else ""
+        st.caption(f"命中 {result.total}{more} 条 · 耗时 {result.elapsed_ms:.1f}ms")
+        for hit in result.hits:
+            message = hit.message
+            sent_at = datetime.fromtimestamp(message.timestamp).strftime('%Y-%m-%d %H:%M')
+            st.markdown(
+                f"**{SENDER_LABELS.get(message.sender, message.sender)}** · "
+                f"{STATUS_LABELS.get(message.status, message.status)} · "
+                f"会话 `{message.session_id[:8]}` · {sent_at}"
+            )
+            st.text(hit.snippet)
@@ -1,21 +1,28 @@
 """监督者对话组件"""
 import streamlit as st
+import time
 from typing import List, Dict, Any, Optional, Callable
 from components.layout import format_timestamp
+from utils.helpers import rerun_fragment
+from utils.render_timing import timed_render
 
 def render_supervisor_chat(container: st.container, controls_container: st.container, 
-                          messages: List[Dict[str, Any]], pending_review: Optional[Dict[str, Any]],
-                          on_approve: Callable[[str], None], on_reject: Callable[[], None]):
+                          state_manager, on_approve: Callable[[str, str, int], None],
+                          on_reject: Callable[[str, int], None], answer_library=None,
+                          on_swap: Optional[Callable[[str, int], None]] = None):
     """渲染监督者视角的对话界面
     
     Args:
         container: 对话容器
         controls_container: 控制面板容器
-        messages: 消息列表
-        pending_review: 待审核消息
+        state_manager: 被审核会话的状态管理器
         on_approve: 批准回调函数
         on_reject: 拒绝回调函数
+        answer_library: 已批准回复知识库（可选）
+        on_swap: 切换备选回复的回调函数（可选）
     """
+    messages = state_manager.get_messages()
+    pending_review = state_manager.get_pending_review()
     with container:
         # 创建滚动容器
         chat_container = st.container(height=350)
@@ -28,8 +35,9 @@ def render_supervisor_chat(container: st.container, controls_container: st.conta
             if pending_review:
                 render_pending_review(pending_review)
     
-    # 监督者控制面板
-    render_supervisor_controls(controls_container, pending_review, on_approve, on_reject)
+    # 监督者控制面板（独立局部片段）
+    with controls_container:
+        render_supervisor_controls(state_manager, on_approve, on_reject, answer_library, on_swap)
 
 def render_conversation_history(messages: List[Dict[str, Any]]):
     """渲染对话历史
@@ -78,9 +86,10 @@ def render_pending_review(pending_review: Dict[str, Any]):
     
     # 显示原始AI回复
     with st.container():
-        st.markdown("""
+        label = "🔀 AI备选回复" if pending_review.get('speculative') else "🤖 AI原始回复"
+        st.markdown(f"""
         <div class="ai-original-response">
-            <strong>🤖 AI原始回复:</strong>
+            <strong>{label}:</strong>
         </div>
         """, unsafe_allow_html=True)
         
@@ -89,59 +98,141 @@ def render_pending_review(pending_review: Dict[str, Any]):
         # 显示生成时间
         st.caption(f"⏰ 生成时间: {format_timestamp(pending_review['timestamp'])}")
 
-def render_supervisor_controls(controls_container: st.container, 
-                             pending_review: Optional[Dict[str, Any]],
-                             on_approve: Callable[[str], None], 
-                             on_reject: Callable[[], None]):
+@st.fragment
+@timed_render("supervisor_controls")
+def render_supervisor_controls(state_manager, on_approve: Callable[[str, str, int], None], 
+                             on_reject: Callable[[str, int], None], answer_library=None,
+                             on_swap: Optional[Callable[[str, int], None]] = None):
     """渲染监督者控制面板
     
+    作为局部片段运行，每次重跑都从state_manager读取最新的待审核消息；
+    编辑回复内容只重绘本面板。批准/拒绝回调带上本面板看到的待审核消息ID和版本号，
+    其他监督者在此期间已处理或修改该回复时操作不会生效。
+    
     Args:
-        controls_container: 控制容器
-        pending_review: 待审核消息
-        on_approve: 批准回调函数
-        on_reject: 拒绝回调函数
+        state_manager: 被审核会话的状态管理器
+        on_approve: 批准回调函数(最终内容, 待审核消息ID, 版本号)
+        on_reject: 拒绝回调函数(待审核消息ID, 版本号)
+        answer_library: 已批准回复知识库（提供时在编辑框上方推荐相似问题的回复）
+        on_swap: 切换备选回复的回调函数(待审核消息ID, 版本号)；后台预生成的备选回复就绪时显示
     """
-    with controls_container:
-        if pending_review:
-            st.markdown("### 📝 审核操作")
-            
-            # 编辑回复内容
-            edited_content = st.text_area(
-                "编辑回复内容:",
-                value=pending_review['edited_content'],
-                height=100,
-                key="edit_response",
-                help="您可以直接发送AI回复，或编辑后再发送"
-            )
-            
-            # 更新编辑内容到session state
-            if edited_content != pending_review['edited_content']:
-                st.session_state.pending_review['edited_content'] = edited_content
-            
-            # 操作按钮
-            col1, col2, col3 = st.columns(3)
-            
+    pending_review = state_manager.get_pending_review()
+    if pending_review:
+        pending_id = pending_review['id']
+        version = pending_review.get('version', 1)
+        
+        st.markdown("### 📝 审核操作")
+        
+        # 同步编辑内容：本地修改以上次看到的版本号写回；期间被其他监督者修改时
+        # 不覆盖对方的修改，编辑框重置为最新内容
+        draft = st.session_state.get('edit_response')
+        base_id, base_version = st.session_state.get('edit_response_base', (None, None))
+        if draft is None or base_id != pending_id:
+            st.session_state.edit_response = pending_review['edited_content']
+        elif draft != pending_review['edited_content']:
+            new_version = state_manager.update_pending_content(draft, base_version)
+            if new_version is None:
+                st.warning("该回复已被其他监督者修改或处理，请查看最新内容")
+                st.session_state.edit_response = pending_review['edited_content']
+            else:
+                version = new_version
+        st.session_state.edit_response_base = (pending_id, version)
+        
+        # 相似问题的已批准回复（插入按钮在编辑框创建前修改其内容）
+        if answer_library is not None:
+            question = next((message['content'] for message in state_manager.get_messages()
+                             if message['id'] == pending_review['user_message_id']), "")
+            render_answer_suggestions(answer_library, question)
+        
+        # 后台预生成的备选回复
+        alternative = pending_review.get('alternative')
+        if alternative and on_swap is not None:
+            render_alternative(alternative, pending_id, version, on_swap)
+        
+        # 编辑回复内容
+        edited_content = st.text_area(
+            "编辑回复内容:",
+            height=100,
+            key="edit_response",
+            help="您可以直接发送AI回复，或编辑后再发送"
+        )
+        
+        # 操作按钮
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            if st.button("✅ 直接发送", type="primary", use_container_width=True,
+                       help="直接发送AI的原始回复"):
+                on_approve(pending_review['original_content'], pending_id, version)
+        
+        with col2:
+            if st.button("📝 编辑后发送", use_container_width=True,
+                       help="发送编辑后的回复内容"):
+                on_approve(edited_content, pending_id, version)
+        
+        with col3:
+            if st.button("❌ 拒绝回复", use_container_width=True,
+                       help="拒绝此回复，换入备选回复" if alternative else "拒绝此回复，重新生成"):
+                on_reject(pending_id, version)
+        
+        # 显示操作提示
+        st.markdown("---")
+        render_operation_tips()
+    
+    else:
+        render_supervisor_status()
+
+def render_alternative(alternative: str, pending_id: str, version: int,
+                       on_swap: Callable[[str, int], None]):
+    """渲染后台预生成的备选回复
+    
+    Args:
+        alternative: 备选回复内容
+        pending_id: 待审核消息ID
+        version: 待审核消息版本号
+        on_swap: 切换备选回复的回调函数
+    """
+    with st.expander("🔀 备选回复已就绪", expanded=False):
+        st.text(alternative)
+        if st.button("🔀 换用备选回复", key="show_alternative", use_container_width=True,
+                     help="与当前回复互换（编辑框重置为备选回复），可再次切换回来"):
+            # 切换后待审核内容和版本号都会变化，编辑框按新内容重新同步
+            st.session_state.edit_response_base = (None, None)
+            on_swap(pending_id, version)
+
+def _insert_answer(answer: str):
+    """把知识库中的回复填入编辑框（按钮回调，在下次重跑创建编辑框之前执行）"""
+    st.session_state.edit_response = answer
+
+def render_answer_suggestions(answer_library, question: str):
+    """渲染相似问题的已批准回复
+    
+    Args:
+        answer_library: 已批准回复知识库
+        question: 当前客户问题
+    """
+    start = time.perf_counter()
+    matches = answer_library.suggest(question)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not matches:
+        return
+    
+    with st.expander(f"📚 相似问题的已批准回复（{len(matches)}）", expanded=True):
+        st.caption(f"知识库 {len(answer_library)} 条 · 检索耗时 {elapsed_ms:.1f}ms")
+        for match in matches:
+            entry = match.entry
+            badge = " · ✏️ 人工修改" if entry.edited else ""
+            st.markdown(f"**问：** {match.question}{badge}")
+            st.text(entry.answer)
+            col1, col2 = st.columns([1, 1])
             with col1:
-                if st.button("✅ 直接发送", type="primary", use_container_width=True,
-                           help="直接发送AI的原始回复"):
-                    on_approve(pending_review['original_content'])
-            
+                st.button("⬆️ 插入编辑框", key=f"library_insert_{entry.entry_id}",
+                          on_click=_insert_answer, args=(entry.answer,), use_container_width=True)
             with col2:
-                if st.button("📝 编辑后发送", use_container_width=True,
-                           help="发送编辑后的回复内容"):
-                    on_approve(edited_content)
-            
-            with col3:
-                if st.button("❌ 拒绝回复", use_container_width=True,
-                           help="拒绝此回复，重新生成"):
-                    on_reject()
-            
-            # 显示操作提示
-            st.markdown("---")
-            render_operation_tips()
-        
-        else:
-            render_supervisor_status()
+                if st.button("🗑️ 移出知识库", key=f"library_remove_{entry.entry_id}",
+                             use_container_width=True):
+                    answer_library.remove(entry.entry_id)
+                    rerun_fragment()
 
 def render_operation_tips():
     """渲染操作提示"""
@@ -196,20 +287,20 @@ def show_supervisor_welcome():
     </div>
     """, unsafe_allow_html=True)
 
-def render_supervisor_metrics(message_count: int, pending_count: int, approval_rate: float = 0.0):
+def render_supervisor_metrics(review_count: int, pending_count: int, approval_rate: float = 0.0):
     """渲染监督者指标
     
     Args:
-        message_count: 消息总数
+        review_count: 审核数
         pending_count: 待审核数量
-        approval_rate: 批准率
+        approval_rate: 批准率（由审核指标引擎按滑动窗口计算）
     """
     st.markdown("### 📈 工作统计")
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("总消息数", message_count)
+        st.metric("审核数", review_count)
     
     with col2:
         st.metric("待审核", pending_count)
@@ -218,24 +309,24 @@ def render_supervisor_metrics(message_count: int, pending_count: int, approval_r
         st.metric("批准率", f"{approval_rate:.1%}")
 
 def create_supervisor_interface(container: st.container, controls_container: st.container,
-                              messages: List[Dict[str, Any]], pending_review: Optional[Dict[str, Any]],
-                              message_count: int, on_approve: Callable[[str], None], 
-                              on_reject: Callable[[], None]):
+                              state_manager, on_approve: Callable[[str, str, int], None], 
+                              on_reject: Callable[[str, int], None], answer_library=None,
+                              on_swap: Optional[Callable[[str, int], None]] = None):
     """创建完整的监督者界面
     
     Args:
         container: 主容器
         controls_container: 控制容器
-        messages: 消息列表
-        pending_review: 待审核消息
-        message_count: 消息数量
+        state_manager: 被审核会话的状态管理器
         on_approve: 批准回调函数
         on_reject: 拒绝回调函数
+        answer_library: 已批准回复知识库（可选）
+        on_swap: 切换备选回复的回调函数（可选）
     """
     # 显示欢迎信息（仅在没有消息时显示）
-    if message_count == 0:
+    if state_manager.get_message_count() == 0:
         show_supervisor_welcome()
     
     # 渲染监督者界面
-    render_supervisor_chat(container, controls_container, messages, pending_review, 
-                          on_approve, on_reject)
\ No newline at end of file
+    render_supervisor_chat(container, controls_container, state_manager, on_approve, on_reject,
+                           answer_library, on_swap)
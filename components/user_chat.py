@@ -150,16 +150,14 @@ def show_preset_prompts():
     with col1:
         if st.button(f"{preset_prompts[0]['icon']} {preset_prompts[0]['label']}",
                      use_container_width=True, key="preset_1"):
-            # 将预置prompt设置到session state中，供主应用使用
+            # 将预置prompt设置到session state中，由同一次片段重跑中的主应用处理
             st.session_state.preset_prompt = preset_prompts[0]['prompt']
-            st.rerun()
     
     with col2:
         if st.button(f"{preset_prompts[1]['icon']} {preset_prompts[1]['label']}",
                      use_container_width=True, key="preset_2"):
-            # 将预置prompt设置到session state中，供主应用使用
+            # 将预置prompt设置到session state中，由同一次片段重跑中的主应用处理
             st.session_state.preset_prompt = preset_prompts[1]['prompt']
-            st.rerun()
     
     # st.markdown("---")
 
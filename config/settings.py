@@ -3,6 +3,7 @@ import os
 from dataclasses import dataclass
 from typing import Optional
 from dotenv import load_dotenv
+from utils.constants import PII_KINDS
 
 # 加载环境变量
 load_dotenv()
@@ -13,18 +14,26 @@ class DifyConfig:
     api_key: str
     base_url: str
     timeout: int = 30
+    response_mode: str = "blocking"
     
     @classmethod
-    def from_env(cls):
-        """从环境变量加载配置"""
+    def from_env(cls, require_key: bool = True):
+        """从环境变量加载配置
+        
+        Args:
+            require_key: 是否要求设置API密钥（回放录制的流量时不访问Dify，可以不设置）
+        """
         api_key = os.getenv('DIFY_API_KEY', '')
         if not api_key:
-            raise ValueError("DIFY_API_KEY环境变量未设置")
+            if require_key:
+                raise ValueError("DIFY_API_KEY环境变量未设置")
+            api_key = 'replay'
         
         return cls(
             api_key=api_key,
             base_url=os.getenv('DIFY_BASE_URL', 'https://api.dify.ai/v1'),
-            timeout=int(os.getenv('DIFY_TIMEOUT', '30'))
+            timeout=int(os.getenv('DIFY_TIMEOUT', '30')),
+            response_mode=os.getenv('DIFY_RESPONSE_MODE', 'blocking').lower()
         )
     
     def validate(self):
@@ -35,6 +44,188 @@ class DifyConfig:
             raise ValueError("Dify API基础URL不能为空")
         if self.timeout <= 0:
             raise ValueError("超时时间必须大于0")
+        if self.response_mode not in ('blocking', 'streaming'):
+            raise ValueError("响应模式必须是blocking或streaming")
+
+@dataclass
+class TrafficConfig:
+    """Dify流量录制/回放配置"""
+    mode: str = ""
+    archive: str = "data/dify_traffic"
+    time_scale: float = 1.0
+    strict: bool = False
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            mode=os.getenv('DIFY_TRAFFIC_MODE', '').lower(),
+            archive=os.getenv('DIFY_TRAFFIC_ARCHIVE', 'data/dify_traffic'),
+            time_scale=float(os.getenv('DIFY_REPLAY_TIME_SCALE', '1.0')),
+            strict=os.getenv('DIFY_REPLAY_STRICT', 'false').lower() == 'true'
+        )
+
+@dataclass
+class SchedulerConfig:
+    """LLM请求调度配置"""
+    max_concurrency: int = 8
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+        )
+
+@dataclass
+class AdmissionConfig:
+    """入口准入控制配置"""
+    enabled: bool = False
+    max_limit: int = 16
+    target_latency: float = 15.0
+    max_waiting: int = 100
+    max_review_queue: int = 50
+    token_budget: int = 0
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            enabled=os.getenv('ADMISSION_CONTROL', 'false').lower() == 'true',
+            max_limit=int(os.getenv('ADMISSION_MAX_CONCURRENCY', '16')),
+            target_latency=float(os.getenv('ADMISSION_TARGET_LATENCY', '15')),
+            max_waiting=int(os.getenv('ADMISSION_MAX_WAITING', '100')),
+            max_review_queue=int(os.getenv('ADMISSION_MAX_REVIEW_QUEUE', '50')),
+            token_budget=int(os.getenv('ADMISSION_TOKEN_BUDGET', '0'))
+        )
+
+@dataclass
+class SpeculativeConfig:
+    """备选草稿预生成配置"""
+    enabled: bool = False
+    token_budget: int = 20000
+    variant: str = "alternative"
+    api_key: str = ""
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            enabled=os.getenv('SPECULATIVE_DRAFTS', 'false').lower() == 'true',
+            token_budget=int(os.getenv('SPECULATIVE_TOKEN_BUDGET', '20000')),
+            variant=os.getenv('SPECULATIVE_VARIANT', 'alternative'),
+            api_key=os.getenv('SPECULATIVE_DIFY_API_KEY', '')
+        )
+
+@dataclass
+class PrivacyConfig:
+    """敏感信息脱敏配置"""
+    enabled: bool = False
+    kinds: tuple = PII_KINDS
+    secret: str = ""
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        kinds = os.getenv('PII_MASK_KINDS', ",".join(PII_KINDS))
+        return cls(
+            enabled=os.getenv('PII_MASKING', 'false').lower() == 'true',
+            kinds=tuple(kind.strip() for kind in kinds.split(",") if kind.strip()),
+            secret=os.getenv('PII_TOKEN_SECRET', '')
+        )
+
+@dataclass
+class LoggingConfig:
+    """日志管道配置"""
+    log_file: str = "app.log"
+    max_bytes: int = 10 * 1024 * 1024
+    backup_count: int = 5
+    rotate_interval: int = 86400
+    sample_rate: float = 1.0
+    queue_size: int = 10000
+    json_format: bool = True
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            log_file=os.getenv('LOG_FILE', 'app.log'),
+            max_bytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            backup_count=int(os.getenv('LOG_BACKUP_COUNT', '5')),
+            rotate_interval=int(os.getenv('LOG_ROTATE_INTERVAL', '86400')),
+            sample_rate=float(os.getenv('LOG_SAMPLE_RATE', '1.0')),
+            queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+            json_format=os.getenv('LOG_JSON', 'true').lower() == 'true'
+        )
+
+@dataclass
+class AuditConfig:
+    """审计日志配置"""
+    directory: str = "audit"
+    segment_max_bytes: int = 64 * 1024 * 1024
+    commit_interval_ms: int = 50
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            directory=os.getenv('AUDIT_DIR', 'audit'),
+            segment_max_bytes=int(os.getenv('AUDIT_SEGMENT_BYTES', str(64 * 1024 * 1024))),
+            commit_interval_ms=int(os.getenv('AUDIT_COMMIT_INTERVAL_MS', '50'))
+        )
+
+@dataclass
+class CustomerAPIConfig:
+    """客户接入端点配置"""
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 8600
+    secret: str = ""  # 会话令牌签名密钥，为空时每个进程随机生成
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            enabled=os.getenv('CUSTOMER_API_ENABLED', 'false').lower() == 'true',
+            host=os.getenv('CUSTOMER_API_HOST', '127.0.0.1'),
+            port=int(os.getenv('CUSTOMER_API_PORT', '8600')),
+            secret=os.getenv('CUSTOMER_API_SECRET', '')
+        )
+
+@dataclass
+class EventBusConfig:
+    """事件总线配置"""
+    broker_address: str = ""
+    broker_authkey: str = ""  # 配置事件代理时必填，没有默认值
+    refresh_interval: float = 2.0
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            broker_address=os.getenv('EVENT_BROKER_ADDRESS', ''),
+            broker_authkey=os.getenv('EVENT_BROKER_AUTHKEY', ''),
+            refresh_interval=float(os.getenv('SUPERVISOR_REFRESH_SECONDS', '2'))
+        )
+    
+    def validate(self):
+        """验证配置"""
+        if self.broker_address and not self.broker_authkey:
+            raise ValueError("配置EVENT_BROKER_ADDRESS时必须设置EVENT_BROKER_AUTHKEY")
+
+@dataclass
+class StateBackendConfig:
+    """共享状态后端配置"""
+    kind: str = ""
+    path: str = "data/state.db"
+    
+    @classmethod
+    def from_env(cls):
+        """从环境变量加载配置"""
+        return cls(
+            kind=os.getenv('STATE_BACKEND', '').lower(),
+            path=os.getenv('STATE_BACKEND_PATH', 'data/state.db')
+        )
 
 @dataclass
 class AppConfig:
@@ -43,18 +234,56 @@ class AppConfig:
     page_icon: str = "🚀"
     layout: str = "wide"
     max_message_length: int = 1000
+    max_prompt_tokens: int = 2000
     debug: bool = False
     log_level: str = "INFO"
+    # 上下文压缩后通过history_summary/recent_history输入变量传给Dify，Dify应用需声明这两个输入
+    context_token_budget: int = 2000
+    context_keep_turns: int = 3
+    generation_timeout: int = 90
+    session_idle_timeout: int = 1800
+    session_max_count: int = 10000
+    session_max_memory_mb: int = 512
+    static_asset_mode: str = "inline"
     
     dify: Optional[DifyConfig] = None
+    traffic: Optional[TrafficConfig] = None
+    scheduler: Optional[SchedulerConfig] = None
+    admission: Optional[AdmissionConfig] = None
+    speculative: Optional[SpeculativeConfig] = None
+    privacy: Optional[PrivacyConfig] = None
+    logging: Optional[LoggingConfig] = None
+    audit: Optional[AuditConfig] = None
+    customer_api: Optional[CustomerAPIConfig] = None
+    events: Optional[EventBusConfig] = None
+    state_backend: Optional[StateBackendConfig] = None
     
     @classmethod
     def load(cls):
         """加载完整配置"""
         config = cls(
             debug=os.getenv('APP_DEBUG', 'false').lower() == 'true',
-            log_level=os.getenv('LOG_LEVEL', 'INFO')
+            log_level=os.getenv('LOG_LEVEL', 'INFO'),
+            max_prompt_tokens=int(os.getenv('MAX_PROMPT_TOKENS', '2000')),
+            context_token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', '2000')),
+            context_keep_turns=int(os.getenv('CONTEXT_KEEP_TURNS', '3')),
+            generation_timeout=int(os.getenv('GENERATION_TIMEOUT', '90')),
+            session_idle_timeout=int(os.getenv('SESSION_IDLE_TIMEOUT', '1800')),
+            session_max_count=int(os.getenv('SESSION_MAX_COUNT', '10000')),
+            session_max_memory_mb=int(os.getenv('SESSION_MAX_MEMORY_MB', '512')),
+            static_asset_mode=os.getenv('STATIC_ASSET_MODE', 'inline')
         )
-        config.dify = DifyConfig.from_env()
+        config.logging = LoggingConfig.from_env()
+        config.audit = AuditConfig.from_env()
+        config.customer_api = CustomerAPIConfig.from_env()
+        config.events = EventBusConfig.from_env()
+        config.events.validate()
+        config.state_backend = StateBackendConfig.from_env()
+        config.traffic = TrafficConfig.from_env()
+        config.scheduler = SchedulerConfig.from_env()
+        config.admission = AdmissionConfig.from_env()
+        config.speculative = SpeculativeConfig.from_env()
+        config.privacy = PrivacyConfig.from_env()
+        config.dify = DifyConfig.from_env(require_key=config.traffic.mode != 'replay')
         config.dify.validate()
         return config
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""客户接入端点独立启动入口
+
+独立进程运行时默认使用自己的会话存储，适合本地联调和压测；需要由监督者控制台
+审核时，请在Streamlit应用中设置CUSTOMER_API_ENABLED=true使端点与控制台同进程运行，
+或让端点与控制台配置同一个共享状态后端（STATE_BACKEND=sqlite）。
+"""
+import argparse
+import logging
+import os
+import uvicorn
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="启动面向客户的HTTP/WebSocket接入端点")
+    parser.add_argument('--host', default=os.getenv('CUSTOMER_API_HOST', '127.0.0.1'), help="监听地址")
+    parser.add_argument('--port', type=int, default=int(os.getenv('CUSTOMER_API_PORT', '8600')),
+                        help="监听端口")
+    parser.add_argument('--mock-dify', action='store_true', help="使用本地模拟Dify服务")
+    parser.add_argument('--mock-latency', type=float, default=0.5, help="模拟Dify的回复延迟(秒)")
+    parser.add_argument('--auto-approve', action='store_true', help="草稿生成后自动批准（跳过人工审核）")
+    args = parser.parse_args()
+
+    if args.mock_dify:
+        from services.mock_dify import MockDifyServer
+        mock = MockDifyServer(latency=args.mock_latency).start()
+        os.environ['DIFY_BASE_URL'] = mock.base_url
+        os.environ.setdefault('DIFY_API_KEY', 'mock-key')
+
+    from config.settings import AppConfig
+    from services.audit_log import AuditLog
+    from services.chat_pipeline import ChatPipeline
+    from services.context_manager import ConversationContextManager
+    from services.customer_gateway import CustomerGateway
+    from services.dify_api import DifyAPIService
+    from services.dify_transport import create_transport
+    from services.event_bus import EventBus, parse_broker_address
+    from services.generation_registry import GenerationRegistry
+    from services.admission_control import create_admission_controller
+    from services.llm_scheduler import LLMScheduler
+    from services.review_metrics import ReviewMetrics
+    from services.session_store import SessionStore
+    from services.speculative_drafts import create_speculative_drafter
+    from utils.pii_masker import create_pii_masker
+    from services.state_backend import create_state_backend
+    from utils.helpers import setup_logging
+
+    config = AppConfig.load()
+    setup_logging(config.log_level, config.logging)
+    session_store = SessionStore(
+        idle_timeout=config.session_idle_timeout,
+        max_sessions=config.session_max_count,
+        max_memory_bytes=config.session_max_memory_mb * 1024 * 1024,
+        backend=create_state_backend(config.state_backend.kind, config.state_backend.path)
+    )
+    event_bus = EventBus()
+    if config.events.broker_address:
+        event_bus.attach_broker(parse_broker_address(config.events.broker_address),
+                                config.events.broker_authkey.encode('utf-8'))
+    transport = create_transport(
+        config.traffic.mode, config.traffic.archive, config.dify.base_url,
+        config.traffic.time_scale, config.traffic.strict, secrets=(config.dify.api_key,)
+    )
+    scheduler = LLMScheduler(config.scheduler.max_concurrency)
+    masker = create_pii_masker(config.privacy.enabled, config.privacy.kinds, config.privacy.secret)
+    generations = GenerationRegistry()
+    generations.attach(event_bus, session_store)
+    review_metrics = ReviewMetrics()
+    review_metrics.attach(event_bus)
+    admission = create_admission_controller(config.admission, review_metrics)
+    pipeline = ChatPipeline(
+        DifyAPIService(config.dify, transport, scheduler, masker),
+        ConversationContextManager(token_budget=config.context_token_budget,
+                                   keep_turns=config.context_keep_turns),
+        session_store,
+        AuditLog(config.audit.directory, config.audit.segment_max_bytes,
+                 config.audit.commit_interval_ms / 1000),
+        event_bus,
+        max_message_length=config.max_message_length,
+        max_prompt_tokens=config.max_prompt_tokens,
+        generations=generations,
+        generation_timeout=config.generation_timeout,
+        speculator=create_speculative_drafter(config.speculative, config.dify, transport, scheduler,
+                                              generations, event_bus, config.generation_timeout, masker,
+                                              admission),
+        admission=admission
+    )
+    gateway = CustomerGateway(pipeline, session_store, auto_approve=args.auto_approve,
+                              secret=config.customer_api.secret.encode('utf-8') or None)
+    logging.getLogger(__name__).info(f"客户接入端点启动: http://{args.host}:{args.port}")
+    uvicorn.run(gateway.create_app(), host=args.host, port=args.port, log_config=None)
+
+if __name__ == "__main__":
+    main()
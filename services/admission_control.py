@@ -0,0 +1,357 @@
+"""消息入口准入控制服务"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+from config.settings import AdmissionConfig
+from services.llm_scheduler import LANE_INTERACTIVE
+from services.review_metrics import ReviewMetrics
+from utils.constants import (
+    ADMISSION_BACKGROUND_RATIO, ADMISSION_DECREASE, ADMISSION_LATENCY_ALPHA, ADMISSION_MAX_ERROR_RATE,
+    ADMISSION_MIN_LIMIT, ADMISSION_NOTICES, ADMISSION_OUTCOME_SAMPLES, ADMISSION_POLL_INTERVAL,
+    ADMISSION_TOKEN_WINDOW
+)
+
+# 准入决定
+ADMISSION_ADMITTED = "admitted"  # 立即生成草稿
+ADMISSION_QUEUED = "queued"  # 消息已受理，排队等待生成
+ADMISSION_SHED = "shed"  # 过载，不受理（后台任务为暂缓）
+
+# 排队或拒绝的原因
+REASON_CONCURRENCY = "concurrency"
+REASON_REVIEW_QUEUE = "review_queue"
+REASON_TOKENS = "token_budget"
+REASON_BACKLOG = "backlog"
+REASON_LATENCY = "latency"
+REASON_ERRORS = "error_rate"
+REASON_INTERACTIVE = "interactive"
+
+REASON_LABELS = {
+    REASON_CONCURRENCY: "并发上限",
+    REASON_REVIEW_QUEUE: "审核积压",
+    REASON_TOKENS: "token预算",
+    REASON_BACKLOG: "排队已满",
+    REASON_LATENCY: "Dify延迟",
+    REASON_ERRORS: "Dify错误率",
+    REASON_INTERACTIVE: "在线消息排队",
+}
+
+class AdmissionTicket:
+    """一条已受理、等待或正在生成草稿的客户消息"""
+
+    __slots__ = ('tokens', 'enqueued', 'granted', 'released', 'future', 'loop')
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.released = False
+        self.future: Optional[asyncio.Future] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+@dataclass
+class AdmissionDecision:
+    """准入决定"""
+    action: str
+    reason: Optional[str] = None
+    position: int = 0  # 排队位置（从1开始）
+    notice: str = ""  # 给客户的提示
+    ticket: Optional[AdmissionTicket] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（返回给客户端）"""
+        return {'status': self.action, 'reason': self.reason, 'position': self.position,
+                'notice': self.notice}
+
+class AdmissionController:
+    """消息入口准入控制器
+
+    客户消息进入流水线前先经过准入：同时生成草稿的消息数受自适应并发上限约束（AIMD：
+    Dify调用在目标延迟内成功时上限加性增加，每轮约加1；延迟超标或出错时乘性减少，
+    每个延迟周期最多减少一次）。达到上限、待审核队列加上生成中的草稿达到审核积压上限、
+    或超出token预算时，消息照常受理但排队等待生成，并告知客户排队位置；排队已满时不再受理。
+    批量营销和备选草稿预生成等后台任务优先让路：有消息排队、在线生成接近并发上限、
+    Dify延迟超标、错误率过高或超出token预算时直接暂缓。所有决定按通道和原因计数。
+    状态由线程锁保护，可被多个事件循环（Streamlit每次运行、客户接入端点）同时使用。
+    """
+
+    def __init__(self, max_limit: int = 16, target_latency: float = 15.0, max_waiting: int = 100,
+                 max_review_queue: int = 50, token_budget: int = 0,
+                 review_metrics: Optional[ReviewMetrics] = None,
+                 min_limit: int = ADMISSION_MIN_LIMIT, token_window: float = ADMISSION_TOKEN_WINDOW):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(self.max_limit)
+        self.target_latency = target_latency
+        self.max_waiting = max_waiting
+        self.max_review_queue = max_review_queue
+        self.token_budget = token_budget
+        self.token_window = token_window
+        self.review_metrics = review_metrics
+        self.inflight = 0
+        self._waiting: Deque[AdmissionTicket] = deque()
+        self._latency: Optional[float] = None
+        self._outcomes: Deque[bool] = deque(maxlen=ADMISSION_OUTCOME_SAMPLES)
+        self._last_decrease = 0.0
+        self._window_start = time.monotonic()
+        self._spent = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        self.decisions: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {ADMISSION_ADMITTED: 0, ADMISSION_QUEUED: 0, ADMISSION_SHED: 0}
+        )
+        self.reasons: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = {'completed': 0, 'failed': 0, 'withdrawn': 0,
+                                         'increased': 0, 'decreased': 0}
+
+    def admit(self, tokens: int = 0) -> AdmissionDecision:
+        """客户消息准入
+
+        Args:
+            tokens: 预计输入token数
+
+        Returns:
+            准入决定；受理时附带准入凭据，生成前需等待acquire，结束后调用release
+        """
+        review_queue = self._review_queue()
+        with self._lock:
+            self._roll_window()
+            if self.max_waiting and len(self._waiting) >= self.max_waiting:
+                decision = AdmissionDecision(ADMISSION_SHED, REASON_BACKLOG, notice=ADMISSION_NOTICES['shed'])
+            else:
+                ticket = AdmissionTicket(tokens)
+                # 已有消息排队时按先来后到排在最后
+                reason = self._blocked(self._waiting[0].tokens if self._waiting else tokens, review_queue)
+                if self._waiting and reason is None:
+                    reason = REASON_CONCURRENCY
+                if reason is None:
+                    self._grant_ticket(ticket)
+                    decision = AdmissionDecision(ADMISSION_ADMITTED, ticket=ticket)
+                else:
+                    self._waiting.append(ticket)
+                    position = len(self._waiting)
+                    decision = AdmissionDecision(ADMISSION_QUEUED, reason, position,
+                                                 ADMISSION_NOTICES['queued'].format(position=position), ticket)
+            self._count(LANE_INTERACTIVE, decision.action, decision.reason)
+        if decision.action != ADMISSION_ADMITTED:
+            self.logger.warning(f"客户消息{'排队' if decision.action == ADMISSION_QUEUED else '未受理'}"
+                                f"({decision.reason}): 位置 {decision.position}")
+        return decision
+
+    def admit_background(self, lane: str, tokens: int = 0) -> Optional[str]:
+        """后台任务（批量营销、备选草稿预生成）准入
+
+        Args:
+            lane: 调度通道
+            tokens: 预计输入token数
+
+        Returns:
+            暂缓原因；可以执行时返回None
+        """
+        with self._lock:
+            self._roll_window()
+            if self._waiting:
+                reason = REASON_INTERACTIVE
+            elif self.inflight >= self.limit * ADMISSION_BACKGROUND_RATIO:
+                reason = REASON_CONCURRENCY
+            elif (len(self._outcomes) >= ADMISSION_OUTCOME_SAMPLES // 5
+                  and self._error_rate() >= ADMISSION_MAX_ERROR_RATE):
+                reason = REASON_ERRORS
+            elif self._latency is not None and self._latency > self.target_latency:
+                reason = REASON_LATENCY
+            elif self.token_budget and self._spent + tokens > self.token_budget:
+                reason = REASON_TOKENS
+            else:
+                reason = None
+                self._spent += tokens
+            self._count(lane, ADMISSION_ADMITTED if reason is None else ADMISSION_SHED, reason)
+        return reason
+
+    async def acquire(self, ticket: AdmissionTicket):
+        """等待排队的消息获准生成（取消时撤出队列）
+
+        Args:
+            ticket: 准入凭据
+        """
+        with self._lock:
+            if ticket.granted:
+                return
+            ticket.loop = asyncio.get_running_loop()
+            ticket.future = ticket.loop.create_future()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.future), ADMISSION_POLL_INTERVAL)
+                    return
+                except asyncio.TimeoutError:
+                    # 审核积压和token预算没有完成通知，定时重新检查
+                    review_queue = self._review_queue()
+                    with self._lock:
+                        self._roll_window()
+                        self._grant(review_queue)
+                        if ticket.granted:
+                            return
+        except asyncio.CancelledError:
+            self.withdraw(ticket)
+            raise
+
+    def release(self, ticket: AdmissionTicket, latency: float, success: Optional[bool]):
+        """草稿生成结束，归还并发并按Dify调用结果调整并发上限
+
+        Args:
+            ticket: 准入凭据
+            latency: 获准后到Dify返回的秒数
+            success: Dify调用是否成功（生成被取消时为None，不调整上限）
+        """
+        review_queue = self._review_queue()
+        with self._lock:
+            if not self._free(ticket):
+                return
+            if success is not None:
+                self._observe(latency, success)
+            self._grant(review_queue)
+
+    def withdraw(self, ticket: AdmissionTicket):
+        """撤回准入凭据（重复提交或生成被取消），不调整并发上限
+
+        Args:
+            ticket: 准入凭据
+        """
+        review_queue = self._review_queue()
+        with self._lock:
+            if self._free(ticket):
+                self.counters['withdrawn'] += 1
+                self._grant(review_queue)
+
+    def _free(self, ticket: AdmissionTicket) -> bool:
+        """归还凭据占用的并发或移出队列（需在锁内调用）"""
+        if ticket.released:
+            return False
+        ticket.released = True
+        if ticket.granted:
+            self.inflight -= 1
+        else:
+            self._waiting.remove(ticket)
+        return True
+
+    def _observe(self, latency: float, success: bool):
+        """AIMD调整并发上限（需在锁内调用）"""
+        self._outcomes.append(success)
+        if success:
+            self._latency = (latency if self._latency is None else
+                             ADMISSION_LATENCY_ALPHA * latency + (1 - ADMISSION_LATENCY_ALPHA) * self._latency)
+        if success and latency <= self.target_latency:
+            if self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self.counters['increased'] += 1
+            self.counters['completed'] += 1
+            return
+
+        self.counters['completed' if success else 'failed'] += 1
+        # 同一批并发请求同时变慢只算一次拥塞
+        now = time.monotonic()
+        if now - self._last_decrease >= (self._latency or self.target_latency):
+            self._last_decrease = now
+            previous = self.limit
+            self.limit = max(float(self.min_limit), self.limit * ADMISSION_DECREASE)
+            if self.limit < previous:
+                self.counters['decreased'] += 1
+                self.logger.warning(f"准入并发上限下调: {previous:.1f} -> {self.limit:.1f}"
+                                    f"（延迟 {latency:.1f}s，成功 {success}）")
+
+    def _review_queue(self) -> Optional[int]:
+        """待审核队列长度；不限制审核积压时返回None
+
+        在获取准入锁之前读取：指标有自己的锁，嵌套持有会让两把锁互相等待
+        """
+        if self.review_metrics is None or not self.max_review_queue:
+            return None
+        return self.review_metrics.queue_depth()
+
+    def _blocked(self, tokens: int, review_queue: Optional[int]) -> Optional[str]:
+        """消息现在不能开始生成的原因（需在锁内调用）"""
+        if self.inflight >= int(self.limit):
+            return REASON_CONCURRENCY
+        # 生成中的草稿很快也会进入审核队列
+        if review_queue is not None and review_queue + self.inflight >= self.max_review_queue:
+            return REASON_REVIEW_QUEUE
+        if self.token_budget and self._spent and self._spent + tokens > self.token_budget:
+            return REASON_TOKENS
+        return None
+
+    def _grant_ticket(self, ticket: AdmissionTicket):
+        """占用并发并计入token预算（需在锁内调用）"""
+        ticket.granted = True
+        self.inflight += 1
+        self._spent += ticket.tokens
+
+    def _grant(self, review_queue: Optional[int]):
+        """按先来后到放行排队的消息（需在锁内调用）"""
+        while self._waiting and self._blocked(self._waiting[0].tokens, review_queue) is None:
+            ticket = self._waiting.popleft()
+            self._grant_ticket(ticket)
+            if ticket.future is not None:
+                try:
+                    ticket.loop.call_soon_threadsafe(self._deliver, ticket)
+                except RuntimeError:
+                    pass  # 等待的事件循环已关闭，凭据由取消处理归还
+
+    @staticmethod
+    def _deliver(ticket: AdmissionTicket):
+        if not ticket.future.done():
+            ticket.future.set_result(None)
+
+    def _roll_window(self):
+        """进入新的统计周期时清零已用token（需在锁内调用）"""
+        now = time.monotonic()
+        if now - self._window_start >= self.token_window:
+            self._window_start = now
+            self._spent = 0
+
+    def _error_rate(self) -> float:
+        """最近Dify调用的错误率（需在锁内调用）"""
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for success in self._outcomes if not success) / len(self._outcomes)
+
+    def _count(self, lane: str, action: str, reason: Optional[str]):
+        """计入准入决定（需在锁内调用）"""
+        self.decisions[lane][action] += 1
+        if reason is not None:
+            self.reasons[reason] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """获取准入控制状态与各通道的决定计数"""
+        review_queue = self.review_metrics.queue_depth() if self.review_metrics is not None else None
+        with self._lock:
+            self._roll_window()
+            result: Dict[str, Any] = dict(self.counters)
+            result.update(
+                limit=self.limit, max_limit=self.max_limit, inflight=self.inflight,
+                waiting=len(self._waiting), latency=self._latency, target_latency=self.target_latency,
+                error_rate=self._error_rate(), review_queue=review_queue,
+                max_review_queue=self.max_review_queue, token_spent=self._spent,
+                token_budget=self.token_budget,
+                decisions={lane: dict(counts) for lane, counts in self.decisions.items()},
+                reasons=dict(self.reasons),
+            )
+            return result
+
+def create_admission_controller(config: AdmissionConfig,
+                                review_metrics: Optional[ReviewMetrics] = None) -> Optional[AdmissionController]:
+    """按配置创建准入控制器
+
+    Args:
+        config: 准入控制配置
+        review_metrics: 审核指标引擎（提供待审核队列深度）
+
+    Returns:
+        准入控制器；未开启时返回None
+    """
+    if not config.enabled:
+        return None
+    return AdmissionController(config.max_limit, config.target_latency, config.max_waiting,
+                               config.max_review_queue, config.token_budget, review_metrics)
@@ -0,0 +1,255 @@
+"""已批准回复知识库服务"""
+import hashlib
+import logging
+import threading
+import time
+from array import array
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from services.audit_log import AUDIT_EVENT_USER_MESSAGE, AUDIT_EVENT_APPROVE
+from services.event_bus import Event, EventBus, EVENT_APPROVED
+from services.search_index import InvertedIndex, tokenize
+from services.state_backend import StateBackend
+from utils.constants import (
+    ANSWER_LIBRARY_MIN_CHARS, ANSWER_LIBRARY_MIN_COVERAGE, ANSWER_LIBRARY_SUGGESTION_LIMIT
+)
+from utils.helpers import clean_text_input
+
+ANSWER_LIBRARY_NAMESPACE = "answer_library"
+
+@dataclass
+class LibraryEntry:
+    """知识库条目：一条已批准的回复及其对应过的客户问题"""
+    entry_id: str
+    answer: str
+    questions: List[str] = field(default_factory=list)
+    edited: bool = False  # 是否有监督者修改过AI草稿
+    removed: bool = False  # 被监督者移出知识库（之后相同回复不再收录）
+    updated_at: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LibraryEntry':
+        """从字典创建条目"""
+        return cls(**data)
+
+@dataclass
+class LibraryMatch:
+    """相似问题检索结果"""
+    entry: LibraryEntry
+    question: str  # 命中的历史问题
+    score: float
+
+class AnswerLibrary:
+    """已批准回复知识库
+
+    监督者批准（尤其是修改后批准）的回复按"客户问题 + 回复"收录，相同回复只保留一条，
+    对应过的不同问题都加入索引。审核时用当前客户问题按OR语义做BM25检索，
+    返回最相似的几条已批准回复，供监督者一键插入编辑框。
+    配置共享状态后端时条目写入后端，命名空间版本号变化时合并其他副本收录的条目。
+    """
+
+    def __init__(self, backend: Optional[StateBackend] = None):
+        self.backend = backend
+        self.index = InvertedIndex()
+        self.logger = logging.getLogger(__name__)
+        self._entries: Dict[str, LibraryEntry] = {}
+        self._docs: List[Tuple[str, int]] = []  # 文档编号 -> (条目ID, 问题下标)
+        self._removed_docs = array('B')  # 文档编号 -> 所属条目是否已移除
+        self._entry_docs: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._subscription: Optional[int] = None
+
+    def __len__(self) -> int:
+        return sum(1 for entry in self._entries.values() if not entry.removed)
+
+    @staticmethod
+    def entry_id(answer: str) -> str:
+        """按规范化后的回复内容计算条目ID（各副本一致）"""
+        return hashlib.sha1(clean_text_input(answer).encode('utf-8')).hexdigest()[:16]
+
+    def _index_question(self, entry: LibraryEntry, question: str):
+        """把问题加入索引（需在锁内调用）"""
+        doc_id = self.index.add(tokenize(question, unigrams=True) + tokenize(entry.answer))
+        self._docs.append((entry.entry_id, entry.questions.index(question)))
+        self._removed_docs.append(int(entry.removed))
+        self._entry_docs.setdefault(entry.entry_id, []).append(doc_id)
+
+    def _mark_removed(self, entry: LibraryEntry):
+        """把条目标记为已移除（需在锁内调用）"""
+        entry.removed = True
+        for doc_id in self._entry_docs.get(entry.entry_id, []):
+            self._removed_docs[doc_id] = 1
+
+    def _removed_mask(self, doc_ids):
+        """过滤已移除条目的向量化函数（需在锁内调用）"""
+        import numpy as np
+
+        return np.frombuffer(self._removed_docs, dtype=np.uint8)[doc_ids] == 0
+
+    def _merge(self, entry: LibraryEntry) -> bool:
+        """合并一个条目（需在锁内调用）
+
+        Returns:
+            条目是否有变化
+        """
+        current = self._entries.get(entry.entry_id)
+        if current is None:
+            current = self._entries[entry.entry_id] = LibraryEntry(entry.entry_id, entry.answer)
+            changed = True
+        else:
+            changed = False
+        for question in entry.questions:
+            if question not in current.questions:
+                current.questions.append(question)
+                self._index_question(current, question)
+                changed = True
+        if entry.edited and not current.edited:
+            current.edited = True
+            changed = True
+        if entry.removed and not current.removed:
+            self._mark_removed(current)
+            changed = True
+        if changed:
+            current.updated_at = max(current.updated_at, entry.updated_at)
+        return changed
+
+    def _sync(self):
+        """共享后端中的条目有更新时合并（需在锁内调用）"""
+        if self.backend is None:
+            return
+        version = self.backend.namespace_version(ANSWER_LIBRARY_NAMESPACE)
+        if version != self._version:
+            for data in self.backend.get_values(ANSWER_LIBRARY_NAMESPACE).values():
+                self._merge(LibraryEntry.from_dict(data))
+            self._version = version
+
+    def _store(self, entry: LibraryEntry):
+        """把条目写入共享后端（需在锁内调用）"""
+        if self.backend is not None:
+            self.backend.put_value(ANSWER_LIBRARY_NAMESPACE, entry.entry_id, entry.to_dict())
+
+    def add(self, question: str, answer: str, edited: bool = False) -> bool:
+        """收录一条已批准的回复
+
+        Args:
+            question: 客户问题
+            answer: 批准发送的回复
+            edited: 回复是否经过监督者修改
+
+        Returns:
+            知识库是否有变化（重复收录、回复过短或已被移除时返回False）
+        """
+        question, answer = clean_text_input(question), answer.strip()
+        if not question or len(answer) < ANSWER_LIBRARY_MIN_CHARS:
+            return False
+        entry = LibraryEntry(self.entry_id(answer), answer, [question], edited, updated_at=time.time())
+        with self._lock:
+            self._sync()
+            current = self._entries.get(entry.entry_id)
+            if current is not None and current.removed:
+                return False
+            if not self._merge(entry):
+                return False
+            self._store(self._entries[entry.entry_id])
+        return True
+
+    def remove(self, entry_id: str) -> bool:
+        """把条目移出知识库
+
+        Args:
+            entry_id: 条目ID
+
+        Returns:
+            是否移除成功
+        """
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(entry_id)
+            if entry is None or entry.removed:
+                return False
+            self._mark_removed(entry)
+            entry.updated_at = time.time()
+            self._store(entry)
+        return True
+
+    def suggest(self, question: str, limit: int = ANSWER_LIBRARY_SUGGESTION_LIMIT) -> List[LibraryMatch]:
+        """检索与客户问题最相似的已批准回复
+
+        Args:
+            question: 当前客户问题
+            limit: 返回的条目数
+
+        Returns:
+            按相关度降序的检索结果（每个条目只出现一次）
+        """
+        tokens = tokenize(question, unigrams=True)
+        if not tokens:
+            return []
+        terms = set(tokens)
+        with self._lock:
+            self._sync()
+            # 同一条目可能有多个问题命中，多取一些候选再按条目去重
+            ranked, _, _ = self.index.search(tokens, mask=self._removed_mask,
+                                             limit=limit * 4, match_all=False)
+            matches: Dict[str, LibraryMatch] = {}
+            for score, doc_id in ranked:
+                entry_id, position = self._docs[doc_id]
+                if entry_id in matches:
+                    continue
+                entry = self._entries[entry_id]
+                matched = entry.questions[position]
+                # BM25得分与知识库规模有关，用查询词元在历史问题中的覆盖率判断是否足够相似
+                covered = len(terms.intersection(tokenize(matched, unigrams=True)))
+                if covered < len(terms) * ANSWER_LIBRARY_MIN_COVERAGE:
+                    continue
+                matches[entry_id] = LibraryMatch(entry, matched, score)
+                if len(matches) >= limit:
+                    break
+        return list(matches.values())
+
+    def attach(self, event_bus: EventBus):
+        """订阅事件总线，收录新批准的回复"""
+        self._subscription = event_bus.subscribe(self._on_approved, [EVENT_APPROVED])
+
+    def _on_approved(self, event: Event):
+        question = event.data.get('question')
+        if question:
+            message = event.data['message']
+            self.add(question, message['content'], message['content'] != event.data.get('draft'))
+
+    def backfill(self, events: Iterable[Dict[str, Any]]) -> int:
+        """从审计日志回填已批准的回复
+
+        Args:
+            events: 审计记录（按时间顺序，如AuditLog.scan的结果）
+
+        Returns:
+            新收录的条目数
+        """
+        start = time.perf_counter()
+        questions: Dict[str, str] = {}
+        added = 0
+        for event in events:
+            if event['event'] == AUDIT_EVENT_USER_MESSAGE:
+                questions[event['message_id']] = event.get('content', '')
+            elif event['event'] == AUDIT_EVENT_APPROVE:
+                question = questions.pop(event.get('user_message_id'), None)
+                if question and self.add(question, event['final'], event.get('edited', False)):
+                    added += 1
+        self.logger.info(f"知识库回填 {added} 条回复，耗时 {time.perf_counter() - start:.2f}s")
+        return added
+
+    def stats(self) -> Dict[str, int]:
+        """获取知识库统计"""
+        with self._lock:
+            entries = [entry for entry in self._entries.values() if not entry.removed]
+            return {
+                'entries': len(entries),
+                'edited': sum(1 for entry in entries if entry.edited),
+                'questions': len(self._docs),
+            }
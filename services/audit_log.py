@@ -0,0 +1,416 @@
+"""监督审核审计日志服务"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from utils.text_diff import diff_opcodes, EQUAL
+
+AUDIT_EVENT_USER_MESSAGE = "user_message"
+AUDIT_EVENT_DRAFT = "draft"
+AUDIT_EVENT_APPROVE = "approve"
+AUDIT_EVENT_REJECT = "reject"
+
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".jsonl"
+
+def compute_edit_diff(original: str, edited: str) -> List[List[str]]:
+    """计算AI草稿与最终内容之间的字符级差异
+
+    Args:
+        original: AI原始草稿
+        edited: 监督者最终发送的内容
+
+    Returns:
+        差异列表，每项为[操作, 原文片段, 新文片段]，不包含相同部分
+    """
+    if original == edited:
+        return []
+    return [
+        [tag, original[i1:i2], edited[j1:j2]]
+        for tag, i1, i2, j1, j2 in diff_opcodes(original, edited)
+        if tag != EQUAL
+    ]
+
+def _parse_segment_name(name: str) -> Optional[Tuple[str, int]]:
+    """解析段文件名
+
+    Args:
+        name: 文件名（segment-<写入进程>-<段号>.jsonl，早期版本为segment-<段号>.jsonl）
+
+    Returns:
+        (写入进程标识, 段号)，不是段文件时返回None
+    """
+    if not name.startswith(_SEGMENT_PREFIX) or not name.endswith(_SEGMENT_SUFFIX):
+        return None
+    writer, _, number = name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)].rpartition("-")
+    if not number.isdigit():
+        return None
+    return writer, int(number)
+
+def _parse_record(line: bytes) -> Optional[Dict[str, Any]]:
+    """解析一行审计记录，损坏的行返回None"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or not isinstance(record.get('ts'), (int, float)):
+        return None
+    return record
+
+@dataclass
+class SegmentInfo:
+    """段文件元数据"""
+    writer: str
+    number: int
+    path: str
+    size: int = 0
+    min_ts: Optional[float] = None
+    max_ts: Optional[float] = None
+
+    def overlaps(self, start: Optional[float], end: Optional[float]) -> bool:
+        """判断段文件的时间范围是否与查询范围重叠"""
+        if self.min_ts is None:
+            return False
+        if start is not None and self.max_ts < start:
+            return False
+        if end is not None and self.min_ts > end:
+            return False
+        return True
+
+class AuditLog:
+    """只追加的分段审计日志
+
+    每条审计记录是一行JSON，写入本进程独占、按大小轮转的段文件，多个进程共用同一目录时
+    互不交错写入。调用方的append只把记录放入内存队列并立即返回；后台写入线程批量写盘，
+    每批只做一次fsync（组提交）。内存中维护会话ID/消息ID到(段文件, 偏移)的索引及每个段的
+    时间范围，支持按ID快速定位和按时间范围扫描。
+    """
+
+    def __init__(self, directory: str = "audit", segment_max_bytes: int = 64 * 1024 * 1024,
+                 commit_interval: float = 0.05, max_batch: int = 512, read_only: bool = False):
+        self.directory = directory
+        self.read_only = read_only
+        self.segment_max_bytes = segment_max_bytes
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.logger = logging.getLogger(__name__)
+
+        self.writer_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self._segments: List[SegmentInfo] = []
+        self._conversation_index: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        self._message_index: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        self._index_lock = threading.Lock()
+        self._corrupt_lines = 0
+
+        self._pending: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+        self._appended = 0
+        self._durable = 0
+        self._closed = False
+
+        self._file = None
+        self._writer = None
+        if read_only:
+            # 只读模式（如离线导出）：不截断、不写入，可与运行中的写入进程并存
+            self._load_segments()
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_segments()
+        # 本进程总是写入自己的新段文件，不追加到其他（可能仍在运行的）进程的段文件
+        self._segments.append(SegmentInfo(writer=self.writer_id, number=1,
+                                          path=self._segment_path(self.writer_id, 1)))
+        self._file = open(self._segments[-1].path, 'ab')
+        self._writer = threading.Thread(target=self._write_loop, name="audit-writer", daemon=True)
+        self._writer.start()
+
+    def append(self, event: str, conversation_id: str, message_id: Optional[str] = None,
+               reviewer: Optional[str] = None, **data: Any) -> int:
+        """追加一条审计记录（不等待落盘）
+
+        Args:
+            event: 事件类型
+            conversation_id: 会话ID
+            message_id: 消息/审核ID
+            reviewer: 审核人
+            **data: 其他字段（草稿、最终内容、差异等）
+
+        Returns:
+            记录序号，可用于wait_durable
+        """
+        now = time.time()
+        record = {
+            'event': event,
+            'ts': now,
+            'timestamp': datetime.fromtimestamp(now).isoformat(),
+            'conversation_id': conversation_id,
+            'message_id': message_id,
+            'reviewer': reviewer,
+        }
+        record.update(data)
+        with self._cond:
+            if self._closed or self.read_only:
+                raise RuntimeError("审计日志已关闭或为只读模式")
+            self._pending.append(record)
+            self._appended += 1
+            self._cond.notify_all()
+            return self._appended
+
+    def wait_durable(self, sequence: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """等待记录落盘
+
+        Args:
+            sequence: append返回的序号（默认等待当前已追加的全部记录）
+            timeout: 超时时间（秒）
+
+        Returns:
+            是否已全部落盘
+        """
+        with self._cond:
+            target = self._appended if sequence is None else sequence
+            return self._cond.wait_for(lambda: self._durable >= target, timeout)
+
+    def close(self):
+        """刷新剩余记录并关闭"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+            self._file.close()
+
+    def get_by_message(self, message_id: str) -> List[Dict[str, Any]]:
+        """按消息/审核ID查询审计记录"""
+        with self._index_lock:
+            locations = list(self._message_index.get(message_id, ()))
+        return self._read_locations(locations)
+
+    def get_by_conversation(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """按会话ID查询审计记录"""
+        with self._index_lock:
+            locations = list(self._conversation_index.get(conversation_id, ()))
+        return self._read_locations(locations)
+
+    def scan(self, start: Optional[float] = None, end: Optional[float] = None,
+             event: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """按时间范围顺序扫描审计记录
+
+        只读取时间范围与查询重叠的段文件；多个写入进程的段文件按时间戳归并输出。
+
+        Args:
+            start: 起始时间戳（含）
+            end: 结束时间戳（含）
+            event: 事件类型过滤
+
+        Yields:
+            审计记录
+        """
+        writers: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        with self._index_lock:
+            for segment in self._segments:
+                if segment.overlaps(start, end):
+                    writers[segment.writer].append((segment.path, segment.size))
+
+        streams = [self._scan_segments(segments, start, end, event) for segments in writers.values()]
+        yield from heapq.merge(*streams, key=lambda record: record['ts'])
+
+    def _scan_segments(self, segments: List[Tuple[str, int]], start: Optional[float],
+                       end: Optional[float], event: Optional[str]) -> Iterator[Dict[str, Any]]:
+        """顺序扫描同一写入进程的段文件（只读取已索引的部分）"""
+        for path, size in segments:
+            with open(path, 'rb') as f:
+                remaining = size
+                for line in f:
+                    remaining -= len(line)
+                    if remaining < 0:
+                        break
+                    record = _parse_record(line)
+                    if record is None:
+                        continue
+                    if start is not None and record['ts'] < start:
+                        continue
+                    if end is not None and record['ts'] > end:
+                        continue
+                    if event is not None and record.get('event') != event:
+                        continue
+                    yield record
+
+    def stats(self) -> Dict[str, int]:
+        """获取审计日志状态
+
+        Returns:
+            段数、已追加与已落盘记录数、加载时跳过的损坏行数
+        """
+        with self._cond:
+            return {
+                'segments': len(self._segments),
+                'appended': self._appended,
+                'durable': self._durable,
+                'corrupt_lines': self._corrupt_lines,
+            }
+
+    def _load_segments(self):
+        """加载已有段文件并重建索引
+
+        段文件只由创建它的进程写入，加载时不修改文件：尾部不完整的记录（写入进程崩溃或
+        仍在写入）不纳入索引，中间损坏的行跳过并计数。
+        """
+        names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        keys = sorted(key for key in map(_parse_segment_name, names) if key is not None)
+        for writer, number in keys:
+            segment = SegmentInfo(writer=writer, number=number, path=self._segment_path(writer, number))
+            corrupt = 0
+            with open(segment.path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        self.logger.warning(f"审计段文件尾部不完整，已忽略: {segment.path}")
+                        break
+                    record = _parse_record(line)
+                    if record is None:
+                        corrupt += 1
+                    else:
+                        self._index_record(segment, offset, record, len(line))
+                    offset += len(line)
+            if corrupt:
+                self.logger.warning(f"审计段文件中有 {corrupt} 行损坏，已跳过: {segment.path}")
+                self._corrupt_lines += corrupt
+            segment.size = offset
+            self._segments.append(segment)
+
+    def _segment_path(self, writer: str, number: int) -> str:
+        name = f"{writer}-{number:08d}" if writer else f"{number:08d}"
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{name}{_SEGMENT_SUFFIX}")
+
+    def _index_record(self, segment: SegmentInfo, offset: int, record: Dict[str, Any], length: int):
+        """将记录加入索引（调用方负责加锁）"""
+        location = (segment.path, offset)
+        if record.get('conversation_id'):
+            self._conversation_index[record['conversation_id']].append(location)
+        if record.get('message_id'):
+            self._message_index[record['message_id']].append(location)
+        ts = record['ts']
+        segment.min_ts = ts if segment.min_ts is None else min(segment.min_ts, ts)
+        segment.max_ts = ts if segment.max_ts is None else max(segment.max_ts, ts)
+        segment.size = offset + length
+
+    def _read_locations(self, locations: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        """按(段文件, 偏移)读取记录"""
+        records = []
+        handles = {}
+        try:
+            for path, offset in locations:
+                f = handles.get(path)
+                if f is None:
+                    f = handles[path] = open(path, 'rb')
+                f.seek(offset)
+                records.append(json.loads(f.readline()))
+        finally:
+            for f in handles.values():
+                f.close()
+        return records
+
+    def _write_loop(self):
+        """后台写入线程：批量写盘并组提交"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending and self._closed:
+                    return
+            # 等待一个提交间隔，让并发的追加合并到同一批
+            if self.commit_interval > 0:
+                time.sleep(self.commit_interval)
+            with self._cond:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:len(batch)]
+
+            written = self._write_batch(batch)
+            with self._cond:
+                self._durable += written
+                if written < len(batch):
+                    # 只重新排队未落盘的记录，已落盘的不会重复写入
+                    self._pending[:0] = batch[written:]
+                self._cond.notify_all()
+            if written < len(batch):
+                time.sleep(1)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> int:
+        """写入一批记录并fsync
+
+        Returns:
+            已落盘的记录数（写入失败时为失败前已落盘的前缀长度）
+        """
+        written = 0
+        try:
+            segment = self._segments[-1]
+            entries = []
+            offset = segment.size
+            for record in batch:
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+                if offset > 0 and offset + len(line) > self.segment_max_bytes:
+                    self._flush_entries(segment, entries)
+                    written += len(entries)
+                    entries = []
+                    segment = self._rotate()
+                    offset = 0
+                entries.append((offset, record, line))
+                offset += len(line)
+            self._flush_entries(segment, entries)
+            written += len(entries)
+        except Exception as e:
+            self.logger.error(f"审计日志写入失败（已落盘 {written}/{len(batch)} 条）: {e}")
+        return written
+
+    def _flush_entries(self, segment: SegmentInfo, entries: List[Tuple[int, Dict[str, Any], bytes]]):
+        """写入段文件、fsync后再更新索引，保证索引只指向已落盘的数据"""
+        if not entries:
+            return
+        try:
+            self._file.write(b"".join(line for _, _, line in entries))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception:
+            self._discard_tail(segment)
+            raise
+        with self._index_lock:
+            for offset, record, line in entries:
+                self._index_record(segment, offset, record, len(line))
+
+    def _discard_tail(self, segment: SegmentInfo):
+        """丢弃写入失败时可能残留的部分数据，使文件长度与已索引的偏移一致后重新打开
+
+        无法截断时改为写入新段，残留的不完整数据在加载时作为损坏行跳过。
+        """
+        try:
+            self._file.close()
+        except (OSError, ValueError):
+            pass
+        try:
+            os.truncate(segment.path, segment.size)
+        except OSError as e:
+            self.logger.error(f"审计段文件截断失败: {e}")
+            self._rotate()
+            return
+        self._file = open(segment.path, 'ab')
+
+    def _rotate(self) -> SegmentInfo:
+        """封存当前段文件并创建本进程的下一个段"""
+        self._file.close()
+        number = self._segments[-1].number + 1
+        segment = SegmentInfo(writer=self.writer_id, number=number,
+                              path=self._segment_path(self.writer_id, number))
+        with self._index_lock:
+            self._segments.append(segment)
+        self._file = open(segment.path, 'ab')
+        self.logger.info(f"审计日志轮转: {segment.path}")
+        return segment
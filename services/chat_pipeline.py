@@ -0,0 +1,397 @@
+"""客服对话处理流水线"""
+import inspect
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from services.admission_control import AdmissionController, AdmissionTicket, ADMISSION_SHED
+from services.audit_log import (
+    AuditLog, compute_edit_diff, AUDIT_EVENT_USER_MESSAGE, AUDIT_EVENT_DRAFT,
+    AUDIT_EVENT_APPROVE, AUDIT_EVENT_REJECT
+)
+from services.context_manager import ConversationContextManager
+from services.dify_api import DifyAPIService
+from services.event_bus import (
+    EventBus, EVENT_MESSAGE_ADDED, EVENT_DRAFT_READY, EVENT_APPROVED, EVENT_REJECTED, EVENT_CLEARED,
+    EVENT_ALTERNATIVE_SHOWN
+)
+from services.generation_registry import GenerationCancelled, GenerationRegistry, CANCEL_EVICTED, CANCEL_TIMEOUT
+from services.llm_scheduler import LANE_INTERACTIVE
+from services.session_store import SessionStore
+from services.speculative_drafts import (
+    SpeculativeDrafter, OUTCOME_APPROVED, OUTCOME_PROMOTED, OUTCOME_SHOWN
+)
+from services.state_manager import Message, StateManager, TransitionResult, TRANSITION_CONFLICT
+from utils.helpers import is_valid_message_content
+from utils.logging_pipeline import set_log_context
+from utils.token_estimator import check_prompt_tokens, estimate_request_tokens
+
+class ChatPipeline:
+    """客服对话处理流水线
+
+    封装"用户消息 → Dify草稿 → 监督者审核 → 发送"的完整流程，不依赖Streamlit，
+    供监督者控制台（app.py）和面向客户的接入端点（customer_gateway）共用。
+    每个状态变化都发布到事件总线，监督者控制台和客户连接据此刷新/推送。
+    进行中的草稿生成登记在生成登记表中，拒绝、清空对话、会话驱逐或超时时取消，
+    取消后返回的结果不会覆盖会话的新状态。
+    配置备选草稿预生成器时，草稿进入审核后在后台预生成备选回复，拒绝或切换查看时立即换入。
+    配置准入控制器时，客户消息先经过准入：过载时排队等待生成（返回排队位置）或不予受理。
+    """
+
+    def __init__(self, dify_service: DifyAPIService, context_manager: ConversationContextManager,
+                 session_store: SessionStore, audit_log: Optional[AuditLog] = None,
+                 event_bus: Optional[EventBus] = None,
+                 max_message_length: int = 1000, max_prompt_tokens: int = 2000,
+                 generations: Optional[GenerationRegistry] = None, generation_timeout: float = 90,
+                 speculator: Optional[SpeculativeDrafter] = None,
+                 admission: Optional[AdmissionController] = None):
+        self.dify_service = dify_service
+        self.context_manager = context_manager
+        self.session_store = session_store
+        self.audit_log = audit_log
+        self.event_bus = event_bus or EventBus()
+        self.max_message_length = max_message_length
+        self.max_prompt_tokens = max_prompt_tokens
+        self.generation_timeout = generation_timeout
+        if generations is None:
+            generations = GenerationRegistry()
+            generations.attach(self.event_bus, session_store)
+        self.generations = generations
+        self.speculator = speculator
+        self.admission = admission
+        self._tickets: Dict[str, AdmissionTicket] = {}  # 用户消息ID -> 待生成的准入凭据
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def accept(self, state_manager: StateManager, content: str,
+               idempotency_key: Optional[str] = None) -> Tuple[Optional[TransitionResult], str]:
+        """校验并添加用户消息
+
+        Args:
+            state_manager: 客户会话的状态管理器
+            content: 消息内容
+            idempotency_key: 幂等键（重复提交时返回首次创建的消息，不再生成草稿）
+
+        Returns:
+            (提交结果或None, 错误信息)；结果applied为False表示重复提交，
+            经过准入控制时结果附带准入决定（admission）；过载不予受理时返回None和提示。
+            上一条消息还在生成草稿或等待审核时不受理（返回None和提示），
+            避免新消息的草稿生成后因会话已有待审核回复而被丢弃
+        """
+        is_valid, error_msg = is_valid_message_content(content, self.max_message_length)
+        if not is_valid:
+            return None, error_msg
+
+        # 发送前拦截超出token上限的消息
+        is_valid, error_msg = check_prompt_tokens(content, self.max_prompt_tokens)
+        if not is_valid:
+            return None, error_msg
+
+        decision = None
+        if self.admission is not None:
+            decision = self.admission.admit(estimate_request_tokens(content))
+            if decision.action == ADMISSION_SHED:
+                return None, decision.notice
+
+        handed_off = False
+        try:
+            result = state_manager.submit_user_message(content, idempotency_key, exclusive=True)
+            if result.status == TRANSITION_CONFLICT:
+                return None, "上一条消息正在处理中，请稍候"
+            if not result.applied:
+                self.logger.info(f"重复提交已忽略: {result.message.id}")
+                return result, ""
+            if decision is not None:
+                # 凭据交给generate，由其负责归还
+                with self._lock:
+                    self._tickets[result.message.id] = decision.ticket
+                result.admission = decision.to_dict()
+            handed_off = True
+        finally:
+            # 重复提交或提交失败时撤回凭据，避免占用排队位置
+            if decision is not None and not handed_off:
+                self.admission.withdraw(decision.ticket)
+
+        user_message = result.message
+        set_log_context(correlation_id=user_message.id)
+        self.logger.info(f"用户消息已添加: {user_message.id}")
+        self._audit(AUDIT_EVENT_USER_MESSAGE, state_manager.get_session_id(), user_message.id,
+                    content=content)
+
+        self._account(state_manager)
+        self.event_bus.publish(EVENT_MESSAGE_ADDED, state_manager.get_session_id(),
+                               message=user_message.to_dict())
+        return result, ""
+
+    async def generate(self, state_manager: StateManager, user_message: Message,
+                       lane: str = LANE_INTERACTIVE) -> Dict[str, Any]:
+        """调用Dify为用户消息生成待审核草稿
+
+        Args:
+            state_manager: 客户会话的状态管理器
+            user_message: 用户消息
+            lane: 调度通道（客户消息为在线通道，监督者重新生成使用重新生成通道）
+
+        Returns:
+            Dify调用结果字典，成功时附带pending（待审核消息）
+        """
+        # 准备对话上下文（历史超出token预算时压缩并开启新会话，调用成功后才保存）
+        conversation_id = state_manager.get_conversation_id()
+        messages = list(state_manager.get_messages())
+        context_plan = self.context_manager.prepare(messages, state_manager.get_context_state())
+        if context_plan.compacted:
+            conversation_id = None
+        request_tokens = estimate_request_tokens(user_message.content, context_plan.inputs)
+        self.logger.info(
+            f"预计输入token: {request_tokens}, 会话历史token: {context_plan.history_tokens}"
+        )
+
+        # 调用AI服务（登记为可取消的生成）
+        session_id = state_manager.get_session_id()
+        with self._lock:
+            ticket = self._tickets.pop(user_message.id, None)
+        completion = None
+        try:
+            handle = self.generations.start(session_id, user_message.id, lane, request_tokens)
+            discarded = False
+            try:
+                completion = self.dify_service.chat_completion(
+                    user_message.content, conversation_id, inputs=context_plan.inputs,
+                    user=state_manager.get_dify_user(), lane=lane, handle=handle
+                )
+                ai_response = await handle.run(self._complete(ticket, completion), self.generation_timeout)
+                # 生成期间会话被清空或已有新的待审核回复时，结果不再适用
+                discarded = ai_response['success'] and not self._is_current(state_manager, user_message.id)
+            except GenerationCancelled as e:
+                error = 'timeout' if e.reason == CANCEL_TIMEOUT else 'cancelled'
+                ai_response = {'success': False, 'error': error, 'reason': e.reason, 'content': str(e)}
+            finally:
+                self.generations.finish(handle, discarded)
+        finally:
+            # 生成在开始前被取消时_complete不会运行，由这里撤回凭据（已归还的凭据撤回无效果）
+            # 并关闭未启动的Dify调用协程
+            if ticket is not None:
+                self.admission.withdraw(ticket)
+            if completion is not None and inspect.getcoroutinestate(completion) == inspect.CORO_CREATED:
+                completion.close()
+        if discarded:
+            ai_response = {'success': False, 'error': 'cancelled', 'reason': 'stale',
+                           'content': "会话状态已变化，回复已丢弃"}
+
+        if ai_response['success']:
+            # 压缩后的上下文和新会话ID只在Dify调用成功后保存，失败或取消时保留原会话
+            if context_plan.compacted:
+                state_manager.set_context_state(context_plan.state)
+                state_manager.set_conversation_id(ai_response.get('conversation_id'))
+            elif ai_response.get('conversation_id'):
+                state_manager.set_conversation_id(ai_response['conversation_id'])
+
+            # 设置待审核消息
+            pending = state_manager.set_pending_review(ai_response['content'], user_message.id)
+            self._audit(AUDIT_EVENT_DRAFT, session_id, pending.id,
+                        user_message_id=user_message.id, draft=pending.original_content,
+                        dify_message_id=ai_response.get('message_id'))
+            ai_response['pending'] = pending
+            self.logger.info("AI回复已生成，等待审核")
+            self.event_bus.publish(EVENT_DRAFT_READY, session_id,
+                                   pending_id=pending.id, user_message_id=user_message.id)
+            if self.speculator is not None:
+                self.speculator.schedule(state_manager, pending.id, user_message.content,
+                                         self.context_manager.standalone_inputs(messages, context_plan))
+        elif ai_response.get('reason') == CANCEL_EVICTED:
+            # 会话已被驱逐，不再写入状态
+            self.logger.info(f"会话已驱逐，草稿生成已取消: {session_id}")
+            return ai_response
+        elif ai_response.get('error') == 'cancelled':
+            state_manager.set_typing_status(False)
+            self.logger.info(f"草稿生成已取消: {ai_response['content']}")
+        else:
+            state_manager.set_typing_status(False)
+            self.logger.error(f"AI服务调用失败: {ai_response}")
+
+        self._account(state_manager)
+        return ai_response
+
+    async def _complete(self, ticket: Optional[AdmissionTicket], completion) -> Dict[str, Any]:
+        """等待准入后调用Dify，结束后把调用结果反馈给准入控制器
+
+        Args:
+            ticket: 客户消息的准入凭据（监督者重新生成等没有凭据时直接调用）
+            completion: Dify调用协程
+
+        Returns:
+            Dify调用结果字典
+        """
+        if ticket is None:
+            return await completion
+        try:
+            await self.admission.acquire(ticket)
+        except BaseException:
+            completion.close()
+            raise
+        started = time.monotonic()
+        success = None
+        try:
+            result = await completion
+            success = result['success']
+            return result
+        finally:
+            self.admission.release(ticket, time.monotonic() - started, success)
+
+    @staticmethod
+    def _is_current(state_manager: StateManager, user_message_id: str) -> bool:
+        """用户消息仍在会话中且还没有待审核回复"""
+        if state_manager.get_pending_review() is not None:
+            return False
+        return any(message['id'] == user_message_id for message in state_manager.get_messages())
+
+    def clear(self, state_manager: StateManager):
+        """清空会话，并取消进行中的草稿生成
+
+        Args:
+            state_manager: 被清空的客户会话的状态管理器
+        """
+        state_manager.clear_all()
+        self.logger.info("会话已清空")
+        self._account(state_manager)
+        self.event_bus.publish(EVENT_CLEARED, state_manager.get_session_id())
+
+    def approve(self, state_manager: StateManager, final_content: Optional[str],
+                reviewer: Optional[str] = None, expected_id: Optional[str] = None,
+                expected_version: Optional[int] = None,
+                idempotency_key: Optional[str] = None) -> TransitionResult:
+        """批准待审核回复并发送给客户
+
+        Args:
+            state_manager: 被审核客户会话的状态管理器
+            final_content: 最终内容（None时使用编辑后的内容）
+            reviewer: 审核人
+            expected_id: 审核人看到的待审核消息ID
+            expected_version: 审核人看到的待审核消息版本号
+            idempotency_key: 幂等键
+
+        Returns:
+            转换结果；只有applied时才写审计、发布事件
+        """
+        result = state_manager.approve_review(final_content, expected_id, expected_version,
+                                              idempotency_key)
+        if not result.applied:
+            self.logger.info(f"批准未生效: {result.status}")
+            return result
+
+        message, pending = result.message, result.pending
+        session_id = state_manager.get_session_id()
+        self.logger.info(f"消息已批准发送: {message.id}")
+        edit_diff = compute_edit_diff(pending['original_content'], message.content)
+        edited = message.content != pending['original_content']
+        speculative = pending.get('speculative', False)
+        review_seconds = (message.timestamp - datetime.fromisoformat(pending['timestamp'])).total_seconds()
+        self._audit(AUDIT_EVENT_APPROVE, session_id, message.id, reviewer=reviewer,
+                    user_message_id=pending['user_message_id'],
+                    draft=pending['original_content'],
+                    final=message.content,
+                    edited=edited,
+                    edit_diff=edit_diff,
+                    edit_distance=sum(len(old) + len(new) for _, old, new in edit_diff),
+                    review_seconds=review_seconds,
+                    speculative=speculative)
+        if speculative and self.speculator is not None:
+            self.speculator.record(OUTCOME_APPROVED)
+        self._account(state_manager)
+        question = next((item['content'] for item in state_manager.get_messages()
+                         if item['id'] == pending['user_message_id']), None)
+        self.event_bus.publish(EVENT_APPROVED, session_id, message=message.to_dict(),
+                               question=question, draft=pending['original_content'],
+                               reviewer=reviewer, edited=edited, review_seconds=review_seconds)
+        return result
+
+    def reject(self, state_manager: StateManager, reviewer: Optional[str] = None,
+               expected_id: Optional[str] = None, expected_version: Optional[int] = None,
+               idempotency_key: Optional[str] = None) -> TransitionResult:
+        """拒绝待审核回复
+
+        Args:
+            state_manager: 被审核客户会话的状态管理器
+            reviewer: 审核人
+            expected_id: 审核人看到的待审核消息ID
+            expected_version: 审核人看到的待审核消息版本号
+            idempotency_key: 幂等键
+
+        Returns:
+            转换结果，生效时pending为被拒绝的待审核消息；已有备选回复时换入为新的待审核消息（replacement）
+        """
+        result = state_manager.reject_review(expected_id, expected_version, idempotency_key,
+                                             promote_alternative=True)
+        if not result.applied:
+            self.logger.info(f"拒绝未生效: {result.status}")
+            return result
+
+        rejected = result.pending
+        self.logger.info("消息已被拒绝")
+        review_seconds = (datetime.now() - datetime.fromisoformat(rejected['timestamp'])).total_seconds()
+        self._audit(AUDIT_EVENT_REJECT, state_manager.get_session_id(), rejected['id'],
+                    reviewer=reviewer,
+                    user_message_id=rejected['user_message_id'],
+                    draft=rejected['original_content'],
+                    edited_draft=rejected['edited_content'],
+                    review_seconds=review_seconds)
+        self.event_bus.publish(EVENT_REJECTED, state_manager.get_session_id(),
+                               pending_id=rejected['id'], reviewer=reviewer,
+                               review_seconds=review_seconds)
+
+        replacement = result.replacement
+        if replacement is not None:
+            self.logger.info(f"已换入备选回复: {replacement['id']}")
+            self._audit(AUDIT_EVENT_DRAFT, state_manager.get_session_id(), replacement['id'],
+                        user_message_id=replacement['user_message_id'],
+                        draft=replacement['original_content'], speculative=True)
+            if self.speculator is not None:
+                self.speculator.record(OUTCOME_PROMOTED)
+            self.event_bus.publish(EVENT_DRAFT_READY, state_manager.get_session_id(),
+                                   pending_id=replacement['id'],
+                                   user_message_id=replacement['user_message_id'], speculative=True)
+        self._account(state_manager)
+        return result
+
+    def show_alternative(self, state_manager: StateManager, expected_id: Optional[str] = None,
+                         expected_version: Optional[int] = None) -> TransitionResult:
+        """切换查看待审核消息的备选回复（再次调用切换回来）
+
+        Args:
+            state_manager: 被审核客户会话的状态管理器
+            expected_id: 审核人看到的待审核消息ID
+            expected_version: 审核人看到的待审核消息版本号
+
+        Returns:
+            转换结果，生效时pending为切换后的待审核消息
+        """
+        result = state_manager.swap_alternative(expected_id, expected_version)
+        if not result.applied:
+            self.logger.info(f"切换备选回复未生效: {result.status}")
+            return result
+
+        pending = result.pending
+        self.logger.info(f"已切换备选回复: {pending['id']}")
+        if self.speculator is not None and pending['speculative']:
+            self.speculator.record(OUTCOME_SHOWN)
+        self.event_bus.publish(EVENT_ALTERNATIVE_SHOWN, state_manager.get_session_id(),
+                               pending_id=pending['id'], speculative=pending['speculative'])
+        return result
+
+    def _audit(self, event: str, conversation_id: Optional[str], message_id: Optional[str] = None,
+               reviewer: Optional[str] = None, **data):
+        """写入审计记录（失败只记录日志，不影响审核流程）"""
+        if self.audit_log is None:
+            return
+        try:
+            self.audit_log.append(event, conversation_id=conversation_id or 'unknown',
+                                  message_id=message_id, reviewer=reviewer, **data)
+        except Exception as e:
+            self.logger.error(f"审计记录写入失败: {e}")
+
+    def _account(self, state_manager: StateManager):
+        """状态变更后重新统计会话内存"""
+        session = self.session_store.get(state_manager.get_session_id() or '')
+        if session is not None:
+            self.session_store.account(session)
@@ -0,0 +1,129 @@
+"""对话上下文窗口管理服务"""
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+from utils.constants import (
+    CONTEXT_SUMMARY_INPUT, CONTEXT_RECENT_INPUT, CONTEXT_SUMMARY_LINE_LENGTH
+)
+from utils.token_estimator import estimate_tokens
+
+@dataclass
+class ContextState:
+    """本地保存的上下文状态"""
+    summary: str = ""
+    base_index: int = 0
+
+@dataclass
+class ContextPlan:
+    """单轮请求的上下文方案"""
+    compacted: bool
+    history_tokens: int
+    state: ContextState
+    inputs: Dict[str, Any] = field(default_factory=dict)
+
+class ConversationContextManager:
+    """对话上下文管理器
+
+    Dify会话会在服务端重放该会话的全部历史，对话越长每轮的延迟和token消耗越高。
+    本管理器在本地跟踪当前Dify会话自起点以来的历史token数，超过预算时
+    将较早的轮次压缩进滚动摘要，保留最近K轮原文，通过inputs开启新的Dify会话。
+    """
+
+    def __init__(self, token_budget: int = 2000, keep_turns: int = 3,
+                 summary_max_chars: int = 600):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summary_max_chars = summary_max_chars
+        self.logger = logging.getLogger(__name__)
+
+    def prepare(self, messages: List[Dict[str, Any]], state: ContextState) -> ContextPlan:
+        """为即将发送的消息准备上下文
+
+        Args:
+            messages: StateManager中的消息列表（最后一条为当前用户消息）
+            state: 当前上下文状态
+
+        Returns:
+            上下文方案；compacted为True时应以新会话发送并携带inputs
+        """
+        history = messages[state.base_index:-1]
+        history_tokens = sum(estimate_tokens(message['content']) for message in history)
+
+        if history_tokens <= self.token_budget:
+            return ContextPlan(compacted=False, history_tokens=history_tokens, state=state)
+
+        # 最近K轮（一问一答为一轮）保留原文，其余并入滚动摘要
+        recent_start = max(state.base_index, len(messages) - 1 - self.keep_turns * 2)
+        summary = self._update_summary(state.summary, messages[state.base_index:recent_start])
+        recent = messages[recent_start:-1]
+
+        # 最近K轮通过inputs带入新会话，仍计入新会话的历史，下次压缩时再并入摘要
+        new_state = ContextState(summary=summary, base_index=recent_start)
+        inputs = {
+            CONTEXT_SUMMARY_INPUT: summary,
+            CONTEXT_RECENT_INPUT: self._format_turns(recent),
+        }
+
+        self.logger.info(
+            f"对话上下文已压缩: 历史 {history_tokens} tokens 超出预算 {self.token_budget}, "
+            f"保留最近 {len(recent)} 条消息"
+        )
+        return ContextPlan(compacted=True, history_tokens=history_tokens,
+                           state=new_state, inputs=inputs)
+
+    def standalone_inputs(self, messages: List[Dict[str, Any]], plan: ContextPlan) -> Dict[str, Any]:
+        """为不依赖Dify会话的单次请求（如备选草稿）准备完整上下文
+
+        Args:
+            messages: prepare时使用的消息列表（最后一条为当前用户消息）
+            plan: prepare返回的上下文方案
+
+        Returns:
+            携带滚动摘要和当前Dify会话历史的inputs
+        """
+        if plan.compacted:
+            return dict(plan.inputs)
+        return {
+            CONTEXT_SUMMARY_INPUT: plan.state.summary,
+            CONTEXT_RECENT_INPUT: self._format_turns(messages[plan.state.base_index:-1]),
+        }
+
+    def _update_summary(self, summary: str, messages: List[Dict[str, Any]]) -> str:
+        """将消息追加到滚动摘要中，超长时丢弃最早的摘要行
+
+        Args:
+            summary: 已有摘要
+            messages: 需要并入摘要的消息
+
+        Returns:
+            更新后的摘要
+        """
+        lines = summary.split("\n") if summary else []
+        for message in messages:
+            lines.append(self._summarize_message(message))
+
+        while len(lines) > 1 and sum(len(line) + 1 for line in lines) > self.summary_max_chars:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    @staticmethod
+    def _summarize_message(message: Dict[str, Any]) -> str:
+        """提取单条消息的摘要行（首句，截断到固定长度）"""
+        sender = "用户" if message['sender'] == 'user' else "客服"
+        content = " ".join(message['content'].split())
+        for delimiter in "。！？!?\n":
+            index = content.find(delimiter)
+            if 0 < index < CONTEXT_SUMMARY_LINE_LENGTH:
+                content = content[:index + 1]
+                break
+        if len(content) > CONTEXT_SUMMARY_LINE_LENGTH:
+            content = content[:CONTEXT_SUMMARY_LINE_LENGTH - 3] + "..."
+        return f"{sender}: {content}"
+
+    @staticmethod
+    def _format_turns(messages: List[Dict[str, Any]]) -> str:
+        """将最近的消息格式化为文本"""
+        return "\n".join(
+            f"{'用户' if message['sender'] == 'user' else '客服'}: {message['content']}"
+            for message in messages
+        )
@@ -0,0 +1,323 @@
+"""对话记录流式导出服务"""
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import logging
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Set
+
+from services.audit_log import (
+    AuditLog, AUDIT_EVENT_USER_MESSAGE, AUDIT_EVENT_DRAFT, AUDIT_EVENT_APPROVE, AUDIT_EVENT_REJECT
+)
+
+logger = logging.getLogger(__name__)
+
+# 导出字段（所有格式共用）
+EXPORT_FIELDS = ['conversation_id', 'message_id', 'sender', 'status', 'timestamp', 'content']
+
+# 导出格式 -> (文件扩展名, MIME类型)
+EXPORT_FORMATS = {
+    'markdown': ('.md', 'text/markdown'),
+    'jsonl': ('.jsonl', 'application/jsonl'),
+    'csv': ('.csv', 'text/csv'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+def available_export_formats() -> List[str]:
+    """获取当前环境可用的导出格式（未安装pyarrow时不提供Parquet）
+
+    Returns:
+        导出格式列表
+    """
+    # 只查找模块而不导入，pyarrow导入较慢
+    has_pyarrow = importlib.util.find_spec('pyarrow') is not None
+    return [name for name in EXPORT_FORMATS if name != 'parquet' or has_pyarrow]
+
+# 审计事件 -> (发送者, 状态)
+_AUDIT_EVENT_MAPPING = {
+    AUDIT_EVENT_USER_MESSAGE: ('user', 'sent'),
+    AUDIT_EVENT_DRAFT: ('assistant', 'draft'),
+    AUDIT_EVENT_APPROVE: ('assistant', 'sent'),
+    AUDIT_EVENT_REJECT: ('assistant', 'rejected'),
+}
+
+@dataclass
+class ExportFilter:
+    """导出过滤条件"""
+    conversation_id: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    statuses: Optional[Set[str]] = None
+
+    def match(self, record: Dict[str, Any]) -> bool:
+        """判断记录是否满足过滤条件
+
+        时间按Unix时间戳比较：记录时间和过滤时间可以分别带或不带时区（不带时区按本地时间），
+        与按时间范围扫描审计日志的口径一致。
+        """
+        if self.conversation_id and record['conversation_id'] != self.conversation_id:
+            return False
+        if self.statuses and record['status'] not in self.statuses:
+            return False
+        if self.since or self.until:
+            timestamp = datetime.fromisoformat(record['timestamp']).timestamp()
+            if self.since and timestamp < self.since.timestamp():
+                return False
+            if self.until and timestamp > self.until.timestamp():
+                return False
+        return True
+
+def iter_session_messages(messages: Iterable[Dict[str, Any]], conversation_id: str,
+                          export_filter: Optional[ExportFilter] = None) -> Iterator[Dict[str, Any]]:
+    """将StateManager中的消息转换为导出记录
+
+    Args:
+        messages: 消息列表
+        conversation_id: 会话ID
+        export_filter: 过滤条件
+
+    Yields:
+        导出记录
+    """
+    for message in messages:
+        record = {
+            'conversation_id': conversation_id,
+            'message_id': message['id'],
+            'sender': message['sender'],
+            'status': message['status'],
+            'timestamp': message['timestamp'],
+            'content': message['content'],
+        }
+        if export_filter is None or export_filter.match(record):
+            yield record
+
+def iter_audit_messages(audit_log: AuditLog, export_filter: Optional[ExportFilter] = None,
+                        group_by_conversation: bool = False) -> Iterator[Dict[str, Any]]:
+    """从持久化的审计日志中流式读取所有会话的消息
+
+    指定会话时走会话索引，否则按时间范围扫描段文件。
+
+    Args:
+        audit_log: 审计日志实例
+        export_filter: 过滤条件
+        group_by_conversation: 按会话分组输出（先扫描出时间范围内的会话，再逐个按会话索引读取），
+            否则按时间顺序输出，不同会话的消息交错
+
+    Yields:
+        导出记录
+    """
+    export_filter = export_filter or ExportFilter()
+    if export_filter.conversation_id:
+        source = _iter_conversation(audit_log, export_filter.conversation_id)
+    else:
+        source = audit_log.scan(
+            start=export_filter.since.timestamp() if export_filter.since else None,
+            end=export_filter.until.timestamp() if export_filter.until else None
+        )
+        if group_by_conversation:
+            # 只在内存中保留会话ID，消息仍逐个会话读取
+            conversation_ids = list(dict.fromkeys(event['conversation_id'] for event in source))
+            source = (event for conversation_id in conversation_ids
+                      for event in _iter_conversation(audit_log, conversation_id))
+
+    for event in source:
+        mapping = _AUDIT_EVENT_MAPPING.get(event['event'])
+        if mapping is None:
+            continue
+        sender, status = mapping
+        record = {
+            'conversation_id': event['conversation_id'],
+            'message_id': event['message_id'],
+            'sender': sender,
+            'status': status,
+            'timestamp': event['timestamp'],
+            'content': event.get('content', event.get('final', event.get('draft', ''))),
+        }
+        if export_filter.match(record):
+            yield record
+
+def _iter_conversation(audit_log: AuditLog, conversation_id: str) -> Iterator[Dict[str, Any]]:
+    """按时间顺序读取单个会话的审计记录（多个写入进程的记录可能分布在不同段文件）"""
+    return iter(sorted(audit_log.get_by_conversation(conversation_id), key=lambda event: event['ts']))
+
+def iter_markdown(records: Iterable[Dict[str, Any]], title: str = "对话记录导出") -> Iterator[str]:
+    """逐条生成Markdown内容
+
+    每个会话只输出一次标题：记录需按会话分组（见iter_audit_messages的group_by_conversation），
+    未分组的记录中同一会话再次出现时只在消息中标注会话ID。
+
+    Args:
+        records: 导出记录
+        title: 文档标题
+
+    Yields:
+        Markdown文本片段
+    """
+    yield f"# {title}\n\n"
+    yield f"导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+
+    count = 0
+    section = None  # 最近输出标题的会话
+    seen_conversations: Set[str] = set()
+    for record in records:
+        count += 1
+        conversation_id = record['conversation_id']
+        if conversation_id not in seen_conversations:
+            seen_conversations.add(conversation_id)
+            section = conversation_id
+            yield f"## 会话 {conversation_id}\n\n"
+        conversation = f"**会话**: {conversation_id}\n" if conversation_id != section else ""
+        sender = "用户" if record['sender'] == 'user' else "AI助手"
+        yield (
+            f"### 消息 {count}\n"
+            f"{conversation}"
+            f"**发送者**: {sender}\n"
+            f"**状态**: {record['status']}\n"
+            f"**时间**: {record['timestamp']}\n"
+            f"**内容**: {record['content']}\n\n"
+        )
+
+    yield f"---\n消息总数: {count}\n"
+
+def iter_jsonl(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """逐条生成JSON Lines内容"""
+    for record in records:
+        yield json.dumps({field: record[field] for field in EXPORT_FIELDS}, ensure_ascii=False) + "\n"
+
+def iter_csv(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """逐条生成CSV内容（复用同一个行缓冲区）"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def write_parquet(records: Iterable[Dict[str, Any]], target: Any, batch_size: int = 10000) -> int:
+    """按批写入Parquet文件
+
+    Args:
+        records: 导出记录
+        target: 文件路径或二进制文件对象
+        batch_size: 每个行组的记录数
+
+    Returns:
+        写入的记录数
+    """
+    try:  # Parquet导出为可选功能，pyarrow导入较慢，只在实际导出时加载
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet导出需要安装pyarrow")
+
+    schema = pa.schema([(field, pa.string()) for field in EXPORT_FIELDS])
+    count = 0
+    with pq.ParquetWriter(target, schema) as writer:
+        batch: Dict[str, List[Any]] = {field: [] for field in EXPORT_FIELDS}
+        for record in records:
+            for field in EXPORT_FIELDS:
+                batch[field].append(record[field])
+            count += 1
+            if count % batch_size == 0:
+                writer.write_table(pa.table(batch, schema=schema))
+                batch = {field: [] for field in EXPORT_FIELDS}
+        if batch['message_id'] or count == 0:
+            writer.write_table(pa.table(batch, schema=schema))
+    return count
+
+def export_records(records: Iterable[Dict[str, Any]], export_format: str, target: IO) -> int:
+    """将记录流式写入文件对象
+
+    Args:
+        records: 导出记录
+        export_format: 导出格式（markdown/jsonl/csv/parquet）
+        target: 二进制文件对象
+
+    Returns:
+        写入的记录数
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {export_format}")
+
+    counter = _Counter(records)
+    if export_format == 'parquet':
+        return write_parquet(counter, target)
+
+    chunks = {
+        'markdown': iter_markdown,
+        'jsonl': iter_jsonl,
+        'csv': iter_csv,
+    }[export_format](counter)
+    for chunk in chunks:
+        target.write(chunk.encode('utf-8'))
+    return counter.count
+
+def export_to_spooled_file(records: Iterable[Dict[str, Any]], export_format: str,
+                           max_memory: int = 4 * 1024 * 1024) -> IO:
+    """导出到临时文件（超过max_memory后落盘）
+
+    Args:
+        records: 导出记录
+        export_format: 导出格式
+        max_memory: 内存缓冲上限（字节）
+
+    Returns:
+        已回到开头的临时文件对象
+    """
+    target = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    export_records(records, export_format, target)
+    target.seek(0)
+    return target
+
+class _Counter:
+    """统计经过迭代器的记录数"""
+
+    def __init__(self, records: Iterable[Dict[str, Any]]):
+        self._records = records
+        self.count = 0
+
+    def __iter__(self):
+        for record in self._records:
+            self.count += 1
+            yield record
+
+def main(argv: Optional[List[str]] = None):
+    """批量导出命令行入口"""
+    parser = argparse.ArgumentParser(description="从审计日志批量导出对话记录")
+    parser.add_argument('--audit-dir', default='audit', help="审计日志目录")
+    parser.add_argument('--format', default='jsonl', choices=sorted(available_export_formats()),
+                        help="导出格式")
+    parser.add_argument('--output', required=True, help="输出文件路径")
+    parser.add_argument('--conversation', help="只导出指定会话")
+    parser.add_argument('--since', help="起始时间（ISO格式）")
+    parser.add_argument('--until', help="结束时间（ISO格式）")
+    parser.add_argument('--status', action='append', help="只导出指定状态（可多次指定）")
+    args = parser.parse_args(argv)
+
+    export_filter = ExportFilter(
+        conversation_id=args.conversation,
+        since=datetime.fromisoformat(args.since) if args.since else None,
+        until=datetime.fromisoformat(args.until) if args.until else None,
+        statuses=set(args.status) if args.status else None
+    )
+
+    audit_log = AuditLog(args.audit_dir, read_only=True)
+    try:
+        with open(args.output, 'wb') as f:
+            # Markdown按会话分节，需要按会话分组读取
+            records = iter_audit_messages(audit_log, export_filter,
+                                          group_by_conversation=args.format == 'markdown')
+            count = export_records(records, args.format, f)
+    finally:
+        audit_log.close()
+    print(f"已导出 {count} 条消息到 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""面向客户的异步HTTP/WebSocket接入端点"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+
+try:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route, WebSocketRoute
+    from starlette.websockets import WebSocket, WebSocketDisconnect
+except ImportError:  # 客户接入端点为可选功能
+    uvicorn = None
+    Starlette = None
+
+from services.chat_pipeline import ChatPipeline
+from services.event_bus import Event, EVENT_APPROVED
+from services.session_store import SessionStore, SESSION_ROLE_CUSTOMER
+from services.state_manager import StateManager, TransitionResult
+from utils.helpers import generate_session_id
+
+# 会话令牌中签名的十六进制长度
+_TOKEN_SIGNATURE_LENGTH = 32
+
+# WebSocket关闭码：会话不存在、已过期或令牌无效
+WS_CLOSE_UNKNOWN_SESSION = 4404
+
+class ReplyBroadcaster:
+    """把批准后的回复推送给订阅该会话的WebSocket连接
+
+    批准事件在发布者线程（如Streamlit脚本线程）中回调，通过call_soon_threadsafe把消息
+    投递到各连接所在事件循环的队列，不阻塞监督者操作。
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, session_id: str) -> Tuple[asyncio.AbstractEventLoop, asyncio.Queue]:
+        """订阅会话的回复（需在事件循环中调用）"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(session_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, session_id: str, subscriber: Tuple[asyncio.AbstractEventLoop, asyncio.Queue]):
+        """取消订阅"""
+        with self._lock:
+            subscribers = self._subscribers.get(session_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[session_id]
+
+    def publish(self, session_id: str, message: Dict[str, Any]):
+        """推送回复（可在任意线程调用）
+
+        Args:
+            session_id: 客户会话ID
+            message: 消息字典
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(session_id, ()))
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    def subscriber_count(self) -> int:
+        """当前连接数"""
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+class CustomerGateway:
+    """客户接入端点
+
+    客户通过HTTP或WebSocket提交消息，消息进入与监督者控制台相同的会话存储和
+    审核流水线；监督者批准后回复通过WebSocket实时推送，也可通过HTTP轮询获取。
+    会话只能由端点创建：客户拿到的是带HMAC签名的会话令牌，签名不符、会话已过期
+    或不是客户会话（如监督者会话）的请求一律拒绝。会话存储、审核流水线的同步操作
+    （SQLite、事件总线、审计日志）在线程池中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, pipeline: ChatPipeline, session_store: SessionStore,
+                 auto_approve: bool = False, secret: Optional[bytes] = None):
+        """
+        Args:
+            pipeline: 审核流水线
+            session_store: 会话存储
+            auto_approve: 草稿生成后自动批准（仅用于本地测试）
+            secret: 会话令牌签名密钥；为空时每个进程随机生成（重启后或其他副本上已签发的令牌失效）
+        """
+        if Starlette is None:
+            raise RuntimeError("客户接入端点需要安装starlette和uvicorn")
+        self.pipeline = pipeline
+        self.session_store = session_store
+        self.auto_approve = auto_approve
+        self._secret = secret or os.urandom(32)
+        self.broadcaster = ReplyBroadcaster()
+        self._subscription = self.pipeline.event_bus.subscribe(self._on_approved, [EVENT_APPROVED])
+        self.logger = logging.getLogger(__name__)
+
+        self._tasks: Set[asyncio.Task] = set()
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def create_app(self) -> "Starlette":
+        """创建ASGI应用"""
+        return Starlette(routes=[
+            Route('/healthz', self.healthz, methods=['GET']),
+            Route('/api/sessions', self.create_session, methods=['POST']),
+            Route('/api/sessions/{session_id}/messages', self.list_messages, methods=['GET']),
+            Route('/api/sessions/{session_id}/messages', self.post_message, methods=['POST']),
+            WebSocketRoute('/api/sessions/{session_id}/ws', self.websocket),
+        ])
+
+    def start(self, host: str = "127.0.0.1", port: int = 8600) -> "CustomerGateway":
+        """在后台线程启动服务（与Streamlit控制台同进程运行）"""
+        config = uvicorn.Config(self.create_app(), host=host, port=port, log_config=None)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="customer-gateway", daemon=True)
+        self._thread.start()
+        self.logger.info(f"客户接入端点已启动: http://{host}:{port}")
+        return self
+
+    def stop(self):
+        """停止后台服务"""
+        self.pipeline.event_bus.unsubscribe(self._subscription)
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+    def _on_approved(self, event: Event):
+        """批准事件：推送回复给该会话的连接"""
+        self.broadcaster.publish(event.session_id, event.data['message'])
+
+    async def healthz(self, request: "Request") -> "JSONResponse":
+        """健康检查（配置准入控制时附带当前并发上限和排队数，便于负载均衡判断过载）"""
+        result = {
+            'status': 'ok',
+            'sessions': self.session_store.stats()['customers'],
+            'connections': self.broadcaster.subscriber_count(),
+        }
+        if self.pipeline.admission is not None:
+            stats = self.pipeline.admission.stats()
+            result['admission'] = {'limit': round(stats['limit'], 1), 'inflight': stats['inflight'],
+                                   'waiting': stats['waiting']}
+        return JSONResponse(result)
+
+    def issue_token(self, session_id: str) -> str:
+        """签发会话令牌
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            会话令牌（会话ID.签名）
+        """
+        signature = hmac.new(self._secret, session_id.encode('utf-8'), hashlib.sha256).hexdigest()
+        return f"{session_id}.{signature[:_TOKEN_SIGNATURE_LENGTH]}"
+
+    def verify_token(self, token: str) -> Optional[str]:
+        """校验会话令牌
+
+        Args:
+            token: 客户提交的会话令牌
+
+        Returns:
+            会话ID，签名不符时返回None
+        """
+        session_id = token.rpartition('.')[0]
+        if not session_id or not hmac.compare_digest(self.issue_token(session_id), token):
+            return None
+        return session_id
+
+    async def create_session(self, request: "Request") -> "JSONResponse":
+        """创建客户会话，返回签名的会话令牌（后续请求路径中的session_id）"""
+        session_id = generate_session_id()
+        await run_in_threadpool(self.session_store.get_or_create, session_id, SESSION_ROLE_CUSTOMER)
+        return JSONResponse({'session_id': self.issue_token(session_id)}, status_code=201)
+
+    async def list_messages(self, request: "Request") -> "JSONResponse":
+        """获取会话中已发送的消息（轮询方式获取回复）"""
+        def snapshot() -> Optional[Dict[str, Any]]:
+            state_manager = self._get_state_manager(request.path_params['session_id'])
+            if state_manager is None:
+                return None
+            return {'messages': list(state_manager.get_messages()), 'pending': state_manager.is_typing()}
+
+        result = await run_in_threadpool(snapshot)
+        if result is None:
+            return self._unknown_session()
+        return JSONResponse(result)
+
+    async def post_message(self, request: "Request") -> "JSONResponse":
+        """提交客户消息，回复生成后进入审核队列
+
+        请求可通过Idempotency-Key请求头（或请求体的idempotency_key字段）携带幂等键，
+        网络重试时重复提交返回首次创建的消息（200），不会重复生成回复。
+        过载时消息排队等待生成，响应的admission字段给出排队位置和提示。
+        """
+        try:
+            data = await request.json()
+        except ValueError:
+            return JSONResponse({'error': "请求体必须是JSON"}, status_code=400)
+        content, idempotency_key, error_msg = self._parse_message(data)
+        if content is None:
+            return JSONResponse({'error': error_msg}, status_code=400)
+
+        state_manager = await run_in_threadpool(self._get_state_manager, request.path_params['session_id'])
+        if state_manager is None:
+            return self._unknown_session()
+        idempotency_key = request.headers.get('idempotency-key') or idempotency_key
+        result, error_msg = await self._submit(state_manager, content, idempotency_key)
+        if result is None:
+            return JSONResponse({'error': error_msg}, status_code=422)
+        if not result.applied:
+            return JSONResponse({'message': result.message.to_dict(), 'duplicate': True})
+        return JSONResponse({'message': result.message.to_dict(), 'admission': result.admission},
+                            status_code=202)
+
+    async def websocket(self, websocket: "WebSocket"):
+        """WebSocket会话：接收客户消息，推送批准后的回复
+
+        格式错误的消息只回复错误帧，不断开连接；会话令牌无效时以WS_CLOSE_UNKNOWN_SESSION拒绝连接。
+        """
+        state_manager = await run_in_threadpool(self._get_state_manager, websocket.path_params['session_id'])
+        await websocket.accept()
+        if state_manager is None:
+            # 先接受再关闭，客户端才能收到关闭码（握手阶段拒绝只会得到HTTP 403）
+            await websocket.close(code=WS_CLOSE_UNKNOWN_SESSION)
+            return
+        session_id = state_manager.get_session_id()
+        subscriber = self.broadcaster.subscribe(session_id)
+        sender = asyncio.create_task(self._push_replies(websocket, subscriber[1]))
+        try:
+            while True:
+                content, idempotency_key, error_msg = self._parse_message(await self._receive_json(websocket))
+                result = None
+                if content is not None:
+                    result, error_msg = await self._submit(state_manager, content, idempotency_key)
+                if result is None:
+                    await websocket.send_json({'type': 'error', 'error': error_msg})
+                else:
+                    await websocket.send_json({'type': 'accepted', 'message': result.message.to_dict(),
+                                               'duplicate': not result.applied,
+                                               'admission': result.admission})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
+            self.broadcaster.unsubscribe(session_id, subscriber)
+
+    async def _push_replies(self, websocket: "WebSocket", queue: asyncio.Queue):
+        """把订阅队列中的回复写入WebSocket"""
+        while True:
+            message = await queue.get()
+            await websocket.send_json({'type': 'reply', 'message': message})
+
+    @staticmethod
+    async def _receive_json(websocket: "WebSocket") -> Any:
+        """接收一条WebSocket消息并解析JSON（解析失败时返回None）"""
+        message = await websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect(message.get('code', 1000))
+        text = message.get('text')
+        if text is None:
+            text = (message.get('bytes') or b'').decode('utf-8', 'replace')
+        try:
+            return json.loads(text)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _parse_message(data: Any) -> Tuple[Optional[str], Optional[str], str]:
+        """校验客户提交的消息
+
+        Args:
+            data: 解析后的JSON
+
+        Returns:
+            (消息内容, 幂等键, 错误信息)；格式错误时消息内容为None
+        """
+        if not isinstance(data, dict):
+            return None, None, "消息必须是JSON对象"
+        content = data.get('content', '')
+        idempotency_key = data.get('idempotency_key')
+        if not isinstance(content, str):
+            return None, None, "content必须是字符串"
+        if idempotency_key is not None and not isinstance(idempotency_key, str):
+            return None, None, "idempotency_key必须是字符串"
+        return content, idempotency_key, ""
+
+    @staticmethod
+    def _unknown_session() -> "JSONResponse":
+        return JSONResponse({'error': "会话不存在或已过期，请重新创建会话"}, status_code=404)
+
+    async def _submit(self, state_manager: StateManager, content: str,
+                      idempotency_key: Optional[str] = None) -> Tuple[Optional[TransitionResult], str]:
+        """接收消息并在后台生成草稿（重复提交只返回首次的消息）"""
+        result, error_msg = await run_in_threadpool(self._accept, state_manager, content, idempotency_key)
+        if result is not None and result.applied:
+            task = asyncio.create_task(self._generate(state_manager, result.message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return result, error_msg
+
+    def _accept(self, state_manager: StateManager, content: str,
+                idempotency_key: Optional[str]) -> Tuple[Optional[TransitionResult], str]:
+        """受理消息（同步访问会话存储和事件总线，在线程池中调用）"""
+        if idempotency_key:
+            previous = state_manager.get_idempotent_result(idempotency_key)
+            if previous is not None:
+                return previous, ""
+        return self.pipeline.accept(state_manager, content, idempotency_key)
+
+    async def _generate(self, state_manager: StateManager, message):
+        """生成草稿；auto_approve模式下直接发送（仅用于本地测试）"""
+        try:
+            result = await self.pipeline.generate(state_manager, message)
+            if result['success'] and self.auto_approve:
+                pending_id = result['pending'].id
+                await run_in_threadpool(self.pipeline.approve, state_manager, None, reviewer='auto',
+                                        expected_id=pending_id, idempotency_key=f"approve:{pending_id}")
+        except Exception as e:
+            state_manager.set_typing_status(False)
+            self.logger.error(f"客户消息处理失败: {e}")
+
+    def _get_state_manager(self, token: str) -> Optional[StateManager]:
+        """按会话令牌获取客户会话（同步访问会话存储，在线程池中调用）
+
+        Args:
+            token: 会话令牌
+
+        Returns:
+            状态管理器；令牌无效、会话不存在或不是客户会话时返回None
+        """
+        session_id = self.verify_token(token)
+        if session_id is None:
+            return None
+        session = self.session_store.get(session_id)
+        if session is None or session.role != SESSION_ROLE_CUSTOMER:
+            return None
+        # get()只读不算访问，确认存在后记一次访问
+        return StateManager(self.session_store.get_or_create(session_id, SESSION_ROLE_CUSTOMER))
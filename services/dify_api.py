@@ -1,67 +1,98 @@
 """Dify API服务"""
 import requests
 import asyncio
+import json
 import logging
 from typing import Dict, Any, Optional
 from config.settings import DifyConfig
+from services.dify_transport import HTTPTransport
+from services.generation_registry import GenerationHandle
+from services.llm_scheduler import LLMScheduler, SchedulerTimeout, LANE_INTERACTIVE, llm_slot
+from utils.pii_masker import PIIMasker
+from utils.token_estimator import estimate_request_tokens
 
 class DifyAPIService:
     """Dify API服务类"""
     
-    def __init__(self, config: DifyConfig):
+    def __init__(self, config: DifyConfig, transport=None, scheduler: Optional[LLMScheduler] = None,
+                 masker: Optional[PIIMasker] = None):
         self.config = config
+        # 传输层：默认直连Dify，也可以是录制/回放传输层
+        self.transport = transport or HTTPTransport()
+        # 进程级调度器：与批量营销等共用Dify配额（未配置时不排队）
+        self.scheduler = scheduler
+        # 敏感信息脱敏：发往Dify前替换为占位符，回复中的占位符再还原（未配置时原样发送）
+        self.masker = masker
         self.headers = {
             'Authorization': f'Bearer {config.api_key}',
             'Content-Type': 'application/json'
         }
         self.logger = logging.getLogger(__name__)
     
-    async def chat_completion(self, message: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
+    async def chat_completion(self, message: str, conversation_id: Optional[str] = None,
+                              inputs: Optional[Dict[str, Any]] = None,
+                              user: Optional[str] = None, lane: str = LANE_INTERACTIVE,
+                              deadline: Optional[float] = None,
+                              handle: Optional[GenerationHandle] = None) -> Dict[str, Any]:
         """异步调用Dify聊天API
         
         Args:
             message: 用户消息
             conversation_id: 会话ID（可选）
+            inputs: 应用输入变量（可选，如压缩后的对话上下文）
+            user: Dify用户标识（可选，默认demo_user）
+            lane: 调度通道（默认在线客服）
+            deadline: 最长排队秒数（可选，默认使用通道的设置）
+            handle: 生成句柄（可选，流式模式下取消时调用Dify停止接口并停止读取）
             
         Returns:
             包含响应结果的字典
         """
+        found: Dict[str, str] = {}
+        if self.masker is not None:
+            message = self.masker.mask(message, found)
+            inputs = self.masker.mask_inputs(inputs, found)
         payload = {
-            'inputs': {},
+            'inputs': inputs or {},
             'query': message,
-            'response_mode': 'blocking',
-            'user': 'demo_user'
+            'response_mode': self.config.response_mode,
+            'user': user or 'demo_user'
         }
         
         if conversation_id:
             payload['conversation_id'] = conversation_id
         
         try:
-            # 使用asyncio运行同步请求
+            # 按调度通道排队，使用asyncio运行同步请求
             loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: requests.post(
-                    f"{self.config.base_url}/chat-messages",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=self.config.timeout
-                )
-            )
-            
-            response.raise_for_status()
-            data = response.json()
+            async with llm_slot(self.scheduler, lane, estimate_request_tokens(message, inputs), deadline):
+                if handle is not None:
+                    handle.dispatched = True
+                data = await loop.run_in_executor(None, lambda: self._request(payload, handle))
             
             self.logger.info(f"API调用成功，消息ID: {data.get('message_id')}")
             
+            content = data.get('answer', '')
+            if self.masker is not None:
+                content = self.masker.restore(content, found)
+            
             return {
                 'success': True,
-                'content': data.get('answer', ''),
+                'content': content,
                 'conversation_id': data.get('conversation_id'),
                 'message_id': data.get('message_id'),
                 'usage': data.get('metadata', {}).get('usage', {})
             }
             
+        except SchedulerTimeout as e:
+            error_msg = "当前咨询人数较多，请稍后再试"
+            self.logger.warning(f"API调用排队超时: {e}")
+            return {
+                'success': False,
+                'error': 'queue_timeout',
+                'content': error_msg
+            }
+            
         except requests.exceptions.Timeout:
             error_msg = "API调用超时，请稍后再试"
             self.logger.error(f"API调用超时: {self.config.timeout}秒")
@@ -89,6 +120,87 @@ class DifyAPIService:
                 'content': error_msg
             }
     
+    def _request(self, payload: Dict[str, Any], handle: Optional[GenerationHandle]) -> Dict[str, Any]:
+        """发送聊天请求（在线程池中执行）
+        
+        Returns:
+            与阻塞模式响应格式相同的字典
+        """
+        streaming = payload['response_mode'] == 'streaming'
+        response = self.transport.post(
+            f"{self.config.base_url}/chat-messages",
+            headers=self.headers,
+            json=payload,
+            timeout=self.config.timeout,
+            stream=streaming
+        )
+        response.raise_for_status()
+        if not streaming:
+            return response.json()
+        return self._read_stream(response, payload['user'], handle)
+    
+    def _read_stream(self, response, user: str, handle: Optional[GenerationHandle]) -> Dict[str, Any]:
+        """读取流式(SSE)响应并拼接回复；生成被取消时停止读取
+        
+        Args:
+            response: 流式响应
+            user: Dify用户标识（调用停止接口时需要）
+            handle: 生成句柄
+            
+        Returns:
+            与阻塞模式响应格式相同的字典
+        """
+        data: Dict[str, Any] = {'answer': '', 'metadata': {}}
+        answer = []
+        try:
+            for line in response.iter_lines(chunk_size=None):
+                if handle is not None and handle.cancelled:
+                    break
+                if not line.startswith(b'data:'):
+                    continue
+                event = json.loads(line[5:].decode('utf-8'))
+                if handle is not None and handle.task_id is None and event.get('task_id'):
+                    task_id = event['task_id']
+                    handle.bind(task_id, lambda: self.stop_generation(task_id, user))
+                kind = event.get('event')
+                if kind in ('message', 'agent_message'):
+                    answer.append(event.get('answer', ''))
+                elif kind == 'message_end':
+                    data['metadata'] = event.get('metadata', {})
+                elif kind == 'error':
+                    raise requests.exceptions.RequestException(event.get('message', '流式响应错误'))
+                for key in ('conversation_id', 'message_id'):
+                    if event.get(key):
+                        data[key] = event[key]
+        finally:
+            response.close()
+        data['answer'] = ''.join(answer)
+        return data
+    
+    def stop_generation(self, task_id: str, user: str) -> bool:
+        """调用Dify停止接口，提前结束流式生成
+        
+        Args:
+            task_id: 流式响应中的任务ID
+            user: 发起生成时的Dify用户标识
+            
+        Returns:
+            是否停止成功
+        """
+        try:
+            response = self.transport.post(
+                f"{self.config.base_url}/chat-messages/{task_id}/stop",
+                headers=self.headers,
+                json={'user': user},
+                timeout=5
+            )
+            response.raise_for_status()
+            self.logger.info(f"已停止Dify生成任务: {task_id}")
+            return True
+        except Exception as e:
+            self.logger.error(f"停止Dify生成任务失败: {e}")
+            return False
+    
     def test_connection(self) -> bool:
         """测试API连接
         
@@ -96,7 +208,7 @@ class DifyAPIService:
             连接是否成功
         """
         try:
-            response = requests.get(
+            response = self.transport.get(
                 f"{self.config.base_url}/info",
                 headers={'Authorization': f'Bearer {self.config.api_key}'},
                 timeout=5
@@ -0,0 +1,524 @@
+"""Dify HTTP传输层：直连、录制与回放
+
+DifyAPIService与MarketingService都通过传输层发起请求：
+- HTTPTransport：直接访问Dify（默认）
+- RecordingTransport：照常访问Dify，同时把请求、响应、流式(SSE)分块的到达时间和延迟
+  写入本地压缩存档（去除密钥）
+- ReplayTransport：不访问网络，按存档中的原始耗时（或按比例缩放）返回录制的响应，
+  用于离线复现性能问题、确定性压测和回归对比
+
+存档是一个目录，每个录制进程写一个gzip压缩的JSON Lines段文件，多个副本可同时录制。
+"""
+import argparse
+import atexit
+import codecs
+import glob
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+import requests
+
+TRAFFIC_MODE_RECORD = "record"
+TRAFFIC_MODE_REPLAY = "replay"
+
+_ARCHIVE_SUFFIX = ".jsonl.gz"
+_REDACTED = "[REDACTED]"
+# 需要整体去除的字段名（用量统计中的prompt_tokens等不受影响）
+_SECRET_KEYS = re.compile(r'^(authorization|api[_-]?key|x-api-key|access[_-]?token|secret|password)$', re.I)
+# 文本中的Bearer令牌（只匹配令牌字符，不吞掉JSON的引号和括号）和Dify应用密钥
+_SECRET_PATTERN = re.compile(r'(Bearer\s+)[A-Za-z0-9._~+/=-]+|\bapp-[A-Za-z0-9]{16,}\b')
+# 宽松匹配时忽略的请求字段：会话ID和用户标识在不同运行之间会变化
+_VOLATILE_FIELDS = ('conversation_id', 'user')
+
+logger = logging.getLogger(__name__)
+
+def scrub(value: Any, secrets: Sequence[str] = ()) -> Any:
+    """去除数据中的密钥
+
+    Args:
+        value: 请求/响应数据（字典、列表或字符串）
+        secrets: 需要替换掉的已知密钥值（如配置的API密钥）
+
+    Returns:
+        去除密钥后的副本
+    """
+    if isinstance(value, dict):
+        return {key: _REDACTED if _SECRET_KEYS.match(str(key)) else scrub(item, secrets)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [scrub(item, secrets) for item in value]
+    if isinstance(value, str):
+        for secret in secrets:
+            if secret:
+                value = value.replace(secret, _REDACTED)
+        return _SECRET_PATTERN.sub(lambda match: (match.group(1) or '') + _REDACTED, value)
+    return value
+
+def request_key(method: str, path: str, payload: Any, loose: bool = False) -> str:
+    """计算请求的匹配键
+
+    Args:
+        method: HTTP方法
+        path: 相对于API基础URL的路径
+        payload: 请求体（已去除密钥）
+        loose: 是否忽略会话ID、用户标识等每次运行都会变化的字段
+
+    Returns:
+        匹配键
+    """
+    if loose and isinstance(payload, dict):
+        payload = {key: value for key, value in payload.items() if key not in _VOLATILE_FIELDS}
+    canonical = json.dumps([method.upper(), path, payload], ensure_ascii=False, sort_keys=True,
+                           separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+def relative_path(url: str, base_url: str) -> str:
+    """把完整URL转换为相对于API基础URL的路径"""
+    path = urlsplit(url).path
+    base_path = urlsplit(base_url).path.rstrip('/')
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    return path or '/'
+
+class HTTPTransport:
+    """直接访问Dify的传输层"""
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发起HTTP请求（参数与requests.request一致）"""
+        return requests.request(method, url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """发起POST请求"""
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发起GET请求"""
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        """释放资源"""
+
+class TrafficArchive:
+    """录制存档写入器
+
+    每条交互记录是一行紧凑JSON，写入本进程独占的gzip段文件；每条记录写入后同步刷新，
+    进程异常退出时最多丢失正在写入的一条。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        name = f"traffic-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.path = os.path.join(directory, name + _ARCHIVE_SUFFIX)
+        self._file = gzip.open(self.path, 'wb')
+        self._lock = threading.Lock()
+        self.records = 0
+        atexit.register(self.close)
+
+    def append(self, record: Dict[str, Any]):
+        """追加一条交互记录"""
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line.encode('utf-8'))
+            self._file.flush()
+            self.records += 1
+
+    def close(self):
+        """关闭段文件（写入gzip结尾）"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def archive_files(path: str) -> List[str]:
+    """列出存档中的段文件（按文件名即录制时间排序）"""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*' + _ARCHIVE_SUFFIX)))
+    return [path] if os.path.exists(path) else []
+
+def load_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """读取存档中的交互记录
+
+    录制进程未正常退出时段文件缺少gzip结尾，读到截断处为止。
+
+    Args:
+        path: 存档目录或单个段文件
+
+    Yields:
+        交互记录
+    """
+    for filename in archive_files(path):
+        try:
+            with gzip.open(filename, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            logger.warning(f"存档段文件 {filename} 在截断处停止读取: {e}")
+
+class _RecordingStream:
+    """包装流式响应的底层数据流，记录每个分块的内容和到达时间"""
+
+    def __init__(self, raw, on_finish):
+        self._raw = raw
+        self._on_finish = on_finish
+        self.started = time.perf_counter()
+        self.chunks: List[Tuple[float, str]] = []
+        self._finished = False
+        # 多字节字符可能被拆在两个分块中，增量解码避免出现乱码
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def _capture(self, data: bytes):
+        text = self._decoder.decode(data or b'', final=not data)
+        if text:
+            self.chunks.append((round(time.perf_counter() - self.started, 4), text))
+
+    def stream(self, amt=None, decode_content=None):
+        try:
+            for data in self._raw.stream(amt, decode_content=decode_content):
+                self._capture(data)
+                yield data
+        finally:
+            self.finish()
+
+    def read(self, amt=None, *args, **kwargs):
+        data = self._raw.read(amt, *args, **kwargs)
+        self._capture(data)
+        if not data:
+            self.finish()
+        return data
+
+    def close(self):
+        self.finish()
+        self._raw.close()
+
+    def finish(self):
+        """流读完或被关闭时写入存档（只写一次）"""
+        if not self._finished:
+            self._finished = True
+            self._on_finish(self.chunks, time.perf_counter() - self.started)
+
+class RecordingTransport:
+    """录制模式：照常访问Dify，并把每次交互写入存档
+
+    存档中不保存请求头；请求体、响应体中的密钥字段、Bearer令牌和配置的API密钥都会被替换。
+    """
+
+    def __init__(self, inner, archive: TrafficArchive, base_url: str, secrets: Sequence[str] = ()):
+        self.inner = inner
+        self.archive = archive
+        self.base_url = base_url
+        self.secrets = [secret for secret in secrets if secret]
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发起请求并录制"""
+        record = {
+            'ts': time.time(),
+            'method': method.upper(),
+            'path': relative_path(url, self.base_url),
+            'request': scrub(kwargs.get('json'), self.secrets),
+            'stream': bool(kwargs.get('stream')),
+        }
+        start = time.perf_counter()
+        try:
+            response = self.inner.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            record.update(latency=round(time.perf_counter() - start, 4),
+                          error=type(e).__name__, message=scrub(str(e), self.secrets))
+            self.archive.append(record)
+            raise
+
+        record.update(latency=round(time.perf_counter() - start, 4), status=response.status_code,
+                      content_type=response.headers.get('Content-Type', ''))
+        if not record['stream']:
+            record['body'] = scrub(response.text, self.secrets)
+            self.archive.append(record)
+            return response
+
+        def finish(chunks: List[Tuple[float, str]], elapsed: float):
+            # 分块时间相对于请求开始
+            offset = record['latency']
+            record['chunks'] = [[round(offset + at, 4), scrub(text, self.secrets)] for at, text in chunks]
+            record['duration'] = round(offset + elapsed, 4)
+            self.archive.append(record)
+
+        response.raw = _RecordingStream(response.raw, finish)
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """发起POST请求"""
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发起GET请求"""
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        """关闭存档"""
+        self.archive.close()
+        self.inner.close()
+
+class _ReplayStream:
+    """按录制时间逐块返回的流式响应数据源"""
+
+    def __init__(self, chunks: List[List[Any]], started: float, time_scale: float):
+        self._chunks = chunks
+        self._started = started
+        self._time_scale = time_scale
+        self._buffer = b''
+        self._position = 0
+        self.closed = False
+
+    def stream(self, amt=None, decode_content=None):
+        for at, text in self._chunks:
+            if self.closed:
+                return
+            _sleep_until(self._started + at * self._time_scale)
+            yield text.encode('utf-8')
+
+    def read(self, amt=None, *args, **kwargs):
+        if not self._buffer and self._position < len(self._chunks):
+            at, text = self._chunks[self._position]
+            self._position += 1
+            _sleep_until(self._started + at * self._time_scale)
+            self._buffer = text.encode('utf-8')
+        size = len(self._buffer) if amt is None else amt
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def release_conn(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def _sleep_until(deadline: float):
+    remaining = deadline - time.perf_counter()
+    if remaining > 0:
+        time.sleep(remaining)
+
+_REPLAY_ERRORS = {
+    'Timeout': requests.exceptions.Timeout,
+    'ReadTimeout': requests.exceptions.ReadTimeout,
+    'ConnectTimeout': requests.exceptions.ConnectTimeout,
+    'ConnectionError': requests.exceptions.ConnectionError,
+    'HTTPError': requests.exceptions.HTTPError,
+}
+
+class ReplayTransport:
+    """回放模式：不访问网络，从存档返回录制的响应
+
+    请求按"方法 + 路径 + 请求体"精确匹配；找不到时忽略会话ID和用户标识再匹配；
+    仍找不到时（非严格模式）按录制顺序轮流返回同一路径的响应，便于用新的问题压测。
+    同一请求录制了多次时按录制顺序轮流返回。等待时间为录制耗时乘以time_scale
+    （1为原始耗时，0为不等待）。
+    """
+
+    def __init__(self, path: str, base_url: str, time_scale: float = 1.0, strict: bool = False,
+                 records: Optional[Iterable[Dict[str, Any]]] = None):
+        self.base_url = base_url
+        self.time_scale = max(0.0, time_scale)
+        self.strict = strict
+        self._exact: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._loose: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._by_path: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+        self._cursors: Dict[Any, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.counters = {'exact': 0, 'loose': 0, 'fallback': 0, 'miss': 0}
+
+        count = 0
+        for record in (records if records is not None else load_archive(path)):
+            method, record_path = record['method'], record['path']
+            self._exact[request_key(method, record_path, record.get('request'))].append(record)
+            self._loose[request_key(method, record_path, record.get('request'), loose=True)].append(record)
+            self._by_path[(method, record_path)].append(record)
+            count += 1
+        logger.info(f"回放存档 {path} 加载 {count} 条交互记录")
+
+    def _next(self, table: Dict[Any, List[Dict[str, Any]]], key: Any) -> Optional[Dict[str, Any]]:
+        """按录制顺序轮流取出匹配的记录（需在锁内调用）"""
+        records = table.get(key)
+        if not records:
+            return None
+        cursor = self._cursors[(id(table), key)]
+        self._cursors[(id(table), key)] = cursor + 1
+        return records[cursor % len(records)]
+
+    def match(self, method: str, path: str, payload: Any) -> Optional[Dict[str, Any]]:
+        """查找与请求匹配的录制记录
+
+        Args:
+            method: HTTP方法
+            path: 相对于API基础URL的路径
+            payload: 请求体
+
+        Returns:
+            录制记录，找不到时为None
+        """
+        method = method.upper()
+        payload = scrub(payload)
+        with self._lock:
+            record = self._next(self._exact, request_key(method, path, payload))
+            kind = 'exact'
+            if record is None:
+                record = self._next(self._loose, request_key(method, path, payload, loose=True))
+                kind = 'loose'
+            if record is None and not self.strict:
+                record = self._next(self._by_path, (method, path))
+                kind = 'fallback'
+            self.counters[kind if record is not None else 'miss'] += 1
+        return record
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """返回录制的响应"""
+        started = time.perf_counter()
+        path = relative_path(url, self.base_url)
+        record = self.match(method, path, kwargs.get('json'))
+        if record is None:
+            raise requests.exceptions.ConnectionError(f"回放存档中没有匹配的请求: {method} {path}")
+
+        _sleep_until(started + record.get('latency', 0) * self.time_scale)
+        if record.get('error'):
+            error = _REPLAY_ERRORS.get(record['error'], requests.exceptions.RequestException)
+            raise error(record.get('message', record['error']))
+
+        response = requests.Response()
+        response.status_code = record.get('status', 200)
+        response.headers['Content-Type'] = record.get('content_type', 'application/json')
+        response.encoding = 'utf-8'
+        response.url = url
+        response.reason = 'Replayed'
+        if 'chunks' in record:
+            response.raw = _ReplayStream(record['chunks'], started, self.time_scale)
+        else:
+            response._content = record.get('body', '').encode('utf-8')
+            response.raw = io.BytesIO(response._content)
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """发起POST请求"""
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发起GET请求"""
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        """释放资源"""
+
+def create_transport(mode: str = "", archive: str = "", base_url: str = "", time_scale: float = 1.0,
+                     strict: bool = False, secrets: Sequence[str] = ()):
+    """按配置创建传输层
+
+    Args:
+        mode: 空为直连，record为录制，replay为回放
+        archive: 存档目录（回放时也可以是单个段文件）
+        base_url: Dify API基础URL（存档中保存相对路径）
+        time_scale: 回放耗时的缩放比例
+        strict: 回放时是否只返回匹配的请求
+        secrets: 录制时需要替换的密钥值
+
+    Returns:
+        传输层实例
+    """
+    if mode == TRAFFIC_MODE_RECORD:
+        transport = RecordingTransport(HTTPTransport(), TrafficArchive(archive), base_url, secrets)
+        logger.info(f"Dify请求录制到 {transport.archive.path}")
+        return transport
+    if mode == TRAFFIC_MODE_REPLAY:
+        return ReplayTransport(archive, base_url, time_scale, strict)
+    if mode:
+        raise ValueError(f"不支持的Dify传输模式: {mode}")
+    return HTTPTransport()
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    """取分位数（最近秩）"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """按请求路径汇总存档中的延迟
+
+    Args:
+        records: 交互记录
+
+    Returns:
+        路径 -> 请求数、错误数、响应延迟和首个分块/完成耗时的分位数（秒）
+    """
+    groups: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    errors: Dict[str, int] = defaultdict(int)
+    for record in records:
+        key = f"{record['method']} {record['path']}"
+        group = groups[key]
+        group['latency'].append(record.get('latency', 0.0))
+        if record.get('error') or record.get('status', 200) >= 400:
+            errors[key] += 1
+        if record.get('chunks'):
+            group['first_chunk'].append(record['chunks'][0][0])
+        group['duration'].append(record.get('duration', record.get('latency', 0.0)))
+
+    summary = {}
+    for key, group in sorted(groups.items()):
+        item: Dict[str, Any] = {'requests': len(group['latency']), 'errors': errors[key]}
+        for metric, values in group.items():
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+                item[f'{metric}_{name}'] = _percentile(values, fraction)
+        summary[key] = item
+    return summary
+
+def format_summary(summary: Dict[str, Dict[str, Any]],
+                   baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """把延迟汇总格式化为文本（提供基线时附带变化百分比）"""
+    lines = []
+    for key, item in summary.items():
+        lines.append(f"{key}: 请求 {item['requests']} 次, 错误 {item['errors']} 次")
+        reference = (baseline or {}).get(key, {})
+        for metric, label in (('latency', '响应延迟'), ('first_chunk', '首个分块'), ('duration', '完成耗时')):
+            values = []
+            for name in ('p50', 'p90', 'p99'):
+                value = item.get(f'{metric}_{name}')
+                if value is None:
+                    continue
+                text = f"{name.upper()} {value:.3f}s"
+                before = reference.get(f'{metric}_{name}')
+                if before:
+                    text += f" ({(value - before) / before:+.1%})"
+                values.append(text)
+            if values:
+                lines.append(f"  {label}: " + ", ".join(values))
+    return "\n".join(lines) if lines else "存档中没有交互记录"
+
+def main(argv: Optional[List[str]] = None):
+    """存档延迟报告命令行入口"""
+    parser = argparse.ArgumentParser(description="汇总Dify录制存档中的请求延迟，可与基线存档对比")
+    parser.add_argument('archive', help="存档目录或段文件")
+    parser.add_argument('--baseline', help="作为对比基线的存档目录或段文件")
+    parser.add_argument('--json', action='store_true', help="以JSON格式输出")
+    args = parser.parse_args(argv)
+
+    summary = summarize(load_archive(args.archive))
+    baseline = summarize(load_archive(args.baseline)) if args.baseline else None
+    if args.json:
+        print(json.dumps({'summary': summary, 'baseline': baseline}, ensure_ascii=False, indent=2))
+    else:
+        print(format_summary(summary, baseline))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""AI草稿修改分析服务
+
+从审计日志中取出每次审核的草稿/最终内容对，计算字符级差异和编辑距离，
+汇总被修改最多的片段和各类问题（提示词）的修改率、拒绝率，用于定位上游Dify应用需要调整的地方。
+"""
+import argparse
+import json
+import logging
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from services.audit_log import (
+    AuditLog, AUDIT_EVENT_USER_MESSAGE, AUDIT_EVENT_APPROVE, AUDIT_EVENT_REJECT
+)
+from utils.constants import (
+    EDIT_BATCH_CHUNK_SIZE, EDIT_PHRASE_MAX_CHARS, EDIT_PHRASE_MERGE_GAP, EDIT_PHRASE_MIN_CHARS,
+    EDIT_PROMPT_KEY_CHARS, EDIT_REPORT_MIN_REVIEWS, EDIT_REPORT_TOP
+)
+from utils.text_diff import diff_opcodes, EQUAL
+
+logger = logging.getLogger(__name__)
+
+REVIEW_STATUS_APPROVED = "approved"
+REVIEW_STATUS_REJECTED = "rejected"
+
+_DIGIT_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+_NON_WORD_PATTERN = re.compile(r'[^\w#]+')
+_PHRASE_STRIP = " \t\r\n，。！？、；：,.!?;:\"'“”‘’（）()"
+
+def prompt_key(question: str) -> str:
+    """把客户问题归一化为提示词分组键
+
+    去掉空白和标点、数字统一为#，相同句式的问题（如只有金额、日期不同）归为一组。
+
+    Args:
+        question: 客户问题
+
+    Returns:
+        分组键
+    """
+    key = _DIGIT_PATTERN.sub('#', question.lower())
+    return _NON_WORD_PATTERN.sub('', key)[:EDIT_PROMPT_KEY_CHARS]
+
+def edit_regions(draft: str, final: str,
+                 gap: int = EDIT_PHRASE_MERGE_GAP) -> Tuple[int, List[Tuple[str, str]]]:
+    """计算编辑距离和修改片段
+
+    字符级差异中间隔不超过gap个相同字符的修改合并为一个片段，
+    避免一处改写被拆成多个零碎的单字修改。
+
+    Args:
+        draft: AI草稿
+        final: 最终发送的内容
+        gap: 合并修改时允许的最大相同字符间隔
+
+    Returns:
+        (插入/删除编辑距离, [(草稿片段, 修改后片段)])
+    """
+    if draft == final:
+        return 0, []
+    opcodes = diff_opcodes(draft, final)
+    distance = sum((i2 - i1) + (j2 - j1) for tag, i1, i2, j1, j2 in opcodes if tag != EQUAL)
+
+    regions = []
+    current: Optional[List[int]] = None
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == EQUAL:
+            if current is not None and i2 - i1 > gap:
+                regions.append(current)
+                current = None
+            continue
+        if current is None:
+            current = [i1, i2, j1, j2]
+        else:
+            current[1], current[3] = i2, j2
+    if current is not None:
+        regions.append(current)
+    return distance, [(draft[i1:i2], final[j1:j2]) for i1, i2, j1, j2 in regions]
+
+@dataclass
+class EditRecord:
+    """一次审核的草稿/最终内容对"""
+    review_id: str
+    conversation_id: str
+    question: str
+    draft: str
+    final: Optional[str]  # 被拒绝时为None
+    status: str
+    reviewer: Optional[str] = None
+    timestamp: str = ""
+    distance: Optional[int] = None
+    regions: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def edited(self) -> bool:
+        """是否修改后批准"""
+        return self.status == REVIEW_STATUS_APPROVED and self.final != self.draft
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'review_id': self.review_id,
+            'conversation_id': self.conversation_id,
+            'question': self.question,
+            'draft': self.draft,
+            'final': self.final,
+            'status': self.status,
+            'reviewer': self.reviewer,
+            'timestamp': self.timestamp,
+            'distance': self.distance,
+            'regions': [list(region) for region in self.regions],
+        }
+
+def iter_edit_records(events: Iterable[Dict[str, Any]]) -> Iterator[EditRecord]:
+    """从审计记录中取出每次审核的草稿/最终内容对
+
+    Args:
+        events: 审计记录（按时间顺序，如AuditLog.scan的结果）
+
+    Yields:
+        审核记录（批准和拒绝）
+    """
+    questions: Dict[str, str] = {}
+    for event in events:
+        kind = event['event']
+        if kind == AUDIT_EVENT_USER_MESSAGE:
+            questions[event['message_id']] = event.get('content', '')
+        elif kind in (AUDIT_EVENT_APPROVE, AUDIT_EVENT_REJECT):
+            # 被拒绝的问题会重新生成草稿，问题内容保留到批准为止
+            user_message_id = event.get('user_message_id')
+            if kind == AUDIT_EVENT_APPROVE:
+                question = questions.pop(user_message_id, '')
+            else:
+                question = questions.get(user_message_id, '')
+            yield EditRecord(
+                review_id=event['message_id'],
+                conversation_id=event['conversation_id'],
+                question=question,
+                draft=event.get('draft', ''),
+                final=event.get('final') if kind == AUDIT_EVENT_APPROVE else None,
+                status=REVIEW_STATUS_APPROVED if kind == AUDIT_EVENT_APPROVE else REVIEW_STATUS_REJECTED,
+                reviewer=event.get('reviewer'),
+                timestamp=event.get('timestamp', '')
+            )
+
+def _analyze(pair: Tuple[str, str]) -> Tuple[int, List[Tuple[str, str]]]:
+    """计算单条记录的差异（进程池任务）"""
+    return edit_regions(*pair)
+
+def compute_edits(records: Iterable[EditRecord], workers: int = 1,
+                  chunk_size: int = EDIT_BATCH_CHUNK_SIZE) -> Iterator[EditRecord]:
+    """批量计算修改差异
+
+    按块处理，workers大于1时各块在进程池中并行计算（回填大量历史记录时使用），
+    输出保持输入顺序，不会一次性加载全部记录。
+
+    Args:
+        records: 审核记录
+        workers: 并行进程数
+        chunk_size: 每块的记录数
+
+    Yields:
+        填好编辑距离和修改片段的记录（被拒绝的记录原样返回）
+    """
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        chunk: List[EditRecord] = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield from _analyze_chunk(chunk, executor, workers)
+                chunk = []
+        if chunk:
+            yield from _analyze_chunk(chunk, executor, workers)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def _analyze_chunk(chunk: List[EditRecord], executor: Optional[ProcessPoolExecutor],
+                   workers: int) -> List[EditRecord]:
+    """计算一块记录的差异"""
+    approved = [record for record in chunk if record.status == REVIEW_STATUS_APPROVED]
+    pairs = [(record.draft, record.final or '') for record in approved]
+    if executor is not None:
+        results = executor.map(_analyze, pairs, chunksize=max(1, len(pairs) // workers))
+    else:
+        results = map(_analyze, pairs)
+    for record, (distance, regions) in zip(approved, results):
+        record.distance, record.regions = distance, regions
+    return chunk
+
+@dataclass
+class PromptEditStats:
+    """一类问题（提示词）的审核统计"""
+    key: str
+    example: str
+    reviews: int = 0
+    edited: int = 0
+    rejected: int = 0
+    distance: int = 0
+    draft_chars: int = 0
+
+    @property
+    def edit_rate(self) -> float:
+        """修改后批准的比例"""
+        return self.edited / self.reviews if self.reviews else 0.0
+
+    @property
+    def reject_rate(self) -> float:
+        """被拒绝的比例"""
+        return self.rejected / self.reviews if self.reviews else 0.0
+
+    @property
+    def change_ratio(self) -> float:
+        """批准的草稿中被改动的字符比例"""
+        return self.distance / self.draft_chars if self.draft_chars else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'key': self.key,
+            'example': self.example,
+            'reviews': self.reviews,
+            'edited': self.edited,
+            'rejected': self.rejected,
+            'edit_rate': round(self.edit_rate, 4),
+            'reject_rate': round(self.reject_rate, 4),
+            'change_ratio': round(self.change_ratio, 4),
+        }
+
+class EditAnalytics:
+    """修改统计汇总
+
+    逐条累加，内存只与问题分组数和不同片段数有关，可以流式处理全部历史记录。
+    """
+
+    def __init__(self):
+        self.reviews = 0
+        self.edited = 0
+        self.rejected = 0
+        self.distance = 0
+        self.prompts: Dict[str, PromptEditStats] = {}
+        self.removed = Counter()
+        self.added = Counter()
+        self.rewrites = Counter()
+
+    def add(self, record: EditRecord):
+        """累加一条已计算差异的审核记录"""
+        key = prompt_key(record.question)
+        stats = self.prompts.get(key)
+        if stats is None:
+            stats = self.prompts[key] = PromptEditStats(key, record.question)
+        self.reviews += 1
+        stats.reviews += 1
+        if record.status == REVIEW_STATUS_REJECTED:
+            self.rejected += 1
+            stats.rejected += 1
+            return
+
+        stats.draft_chars += len(record.draft)
+        if not record.edited:
+            return
+        self.edited += 1
+        stats.edited += 1
+        self.distance += record.distance or 0
+        stats.distance += record.distance or 0
+        for old, new in record.regions:
+            old, new = self._phrase(old), self._phrase(new)
+            if old:
+                self.removed[old] += 1
+            if new:
+                self.added[new] += 1
+            if old and new:
+                self.rewrites[(old, new)] += 1
+
+    @staticmethod
+    def _phrase(text: str) -> str:
+        """归一化修改片段（过短的片段视为噪声）"""
+        text = text.strip(_PHRASE_STRIP)
+        if len(text) < EDIT_PHRASE_MIN_CHARS:
+            return ""
+        return text[:EDIT_PHRASE_MAX_CHARS]
+
+    def report(self, top: int = EDIT_REPORT_TOP,
+               min_reviews: int = EDIT_REPORT_MIN_REVIEWS) -> Dict[str, Any]:
+        """生成统计报告
+
+        Args:
+            top: 每个榜单的条数
+            min_reviews: 参与提示词排名的最少审核数
+
+        Returns:
+            报告字典
+        """
+        prompts = [stats for stats in self.prompts.values() if stats.reviews >= min_reviews]
+        prompts.sort(key=lambda stats: (stats.edit_rate + stats.reject_rate, stats.reviews), reverse=True)
+        return {
+            'reviews': self.reviews,
+            'edited': self.edited,
+            'rejected': self.rejected,
+            'edit_rate': round(self.edited / self.reviews, 4) if self.reviews else 0.0,
+            'reject_rate': round(self.rejected / self.reviews, 4) if self.reviews else 0.0,
+            'mean_distance': round(self.distance / self.edited, 1) if self.edited else 0.0,
+            'prompts': [stats.to_dict() for stats in prompts[:top]],
+            'removed_phrases': self.removed.most_common(top),
+            'added_phrases': self.added.most_common(top),
+            'rewrites': [[old, new, count] for (old, new), count in self.rewrites.most_common(top)],
+        }
+
+def format_report(report: Dict[str, Any]) -> str:
+    """生成文本报告
+
+    Args:
+        report: EditAnalytics.report的结果
+
+    Returns:
+        报告文本
+    """
+    lines = [
+        f"审核数: {report['reviews']}  修改后批准: {report['edited']} ({report['edit_rate']:.1%})  "
+        f"拒绝: {report['rejected']} ({report['reject_rate']:.1%})  平均编辑距离: {report['mean_distance']}",
+        "",
+        "修改/拒绝率最高的问题:",
+        f"{'审核数':>6} {'修改率':>7} {'拒绝率':>7} {'改动比例':>8}  示例问题",
+    ]
+    for stats in report['prompts']:
+        lines.append(f"{stats['reviews']:>6} {stats['edit_rate']:>7.1%} {stats['reject_rate']:>7.1%} "
+                     f"{stats['change_ratio']:>8.1%}  {stats['example'][:40]}")
+    for title, key in (("被删改最多的草稿片段", 'removed_phrases'), ("补充最多的片段", 'added_phrases')):
+        lines += ["", f"{title}:"]
+        lines += [f"{count:>6}  {phrase}" for phrase, count in report[key]]
+    lines += ["", "最常见的改写:"]
+    lines += [f"{count:>6}  {old} → {new}" for old, new, count in report['rewrites']]
+    return "\n".join(lines)
+
+def main(argv: Optional[List[str]] = None):
+    """修改分析命令行入口"""
+    parser = argparse.ArgumentParser(description="从审计日志统计AI草稿的修改情况")
+    parser.add_argument('--audit-dir', default='audit', help="审计日志目录")
+    parser.add_argument('--since', help="起始时间（ISO格式）")
+    parser.add_argument('--until', help="结束时间（ISO格式）")
+    parser.add_argument('--workers', type=int, default=1, help="计算差异的并行进程数")
+    parser.add_argument('--top', type=int, default=EDIT_REPORT_TOP, help="每个榜单的条数")
+    parser.add_argument('--min-reviews', type=int, default=EDIT_REPORT_MIN_REVIEWS,
+                        help="参与问题排名的最少审核数")
+    parser.add_argument('--records', help="同时把逐条审核记录（含差异）写入该JSONL文件")
+    parser.add_argument('--json', action='store_true', help="以JSON格式输出报告")
+    args = parser.parse_args(argv)
+
+    audit_log = AuditLog(args.audit_dir, read_only=True)
+    analytics = EditAnalytics()
+    start = time.perf_counter()
+    records_file = open(args.records, 'w', encoding='utf-8') if args.records else None
+    try:
+        events = audit_log.scan(
+            start=datetime.fromisoformat(args.since).timestamp() if args.since else None,
+            end=datetime.fromisoformat(args.until).timestamp() if args.until else None
+        )
+        for record in compute_edits(iter_edit_records(events), workers=args.workers):
+            analytics.add(record)
+            if records_file is not None:
+                records_file.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+    finally:
+        audit_log.close()
+        if records_file is not None:
+            records_file.close()
+    logger.info(f"分析 {analytics.reviews} 条审核记录，耗时 {time.perf_counter() - start:.2f}s")
+
+    report = analytics.report(args.top, args.min_reviews)
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+if __name__ == "__main__":
+    main()
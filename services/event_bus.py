@@ -0,0 +1,391 @@
+"""会话事件总线服务"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:  # 进程间连接只在接入事件代理时才导入
+    from multiprocessing.connection import Connection
+
+EVENT_MESSAGE_ADDED = "message_added"
+EVENT_DRAFT_READY = "draft_ready"
+EVENT_APPROVED = "approved"
+EVENT_REJECTED = "rejected"
+EVENT_CLEARED = "cleared"
+EVENT_ALTERNATIVE_READY = "alternative_ready"
+EVENT_ALTERNATIVE_SHOWN = "alternative_shown"
+
+@dataclass
+class Event:
+    """会话事件"""
+    seq: int
+    event_type: str
+    session_id: str
+    timestamp: float
+    data: Dict[str, Any] = field(default_factory=dict)
+    origin: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Event':
+        """从字典创建事件"""
+        return cls(**data)
+
+    def encode(self) -> bytes:
+        """编码为进程间传输的JSON字节串"""
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    @classmethod
+    def decode(cls, payload: bytes) -> 'Event':
+        """从JSON字节串解码事件
+
+        Raises:
+            ValueError: 内容不是合法的事件
+        """
+        data = json.loads(payload)
+        if not isinstance(data, dict):
+            raise ValueError("事件必须是JSON对象")
+        try:
+            return cls.from_dict(data)
+        except TypeError as e:
+            raise ValueError(f"事件字段不正确: {e}") from None
+
+def require_authkey(authkey: bytes) -> bytes:
+    """检查事件代理认证密钥（没有默认值，未配置时拒绝启动）
+
+    Raises:
+        ValueError: 未配置密钥
+    """
+    if not authkey:
+        raise ValueError("事件代理需要配置认证密钥（EVENT_BROKER_AUTHKEY或--authkey）")
+    return authkey
+
+class EventBus:
+    """进程内发布/订阅事件总线
+
+    发布者（对话流水线）在消息新增、草稿生成、备选回复就绪/切换、批准/拒绝、清空对话时发布事件，订阅者同步收到回调。
+    总线为每个会话维护最近一次事件的序号（版本号），监督者控制台的局部刷新片段
+    只需比较版本号即可判断面板是否需要重绘，无需对比会话内容。
+    可选接入本地事件代理（EventBroker），在多个进程之间转发事件。
+    """
+
+    def __init__(self, history_size: int = 1000):
+        self.node_id = uuid.uuid4().hex[:12]
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._versions: Dict[str, int] = {}
+        self._history: Deque[Event] = deque(maxlen=history_size)
+        self._subscribers: Dict[int, Tuple[Callable[[Event], None], Optional[frozenset]]] = {}
+        self._next_subscription = 0
+        self._bridge: Optional['BrokerBridge'] = None
+
+    def subscribe(self, handler: Callable[[Event], None],
+                  event_types: Optional[Iterable[str]] = None) -> int:
+        """订阅事件
+
+        Args:
+            handler: 回调函数（在发布者线程中同步调用，应尽快返回）
+            event_types: 只订阅指定类型的事件（默认全部）
+
+        Returns:
+            订阅ID，用于取消订阅
+        """
+        with self._lock:
+            self._next_subscription += 1
+            self._subscribers[self._next_subscription] = (
+                handler, frozenset(event_types) if event_types else None
+            )
+            return self._next_subscription
+
+    def unsubscribe(self, subscription_id: int):
+        """取消订阅"""
+        with self._lock:
+            self._subscribers.pop(subscription_id, None)
+
+    def publish(self, event_type: str, session_id: str, **data: Any) -> Event:
+        """发布事件
+
+        Args:
+            event_type: 事件类型
+            session_id: 客户会话ID
+            **data: 事件数据
+
+        Returns:
+            发布的事件
+        """
+        event = self._record(event_type, session_id, time.time(), data, self.node_id)
+        self._dispatch(event)
+        if self._bridge is not None:
+            self._bridge.forward(event)
+        return event
+
+    def deliver(self, event: Event):
+        """投递来自其他进程的事件（重新编号，不再转发）"""
+        self._dispatch(self._record(event.event_type, event.session_id, event.timestamp,
+                                    event.data, event.origin))
+
+    def version(self, session_id: Optional[str] = None) -> int:
+        """获取版本号
+
+        Args:
+            session_id: 会话ID（默认返回全局版本号）
+
+        Returns:
+            该会话（或任意会话）最近一次事件的序号，没有事件时为0
+        """
+        with self._lock:
+            if session_id is None:
+                return self._seq
+            return self._versions.get(session_id, 0)
+
+    def events_since(self, seq: int, session_id: Optional[str] = None,
+                     event_types: Optional[Iterable[str]] = None) -> List[Event]:
+        """获取指定序号之后的事件（仅保留最近history_size条）
+
+        Args:
+            seq: 起始序号（不含）
+            session_id: 只返回指定会话的事件
+            event_types: 只返回指定类型的事件
+
+        Returns:
+            事件列表
+        """
+        event_types = frozenset(event_types) if event_types else None
+        with self._lock:
+            history = list(self._history)
+        return [
+            event for event in history
+            if event.seq > seq
+            and (session_id is None or event.session_id == session_id)
+            and (event_types is None or event.event_type in event_types)
+        ]
+
+    def attach_broker(self, address: Tuple[str, int], authkey: bytes) -> 'BrokerBridge':
+        """接入本地事件代理，与其他进程共享事件
+
+        Args:
+            address: 代理地址(host, port)
+            authkey: 认证密钥（必填）
+
+        Returns:
+            代理连接
+
+        Raises:
+            ValueError: 未配置认证密钥
+        """
+        self._bridge = BrokerBridge(self, address, authkey).start()
+        return self._bridge
+
+    def close(self):
+        """断开事件代理"""
+        if self._bridge is not None:
+            self._bridge.close()
+            self._bridge = None
+
+    def _record(self, event_type: str, session_id: str, timestamp: float,
+                data: Dict[str, Any], origin: str) -> Event:
+        """分配序号并记录事件"""
+        with self._lock:
+            self._seq += 1
+            event = Event(self._seq, event_type, session_id, timestamp, data, origin)
+            self._versions[session_id] = self._seq
+            self._history.append(event)
+        return event
+
+    def _dispatch(self, event: Event):
+        """同步调用订阅者（单个订阅者失败不影响其他订阅者）"""
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for handler, event_types in subscribers:
+            if event_types is not None and event.event_type not in event_types:
+                continue
+            try:
+                handler(event)
+            except Exception as e:
+                self.logger.error(f"事件订阅回调失败: {e}")
+
+class BrokerBridge:
+    """事件总线与本地事件代理之间的连接
+
+    本进程发布的事件转发给代理，代理广播的其他进程事件投递到本进程总线。
+    事件以JSON字节串收发（不使用pickle），格式不正确的事件丢弃。
+    连接断开后自动重连，期间本进程的事件照常在进程内分发。
+    """
+
+    def __init__(self, bus: EventBus, address: Tuple[str, int], authkey: bytes,
+                 reconnect_interval: float = 2.0):
+        self.bus = bus
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self.reconnect_interval = reconnect_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._conn: Optional['Connection'] = None
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'BrokerBridge':
+        """启动接收线程"""
+        self._thread = threading.Thread(target=self._receive_loop, name="event-bridge", daemon=True)
+        self._thread.start()
+        return self
+
+    def forward(self, event: Event):
+        """转发本进程事件（未连接时丢弃）"""
+        with self._send_lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.send_bytes(event.encode())
+            except TypeError as e:
+                self.logger.warning(f"事件无法编码，未转发: {event.event_type} {e}")
+            except (OSError, EOFError) as e:
+                self.logger.warning(f"事件转发失败: {e}")
+                self._conn = None
+
+    def close(self):
+        """关闭连接"""
+        self._closed.set()
+        with self._send_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _receive_loop(self):
+        """连接代理并接收其他进程的事件"""
+        from multiprocessing.connection import Client
+
+        while not self._closed.is_set():
+            try:
+                conn = Client(self.address, authkey=self.authkey)
+            except OSError as e:
+                self.logger.warning(f"事件代理连接失败: {e}")
+                self._closed.wait(self.reconnect_interval)
+                continue
+
+            with self._send_lock:
+                self._conn = conn
+            self.logger.info(f"已连接事件代理: {self.address[0]}:{self.address[1]}")
+            try:
+                while not self._closed.is_set():
+                    try:
+                        event = Event.decode(conn.recv_bytes())
+                    except ValueError as e:
+                        self.logger.warning(f"丢弃格式不正确的事件: {e}")
+                        continue
+                    if event.origin != self.bus.node_id:
+                        self.bus.deliver(event)
+            except (OSError, EOFError):
+                if not self._closed.is_set():
+                    self.logger.warning("事件代理连接断开，稍后重连")
+            with self._send_lock:
+                if self._conn is conn:
+                    self._conn = None
+            conn.close()
+
+class EventBroker:
+    """本地事件代理：把任一进程发来的事件广播给所有已连接进程
+
+    连接须通过认证密钥的质询；代理只按字节转发事件，不反序列化内容。
+    """
+
+    def __init__(self, host: str, port: int, authkey: bytes):
+        from multiprocessing.connection import Listener
+
+        self.listener = Listener((host, port), authkey=require_authkey(authkey))
+        self.logger = logging.getLogger(__name__)
+        self._connections: List['Connection'] = []
+        self._lock = threading.Lock()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """代理监听地址"""
+        return self.listener.address
+
+    def serve_forever(self):
+        """接受连接（阻塞）"""
+        from multiprocessing.connection import AuthenticationError
+
+        self.logger.info(f"事件代理已启动: {self.address[0]}:{self.address[1]}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError as e:
+                self.logger.warning(f"拒绝未通过认证的事件代理连接: {e}")
+                continue
+            except (EOFError, ConnectionResetError):
+                # 连接在认证过程中断开，只影响这一个连接
+                continue
+            except OSError:
+                return
+            with self._lock:
+                self._connections.append(conn)
+            threading.Thread(target=self._relay, args=(conn,), daemon=True).start()
+
+    def start(self) -> 'EventBroker':
+        """在后台线程运行代理"""
+        threading.Thread(target=self.serve_forever, name="event-broker", daemon=True).start()
+        return self
+
+    def close(self):
+        """关闭代理"""
+        self.listener.close()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    def _relay(self, conn: 'Connection'):
+        """转发单个连接发来的事件"""
+        try:
+            while True:
+                data = conn.recv_bytes()
+                with self._lock:
+                    targets = [target for target in self._connections if target is not conn]
+                for target in targets:
+                    try:
+                        target.send_bytes(data)
+                    except (OSError, EOFError):
+                        self._drop(target)
+        except (OSError, EOFError):
+            self._drop(conn)
+
+    def _drop(self, conn: 'Connection'):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+def parse_broker_address(address: str) -> Tuple[str, int]:
+    """解析"host:port"格式的代理地址"""
+    host, _, port = address.rpartition(':')
+    return host or "127.0.0.1", int(port)
+
+def main(argv: Optional[List[str]] = None):
+    """事件代理命令行入口"""
+    parser = argparse.ArgumentParser(description="启动本地事件代理，在多个进程之间转发会话事件")
+    parser.add_argument('--address', default='127.0.0.1:8610', help="监听地址（host:port）")
+    parser.add_argument('--authkey', default=os.getenv('EVENT_BROKER_AUTHKEY', ''),
+                        help="认证密钥（必填，默认读取EVENT_BROKER_AUTHKEY）")
+    args = parser.parse_args(argv)
+    if not args.authkey:
+        parser.error("必须通过--authkey或EVENT_BROKER_AUTHKEY配置认证密钥")
+
+    logging.basicConfig(level=logging.INFO)
+    host, port = parse_broker_address(args.address)
+    EventBroker(host, port, args.authkey.encode('utf-8')).serve_forever()
+
+if __name__ == "__main__":
+    main()
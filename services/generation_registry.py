@@ -0,0 +1,269 @@
+"""进行中的草稿生成任务登记与取消"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from services.event_bus import Event, EventBus, EVENT_CLEARED, EVENT_REJECTED
+
+CANCEL_REJECT = "reject"
+CANCEL_CLEAR = "clear"
+CANCEL_EVICTED = "evicted"
+CANCEL_TIMEOUT = "timeout"
+CANCEL_SUPERSEDED = "superseded"
+CANCEL_APPROVED = "approved"
+
+CANCEL_REASON_LABELS = {
+    CANCEL_REJECT: "审核拒绝",
+    CANCEL_CLEAR: "清空对话",
+    CANCEL_EVICTED: "会话驱逐",
+    CANCEL_TIMEOUT: "生成超时",
+    CANCEL_SUPERSEDED: "被新请求替代",
+    CANCEL_APPROVED: "草稿已批准",
+}
+
+class GenerationCancelled(Exception):
+    """草稿生成已被取消"""
+
+    def __init__(self, reason: str):
+        super().__init__(CANCEL_REASON_LABELS.get(reason, reason))
+        self.reason = reason
+
+class GenerationHandle:
+    """一次进行中的草稿生成
+
+    取消可以来自任意线程：设置取消标志（执行流式读取的线程在下一个分块处停止）、
+    调用Dify停止接口（已拿到流式任务ID时），并唤醒等待结果的协程。
+    """
+
+    def __init__(self, session_id: str, review_id: Optional[str], lane: str, tokens: int = 0):
+        self.session_id = session_id
+        self.review_id = review_id
+        self.lane = lane
+        self.tokens = tokens
+        self.started = time.monotonic()
+        self.reason: Optional[str] = None
+        self.dispatched = False  # 请求已发往Dify（此前取消不消耗Dify算力）
+        self.task_id: Optional[str] = None
+        self.stopped = False
+        self.cancel_event = threading.Event()
+        self._stopper: Optional[Callable[[], Any]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Future] = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消"""
+        return self.cancel_event.is_set()
+
+    def bind(self, task_id: str, stopper: Callable[[], Any]):
+        """登记Dify流式任务ID和停止方法（已取消时立即停止）
+
+        Args:
+            task_id: Dify任务ID
+            stopper: 调用Dify停止接口的函数
+        """
+        with self._lock:
+            self.task_id = task_id
+            self._stopper = stopper
+            stop_now = self.cancelled and not self.stopped
+            if stop_now:
+                self.stopped = True
+        if stop_now:
+            self._stop(stopper)
+
+    def cancel(self, reason: str) -> bool:
+        """取消生成
+
+        Args:
+            reason: 取消原因
+
+        Returns:
+            是否由本次调用取消（已取消过时为False）
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.reason = reason
+            self.cancel_event.set()
+            stopper = self._stopper if not self.stopped else None
+            if stopper is not None:
+                self.stopped = True
+            loop, wakeup = self._loop, self._wakeup
+        if stopper is not None:
+            self._stop(stopper)
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wake, wakeup)
+            except RuntimeError:
+                pass  # 等待结果的事件循环已结束
+        return True
+
+    @staticmethod
+    def _wake(wakeup: asyncio.Future):
+        if not wakeup.done():
+            wakeup.set_result(None)
+
+    @staticmethod
+    def _stop(stopper: Callable[[], Any]):
+        """在后台线程调用Dify停止接口，不阻塞取消方"""
+        threading.Thread(target=stopper, name="dify-stop", daemon=True).start()
+
+    async def run(self, awaitable: Awaitable, timeout: Optional[float] = None) -> Any:
+        """等待生成结果，取消或超时时立即返回
+
+        Args:
+            awaitable: 生成协程
+            timeout: 总超时秒数（可选）
+
+        Returns:
+            生成结果
+
+        Raises:
+            GenerationCancelled: 生成被取消或超时
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._loop = loop
+            self._wakeup = loop.create_future()
+            wakeup = self._wakeup
+        task = asyncio.ensure_future(awaitable)
+        if self.cancelled:
+            wakeup.set_result(None)
+        try:
+            done, _ = await asyncio.wait({task, wakeup}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if task in done and not self.cancelled:
+            return task.result()
+        if not done:
+            self.cancel(CANCEL_TIMEOUT)
+        # 排队中的请求撤出调度队列；已发出的阻塞请求结果不再处理
+        task.cancel()
+        raise GenerationCancelled(self.reason)
+
+class GenerationRegistry:
+    """进程级草稿生成登记表
+
+    每次草稿生成按客户会话登记。监督者拒绝、清空对话（通过事件总线，跨进程也能收到）、
+    会话被驱逐、生成超时或同一会话的新生成开始时，取消对应的生成，并统计回收的工作：
+    还在排队就取消的请求不会发往Dify；流式请求调用Dify停止接口提前结束；
+    已发出的阻塞请求只能丢弃结果。
+    """
+
+    def __init__(self):
+        self._handles: Dict[str, List[GenerationHandle]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._subscription: Optional[int] = None
+        self.logger = logging.getLogger(__name__)
+        self.counters: Dict[str, int] = {
+            'started': 0, 'completed': 0, 'cancelled': 0, 'reclaimed_queued': 0,
+            'stopped': 0, 'abandoned': 0, 'discarded': 0, 'reclaimed_tokens': 0,
+        }
+        self.reasons: Dict[str, int] = defaultdict(int)
+
+    def start(self, session_id: str, review_id: Optional[str], lane: str,
+              tokens: int = 0) -> GenerationHandle:
+        """登记一次生成（同一会话同一通道中更早的生成被替代）
+
+        Args:
+            session_id: 客户会话ID
+            review_id: 对应的用户消息ID
+            lane: 调度通道
+            tokens: 预计输入token数
+
+        Returns:
+            生成句柄
+        """
+        handle = GenerationHandle(session_id, review_id, lane, tokens)
+        with self._lock:
+            previous = [item for item in self._handles[session_id] if item.lane == lane]
+            self._handles[session_id].append(handle)
+            self.counters['started'] += 1
+        for item in previous:
+            item.cancel(CANCEL_SUPERSEDED)
+        return handle
+
+    def finish(self, handle: GenerationHandle, discarded: bool = False):
+        """生成结束（完成、取消或结果被丢弃）后注销并计入统计
+
+        Args:
+            handle: 生成句柄
+            discarded: 结果返回时会话状态已变化，结果被丢弃
+        """
+        with self._lock:
+            handles = self._handles.get(handle.session_id)
+            if handles and handle in handles:
+                handles.remove(handle)
+                if not handles:
+                    del self._handles[handle.session_id]
+            if discarded:
+                self.counters['discarded'] += 1
+            elif not handle.cancelled:
+                self.counters['completed'] += 1
+                return
+            else:
+                self.counters['cancelled'] += 1
+                self.reasons[handle.reason] += 1
+                if not handle.dispatched:
+                    self.counters['reclaimed_queued'] += 1
+                    self.counters['reclaimed_tokens'] += handle.tokens
+                elif handle.stopped:
+                    self.counters['stopped'] += 1
+                else:
+                    self.counters['abandoned'] += 1
+        if handle.cancelled:
+            self.logger.info(f"草稿生成已取消({handle.reason}): 会话 {handle.session_id}, "
+                             f"已发往Dify: {handle.dispatched}, 调用停止接口: {handle.stopped}")
+
+    def cancel(self, session_id: str, reason: str, review_id: Optional[str] = None) -> int:
+        """取消会话中进行中的生成
+
+        Args:
+            session_id: 客户会话ID
+            reason: 取消原因
+            review_id: 只取消该用户消息的生成（可选）
+
+        Returns:
+            取消的生成数
+        """
+        with self._lock:
+            handles = [handle for handle in self._handles.get(session_id, [])
+                       if review_id is None or handle.review_id == review_id]
+        return sum(1 for handle in handles if handle.cancel(reason))
+
+    def active(self, session_id: Optional[str] = None) -> int:
+        """进行中的生成数"""
+        with self._lock:
+            if session_id is not None:
+                return len(self._handles.get(session_id, []))
+            return sum(len(handles) for handles in self._handles.values())
+
+    def attach(self, event_bus: EventBus, session_store=None):
+        """订阅拒绝/清空事件和会话驱逐，取消对应会话的生成
+
+        Args:
+            event_bus: 事件总线
+            session_store: 会话存储（可选）
+        """
+        self._subscription = event_bus.subscribe(self._on_event, [EVENT_REJECTED, EVENT_CLEARED])
+        if session_store is not None:
+            session_store.add_evict_listener(
+                lambda session: self.cancel(session.session_id, CANCEL_EVICTED)
+            )
+
+    def _on_event(self, event: Event):
+        reason = CANCEL_REJECT if event.event_type == EVENT_REJECTED else CANCEL_CLEAR
+        self.cancel(event.session_id, reason)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取生成与回收统计"""
+        with self._lock:
+            result: Dict[str, Any] = dict(self.counters)
+            result['active'] = sum(len(handles) for handles in self._handles.values())
+            result['reasons'] = dict(self.reasons)
+            return result
@@ -0,0 +1,352 @@
+"""LLM请求调度服务"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+from utils.constants import (
+    LLM_BATCH_MIN_SLOTS, LLM_LANE_CAP_RATIOS, LLM_LANE_DEADLINES, LLM_LANE_WEIGHTS, LLM_WAIT_SAMPLES
+)
+
+LANE_INTERACTIVE = "interactive"
+LANE_REGENERATE = "regenerate"
+LANE_SPECULATIVE = "speculative"
+LANE_BATCH = "batch"
+LANES = (LANE_INTERACTIVE, LANE_REGENERATE, LANE_SPECULATIVE, LANE_BATCH)
+BACKGROUND_LANES = (LANE_SPECULATIVE, LANE_BATCH)  # 有在线请求排队时让出空闲并发
+
+LANE_LABELS = {
+    LANE_INTERACTIVE: "在线客服",
+    LANE_REGENERATE: "监督者重新生成",
+    LANE_SPECULATIVE: "备选草稿预生成",
+    LANE_BATCH: "批量营销",
+}
+
+class SchedulerTimeout(Exception):
+    """请求排队超过截止时间"""
+
+class _Ticket:
+    """一次排队中的LLM请求"""
+
+    __slots__ = ('lane', 'cost', 'deadline', 'seq', 'enqueued', 'started', 'future', 'loop',
+                 'granted', 'withdrawn', 'passed_over')
+
+    def __init__(self, lane: str, cost: float, deadline: Optional[float], seq: int,
+                 future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.lane = lane
+        self.cost = cost
+        self.deadline = deadline
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.started = 0.0
+        self.future = future
+        self.loop = loop
+        self.granted = False
+        self.withdrawn = False
+        self.passed_over = False
+
+    def __lt__(self, other: '_Ticket') -> bool:
+        # 通道内按截止时间优先（无截止时间的排在后面），相同时先到先得
+        return ((self.deadline or math.inf), self.seq) < ((other.deadline or math.inf), other.seq)
+
+@dataclass
+class _Lane:
+    """调度通道"""
+    name: str
+    weight: float
+    cap: int
+    deadline: float
+    queue: List[_Ticket] = field(default_factory=list)
+    waiting: int = 0
+    running: int = 0
+    last_finish: float = 0.0  # 加权公平排队：该通道上一个请求的虚拟完成时间
+    submitted: int = 0
+    completed: int = 0
+    expired: int = 0
+    cancelled: int = 0
+    preempted: int = 0
+    service_seconds: float = 0.0
+    waits: Deque[float] = field(default_factory=lambda: deque(maxlen=LLM_WAIT_SAMPLES))
+
+class _NoSlot:
+    """未配置调度器时的空上下文"""
+
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+class LLMScheduler:
+    """进程级LLM请求调度器
+
+    在线客服、监督者重新生成、备选草稿预生成和批量营销共用同一个Dify应用和配额。所有请求先在各自通道排队，
+    有空闲并发时按加权公平排队（起始时间公平排队，代价为预计token数）选出下一个：
+    通道权重越大，分到的配额越多；空闲后重新排队的通道不会积攒额度。
+    - 每个通道有并发上限，批量任务最多占用一部分并发
+    - 通道内按截止时间优先，排队超过截止时间的请求直接失败，不再占用Dify
+    - 有在线或重新生成请求排队时，排队中的后台请求让出空闲并发（批量任务保留最少并发避免饿死，
+      备选草稿预生成不保留）
+    调度状态由线程锁保护，可被多个事件循环（Streamlit每次运行、客户接入端点）同时使用。
+    """
+
+    def __init__(self, max_concurrency: int = 8,
+                 weights: Optional[Dict[str, float]] = None,
+                 cap_ratios: Optional[Dict[str, float]] = None,
+                 deadlines: Optional[Dict[str, float]] = None,
+                 batch_min_slots: int = LLM_BATCH_MIN_SLOTS):
+        self.max_concurrency = max(1, max_concurrency)
+        self.batch_min_slots = batch_min_slots
+        weights = weights or LLM_LANE_WEIGHTS
+        cap_ratios = cap_ratios or LLM_LANE_CAP_RATIOS
+        deadlines = deadlines or LLM_LANE_DEADLINES
+        self._lanes: Dict[str, _Lane] = {
+            lane: _Lane(lane, float(weights[lane]),
+                        max(1, math.ceil(self.max_concurrency * cap_ratios[lane])),
+                        float(deadlines[lane]))
+            for lane in LANES
+        }
+        self._running = 0
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def slot(self, lane: str = LANE_INTERACTIVE, cost: float = 1.0,
+             deadline: Optional[float] = None) -> '_Slot':
+        """获取一个调度槽位（用于async with）
+
+        Args:
+            lane: 调度通道
+            cost: 请求代价（预计token数）
+            deadline: 最长排队秒数（None使用通道默认值，0表示不限）
+
+        Returns:
+            异步上下文管理器，退出时归还槽位
+        """
+        return _Slot(self, lane, cost, deadline)
+
+    async def acquire(self, lane: str = LANE_INTERACTIVE, cost: float = 1.0,
+                      deadline: Optional[float] = None) -> _Ticket:
+        """排队等待调度槽位
+
+        Raises:
+            SchedulerTimeout: 排队超过截止时间
+        """
+        state = self._lanes[lane]
+        wait = state.deadline if deadline is None else deadline
+        loop = asyncio.get_running_loop()
+        ticket = _Ticket(lane, max(cost, 1.0), time.monotonic() + wait if wait > 0 else None,
+                         next(self._seq), loop.create_future(), loop)
+        with self._lock:
+            state.submitted += 1
+            state.waiting += 1
+            heapq.heappush(state.queue, ticket)
+            self._dispatch()
+
+        try:
+            if ticket.deadline is None:
+                return await ticket.future
+            return await asyncio.wait_for(ticket.future, max(0.0, ticket.deadline - time.monotonic()))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            future = ticket.future
+            if ticket.granted and future.done() and not future.cancelled() and future.exception() is None:
+                # 槽位已送达，等待方恢复前同时超时或被取消：超时时照常使用，取消时归还槽位
+                if isinstance(e, asyncio.TimeoutError):
+                    return ticket
+                with self._lock:
+                    state.running -= 1
+                    state.cancelled += 1
+                    self._running -= 1
+                    self._dispatch()
+                raise
+            with self._lock:
+                if not ticket.granted and not ticket.withdrawn:
+                    ticket.withdrawn = True
+                    state.waiting -= 1
+                    if isinstance(e, asyncio.TimeoutError):
+                        state.expired += 1
+                    else:
+                        state.cancelled += 1
+            # 已分配但尚未送达的槽位由_deliver归还
+            if isinstance(e, asyncio.TimeoutError):
+                raise SchedulerTimeout(f"{LANE_LABELS[lane]}请求排队超时") from None
+            raise
+
+    def release(self, ticket: _Ticket):
+        """归还调度槽位"""
+        with self._lock:
+            state = self._lanes[ticket.lane]
+            state.running -= 1
+            state.completed += 1
+            state.service_seconds += time.monotonic() - ticket.started
+            self._running -= 1
+            self._dispatch()
+
+    def _deliver(self, ticket: _Ticket):
+        """在请求所在的事件循环中送达槽位"""
+        if ticket.future.done():
+            # 送达前已超时或被取消
+            self.release(ticket)
+        else:
+            ticket.future.set_result(ticket)
+
+    def _head(self, state: _Lane, now: float) -> Optional[_Ticket]:
+        """通道队首的有效请求，顺便丢弃已撤回和已过期的请求（需在锁内调用）"""
+        while state.queue:
+            ticket = state.queue[0]
+            if ticket.withdrawn:
+                heapq.heappop(state.queue)
+            elif ticket.deadline is not None and ticket.deadline <= now:
+                heapq.heappop(state.queue)
+                ticket.withdrawn = True
+                state.waiting -= 1
+                state.expired += 1
+                try:
+                    ticket.loop.call_soon_threadsafe(self._expire, ticket)
+                except RuntimeError:
+                    pass  # 请求所在的事件循环已关闭
+            else:
+                return ticket
+        return None
+
+    @staticmethod
+    def _expire(ticket: _Ticket):
+        if not ticket.future.done():
+            ticket.future.set_exception(SchedulerTimeout(f"{LANE_LABELS[ticket.lane]}请求排队超时"))
+
+    def _dispatch(self):
+        """有空闲并发时按加权公平排队分配槽位（需在锁内调用）"""
+        while self._running < self.max_concurrency:
+            now = time.monotonic()
+            candidates = {}
+            for name, state in self._lanes.items():
+                if state.running < state.cap:
+                    ticket = self._head(state, now)
+                    if ticket is not None:
+                        candidates[name] = ticket
+            if not candidates:
+                return
+
+            if any(name not in BACKGROUND_LANES for name in candidates):
+                # 在线请求优先：排队中的后台请求让出这个槽位
+                for name in BACKGROUND_LANES:
+                    ticket = candidates.get(name)
+                    if ticket is None or (name == LANE_BATCH
+                                          and self._lanes[name].running < self.batch_min_slots):
+                        continue
+                    if not ticket.passed_over:
+                        ticket.passed_over = True
+                        self._lanes[name].preempted += 1
+                    del candidates[name]
+
+            # 起始时间公平排队：选虚拟起始时间最小的通道，系统虚拟时间推进到该起始时间
+            best, best_start, best_finish = None, math.inf, math.inf
+            for name, ticket in candidates.items():
+                state = self._lanes[name]
+                start = max(self._virtual_time, state.last_finish)
+                finish = start + ticket.cost / state.weight
+                if (start, finish) < (best_start, best_finish):
+                    best, best_start, best_finish = ticket, start, finish
+
+            state = self._lanes[best.lane]
+            heapq.heappop(state.queue)
+            state.waiting -= 1
+            state.running += 1
+            state.last_finish = best_finish
+            state.waits.append(now - best.enqueued)
+            self._virtual_time = best_start
+            self._running += 1
+            best.granted = True
+            best.started = now
+            try:
+                best.loop.call_soon_threadsafe(self._deliver, best)
+            except RuntimeError:
+                # 请求所在的事件循环已关闭，直接收回槽位
+                state.running -= 1
+                state.cancelled += 1
+                self._running -= 1
+
+    def queue_depth(self, lane: Optional[str] = None) -> int:
+        """排队中的请求数
+
+        Args:
+            lane: 调度通道（None为所有通道）
+        """
+        with self._lock:
+            if lane is not None:
+                return self._lanes[lane].waiting
+            return sum(state.waiting for state in self._lanes.values())
+
+    def utilization(self) -> float:
+        """已占用并发占总并发的比例"""
+        with self._lock:
+            return self._running / self.max_concurrency
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各通道的调度指标
+
+        Returns:
+            通道 -> 排队数、运行数、上限、累计请求/完成/超时/取消/让出次数，
+            以及最近排队耗时的P50/P95/最大值（秒）和平均处理耗时（秒）
+        """
+        with self._lock:
+            result = {}
+            for name, state in self._lanes.items():
+                waits = sorted(state.waits)
+                result[name] = {
+                    'queued': state.waiting,
+                    'running': state.running,
+                    'cap': state.cap,
+                    'weight': state.weight,
+                    'submitted': state.submitted,
+                    'completed': state.completed,
+                    'expired': state.expired,
+                    'cancelled': state.cancelled,
+                    'preempted': state.preempted,
+                    'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+                    'wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    'wait_max': waits[-1] if waits else 0.0,
+                    'service_avg': state.service_seconds / state.completed if state.completed else 0.0,
+                }
+            return result
+
+class _Slot:
+    """调度槽位上下文"""
+
+    def __init__(self, scheduler: LLMScheduler, lane: str, cost: float, deadline: Optional[float]):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.cost = cost
+        self.deadline = deadline
+        self.ticket: Optional[_Ticket] = None
+
+    async def __aenter__(self) -> _Ticket:
+        self.ticket = await self.scheduler.acquire(self.lane, self.cost, self.deadline)
+        return self.ticket
+
+    async def __aexit__(self, *exc_info):
+        self.scheduler.release(self.ticket)
+        return False
+
+def llm_slot(scheduler: Optional[LLMScheduler], lane: str = LANE_INTERACTIVE, cost: float = 1.0,
+             deadline: Optional[float] = None):
+    """获取调度槽位；未配置调度器时不排队
+
+    Args:
+        scheduler: 调度器（可选）
+        lane: 调度通道
+        cost: 请求代价（预计token数）
+        deadline: 最长排队秒数
+
+    Returns:
+        异步上下文管理器
+    """
+    if scheduler is None:
+        return _NoSlot()
+    return scheduler.slot(lane, cost, deadline)
@@ -2,61 +2,149 @@
 import requests
 import asyncio
 import logging
-from typing import Dict, Any, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, TypeVar
 from config.settings import DifyConfig
+from services.admission_control import AdmissionController
+from services.dify_transport import HTTPTransport
+from services.llm_scheduler import (
+    LLMScheduler, SchedulerTimeout, LANE_BATCH, LANE_INTERACTIVE, llm_slot
+)
+from services.signal_ingest import WorkSet
+from utils.constants import ADMISSION_NOTICES, MARKETING_BATCH_CONCURRENCY
+from utils.pii_masker import PIIMasker
+from utils.token_estimator import estimate_request_tokens
+
+T = TypeVar('T')
+
+async def run_bounded(items: Iterable[T], func: Callable[[T], Awaitable[Any]],
+                      concurrency: int = MARKETING_BATCH_CONCURRENCY):
+    """用固定数量的工作协程处理任务
+    
+    任务从有界队列中逐个取出，同一时间只存在concurrency个进行中的协程和有限的排队任务，
+    任务数量再多也不会一次性创建全部协程。
+    
+    Args:
+        items: 任务（可以是生成器）
+        func: 处理单个任务的协程函数（需自行处理异常）
+        concurrency: 工作协程数
+    """
+    concurrency = max(1, concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    done = object()
+    
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            await func(item)
+    
+    async def produce():
+        for item in items:
+            await queue.put(item)
+        for _ in range(concurrency):
+            await queue.put(done)
+    
+    tasks = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    tasks.append(asyncio.ensure_future(produce()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
 
 class MarketingService:
     """营销文案生成服务类"""
     
-    def __init__(self, config: DifyConfig):
+    def __init__(self, config: DifyConfig, transport=None, scheduler: Optional[LLMScheduler] = None,
+                 masker: Optional[PIIMasker] = None, admission: Optional[AdmissionController] = None):
         self.config = config
+        # 传输层：默认直连Dify，也可以是录制/回放传输层
+        self.transport = transport or HTTPTransport()
+        # 进程级调度器：批量生成走批量通道，不挤占在线客服（未配置时不排队）
+        self.scheduler = scheduler
+        # 敏感信息脱敏：营销信号中的手机号、卡号、金额等替换为占位符后再发往Dify
+        self.masker = masker
+        # 准入控制：过载时批量任务最先暂缓，为在线客服让路
+        self.admission = admission
         self.headers = {
             'Authorization': f'Bearer {config.api_key}',
             'Content-Type': 'application/json'
         }
         self.logger = logging.getLogger(__name__)
     
-    async def generate_marketing_copy(self, prompt: str) -> Dict[str, Any]:
+    async def generate_marketing_copy(self, prompt: str, user: Optional[str] = None,
+                                      lane: str = LANE_INTERACTIVE) -> Dict[str, Any]:
         """生成营销文案
         
         Args:
             prompt: 用户输入的完整提示词
+            user: Dify用户标识（可选，默认marketing_user）
+            lane: 调度通道（单条生成默认在线通道，批量生成使用批量通道）
             
         Returns:
-            包含生成结果的字典
+            包含生成结果的字典；批量生成被准入控制暂缓时error为shed
         """
+        tokens = estimate_request_tokens(prompt)
+        if lane == LANE_BATCH and self.admission is not None:
+            reason = self.admission.admit_background(lane, tokens)
+            if reason is not None:
+                self.logger.info(f"批量营销文案生成已暂缓: {reason}")
+                return {
+                    'success': False,
+                    'error': 'shed',
+                    'content': ADMISSION_NOTICES['batch']
+                }
+        
+        found: Dict[str, str] = {}
+        if self.masker is not None:
+            prompt = self.masker.mask(prompt, found)
         payload = {
             'inputs': {},
             'query': prompt,
             'response_mode': 'blocking',
-            'user': 'marketing_user'
+            'user': user or 'marketing_user'
         }
         
         try:
-            # 使用asyncio运行同步请求
+            # 按调度通道排队，使用asyncio运行同步请求
             loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: requests.post(
-                    f"{self.config.base_url}/chat-messages",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=self.config.timeout
+            async with llm_slot(self.scheduler, lane, tokens):
+                response = await loop.run_in_executor(
+                    None, 
+                    lambda: self.transport.post(
+                        f"{self.config.base_url}/chat-messages",
+                        headers=self.headers,
+                        json=payload,
+                        timeout=self.config.timeout
+                    )
                 )
-            )
             
             response.raise_for_status()
             data = response.json()
             
             self.logger.info(f"营销文案生成成功，消息ID: {data.get('message_id')}")
             
+            content = data.get('answer', '')
+            if self.masker is not None:
+                content = self.masker.restore(content, found)
+            
             return {
                 'success': True,
-                'content': data.get('answer', ''),
+                'content': content,
                 'message_id': data.get('message_id'),
                 'usage': data.get('metadata', {}).get('usage', {})
             }
             
+        except SchedulerTimeout as e:
+            error_msg = "文案生成排队人数较多，请稍后再试"
+            self.logger.warning(f"营销文案生成排队超时: {e}")
+            return {
+                'success': False,
+                'error': 'queue_timeout',
+                'content': error_msg
+            }
+            
         except requests.exceptions.Timeout:
             error_msg = "文案生成超时，请稍后再试"
             self.logger.error(f"营销文案生成超时: {self.config.timeout}秒")
@@ -83,4 +171,29 @@ class MarketingService:
                 'error': str(e),
                 'content': error_msg
             }
-    
\ No newline at end of file
+    
+    async def generate_for_work_set(self, work_set: WorkSet,
+                                    concurrency: int = MARKETING_BATCH_CONCURRENCY) -> Dict[str, Dict[str, Any]]:
+        """为去重后的工作集批量生成营销文案
+        
+        每个唯一信号只调用一次Dify，由固定数量的工作协程依次处理；结果可通过
+        SignalIngestor.fan_out重新读取信号文件逐行分发给所有客户。
+        
+        Args:
+            work_set: 去重后的工作集
+            concurrency: 最大并发请求数
+            
+        Returns:
+            规范键 -> 生成结果
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        
+        async def generate(signal):
+            results[signal.key] = await self.generate_marketing_copy(signal.to_prompt(), lane=LANE_BATCH)
+        
+        await run_bounded(work_set, generate, concurrency)
+        
+        failed = sum(1 for result in results.values() if not result['success'])
+        self.logger.info(f"批量营销文案生成完成: 唯一信号 {len(results)} 个, 失败 {failed} 个")
+        
+        return results
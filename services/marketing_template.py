@@ -0,0 +1,374 @@
+"""营销文案模板缓存服务"""
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from services.llm_scheduler import LANE_BATCH
+from services.marketing_service import MarketingService, run_bounded
+from services.signal_ingest import UniqueSignal, WorkSet
+from services.state_backend import StateBackend
+from utils.constants import MARKETING_BATCH_CONCURRENCY, MARKETING_TEMPLATE_ATTEMPTS
+
+# 事件中的数值（整数、小数、千分位）
+NUMBER_PATTERN = re.compile(r'\d+(?:,\d{3})*(?:\.\d+)?')
+
+# 占位符格式：{N1}、{N2}...
+PLACEHOLDER_PATTERN = re.compile(r'\{N(\d+)\}')
+
+TEMPLATE_STATUS_PENDING = "pending"
+TEMPLATE_STATUS_APPROVED = "approved"
+TEMPLATE_STATUS_REJECTED = "rejected"
+
+TEMPLATE_NAMESPACE = "marketing_templates"
+
+def abstract_event(event: str) -> Tuple[str, Tuple[str, ...]]:
+    """将事件中的数值抽象为占位符
+
+    Args:
+        event: 归一化后的事件，如"工资到账6000元"
+
+    Returns:
+        (事件模板, 数值列表)，如("工资到账{N1}元", ("6000",))
+    """
+    values = []
+
+    def replace(match):
+        values.append(match.group(0))
+        return f"{{N{len(values)}}}"
+
+    return NUMBER_PATTERN.sub(replace, event), tuple(values)
+
+def template_key(tags: Tuple[str, ...], event_template: str) -> str:
+    """计算模板分组键
+
+    对标签和事件模板的JSON编码取哈希，标签或事件中含有任何字符都不会使不同的组合得到相同的键。
+
+    Args:
+        tags: 已归一化并排序的标签
+        event_template: 事件模板
+
+    Returns:
+        分组键
+    """
+    data = json.dumps([list(tags), event_template], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+def fill_placeholders(template: str, values: Tuple[str, ...]) -> str:
+    """用具体数值替换文案模板中的占位符
+
+    Args:
+        template: 含占位符的文案模板
+        values: 数值列表
+
+    Returns:
+        填充后的文案（超出范围的占位符保持原样）
+    """
+    def replace(match):
+        index = int(match.group(1)) - 1
+        return values[index] if 0 <= index < len(values) else match.group(0)
+
+    return PLACEHOLDER_PATTERN.sub(replace, template)
+
+def check_placeholders(template: str, content: str) -> str:
+    """检查生成的文案是否原样保留了事件模板中的占位符
+
+    Args:
+        template: 事件模板
+        content: 生成的文案模板
+
+    Returns:
+        错误信息，占位符一致时为空字符串
+    """
+    expected = set(PLACEHOLDER_PATTERN.findall(template))
+    found = set(PLACEHOLDER_PATTERN.findall(content))
+    missing = sorted(expected - found, key=int)
+    unknown = sorted(found - expected, key=int)
+    errors = []
+    if missing:
+        errors.append("缺少占位符 " + "、".join(f"{{N{index}}}" for index in missing))
+    if unknown:
+        errors.append("出现未知占位符 " + "、".join(f"{{N{index}}}" for index in unknown))
+    return "，".join(errors)
+
+@dataclass
+class TemplateGroup:
+    """标签组合 + 事件模板相同的一组信号"""
+    key: str
+    tags: Tuple[str, ...]
+    event_template: str
+    signal_count: int = 0
+    customer_count: int = 0
+    content: Optional[str] = None
+    status: str = TEMPLATE_STATUS_PENDING
+    error: Optional[str] = None
+
+    def to_prompt(self) -> str:
+        """转换为发送给Dify的提示词（事件中保留占位符，并要求文案原样保留）"""
+        data: Dict[str, Any] = {"tags": list(self.tags), "event": self.event_template}
+        placeholders = [match.group(0) for match in PLACEHOLDER_PATTERN.finditer(self.event_template)]
+        if placeholders:
+            data["placeholders"] = placeholders
+            data["instruction"] = (f"事件中的{'、'.join(placeholders)}是数值占位符，文案中必须原样保留每个占位符，"
+                                   "不要替换为具体数字，也不要新增其他占位符")
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'key': self.key,
+            'tags': list(self.tags),
+            'event_template': self.event_template,
+            'signal_count': self.signal_count,
+            'customer_count': self.customer_count,
+            'content': self.content,
+            'status': self.status,
+            'error': self.error,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TemplateGroup':
+        """从字典创建分组"""
+        return cls(**{**data, 'tags': tuple(data['tags'])})
+
+class TemplateCache:
+    """营销文案模板缓存
+
+    按标签集合和抽象后的事件类型对信号分组，每组只调用一次Dify生成带占位符的
+    文案模板，具体数值在本地填充；缺少或多出占位符的文案会重新生成，仍不一致时记为失败。
+    可选的分组审批保证只有合规审核通过的模板被使用：新生成的模板一律待审批，
+    关闭审批时直接使用，之后开启审批也不会跳过审核。
+    配置共享状态后端时，分组按键写入后端，命名空间版本号变化时重新读取，
+    其他会话或副本生成、审批的模板可以直接复用。写入按版本号比较并交换，
+    并发的生成、审批、拒绝基于最新内容合并，不会互相覆盖。
+    """
+
+    def __init__(self, require_approval: bool = False, backend: Optional[StateBackend] = None):
+        self.require_approval = require_approval
+        self.backend = backend
+        self.groups: Dict[str, TemplateGroup] = {}
+        self.logger = logging.getLogger(__name__)
+        self._version = 0
+
+    def _sync(self):
+        """共享后端中的模板有更新时重新读取"""
+        if self.backend is None:
+            return
+        version = self.backend.namespace_version(TEMPLATE_NAMESPACE)
+        if version != self._version:
+            for key, data in self.backend.get_values(TEMPLATE_NAMESPACE).items():
+                group = TemplateGroup.from_dict(data)
+                # 旧版本按分隔符拼接的键不再使用，对应分组会按新键重新生成
+                if key == template_key(group.tags, group.event_template):
+                    self.groups[key] = group
+            self._version = version
+
+    def _update(self, key: str, mutate: Callable[[TemplateGroup], None]) -> TemplateGroup:
+        """修改分组并写入共享后端
+
+        配置共享后端时读取最新的分组后修改、按版本号写入，版本冲突时重新读取并重试。
+
+        Args:
+            key: 分组键
+            mutate: 就地修改分组的函数
+
+        Returns:
+            修改后的分组
+        """
+        if self.backend is None:
+            mutate(self.groups[key])
+            return self.groups[key]
+        while True:
+            data, version = self.backend.get_value(TEMPLATE_NAMESPACE, key)
+            group = TemplateGroup.from_dict(data) if data is not None else replace(self.groups[key])
+            mutate(group)
+            if self.backend.put_value(TEMPLATE_NAMESPACE, key, group.to_dict(), version) is not None:
+                self.groups[key] = group
+                return group
+
+    @staticmethod
+    def _merge_generated(group: TemplateGroup, batch: TemplateGroup,
+                         outcome: Optional[Tuple[Optional[str], Optional[str]]]):
+        """把本批次的覆盖统计和生成结果合并到最新的分组
+
+        其他会话或副本已经写入文案时保留对方的文案和审批状态，本次生成的文案丢弃。
+
+        Args:
+            group: 最新的分组
+            batch: 本批次的分组
+            outcome: (生成的文案, 错误信息)，本批次未生成时为None
+        """
+        group.signal_count = batch.signal_count
+        group.customer_count = batch.customer_count
+        if outcome is None or group.content is not None:
+            return
+        content, error = outcome
+        if content is None:
+            group.error = error
+            return
+        group.content = content
+        group.error = None
+        group.status = TEMPLATE_STATUS_PENDING
+
+    @staticmethod
+    def group_key(signal: UniqueSignal) -> Tuple[str, Tuple[str, ...]]:
+        """计算信号所属分组的键
+
+        Args:
+            signal: 唯一信号
+
+        Returns:
+            (分组键, 事件中的数值)
+        """
+        event_template, values = abstract_event(signal.event)
+        return template_key(signal.tags, event_template), values
+
+    def assign(self, work_set: WorkSet) -> List[TemplateGroup]:
+        """将工作集中的信号分配到模板分组
+
+        Args:
+            work_set: 去重后的工作集
+
+        Returns:
+            本次涉及的分组列表
+        """
+        self._sync()
+        touched = {}
+        for signal in work_set:
+            key, _ = self.group_key(signal)
+            group = self.groups.get(key)
+            if group is None:
+                group = TemplateGroup(
+                    key=key,
+                    tags=signal.tags,
+                    event_template=abstract_event(signal.event)[0]
+                )
+                self.groups[key] = group
+            if key not in touched:
+                group.signal_count = 0
+                group.customer_count = 0
+                touched[key] = group
+            group.signal_count += 1
+            group.customer_count += signal.count
+        return list(touched.values())
+
+    async def generate(self, work_set: WorkSet, marketing_service: MarketingService,
+                       concurrency: int = MARKETING_BATCH_CONCURRENCY) -> List[TemplateGroup]:
+        """为工作集生成缺失的文案模板
+
+        已有文案的分组（包括之前批次生成的）不会重复调用Dify。
+
+        Args:
+            work_set: 去重后的工作集
+            marketing_service: 营销服务实例
+            concurrency: 最大并发请求数
+
+        Returns:
+            本次涉及的分组列表
+        """
+        groups = self.assign(work_set)
+        missing = [group for group in groups if group.content is None]
+        outcomes: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+        async def generate_group(group: TemplateGroup):
+            for _ in range(MARKETING_TEMPLATE_ATTEMPTS):
+                result = await marketing_service.generate_marketing_copy(group.to_prompt(), lane=LANE_BATCH)
+                if not result['success']:
+                    outcomes[group.key] = (None, result['content'])
+                    return
+                error = check_placeholders(group.event_template, result['content'])
+                if not error:
+                    outcomes[group.key] = (result['content'], None)
+                    return
+                outcomes[group.key] = (None, f"模板文案{error}")
+                self.logger.warning(f"模板文案占位符不一致({error}): {group.key}")
+
+        await run_bounded(missing, generate_group, concurrency)
+        groups = [
+            self._update(group.key, partial(self._merge_generated, batch=group, outcome=outcomes.get(group.key)))
+            for group in groups
+        ]
+
+        self.logger.info(
+            f"模板文案生成完成: 唯一信号 {len(work_set)} 个, 分组 {len(groups)} 个, "
+            f"调用Dify {len(missing)} 次"
+        )
+        return groups
+
+    def approve(self, key: str, content: Optional[str] = None):
+        """审批通过分组模板
+
+        Args:
+            key: 分组键
+            content: 修改后的模板文案（可选）
+        """
+        self._sync()
+
+        def mutate(group: TemplateGroup):
+            if content is not None:
+                group.content = content
+            # 其他会话已拒绝且未提供文案时不能批准空模板
+            if group.content is not None:
+                group.status = TEMPLATE_STATUS_APPROVED
+
+        self._update(key, mutate)
+
+    def reject(self, key: str):
+        """拒绝分组模板，丢弃已生成的文案以便重新生成
+
+        Args:
+            key: 分组键
+        """
+        self._sync()
+
+        def mutate(group: TemplateGroup):
+            group.content = None
+            group.status = TEMPLATE_STATUS_REJECTED
+
+        self._update(key, mutate)
+
+    def render(self, signal: UniqueSignal) -> Optional[str]:
+        """为单个信号渲染最终文案
+
+        Args:
+            signal: 唯一信号
+
+        Returns:
+            填充后的文案；分组未生成或未审批时返回None
+        """
+        key, values = self.group_key(signal)
+        group = self.groups.get(key)
+        if group is None or group.content is None:
+            return None
+        if self.require_approval and group.status != TEMPLATE_STATUS_APPROVED:
+            return None
+        return fill_placeholders(group.content, values)
+
+    def results_for(self, work_set: WorkSet) -> Dict[str, Dict[str, Any]]:
+        """生成与MarketingService.generate_for_work_set兼容的结果
+
+        Args:
+            work_set: 去重后的工作集
+
+        Returns:
+            规范键 -> 生成结果（仅包含可用的分组）
+        """
+        self._sync()
+        results = {}
+        for signal in work_set:
+            content = self.render(signal)
+            if content is not None:
+                results[signal.key] = {'success': True, 'content': content}
+        return results
+
+    def pending_groups(self) -> List[TemplateGroup]:
+        """获取已生成但等待审批的分组
+
+        Returns:
+            待审批分组列表
+        """
+        self._sync()
+        return [group for group in self.groups.values()
+                if group.content is not None and group.status == TEMPLATE_STATUS_PENDING]
@@ -0,0 +1,135 @@
+"""本地模拟Dify服务（用于开发和压测，无需真实API密钥）"""
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from utils.constants import SPECULATIVE_VARIANT_INPUT
+
+class _MockDifyHandler(BaseHTTPRequestHandler):
+    """模拟Dify的/info与/chat-messages接口（支持阻塞和流式两种响应模式）"""
+
+    server: "MockDifyServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/info'):
+            self._send_json(200, {'name': 'mock-dify', 'mode': 'chat'})
+        else:
+            self._send_json(404, {'message': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path.rstrip('/').endswith('/stop'):
+            self.server.stopped.add(self.path.rstrip('/').split('/')[-2])
+            self._send_json(200, {'result': 'success'})
+            return
+        if not self.path.rstrip('/').endswith('/chat-messages'):
+            self._send_json(404, {'message': 'not found'})
+            return
+        if body.get('response_mode') == 'streaming':
+            self._send_stream(body)
+            return
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        self._send_json(200, {
+            'answer': self._answer(body),
+            'conversation_id': body.get('conversation_id') or str(uuid.uuid4()),
+            'message_id': str(uuid.uuid4()),
+            'metadata': {'usage': {'total_tokens': len(body.get('query', ''))}}
+        })
+
+    def _send_stream(self, body: dict):
+        """按SSE分块返回回复，延迟平均分摊到各分块；收到停止请求后提前结束"""
+        task_id = str(uuid.uuid4())
+        answer = self._answer(body)
+        pieces = [answer[i:i + 4] for i in range(0, len(answer), 4)] or ['']
+        delay = self.server.latency / len(pieces)
+        common = {
+            'task_id': task_id,
+            'conversation_id': body.get('conversation_id') or str(uuid.uuid4()),
+            'message_id': str(uuid.uuid4()),
+        }
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for piece in pieces:
+                if delay > 0:
+                    time.sleep(delay)
+                if task_id in self.server.stopped:
+                    break
+                self._write_event(dict(common, event='message', answer=piece))
+            self._write_event(dict(common, event='message_end',
+                                   metadata={'usage': {'total_tokens': len(body.get('query', ''))}}))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.logger.debug(f"客户端已断开流式连接: {task_id}")
+        finally:
+            self.server.stopped.discard(task_id)
+
+    def _answer(self, body: dict) -> str:
+        """回复内容：固定前缀加用户问题，携带提示词变体输入时标明变体"""
+        variant = body.get('inputs', {}).get(SPECULATIVE_VARIANT_INPUT)
+        prefix = f"[{variant}] " if variant else ""
+        return prefix + self.server.reply_prefix + body.get('query', '')
+
+    def _write_event(self, data: dict):
+        """写入一个SSE事件（一个HTTP分块）"""
+        payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, data: dict):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class MockDifyServer(ThreadingHTTPServer):
+    """在后台线程运行的模拟Dify服务
+
+    回复内容为固定前缀加用户问题，可配置固定延迟以模拟模型生成耗时。
+    流式模式下回复按分块逐步返回，支持停止接口。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 reply_prefix: str = "您好，关于您的问题：",
+                 logger: Optional[logging.Logger] = None):
+        super().__init__((host, port), _MockDifyHandler)
+        self.latency = latency
+        self.reply_prefix = reply_prefix
+        self.stopped = set()  # 收到停止请求的流式任务ID
+        self.logger = logger or logging.getLogger(__name__)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """模拟服务的API基础URL（可直接用作DIFY_BASE_URL）"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockDifyServer":
+        """在后台线程启动服务"""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-dify", daemon=True)
+        self._thread.start()
+        self.logger.info(f"模拟Dify服务已启动: {self.base_url}")
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self.shutdown()
+        self.server_close()
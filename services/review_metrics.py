@@ -0,0 +1,384 @@
+"""监督审核效率指标服务"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+from services.audit_log import AUDIT_EVENT_DRAFT, AUDIT_EVENT_APPROVE, AUDIT_EVENT_REJECT
+from services.event_bus import Event, EventBus, EVENT_DRAFT_READY, EVENT_APPROVED, EVENT_REJECTED
+from utils.constants import (
+    METRICS_HISTORY_BUCKET_SECONDS, METRICS_LATENCY_BINS, METRICS_LATENCY_GROWTH,
+    METRICS_LATENCY_MIN_SECONDS, METRICS_OPEN_REVIEW_TTL, METRICS_RETENTION_DAYS,
+    METRICS_WINDOW_SLOTS, METRICS_WINDOWS
+)
+
+REVIEW_APPROVED = "approved"
+REVIEW_REJECTED = "rejected"
+
+def latency_bin(seconds: float) -> int:
+    """审核耗时所在的直方图分桶（按对数等比划分）"""
+    if seconds <= METRICS_LATENCY_MIN_SECONDS:
+        return 0
+    index = int(math.log(seconds / METRICS_LATENCY_MIN_SECONDS, METRICS_LATENCY_GROWTH)) + 1
+    return min(index, METRICS_LATENCY_BINS - 1)
+
+def bin_upper_bound(index: int) -> float:
+    """直方图分桶的上界（秒）"""
+    return METRICS_LATENCY_MIN_SECONDS * METRICS_LATENCY_GROWTH ** index
+
+@dataclass
+class ReviewCounters:
+    """一个时间桶内的审核计数（可相加、相减）"""
+    drafts: int = 0
+    approved: int = 0
+    edited: int = 0
+    rejected: int = 0
+    latency_count: int = 0
+    latency_sum: float = 0.0
+    latency_bins: List[int] = field(default_factory=lambda: [0] * METRICS_LATENCY_BINS)
+    reviewers: Dict[str, int] = field(default_factory=dict)
+    queue_peak: int = 0  # 桶内最大队列深度（不参与加减）
+
+    @property
+    def reviews(self) -> int:
+        return self.approved + self.rejected
+
+    def count_draft(self, depth: int):
+        """累加一条草稿并记录队列深度"""
+        self.drafts += 1
+        self.queue_peak = max(self.queue_peak, depth)
+
+    def count_review(self, status: str, reviewer: str, edited: bool, latency: Optional[float],
+                     depth: int):
+        """累加一次审核结果并记录队列深度"""
+        if status == REVIEW_APPROVED:
+            self.approved += 1
+            self.edited += int(edited)
+        else:
+            self.rejected += 1
+        self.reviewers[reviewer] = self.reviewers.get(reviewer, 0) + 1
+        if latency is not None and latency >= 0:
+            self.latency_count += 1
+            self.latency_sum += latency
+            self.latency_bins[latency_bin(latency)] += 1
+        self.queue_peak = max(self.queue_peak, depth)
+
+    def merge(self, other: 'ReviewCounters', sign: int = 1):
+        """累加（sign=-1时扣除）另一个桶的计数"""
+        self.drafts += sign * other.drafts
+        self.approved += sign * other.approved
+        self.edited += sign * other.edited
+        self.rejected += sign * other.rejected
+        self.latency_count += sign * other.latency_count
+        self.latency_sum += sign * other.latency_sum
+        for index, count in enumerate(other.latency_bins):
+            if count:
+                self.latency_bins[index] += sign * count
+        for reviewer, count in other.reviewers.items():
+            remaining = self.reviewers.get(reviewer, 0) + sign * count
+            if remaining:
+                self.reviewers[reviewer] = remaining
+            else:
+                self.reviewers.pop(reviewer, None)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """审核耗时分位数（取所在分桶的上界，相对误差不超过分桶增长率）"""
+        if self.latency_count <= 0:
+            return None
+        target = fraction * self.latency_count
+        seen = 0
+        for index, count in enumerate(self.latency_bins):
+            seen += count
+            if seen >= target:
+                return bin_upper_bound(index)
+        return bin_upper_bound(METRICS_LATENCY_BINS - 1)
+
+class RollingWindow:
+    """滑动时间窗口
+
+    窗口划分为固定数量的槽（环形数组），每个事件只更新所在槽和窗口总计；
+    时间前进时把过期的槽从总计中扣除后清空。每个槽只会过期一次，
+    单次更新的均摊代价为O(1)，与历史数据量无关。
+    """
+
+    def __init__(self, span: float, slots: int = METRICS_WINDOW_SLOTS):
+        self.span = span
+        self.slot_seconds = span / slots
+        self.slots: List[Optional[ReviewCounters]] = [None] * slots
+        self.slot_numbers = [-1] * slots
+        self.total = ReviewCounters()
+        self._current = -1
+
+    def _advance(self, number: int):
+        """前进到第number个槽，扣除其间过期的槽"""
+        if number <= self._current:
+            return
+        start = max(self._current + 1, number - len(self.slots) + 1)
+        for expired in range(start, number + 1):
+            position = expired % len(self.slots)
+            if self.slots[position] is not None:
+                self.total.merge(self.slots[position], -1)
+                self.slots[position] = None
+            self.slot_numbers[position] = expired
+        self._current = number
+
+    def _slot(self, timestamp: float) -> Optional[ReviewCounters]:
+        """获取时间所在的槽（早于窗口的时间返回None）"""
+        number = int(timestamp // self.slot_seconds)
+        self._advance(number)
+        position = number % len(self.slots)
+        if self.slot_numbers[position] != number:
+            return None
+        if self.slots[position] is None:
+            self.slots[position] = ReviewCounters()
+        return self.slots[position]
+
+    def count_draft(self, timestamp: float, depth: int):
+        """累加一条草稿"""
+        slot = self._slot(timestamp)
+        if slot is not None:
+            slot.count_draft(depth)
+            self.total.count_draft(depth)
+
+    def count_review(self, timestamp: float, status: str, reviewer: str, edited: bool,
+                     latency: Optional[float], depth: int):
+        """累加一次审核结果"""
+        slot = self._slot(timestamp)
+        if slot is not None:
+            slot.count_review(status, reviewer, edited, latency, depth)
+            self.total.count_review(status, reviewer, edited, latency, depth)
+
+    def snapshot(self, now: float) -> ReviewCounters:
+        """截至now的窗口总计（queue_peak为窗口内各槽的最大值）"""
+        self._advance(int(now // self.slot_seconds))
+        total = ReviewCounters()
+        total.merge(self.total)
+        total.queue_peak = max((slot.queue_peak for slot in self.slots if slot is not None), default=0)
+        return total
+
+@dataclass
+class MetricsSnapshot:
+    """一个时间窗口内的审核指标"""
+    window_seconds: float
+    drafts: int
+    approved: int
+    edited: int
+    rejected: int
+    latency_p50: Optional[float]
+    latency_p90: Optional[float]
+    latency_p99: Optional[float]
+    latency_mean: Optional[float]
+    queue_depth: int
+    queue_peak: int
+    throughput: Dict[str, float]  # 审核人 -> 每小时审核数
+
+    @property
+    def reviews(self) -> int:
+        return self.approved + self.rejected
+
+    @property
+    def approval_rate(self) -> float:
+        """批准数占审核数的比例"""
+        return self.approved / self.reviews if self.reviews else 0.0
+
+    @property
+    def edit_rate(self) -> float:
+        """修改后批准占批准数的比例"""
+        return self.edited / self.approved if self.approved else 0.0
+
+    @property
+    def reject_rate(self) -> float:
+        """拒绝数占审核数的比例"""
+        return self.rejected / self.reviews if self.reviews else 0.0
+
+class ReviewMetrics:
+    """监督审核效率指标引擎
+
+    订阅草稿生成、批准、拒绝事件增量汇总（启动时可从审计日志回填），
+    同时维护若干滑动窗口（如最近1小时、24小时、7天）和按小时的历史桶。
+    每个事件只更新所在的槽和桶，看板读取的都是汇总后的计数，耗时与历史数据量无关。
+    """
+
+    def __init__(self, windows: Optional[Dict[str, float]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.windows = {name: RollingWindow(span) for name, span in (windows or METRICS_WINDOWS).items()}
+        self.history: Dict[int, ReviewCounters] = {}
+        self._open: 'OrderedDict[str, float]' = OrderedDict()  # 待审核ID -> 草稿生成时间
+        self._lock = threading.Lock()
+        self._subscription: Optional[int] = None
+
+    def _history_bucket(self, timestamp: float) -> ReviewCounters:
+        """时间所在的小时桶，超出保留期的桶随之删除（需在锁内调用）"""
+        hour = int(timestamp // METRICS_HISTORY_BUCKET_SECONDS)
+        bucket = self.history.get(hour)
+        if bucket is None:
+            bucket = self.history[hour] = ReviewCounters()
+            oldest = hour - METRICS_RETENTION_DAYS * 86400 // METRICS_HISTORY_BUCKET_SECONDS
+            for expired in [key for key in self.history if key < oldest]:
+                del self.history[expired]
+        return bucket
+
+    def _queue_depth(self, now: float) -> int:
+        """当前队列深度（需在锁内调用）
+
+        长时间未处理的待审核项（如会话已清空或过期）不再计入队列。
+        """
+        while self._open:
+            created = next(iter(self._open.values()))
+            if created >= now - METRICS_OPEN_REVIEW_TTL:
+                break
+            self._open.popitem(last=False)
+        return len(self._open)
+
+    def queue_depth(self) -> int:
+        """当前待审核队列深度"""
+        with self._lock:
+            return self._queue_depth(time.time())
+
+    def record_draft(self, review_id: str, timestamp: Optional[float] = None):
+        """记录一条进入审核队列的草稿
+
+        Args:
+            review_id: 待审核消息ID
+            timestamp: 草稿生成时间（默认当前时间）
+        """
+        timestamp = timestamp or time.time()
+        with self._lock:
+            self._open[review_id] = timestamp
+            depth = self._queue_depth(timestamp)
+            for window in self.windows.values():
+                window.count_draft(timestamp, depth)
+            self._history_bucket(timestamp).count_draft(depth)
+
+    def record_review(self, status: str, review_id: str, reviewer: Optional[str] = None,
+                      edited: bool = False, latency: Optional[float] = None,
+                      timestamp: Optional[float] = None):
+        """记录一次审核结果
+
+        Args:
+            status: approved/rejected
+            review_id: 待审核消息ID
+            reviewer: 审核人
+            edited: 是否修改后批准
+            latency: 从草稿生成到审核完成的秒数（默认按记录的草稿时间计算）
+            timestamp: 审核时间（默认当前时间）
+        """
+        timestamp = timestamp or time.time()
+        reviewer = reviewer or "unknown"
+        with self._lock:
+            created = self._open.pop(review_id, None)
+            if latency is None and created is not None:
+                latency = timestamp - created
+            depth = self._queue_depth(timestamp)
+            for window in self.windows.values():
+                window.count_review(timestamp, status, reviewer, edited, latency, depth)
+            self._history_bucket(timestamp).count_review(status, reviewer, edited, latency, depth)
+
+    def attach(self, event_bus: EventBus):
+        """订阅事件总线，增量汇总审核事件"""
+        self._subscription = event_bus.subscribe(
+            self._on_event, [EVENT_DRAFT_READY, EVENT_APPROVED, EVENT_REJECTED]
+        )
+
+    def _on_event(self, event: Event):
+        data = event.data
+        if event.event_type == EVENT_DRAFT_READY:
+            self.record_draft(data['pending_id'], event.timestamp)
+        elif event.event_type == EVENT_APPROVED:
+            self.record_review(REVIEW_APPROVED, data['message']['id'], data.get('reviewer'),
+                               data.get('edited', False), data.get('review_seconds'), event.timestamp)
+        else:
+            self.record_review(REVIEW_REJECTED, data['pending_id'], data.get('reviewer'),
+                               latency=data.get('review_seconds'), timestamp=event.timestamp)
+
+    def backfill(self, events: Iterable[Dict[str, Any]]) -> int:
+        """从审计日志回填
+
+        Args:
+            events: 审计记录（按时间顺序，如AuditLog.scan的结果）
+
+        Returns:
+            回填的审核事件数
+        """
+        start = time.perf_counter()
+        count = 0
+        for event in events:
+            kind = event['event']
+            if kind == AUDIT_EVENT_DRAFT:
+                self.record_draft(event['message_id'], event['ts'])
+            elif kind in (AUDIT_EVENT_APPROVE, AUDIT_EVENT_REJECT):
+                self.record_review(REVIEW_APPROVED if kind == AUDIT_EVENT_APPROVE else REVIEW_REJECTED,
+                                   event['message_id'], event.get('reviewer'), event.get('edited', False),
+                                   event.get('review_seconds'), event['ts'])
+            else:
+                continue
+            count += 1
+        self.logger.info(f"审核指标回填 {count} 条记录，耗时 {time.perf_counter() - start:.2f}s")
+        return count
+
+    def snapshot(self, window: str, now: Optional[float] = None) -> MetricsSnapshot:
+        """获取滑动窗口内的指标
+
+        Args:
+            window: 窗口名称（METRICS_WINDOWS中的键）
+            now: 当前时间（默认当前时间）
+
+        Returns:
+            指标快照
+        """
+        now = now or time.time()
+        rolling = self.windows[window]
+        with self._lock:
+            total = rolling.snapshot(now)
+            depth = self._queue_depth(now)
+        hours = rolling.span / 3600
+        return MetricsSnapshot(
+            window_seconds=rolling.span,
+            drafts=total.drafts,
+            approved=total.approved,
+            edited=total.edited,
+            rejected=total.rejected,
+            latency_p50=total.percentile(0.5),
+            latency_p90=total.percentile(0.9),
+            latency_p99=total.percentile(0.99),
+            latency_mean=total.latency_sum / total.latency_count if total.latency_count else None,
+            queue_depth=depth,
+            queue_peak=max(total.queue_peak, depth),
+            throughput={reviewer: count / hours for reviewer, count in
+                        sorted(total.reviewers.items(), key=lambda item: item[1], reverse=True)}
+        )
+
+    def timeseries(self, days: int = 7, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """按小时的历史指标
+
+        Args:
+            days: 最近的天数
+            now: 当前时间（默认当前时间）
+
+        Returns:
+            按时间升序的每小时指标（没有事件的小时省略）
+        """
+        now = now or time.time()
+        since = int((now - days * 86400) // METRICS_HISTORY_BUCKET_SECONDS)
+        with self._lock:
+            buckets = sorted(((hour, bucket) for hour, bucket in self.history.items() if hour >= since),
+                             key=lambda item: item[0])
+            return [
+                {
+                    'hour': hour * METRICS_HISTORY_BUCKET_SECONDS,
+                    'drafts': bucket.drafts,
+                    'approved': bucket.approved,
+                    'edited': bucket.edited,
+                    'rejected': bucket.rejected,
+                    'latency_p90': bucket.percentile(0.9),
+                    'queue_peak': bucket.queue_peak,
+                }
+                for hour, bucket in buckets
+            ]
+
+    def stats(self) -> Dict[str, int]:
+        """获取引擎统计"""
+        with self._lock:
+            return {'open_reviews': len(self._open), 'history_buckets': len(self.history)}
@@ -0,0 +1,503 @@
+"""对话历史全文检索服务"""
+import logging
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from services.event_bus import Event, EventBus, EVENT_MESSAGE_ADDED, EVENT_APPROVED
+from utils.constants import (
+    BM25_B, BM25_K1, SEARCH_MAX_CANDIDATES, SEARCH_RESULT_LIMIT, SEARCH_SNIPPET_CHARS
+)
+
+# 中文字符串、英文单词/数字
+_TOKEN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+')
+
+# 查询语法：字段过滤（sender:user）和带引号的短语
+_FIELD_PATTERN = re.compile(r'\b(sender|status|session|after|before):(\S+)')
+_PHRASE_PATTERN = re.compile(r'"([^"]+)"|“([^”]+)”')
+
+def _is_cjk(token: str) -> bool:
+    return token[0] >= '\u3400'
+
+def tokenize(text: str, unigrams: bool = False) -> List[str]:
+    """切分检索词元
+
+    中文按字符二元组（bigram）切分，不依赖分词词典；英文单词和数字整体作为词元。
+
+    Args:
+        text: 文本
+        unigrams: 是否同时输出中文单字（建索引时开启，使单字查询也能命中）
+
+    Returns:
+        词元列表（含重复，用于统计词频）
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if not _is_cjk(run):
+            tokens.append(run)
+            continue
+        if len(run) == 1 or unigrams:
+            tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class InvertedIndex:
+    """增量倒排索引（BM25排序）
+
+    文档编号按加入顺序递增，每个词元的倒排表是按编号有序的紧凑数组（编号、词频），
+    新文档只需在相关倒排表末尾追加。多词查询默认按AND语义求交集：从最短的倒排表出发，
+    在其余倒排表中批量二分查找，交集和BM25打分都用numpy向量化计算，
+    代价由最稀有的词元决定；也可按OR语义取并集（相似问题检索）。调用方需要逐条校验（如短语）时，只从最新的文档起评估
+    max_candidates条候选。
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths = array('I')
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, tokens: List[str]) -> int:
+        """加入文档
+
+        Args:
+            tokens: 文档词元（含重复）
+
+        Returns:
+            文档编号
+        """
+        counts = Counter(tokens)
+        with self._lock:
+            doc_id = len(self._lengths)
+            for token, count in counts.items():
+                posting = self._postings.get(token)
+                if posting is None:
+                    posting = self._postings[token] = (array('I'), array('H'))
+                posting[0].append(doc_id)
+                posting[1].append(min(count, 0xFFFF))
+            self._lengths.append(len(tokens))
+            self._total_length += len(tokens)
+        return doc_id
+
+    def search(self, tokens: Iterable[str], mask: Optional[Callable[[Any], Any]] = None,
+               accept: Optional[Callable[[int], bool]] = None, limit: int = SEARCH_RESULT_LIMIT,
+               max_candidates: int = SEARCH_MAX_CANDIDATES,
+               match_all: bool = True) -> Tuple[List[Tuple[float, int]], int, bool]:
+        """检索包含全部（或任一）词元的文档
+
+        Args:
+            tokens: 查询词元
+            mask: 向量化过滤函数（文档编号数组 -> 布尔数组，如字段过滤）
+            accept: 逐条过滤函数（文档编号 -> 是否保留，如短语校验）
+            limit: 返回的文档数
+            max_candidates: 使用accept时最多评估的候选文档数
+            match_all: True为AND语义，False为OR语义（忽略索引中不存在的词元）
+
+        Returns:
+            ([(得分, 文档编号)]按得分降序, 命中数, 是否因候选数上限而截断)
+        """
+        terms = list(dict.fromkeys(tokens))
+        with self._lock:
+            postings = [self._postings.get(term) for term in terms]
+            if not match_all:
+                postings = [posting for posting in postings if posting is not None]
+            if not postings or any(posting is None for posting in postings):
+                return [], 0, False
+            # numpy视图引用底层数组期间不能追加，整个计算在锁内完成，只返回普通对象
+            return self._rank(postings, mask, accept, limit, max_candidates, match_all)
+
+    def _rank(self, postings: List[Tuple[array, array]], mask: Optional[Callable[[Any], Any]],
+              accept: Optional[Callable[[int], bool]], limit: int, max_candidates: int,
+              match_all: bool = True) -> Tuple[List[Tuple[float, int]], int, bool]:
+        """求交集（或并集）并按BM25排序（需在锁内调用）"""
+        import numpy as np
+
+        doc_count = len(self._lengths)
+        avg_length = self._total_length / doc_count
+        k1, b = self.k1, self.b
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+        views = sorted(
+            ((np.frombuffer(docs, dtype=np.uint32), np.frombuffer(tfs, dtype=np.uint16))
+             for docs, tfs in postings),
+            key=lambda view: len(view[0])
+        )
+        idfs = [math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5)) for docs, _ in views]
+
+        def term_scores(docs, tfs, idf):
+            tf = tfs.astype(np.float64)
+            return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[docs] / avg_length))
+
+        if match_all:
+            candidates = views[0][0].copy()
+            scores = term_scores(views[0][0], views[0][1], idfs[0])
+            for (docs, tfs), idf in zip(views[1:], idfs[1:]):
+                positions = np.searchsorted(docs, candidates)
+                positions[positions == len(docs)] = 0
+                hit = docs[positions] == candidates
+                candidates = candidates[hit]
+                scores = scores[hit] + term_scores(candidates, tfs[positions[hit]], idf)
+                if not len(candidates):
+                    return [], 0, False
+        else:
+            # 并集：在稠密数组上按倒排表累加得分，代价与倒排表总长成正比，不需要排序
+            dense = np.zeros(doc_count)
+            for (docs, tfs), idf in zip(views, idfs):
+                dense[docs] += term_scores(docs, tfs, idf)
+            candidates = np.flatnonzero(dense)
+            scores = dense[candidates]
+
+        if mask is not None:
+            keep = mask(candidates)
+            candidates = candidates[keep]
+            scores = scores[keep]
+
+        truncated = False
+        if accept is not None:
+            # 从最新的文档开始逐条校验
+            selected = []
+            for position in range(len(candidates) - 1, -1, -1):
+                if accept(int(candidates[position])):
+                    selected.append(position)
+                    if len(selected) >= max_candidates:
+                        truncated = position > 0
+                        break
+            selected.reverse()
+            candidates = candidates[selected]
+            scores = scores[selected]
+
+        total = len(candidates)
+        if not total:
+            return [], 0, truncated
+
+        if total > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(total)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(float(scores[i]), int(candidates[i])) for i in top], total, truncated
+
+    def stats(self) -> Dict[str, int]:
+        """获取索引统计"""
+        with self._lock:
+            return {
+                'documents': len(self._lengths),
+                'terms': len(self._postings),
+                'postings': sum(len(docs) for docs, _ in self._postings.values()),
+            }
+
+@dataclass
+class IndexedMessage:
+    """已索引的消息"""
+    message_id: str
+    session_id: str
+    sender: str
+    status: str
+    timestamp: float
+    content: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'message_id': self.message_id,
+            'session_id': self.session_id,
+            'sender': self.sender,
+            'status': self.status,
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(),
+            'content': self.content,
+        }
+
+@dataclass
+class SearchQuery:
+    """检索条件"""
+    text: str = ""
+    phrases: List[str] = field(default_factory=list)
+    sender: Optional[str] = None
+    status: Optional[str] = None
+    session_id: Optional[str] = None
+    since: Optional[float] = None
+    until: Optional[float] = None
+
+    @classmethod
+    def parse(cls, query: str) -> 'SearchQuery':
+        """解析查询字符串
+
+        支持"带引号的短语"，以及字段过滤 sender:user、status:sent、session:会话ID前缀、
+        after:2024-01-01、before:2024-01-31（日期按当天整天计算）。
+
+        Args:
+            query: 查询字符串
+
+        Returns:
+            检索条件
+        """
+        parsed = cls()
+        for name, value in _FIELD_PATTERN.findall(query):
+            if name == 'after':
+                parsed.since = datetime.fromisoformat(value).timestamp()
+            elif name == 'before':
+                until = datetime.fromisoformat(value)
+                if len(value) <= 10:
+                    until = until.replace(hour=23, minute=59, second=59)
+                parsed.until = until.timestamp()
+            elif name == 'session':
+                parsed.session_id = value
+            else:
+                setattr(parsed, name, value)
+        query = _FIELD_PATTERN.sub(' ', query)
+        parsed.phrases = [first or second for first, second in _PHRASE_PATTERN.findall(query)]
+        parsed.text = _PHRASE_PATTERN.sub(' ', query).strip()
+        return parsed
+
+    def tokens(self) -> List[str]:
+        """查询词元（自由文本和短语）"""
+        return tokenize(" ".join([self.text] + self.phrases))
+
+    def has_filters(self) -> bool:
+        """是否包含字段过滤条件"""
+        return any(value is not None for value in
+                   (self.sender, self.status, self.session_id, self.since, self.until))
+
+@dataclass
+class SearchHit:
+    """检索结果"""
+    message: IndexedMessage
+    score: float
+    snippet: str
+
+@dataclass
+class SearchResult:
+    """一次检索的结果"""
+    hits: List[SearchHit]
+    total: int
+    truncated: bool
+    elapsed_ms: float
+
+class MessageSearchIndex:
+    """对话历史全文检索
+
+    订阅事件总线，用户消息新增和回复批准时增量加入索引（接入事件代理时也包含其他进程的
+    消息）；启动时可从审计日志回填历史消息（含草稿和被拒绝的回复）。同一条消息
+    （消息ID+状态）只索引一次。发送者、状态、时间另存为按文档编号排列的紧凑数组，
+    字段过滤与倒排表交集一起向量化计算。
+    """
+
+    def __init__(self):
+        self.index = InvertedIndex()
+        self.logger = logging.getLogger(__name__)
+        self._messages: List[IndexedMessage] = []
+        self._keys: Dict[Tuple[str, str], int] = {}
+        self._codes: Dict[str, int] = {}
+        self._session_codes: Dict[str, int] = {}
+        self._sessions = array('I')
+        self._senders = array('B')
+        self._statuses = array('B')
+        self._timestamps = array('d')
+        self._lock = threading.Lock()
+        self._subscription: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def _code(self, value: str) -> int:
+        """发送者/状态取值的编码（需在锁内调用）"""
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._codes) + 1
+        return code
+
+    def add(self, message_id: str, session_id: str, sender: str, status: str,
+            timestamp: Any, content: str) -> bool:
+        """加入一条消息
+
+        Args:
+            message_id: 消息ID
+            session_id: 会话ID
+            sender: 发送者（user/assistant）
+            status: 状态（sent/draft/rejected）
+            timestamp: 时间（ISO字符串、datetime或时间戳）
+            content: 消息内容
+
+        Returns:
+            是否新加入（已索引过时返回False）
+        """
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        tokens = tokenize(content, unigrams=True)
+        key = (message_id, status)
+        with self._lock:
+            if key in self._keys:
+                return False
+            # 文档编号与消息列表下标一致（加入顺序在锁内保证）
+            self._keys[key] = len(self._messages)
+            self._messages.append(IndexedMessage(message_id, session_id, sender, status,
+                                                 float(timestamp), content))
+            self._sessions.append(self._session_codes.setdefault(session_id, len(self._session_codes)))
+            self._senders.append(self._code(sender))
+            self._statuses.append(self._code(status))
+            self._timestamps.append(float(timestamp))
+            self.index.add(tokens)
+        return True
+
+    def add_record(self, record: Dict[str, Any]) -> bool:
+        """加入一条导出记录（conversation_export的记录格式）"""
+        return self.add(record['message_id'], record['conversation_id'], record['sender'],
+                        record['status'], record['timestamp'], record['content'])
+
+    def backfill(self, records: Iterable[Dict[str, Any]]) -> int:
+        """批量回填历史消息
+
+        Args:
+            records: 导出记录（如iter_audit_messages的结果）
+
+        Returns:
+            新加入的消息数
+        """
+        start = time.perf_counter()
+        added = sum(1 for record in records if record['content'] and self.add_record(record))
+        self.logger.info(f"检索索引回填 {added} 条消息，耗时 {time.perf_counter() - start:.2f}s")
+        return added
+
+    def attach(self, event_bus: EventBus):
+        """订阅事件总线，增量索引新消息"""
+        self._subscription = event_bus.subscribe(self._on_event, [EVENT_MESSAGE_ADDED, EVENT_APPROVED])
+
+    def _on_event(self, event: Event):
+        message = event.data['message']
+        self.add(message['id'], event.session_id, message['sender'], message['status'],
+                 message['timestamp'], message['content'])
+
+    def search(self, query: Any, limit: int = SEARCH_RESULT_LIMIT) -> SearchResult:
+        """检索消息
+
+        Args:
+            query: 查询字符串或SearchQuery
+            limit: 最多返回的结果数
+
+        Returns:
+            检索结果（按BM25得分降序；只有过滤条件时按时间倒序）
+        """
+        start = time.perf_counter()
+        if isinstance(query, str):
+            query = SearchQuery.parse(query)
+        tokens = query.tokens()
+
+        with self._lock:
+            if tokens:
+                ranked, total, truncated = self.index.search(
+                    tokens, self._field_mask(query), self._accept(query), limit
+                )
+                messages = [(self._messages[doc_id], score) for score, doc_id in ranked]
+            elif query.has_filters():
+                messages, total, truncated = self._browse(query, limit)
+            else:
+                messages, total, truncated = [], 0, False
+
+        hits = [SearchHit(message, score, self._snippet(message.content, query))
+                for message, score in messages]
+        return SearchResult(hits, total, truncated, (time.perf_counter() - start) * 1000)
+
+    def _field_mask(self, query: SearchQuery) -> Optional[Callable[[Any], Any]]:
+        """会话/发送者/状态/时间过滤的向量化函数（需在锁内调用）"""
+        conditions = []
+        if query.session_id:
+            # 会话ID前缀先换算成会话编号集合，再按编号批量过滤
+            codes = [code for session_id, code in self._session_codes.items()
+                     if session_id.startswith(query.session_id)]
+            conditions.append((self._sessions, 'I', 'in', codes))
+        for name, column in (('sender', self._senders), ('status', self._statuses)):
+            value = getattr(query, name)
+            if value is not None:
+                conditions.append((column, 'B', '==', self._codes.get(value, -1)))
+        if query.since is not None:
+            conditions.append((self._timestamps, 'd', '>=', query.since))
+        if query.until is not None:
+            conditions.append((self._timestamps, 'd', '<=', query.until))
+        if not conditions:
+            return None
+
+        def mask(doc_ids):
+            import numpy as np
+
+            keep = np.ones(len(doc_ids), dtype=bool)
+            dtypes = {'B': np.uint8, 'I': np.uint32, 'd': np.float64}
+            for column, typecode, op, value in conditions:
+                values = np.frombuffer(column, dtype=dtypes[typecode])[doc_ids]
+                if op == 'in':
+                    keep &= np.isin(values, value)
+                elif op == '==':
+                    keep &= values == value
+                elif op == '>=':
+                    keep &= values >= value
+                else:
+                    keep &= values <= value
+            return keep
+
+        return mask
+
+    def _accept(self, query: SearchQuery) -> Optional[Callable[[int], bool]]:
+        """短语的逐条校验函数（需在锁内调用）"""
+        if not query.phrases:
+            return None
+        messages = self._messages
+        phrases = [phrase.lower() for phrase in query.phrases]
+
+        def accept(doc_id: int) -> bool:
+            content = messages[doc_id].content.lower()
+            return all(phrase in content for phrase in phrases)
+
+        return accept
+
+    def _browse(self, query: SearchQuery,
+                limit: int) -> Tuple[List[Tuple[IndexedMessage, float]], int, bool]:
+        """只有过滤条件时列出最新的消息（需在锁内调用）"""
+        import numpy as np
+
+        doc_ids = np.arange(len(self._messages))
+        mask = self._field_mask(query)
+        if mask is not None:
+            doc_ids = doc_ids[mask(doc_ids)]
+        accept = self._accept(query)
+        if accept is None:
+            latest = doc_ids[::-1][:limit]
+            return [(self._messages[int(doc_id)], 0.0) for doc_id in latest], len(doc_ids), False
+
+        selected = []
+        total = 0
+        for position in range(len(doc_ids) - 1, -1, -1):
+            doc_id = int(doc_ids[position])
+            if not accept(doc_id):
+                continue
+            total += 1
+            if len(selected) < limit:
+                selected.append((self._messages[doc_id], 0.0))
+            if total >= SEARCH_MAX_CANDIDATES:
+                return selected, total, position > 0
+        return selected, total, False
+
+    @staticmethod
+    def _snippet(content: str, query: SearchQuery) -> str:
+        """截取命中位置附近的片段"""
+        lowered = content.lower()
+        positions = [lowered.find(term) for term in query.phrases + query.tokens()]
+        positions = [position for position in positions if position >= 0]
+        if not positions or len(content) <= SEARCH_SNIPPET_CHARS * 2:
+            return content[:SEARCH_SNIPPET_CHARS * 2]
+        start = max(0, min(positions) - SEARCH_SNIPPET_CHARS // 2)
+        end = start + SEARCH_SNIPPET_CHARS * 2
+        return ("…" if start else "") + content[start:end] + ("…" if end < len(content) else "")
+
+    def stats(self) -> Dict[str, int]:
+        """获取索引统计"""
+        return {'messages': len(self._messages), **self.index.stats()}
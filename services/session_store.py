@@ -0,0 +1,357 @@
+"""多会话状态存储服务"""
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from services.state_backend import StateBackend
+from utils.constants import SESSION_TOUCH_INTERVAL
+
+SESSION_ROLE_CUSTOMER = "customer"
+SESSION_ROLE_SUPERVISOR = "supervisor"
+
+# 有待审核回复的会话不会因空闲被驱逐或过期，避免监督者正在处理的草稿丢失
+_PINNED_STATE_KEY = "pending_review"
+
+class SessionState(dict):
+    """单个会话的状态
+
+    与st.session_state一样支持属性和键两种访问方式，StateManager可以无差别地
+    使用二者。会话元数据（ID、角色、Dify用户标识等）保存在槽属性中，不计入状态键。
+    配置了共享状态后端时，本对象是后端文档的本地副本：refresh()按版本号重新读取，
+    commit()以读到的版本号做比较并交换写回，touch()把访问时间同步到后端。
+    """
+
+    __slots__ = ('session_id', 'role', 'dify_user', 'created_at', 'last_access', 'touched_at',
+                 'memory_bytes', 'lock', 'backend', 'version', 'stored_state')
+
+    def __init__(self, session_id: str, role: str = SESSION_ROLE_CUSTOMER,
+                 dify_user: Optional[str] = None, backend: Optional[StateBackend] = None):
+        super().__init__()
+        now = time.time()
+        object.__setattr__(self, 'session_id', session_id)
+        object.__setattr__(self, 'role', role)
+        object.__setattr__(self, 'dify_user', dify_user or f"{role}-{session_id}")
+        object.__setattr__(self, 'created_at', now)
+        object.__setattr__(self, 'last_access', now)
+        object.__setattr__(self, 'touched_at', 0.0)
+        object.__setattr__(self, 'memory_bytes', 0)
+        object.__setattr__(self, 'lock', threading.RLock())
+        object.__setattr__(self, 'backend', backend)
+        object.__setattr__(self, 'version', 0)
+        object.__setattr__(self, 'stored_state', None)
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name: str, value: Any):
+        if name in SessionState.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            self[name] = value
+
+    def __delattr__(self, name: str):
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def is_pinned(self) -> bool:
+        """会话是否有待审核回复"""
+        return self.get(_PINNED_STATE_KEY) is not None
+
+    def touch(self, now: Optional[float] = None):
+        """把访问时间同步到共享后端（间隔不足SESSION_TOUCH_INTERVAL时跳过）
+
+        Args:
+            now: 访问时间戳（默认time.time()）
+        """
+        now = now or time.time()
+        if self.backend is None or now - self.touched_at < SESSION_TOUCH_INTERVAL:
+            return
+        self.backend.touch(self.session_id, now)
+        self.touched_at = now
+
+    def refresh(self, force: bool = False) -> bool:
+        """从共享后端重新读取状态（版本号未变时不读取）
+
+        Args:
+            force: 不比较版本号，强制重新读取
+
+        Returns:
+            本地状态是否被替换
+        """
+        if self.backend is None:
+            return False
+        if not force and self.backend.version(self.session_id) == self.version:
+            return False
+        stored = self.backend.load(self.session_id)
+        with self.lock:
+            self.clear()
+            if stored is None:
+                self.version = 0
+                self.stored_state = None
+            else:
+                self.update(json.loads(stored.state))
+                self.role = stored.role
+                self.dify_user = stored.dify_user
+                self.version = stored.version
+                self.stored_state = stored.state
+        return True
+
+    def commit(self) -> bool:
+        """把本地状态写回共享后端（内容未变时不写入）
+
+        Returns:
+            是否写入成功；False表示其他副本已修改该会话，需要refresh后重试
+        """
+        if self.backend is None:
+            return True
+        with self.lock:
+            state = json.dumps(dict(self), ensure_ascii=False, separators=(',', ':'))
+            if state == self.stored_state:
+                return True
+            version = self.backend.save(self.session_id, self.role, self.dify_user, state, self.version,
+                                        pinned=self.is_pinned())
+            if version is None:
+                return False
+            self.version = version
+            self.stored_state = state
+            self.touched_at = time.time()
+        return True
+
+def estimate_size(value: Any) -> int:
+    """估算对象占用的内存（字节），递归统计容器内的字符串等对象
+
+    Args:
+        value: 任意对象
+
+    Returns:
+        估算的字节数
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+class SessionStore:
+    """进程内共享的多会话存储
+
+    保存同一进程内所有客户会话和监督者会话的状态，按最近访问顺序维护，
+    支持空闲会话驱逐和内存上限驱逐，使单个副本可以服务大量并发会话；
+    有待审核回复的会话不会因空闲被驱逐。
+    每个会话有自己的锁，访问不同会话互不阻塞。
+    配置共享状态后端后，本存储只是后端的本地缓存：会话按版本号校验新鲜度，
+    驱逐只丢弃本地副本，其他副本上的监督者看到同一个待审核队列。
+    """
+
+    def __init__(self, idle_timeout: float = 1800, max_sessions: int = 10000,
+                 max_memory_bytes: int = 512 * 1024 * 1024, eviction_interval: float = 30,
+                 backend: Optional[StateBackend] = None):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = max_memory_bytes
+        self.eviction_interval = eviction_interval
+        self.backend = backend
+        self.logger = logging.getLogger(__name__)
+
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_bytes = 0
+        self._last_eviction = time.time()
+        self._evict_listeners: List[Callable[[SessionState], None]] = []
+        self._evicted_total = 0
+
+    def get_or_create(self, session_id: str, role: str = SESSION_ROLE_CUSTOMER,
+                      dify_user: Optional[str] = None) -> SessionState:
+        """获取会话，不存在时创建
+
+        Args:
+            session_id: 会话ID
+            role: 会话角色（customer/supervisor）
+            dify_user: 发送给Dify的用户标识（默认由角色和会话ID生成）
+
+        Returns:
+            会话状态
+        """
+        return self._attach(session_id, role, dify_user, access=True)
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        """获取已存在的会话（不更新访问时间）"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if self.backend is None:
+            return session
+        if session is None:
+            stored = self.backend.load(session_id)
+            if stored is None:
+                return None
+            return self._attach(session_id, stored.role, stored.dify_user, access=False)
+        session.refresh()
+        return session
+
+    def _attach(self, session_id: str, role: str, dify_user: Optional[str], access: bool) -> SessionState:
+        """获取或创建本地会话副本
+
+        Args:
+            session_id: 会话ID
+            role: 会话角色
+            dify_user: Dify用户标识
+            access: 是否记为一次访问（更新本地LRU顺序和后端访问时间）；
+                监督者列出会话等只读查看不算访问，不会让空闲会话一直保留
+        """
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            created = session is None
+            if created:
+                session = SessionState(session_id, role, dify_user, self.backend)
+                self._sessions[session_id] = session
+            elif access:
+                self._sessions.move_to_end(session_id)
+            if access or created:
+                session.last_access = now
+            should_evict = now - self._last_eviction >= self.eviction_interval
+
+        if self.backend is not None:
+            self._sync(session, created)
+            if access:
+                session.touch(now)
+        if should_evict:
+            self.evict()
+        return session
+
+    def _sync(self, session: SessionState, created: bool):
+        """与共享后端同步：已有会话按版本号刷新，新会话不存在于后端时写入"""
+        session.refresh()
+        if created and session.version == 0 and not session.commit():
+            session.refresh(force=True)
+
+    def list_sessions(self, role: Optional[str] = None) -> List[SessionState]:
+        """列出会话（按最近访问倒序）
+
+        Args:
+            role: 只列出指定角色的会话
+
+        Returns:
+            会话列表快照
+        """
+        if self.backend is not None:
+            return self._list_shared(role)
+        with self._lock:
+            sessions = list(self._sessions.values())
+        sessions.reverse()
+        if role is not None:
+            sessions = [session for session in sessions if session.role == role]
+        return sessions
+
+    def _list_shared(self, role: Optional[str]) -> List[SessionState]:
+        """列出共享后端中的会话（只重新读取版本号变化的会话）"""
+        sessions = []
+        for session_id, session_role, version in self.backend.list_sessions(role):
+            with self._lock:
+                session = self._sessions.get(session_id)
+            if session is None:
+                session = self.get(session_id)
+            elif session.version != version:
+                session.refresh()
+            if session is not None:
+                sessions.append(session)
+        return sessions
+
+    def remove(self, session_id: str) -> Optional[SessionState]:
+        """移除会话（同时从共享后端删除）"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._memory_bytes -= session.memory_bytes
+        if self.backend is not None:
+            self.backend.delete(session_id)
+        return session
+
+    def account(self, session: SessionState):
+        """重新统计会话的内存占用（状态变更后调用）
+
+        Args:
+            session: 会话状态
+        """
+        with session.lock:
+            memory_bytes = estimate_size(dict(session))
+        with self._lock:
+            if self._sessions.get(session.session_id) is session:
+                self._memory_bytes += memory_bytes - session.memory_bytes
+            session.memory_bytes = memory_bytes
+
+    def add_evict_listener(self, listener: Callable[[SessionState], None]):
+        """注册会话被驱逐时的回调"""
+        self._evict_listeners.append(listener)
+
+    def evict(self, now: Optional[float] = None) -> List[str]:
+        """驱逐空闲会话，并在超出会话数或内存上限时按最近最少访问驱逐
+
+        Args:
+            now: 当前时间戳（默认time.time()）
+
+        Returns:
+            被驱逐的会话ID列表
+        """
+        now = now or time.time()
+        evicted = []
+        with self._lock:
+            self._last_eviction = now
+            # OrderedDict按访问顺序排列，最久未访问的在前
+            for session_id, session in list(self._sessions.items()):
+                idle = now - session.last_access >= self.idle_timeout
+                over_count = len(self._sessions) > self.max_sessions
+                over_memory = self._memory_bytes > self.max_memory_bytes
+                if not (idle or over_count or over_memory):
+                    break
+                if not (over_count or over_memory) and session.is_pinned():
+                    continue
+                del self._sessions[session_id]
+                self._memory_bytes -= session.memory_bytes
+                evicted.append(session)
+            self._evicted_total += len(evicted)
+
+        # 共享后端中长时间没有访问且没有待审核回复的会话视为空闲，由任一副本清理
+        if self.backend is not None:
+            self.backend.expire(now - self.idle_timeout)
+
+        for session in evicted:
+            for listener in self._evict_listeners:
+                try:
+                    listener(session)
+                except Exception as e:
+                    self.logger.error(f"会话驱逐回调失败: {e}")
+        if evicted:
+            self.logger.info(f"已驱逐 {len(evicted)} 个会话")
+        return [session.session_id for session in evicted]
+
+    def stats(self) -> Dict[str, int]:
+        """获取存储统计
+
+        Returns:
+            会话数、各角色会话数（共享后端时为所有副本的会话）、本地内存占用、累计驱逐数
+        """
+        with self._lock:
+            roles = [session.role for session in self._sessions.values()]
+            memory_bytes = self._memory_bytes
+            evicted_total = self._evicted_total
+        if self.backend is not None:
+            roles = [role for _, role, _ in self.backend.list_sessions()]
+        return {
+            'sessions': len(roles),
+            'customers': roles.count(SESSION_ROLE_CUSTOMER),
+            'supervisors': roles.count(SESSION_ROLE_SUPERVISOR),
+            'memory_bytes': memory_bytes,
+            'evicted_total': evicted_total,
+        }
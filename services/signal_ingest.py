@@ -0,0 +1,302 @@
+"""营销信号导入服务"""
+import json
+import logging
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple, Union
+from utils.constants import SIGNAL_SCHEMA, SIGNAL_TAG_ALIASES, SIGNAL_ERROR_SAMPLE_LIMIT
+
+# 规范键中标签与事件之间的分隔符（不会出现在正常文本中）
+_KEY_SEPARATOR = "\x1f"
+
+@dataclass
+class SignalRecord:
+    """单条营销信号"""
+    tags: Tuple[str, ...]
+    event: str
+    customer_id: Optional[str] = None
+    line_no: int = 0
+
+    @property
+    def key(self) -> str:
+        """规范键：排序后的标签 + 归一化事件"""
+        return canonical_key(self.tags, self.event)
+
+@dataclass
+class UniqueSignal:
+    """去重后的营销信号"""
+    key: str
+    tags: Tuple[str, ...]
+    event: str
+    count: int = 0
+    customer_ids: List[str] = field(default_factory=list)
+
+    def to_prompt(self) -> str:
+        """转换为发送给Dify的提示词（与预置prompt格式一致）"""
+        return json.dumps(
+            {"tags": list(self.tags), "event": self.event},
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+
+@dataclass
+class IngestStats:
+    """导入统计"""
+    total: int = 0
+    valid: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'total': self.total,
+            'valid': self.valid,
+            'invalid': self.invalid,
+            'duplicates': self.duplicates,
+            'unique': self.valid - self.duplicates,
+        }
+
+@dataclass
+class WorkSet:
+    """去重后的工作集"""
+    signals: Dict[str, UniqueSignal] = field(default_factory=dict)
+    stats: IngestStats = field(default_factory=IngestStats)
+
+    def __len__(self) -> int:
+        return len(self.signals)
+
+    def __iter__(self) -> Iterator[UniqueSignal]:
+        return iter(self.signals.values())
+
+    def fan_out(self, results: Dict[str, Dict[str, Any]]) -> Iterator[Tuple[Optional[str], UniqueSignal, Dict[str, Any]]]:
+        """将每个唯一信号的生成结果分发给对应的所有客户
+
+        Args:
+            results: 规范键 -> 生成结果
+
+        Yields:
+            (客户ID, 唯一信号, 生成结果)；未携带客户ID的信号客户ID为None
+        """
+        for key, signal in self.signals.items():
+            result = results.get(key)
+            if result is None:
+                continue
+            if not signal.customer_ids:
+                yield None, signal, result
+                continue
+            for customer_id in signal.customer_ids:
+                yield customer_id, signal, result
+
+def normalize_text(text: str) -> str:
+    """归一化文本：全角转半角、去除首尾及多余空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def normalize_tags(tags: Iterable[str], aliases: Optional[Dict[str, str]] = None) -> Tuple[str, ...]:
+    """归一化标签词表
+
+    Args:
+        tags: 原始标签
+        aliases: 别名映射（默认使用SIGNAL_TAG_ALIASES）
+
+    Returns:
+        去重并排序后的标准标签
+    """
+    aliases = SIGNAL_TAG_ALIASES if aliases is None else aliases
+    normalized = set()
+    for tag in tags:
+        tag = normalize_text(tag)
+        if tag:
+            normalized.add(aliases.get(tag, tag))
+    return tuple(sorted(normalized))
+
+def canonical_key(tags: Tuple[str, ...], event: str) -> str:
+    """计算信号的规范键
+
+    Args:
+        tags: 已归一化并排序的标签
+        event: 已归一化的事件
+
+    Returns:
+        规范键
+    """
+    return _KEY_SEPARATOR.join(tags) + _KEY_SEPARATOR * 2 + event
+
+def validate_signal(data: Any, schema: Optional[Dict[str, Dict[str, Any]]] = None) -> Tuple[bool, str]:
+    """按模式校验信号记录
+
+    Args:
+        data: 解析后的JSON对象
+        schema: 字段模式（默认使用SIGNAL_SCHEMA）
+
+    Returns:
+        (是否有效, 错误信息)
+    """
+    schema = schema or SIGNAL_SCHEMA
+    if not isinstance(data, dict):
+        return False, "记录必须是JSON对象"
+
+    for name, rule in schema.items():
+        if name not in data or data[name] is None:
+            if rule.get('required'):
+                return False, f"缺少必填字段: {name}"
+            continue
+
+        value = data[name]
+        # bool是int的子类，需要单独排除
+        if isinstance(value, bool) or not isinstance(value, rule['type']):
+            return False, f"字段类型错误: {name}"
+
+        if isinstance(value, list):
+            if len(value) < rule.get('min_items', 0):
+                return False, f"字段不能为空: {name}"
+            if len(value) > rule.get('max_items', len(value)):
+                return False, f"字段元素过多: {name}"
+            item_max_length = rule.get('item_max_length')
+            for item in value:
+                if not isinstance(item, str) or not item.strip():
+                    return False, f"字段元素必须是非空字符串: {name}"
+                if item_max_length and len(item) > item_max_length:
+                    return False, f"字段元素过长: {name}"
+        else:
+            text = str(value)
+            if isinstance(value, str) and not text.strip():
+                return False, f"字段不能为空: {name}"
+            if len(text) > rule.get('max_length', len(text)):
+                return False, f"字段过长: {name}"
+
+    return True, ""
+
+class SignalIngestor:
+    """营销信号流式导入器
+
+    逐行解析JSON Lines格式的信号文件，校验、归一化后按规范键去重计数，
+    内存占用只与唯一信号数量（及保留的客户ID）相关，与文件行数无关。
+    """
+
+    def __init__(self, tag_aliases: Optional[Dict[str, str]] = None,
+                 keep_customer_ids: bool = True,
+                 max_error_samples: int = SIGNAL_ERROR_SAMPLE_LIMIT):
+        self.tag_aliases = SIGNAL_TAG_ALIASES if tag_aliases is None else tag_aliases
+        self.keep_customer_ids = keep_customer_ids
+        self.max_error_samples = max_error_samples
+        self.logger = logging.getLogger(__name__)
+
+    def parse_line(self, line: Union[str, bytes], line_no: int = 0) -> Tuple[Optional[SignalRecord], str]:
+        """解析并校验单行信号
+
+        Args:
+            line: 原始行
+            line_no: 行号
+
+        Returns:
+            (信号记录或None, 错误信息)
+        """
+        if isinstance(line, bytes):
+            try:
+                line = line.decode("utf-8-sig")
+            except UnicodeDecodeError:
+                return None, "编码错误: 文件需为UTF-8编码"
+        line = line.strip()
+        if not line:
+            return None, ""
+
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            return None, f"JSON解析失败: {e.msg}"
+
+        is_valid, error_msg = validate_signal(data)
+        if not is_valid:
+            return None, error_msg
+
+        tags = normalize_tags(data['tags'], self.tag_aliases)
+        if not tags:
+            return None, "归一化后标签为空"
+
+        customer_id = data.get('customer_id')
+        return SignalRecord(
+            tags=tags,
+            event=normalize_text(data['event']),
+            customer_id=str(customer_id) if customer_id is not None else None,
+            line_no=line_no
+        ), ""
+
+    def iter_records(self, lines: Iterable[Union[str, bytes]],
+                     stats: Optional[IngestStats] = None) -> Iterator[SignalRecord]:
+        """流式迭代有效的信号记录
+
+        Args:
+            lines: 可迭代的行（文件对象、生成器等）
+            stats: 可选的统计对象，用于累计解析结果
+
+        Yields:
+            有效的信号记录
+        """
+        stats = stats if stats is not None else IngestStats()
+        line_no = 0
+        try:
+            for line_no, line in enumerate(lines, 1):
+                record, error_msg = self.parse_line(line, line_no)
+                if record is None:
+                    if error_msg:
+                        self._count_error(stats, line_no, error_msg)
+                    continue
+                stats.total += 1
+                stats.valid += 1
+                yield record
+        except UnicodeDecodeError:
+            # 文本文件对象在读取时解码失败，无法定位到下一行，停止导入
+            self._count_error(stats, line_no + 1, "编码错误: 文件需为UTF-8编码，后续内容未导入")
+
+    def _count_error(self, stats: IngestStats, line_no: int, error_msg: str):
+        """计入一条无效记录"""
+        stats.total += 1
+        stats.invalid += 1
+        if len(stats.errors) < self.max_error_samples:
+            stats.errors.append((line_no, error_msg))
+
+    def ingest(self, source: Union[IO, Iterable[Union[str, bytes]]]) -> WorkSet:
+        """导入信号并构建去重后的工作集
+
+        Args:
+            source: 文本/二进制文件对象或可迭代的行（二进制文件逐行解码，编码错误只影响所在行）
+
+        Returns:
+            去重后的工作集
+        """
+        work_set = WorkSet()
+        signals = work_set.signals
+        for record in self.iter_records(source, work_set.stats):
+            key = record.key
+            signal = signals.get(key)
+            if signal is None:
+                signal = UniqueSignal(key=key, tags=record.tags, event=record.event)
+                signals[key] = signal
+            else:
+                work_set.stats.duplicates += 1
+            signal.count += 1
+            if self.keep_customer_ids and record.customer_id is not None:
+                signal.customer_ids.append(record.customer_id)
+
+        self.logger.info(f"营销信号导入完成: {work_set.stats.to_dict()}")
+        return work_set
+
+    def fan_out(self, source: Union[IO, Iterable[Union[str, bytes]]],
+                results: Dict[str, Dict[str, Any]]) -> Iterator[Tuple[SignalRecord, Dict[str, Any]]]:
+        """重新流式读取信号文件，把唯一信号的生成结果逐行分发给对应的客户
+
+        与WorkSet.fan_out不同，不需要在导入时保留客户ID，内存只与唯一信号数量相关。
+
+        Args:
+            source: 与导入时相同的信号文件（文件对象需先回到开头）
+            results: 规范键 -> 生成结果
+
+        Yields:
+            (信号记录, 生成结果)；没有生成结果的行跳过
+        """
+        for record in self.iter_records(source):
+            result = results.get(record.key)
+            if result is not None:
+                yield record, result
@@ -0,0 +1,245 @@
+"""备选草稿预生成服务"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import replace
+from typing import Any, Dict, Optional
+from config.settings import DifyConfig, SpeculativeConfig
+from services.admission_control import AdmissionController
+from services.dify_api import DifyAPIService
+from services.event_bus import Event, EventBus, EVENT_APPROVED, EVENT_ALTERNATIVE_READY
+from services.generation_registry import GenerationCancelled, GenerationRegistry, CANCEL_APPROVED
+from services.llm_scheduler import (
+    LLMScheduler, LANE_INTERACTIVE, LANE_REGENERATE, LANE_SPECULATIVE
+)
+from services.state_manager import StateManager
+from utils.pii_masker import PIIMasker
+from utils.constants import (
+    SPECULATIVE_BUDGET_WINDOW, SPECULATIVE_MAX_UTILIZATION, SPECULATIVE_VARIANT_INPUT
+)
+from utils.token_estimator import estimate_request_tokens
+
+# 预生成跳过原因
+SKIP_BUDGET = "budget"
+SKIP_PRESSURE = "pressure"
+
+# 备选回复的使用方式
+OUTCOME_PROMOTED = "promoted"  # 拒绝后换入
+OUTCOME_SHOWN = "shown"  # 监督者切换查看
+OUTCOME_APPROVED = "approved"  # 备选回复被批准发送
+
+class SpeculativeDrafter:
+    """备选草稿预生成器
+
+    草稿进入审核后，在后台以低优先级（预生成通道）为同一问题再生成一个备选回复：
+    不沿用Dify会话（避免在会话历史中多出一轮），而是携带完整上下文单独请求，并通过
+    输入变量标明提示词变体，Dify应用可据此使用不同的提示词或温度；也可以配置单独的
+    Dify应用。备选回复就绪后附加在待审核消息上，监督者拒绝或切换查看时立即换入。
+
+    成本控制：按统计周期的token预算预扣（完成后按Dify返回的实际用量结算），
+    在线或重新生成请求排队、预生成通道已有积压、Dify并发占用过高、或准入控制器
+    暂缓后台任务时跳过。
+    生成在独立的后台事件循环线程中运行，不受Streamlit单次运行结束的影响；
+    草稿被批准、拒绝、清空或会话驱逐时通过生成登记表取消。
+    """
+
+    def __init__(self, dify_service: DifyAPIService, generations: GenerationRegistry,
+                 scheduler: Optional[LLMScheduler] = None, token_budget: int = 20000,
+                 variant: str = "alternative", timeout: float = 90,
+                 max_utilization: float = SPECULATIVE_MAX_UTILIZATION,
+                 budget_window: float = SPECULATIVE_BUDGET_WINDOW,
+                 admission: Optional[AdmissionController] = None):
+        self.dify_service = dify_service
+        self.generations = generations
+        self.scheduler = scheduler
+        self.token_budget = token_budget
+        self.variant = variant
+        self.timeout = timeout
+        self.max_utilization = max_utilization
+        self.budget_window = budget_window
+        self.admission = admission
+        self.event_bus: Optional[EventBus] = None
+        self._window_start = time.time()
+        self._spent = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._subscription: Optional[int] = None
+        self.logger = logging.getLogger(__name__)
+        self.counters: Dict[str, int] = {
+            'scheduled': 0, 'ready': 0, 'failed': 0, 'discarded': 0, 'cancelled': 0,
+            'skipped_budget': 0, 'skipped_pressure': 0,
+            OUTCOME_PROMOTED: 0, OUTCOME_SHOWN: 0, OUTCOME_APPROVED: 0,
+        }
+
+    def attach(self, event_bus: EventBus):
+        """记录事件总线，草稿被批准时取消仍在生成的备选回复
+
+        Args:
+            event_bus: 事件总线
+        """
+        self.event_bus = event_bus
+        self._subscription = event_bus.subscribe(self._on_approved, [EVENT_APPROVED])
+
+    def _on_approved(self, event: Event):
+        self.generations.cancel(event.session_id, CANCEL_APPROVED, review_id=event.data['message']['id'])
+
+    def schedule(self, state_manager: StateManager, pending_id: str, query: str,
+                 inputs: Dict[str, Any]) -> bool:
+        """为待审核草稿预生成备选回复（立即返回）
+
+        Args:
+            state_manager: 客户会话的状态管理器
+            pending_id: 待审核消息ID
+            query: 用户消息内容
+            inputs: 不依赖Dify会话的完整上下文（见ConversationContextManager.standalone_inputs）
+
+        Returns:
+            是否已开始预生成（预算不足或排队压力大时跳过）
+        """
+        inputs = {**inputs, SPECULATIVE_VARIANT_INPUT: self.variant}
+        tokens = estimate_request_tokens(query, inputs)
+        skip = self._admit(tokens)
+        if skip is not None:
+            with self._lock:
+                self.counters[f'skipped_{skip}'] += 1
+            self.logger.info(f"跳过备选草稿预生成({skip}): 待审核消息 {pending_id}")
+            return False
+
+        with self._lock:
+            self.counters['scheduled'] += 1
+        asyncio.run_coroutine_threadsafe(
+            self._generate(state_manager, pending_id, query, inputs, tokens), self._background_loop()
+        )
+        return True
+
+    def _admit(self, tokens: int) -> Optional[str]:
+        """检查排队压力并预扣token预算
+
+        Returns:
+            跳过原因，可以预生成时返回None
+        """
+        if self.scheduler is not None and (
+                self.scheduler.queue_depth(LANE_INTERACTIVE) > 0
+                or self.scheduler.queue_depth(LANE_REGENERATE) > 0
+                or self.scheduler.queue_depth(LANE_SPECULATIVE) > 0
+                or self.scheduler.utilization() >= self.max_utilization):
+            return SKIP_PRESSURE
+        with self._lock:
+            self._roll_window()
+            if self._spent + tokens > self.token_budget:
+                return SKIP_BUDGET
+            self._spent += tokens
+            window_start = self._window_start
+        if self.admission is not None and self.admission.admit_background(LANE_SPECULATIVE, tokens):
+            self._settle(window_start, tokens, 0)
+            return SKIP_PRESSURE
+        return None
+
+    def _settle(self, window_start: float, reserved: int, actual: int):
+        """按实际用量结算预扣的token（跨统计周期时不再调整）"""
+        with self._lock:
+            if self._window_start == window_start:
+                self._spent = max(0, self._spent + actual - reserved)
+
+    def _roll_window(self):
+        """进入新的统计周期时清零已用预算（需在锁内调用）"""
+        now = time.time()
+        if now - self._window_start >= self.budget_window:
+            self._window_start = now
+            self._spent = 0
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        """获取后台事件循环（首次使用时启动线程）"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="speculative-drafts",
+                                 daemon=True).start()
+            return self._loop
+
+    async def _generate(self, state_manager: StateManager, pending_id: str, query: str,
+                        inputs: Dict[str, Any], tokens: int):
+        """生成备选回复并附加到待审核消息"""
+        session_id = state_manager.get_session_id()
+        window_start = self._window_start
+        handle = self.generations.start(session_id, pending_id, LANE_SPECULATIVE, tokens)
+        discarded = False
+        outcome = 'failed'
+        actual = 0
+        try:
+            result = await handle.run(self.dify_service.chat_completion(
+                query, None, inputs=inputs, user=state_manager.get_dify_user(),
+                lane=LANE_SPECULATIVE, handle=handle
+            ), self.timeout)
+            if result['success']:
+                actual = result.get('usage', {}).get('total_tokens') or tokens
+                discarded = not state_manager.set_pending_alternative(pending_id, result['content'])
+                outcome = 'discarded' if discarded else 'ready'
+            else:
+                self.logger.warning(f"备选草稿预生成失败: {result.get('content')}")
+        except GenerationCancelled:
+            outcome = 'cancelled'
+        except Exception as e:
+            self.logger.error(f"备选草稿预生成异常: {e}")
+        finally:
+            self.generations.finish(handle, discarded)
+
+        # 未发往Dify的请求退还预扣的预算，已发出但没有用量数据的按预估计入
+        self._settle(window_start, tokens, (actual or tokens) if handle.dispatched else 0)
+        with self._lock:
+            self.counters[outcome] += 1
+        if outcome == 'ready':
+            self.logger.info(f"备选草稿已就绪: 待审核消息 {pending_id}")
+            if self.event_bus is not None:
+                self.event_bus.publish(EVENT_ALTERNATIVE_READY, session_id, pending_id=pending_id)
+
+    def record(self, outcome: str):
+        """记录备选回复的使用情况
+
+        Args:
+            outcome: OUTCOME_PROMOTED / OUTCOME_SHOWN / OUTCOME_APPROVED
+        """
+        with self._lock:
+            self.counters[outcome] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """获取预生成与预算统计"""
+        with self._lock:
+            self._roll_window()
+            result: Dict[str, Any] = dict(self.counters)
+            result['budget'] = self.token_budget
+            result['spent'] = self._spent
+            result['window_remaining'] = max(0.0, self._window_start + self.budget_window - time.time())
+            return result
+
+def create_speculative_drafter(config: SpeculativeConfig, dify_config: DifyConfig, transport,
+                               scheduler: Optional[LLMScheduler], generations: GenerationRegistry,
+                               event_bus: EventBus, timeout: float = 90,
+                               masker: Optional[PIIMasker] = None,
+                               admission: Optional[AdmissionController] = None) -> Optional[SpeculativeDrafter]:
+    """按配置创建备选草稿预生成器
+
+    Args:
+        config: 预生成配置
+        dify_config: Dify配置（配置了单独的API密钥时改用该密钥对应的Dify应用）
+        transport: Dify传输层
+        scheduler: LLM请求调度器
+        generations: 草稿生成登记表
+        event_bus: 事件总线
+        timeout: 单次生成的总超时秒数
+        masker: 敏感信息脱敏器（可选）
+        admission: 准入控制器（可选，过载时暂缓预生成）
+
+    Returns:
+        预生成器；未开启时返回None
+    """
+    if not config.enabled:
+        return None
+    if config.api_key:
+        dify_config = replace(dify_config, api_key=config.api_key)
+    drafter = SpeculativeDrafter(DifyAPIService(dify_config, transport, scheduler, masker), generations,
+                                 scheduler, config.token_budget, config.variant, timeout,
+                                 admission=admission)
+    drafter.attach(event_bus)
+    return drafter
@@ -0,0 +1,401 @@
+"""共享状态后端服务"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+STATE_BACKEND_MEMORY = "memory"
+STATE_BACKEND_SQLITE = "sqlite"
+
+@dataclass
+class StoredSession:
+    """后端中保存的会话记录"""
+    session_id: str
+    role: str
+    dify_user: str
+    state: str  # JSON编码的会话状态
+    version: int
+    updated_at: float
+    accessed_at: float  # 最近访问时间（写入或touch），用于空闲过期
+    pinned: bool = False  # 有待审核回复，不会过期
+
+class StateBackend:
+    """共享状态后端接口
+
+    会话状态以JSON文档保存，每次写入版本号加一。写入采用比较并交换（CAS）：
+    只有调用方读到的版本号仍是最新时才写入成功，否则返回None，由调用方重新读取后重试。
+    多个应用副本指向同一后端时，任一副本都能接管任意会话，无需会话粘滞。
+    会话的空闲过期按最近访问时间判断（只读访问通过touch更新），有待审核回复的会话不会过期。
+    另提供按命名空间划分的键值存储，供模板缓存等跨会话共享的数据使用；
+    键值写入同样可以带上读到的版本号做CAS，冲突时由调用方重新读取、合并后重试。
+    """
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        """读取会话（不存在时返回None）"""
+        raise NotImplementedError
+
+    def version(self, session_id: str) -> int:
+        """读取会话当前版本号（不存在时为0）"""
+        raise NotImplementedError
+
+    def save(self, session_id: str, role: str, dify_user: str, state: str,
+             expected_version: int, pinned: bool = False) -> Optional[int]:
+        """比较并交换写入会话（同时更新访问时间）
+
+        Args:
+            session_id: 会话ID
+            role: 会话角色
+            dify_user: Dify用户标识
+            state: JSON编码的会话状态
+            expected_version: 调用方读到的版本号（0表示新建）
+            pinned: 会话是否有待审核回复（有则不会过期）
+
+        Returns:
+            写入后的版本号，版本冲突时返回None
+        """
+        raise NotImplementedError
+
+    def touch(self, session_id: str, now: Optional[float] = None):
+        """更新会话的访问时间（不改变版本号）
+
+        Args:
+            session_id: 会话ID
+            now: 访问时间戳（默认time.time()）
+        """
+        raise NotImplementedError
+
+    def list_sessions(self, role: Optional[str] = None) -> List[Tuple[str, str, int]]:
+        """列出会话
+
+        Args:
+            role: 只列出指定角色的会话
+
+        Returns:
+            (会话ID, 角色, 版本号)列表，按最近更新倒序
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        """删除会话"""
+        raise NotImplementedError
+
+    def expire(self, before: float) -> int:
+        """删除最近访问时间早于before且没有待审核回复的会话
+
+        Returns:
+            删除的会话数
+        """
+        raise NotImplementedError
+
+    def get_values(self, namespace: str) -> Dict[str, Any]:
+        """读取命名空间下的全部键值"""
+        raise NotImplementedError
+
+    def get_value(self, namespace: str, key: str) -> Tuple[Optional[Any], int]:
+        """读取单个键值及其版本号
+
+        Returns:
+            (值, 版本号)，不存在时为(None, 0)
+        """
+        raise NotImplementedError
+
+    def put_value(self, namespace: str, key: str, value: Any,
+                  expected_version: Optional[int] = None) -> Optional[int]:
+        """写入键值
+
+        Args:
+            namespace: 命名空间
+            key: 键
+            value: 可JSON编码的值
+            expected_version: 调用方读到的版本号（0表示新建）；为None时后写覆盖先写
+
+        Returns:
+            写入后的版本号，版本冲突时返回None
+        """
+        raise NotImplementedError
+
+    def namespace_version(self, namespace: str) -> int:
+        """命名空间的版本号（任一键写入后增大），用于判断本地缓存是否过期"""
+        raise NotImplementedError
+
+    def close(self):
+        """释放资源"""
+
+class InMemoryStateBackend(StateBackend):
+    """进程内状态后端
+
+    语义与SQLite后端一致（JSON文档、版本号、CAS），用于单进程运行和测试；
+    同一进程内的多个SessionStore共享它时，行为与多副本共享SQLite相同。
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, StoredSession] = {}
+        self._values: Dict[str, Dict[str, Tuple[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def version(self, session_id: str) -> int:
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            return stored.version if stored else 0
+
+    def save(self, session_id: str, role: str, dify_user: str, state: str,
+             expected_version: int, pinned: bool = False) -> Optional[int]:
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            if (stored.version if stored else 0) != expected_version:
+                return None
+            now = time.time()
+            self._sessions[session_id] = StoredSession(
+                session_id, role, dify_user, state, expected_version + 1, now, now, pinned
+            )
+            return expected_version + 1
+
+    def touch(self, session_id: str, now: Optional[float] = None):
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            if stored is not None:
+                stored.accessed_at = max(stored.accessed_at, now or time.time())
+
+    def list_sessions(self, role: Optional[str] = None) -> List[Tuple[str, str, int]]:
+        with self._lock:
+            sessions = sorted(self._sessions.values(), key=lambda stored: stored.updated_at, reverse=True)
+        return [(stored.session_id, stored.role, stored.version) for stored in sessions
+                if role is None or stored.role == role]
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def expire(self, before: float) -> int:
+        with self._lock:
+            expired = [session_id for session_id, stored in self._sessions.items()
+                       if stored.accessed_at < before and not stored.pinned]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+    def get_values(self, namespace: str) -> Dict[str, Any]:
+        with self._lock:
+            values = dict(self._values.get(namespace, {}))
+        return {key: json.loads(value) for key, (value, _) in values.items()}
+
+    def get_value(self, namespace: str, key: str) -> Tuple[Optional[Any], int]:
+        with self._lock:
+            item = self._values.get(namespace, {}).get(key)
+        return (json.loads(item[0]), item[1]) if item else (None, 0)
+
+    def put_value(self, namespace: str, key: str, value: Any,
+                  expected_version: Optional[int] = None) -> Optional[int]:
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            values = self._values.setdefault(namespace, {})
+            current = values.get(key)
+            if expected_version is not None and (current[1] if current else 0) != expected_version:
+                return None
+            version = max((item[1] for item in values.values()), default=0) + 1
+            values[key] = (data, version)
+            return version
+
+    def namespace_version(self, namespace: str) -> int:
+        with self._lock:
+            return max((item[1] for item in self._values.get(namespace, {}).values()), default=0)
+
+class SQLiteStateBackend(StateBackend):
+    """SQLite状态后端
+
+    多个副本（同一主机上的多个进程，或挂载同一共享卷）共享一个数据库文件。
+    使用WAL模式，读不阻塞写；CAS写入是单条带版本条件的UPDATE，不需要额外加锁。
+    每个线程使用自己的连接。
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                role TEXT NOT NULL,
+                dify_user TEXT NOT NULL,
+                state TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                accessed_at REAL NOT NULL DEFAULT 0,
+                pinned INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at);
+            CREATE TABLE IF NOT EXISTS kv (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+        """)
+        self._migrate(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_accessed ON sessions(accessed_at)")
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """为早期版本创建的数据库补充访问时间和待审核标记列"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if 'accessed_at' not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+            conn.execute("UPDATE sessions SET accessed_at = updated_at")
+            self.logger.info("状态数据库已添加会话访问时间列")
+        if 'pinned' not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前线程的连接（自动提交模式）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> Optional[StoredSession]:
+        row = self._connection().execute(
+            "SELECT session_id, role, dify_user, state, version, updated_at, accessed_at, pinned "
+            "FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return StoredSession(*row[:7], pinned=bool(row[7]))
+
+    def version(self, session_id: str) -> int:
+        row = self._connection().execute(
+            "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def save(self, session_id: str, role: str, dify_user: str, state: str,
+             expected_version: int, pinned: bool = False) -> Optional[int]:
+        conn = self._connection()
+        now = time.time()
+        if expected_version == 0:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO sessions "
+                "(session_id, role, dify_user, state, version, updated_at, accessed_at, pinned) "
+                "VALUES (?, ?, ?, ?, 1, ?, ?, ?)", (session_id, role, dify_user, state, now, now, int(pinned))
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE sessions SET state = ?, version = version + 1, updated_at = ?, accessed_at = ?, "
+                "pinned = ? WHERE session_id = ? AND version = ?",
+                (state, now, now, int(pinned), session_id, expected_version)
+            )
+        return expected_version + 1 if cursor.rowcount == 1 else None
+
+    def touch(self, session_id: str, now: Optional[float] = None):
+        now = now or time.time()
+        self._connection().execute(
+            "UPDATE sessions SET accessed_at = ? WHERE session_id = ? AND accessed_at < ?",
+            (now, session_id, now)
+        )
+
+    def list_sessions(self, role: Optional[str] = None) -> List[Tuple[str, str, int]]:
+        if role is None:
+            rows = self._connection().execute(
+                "SELECT session_id, role, version FROM sessions ORDER BY updated_at DESC"
+            )
+        else:
+            rows = self._connection().execute(
+                "SELECT session_id, role, version FROM sessions WHERE role = ? ORDER BY updated_at DESC",
+                (role,)
+            )
+        return [tuple(row) for row in rows]
+
+    def delete(self, session_id: str):
+        self._connection().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def expire(self, before: float) -> int:
+        return self._connection().execute(
+            "DELETE FROM sessions WHERE accessed_at < ? AND pinned = 0", (before,)
+        ).rowcount
+
+    def get_values(self, namespace: str) -> Dict[str, Any]:
+        rows = self._connection().execute(
+            "SELECT key, value FROM kv WHERE namespace = ?", (namespace,)
+        )
+        return {key: json.loads(value) for key, value in rows}
+
+    def get_value(self, namespace: str, key: str) -> Tuple[Optional[Any], int]:
+        row = self._connection().execute(
+            "SELECT value, version FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+    def put_value(self, namespace: str, key: str, value: Any,
+                  expected_version: Optional[int] = None) -> Optional[int]:
+        conn = self._connection()
+        # 版本比较和写入在同一个写事务内完成，其他进程的写入会等待
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if expected_version is not None:
+                row = conn.execute(
+                    "SELECT version FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                if (row[0] if row else 0) != expected_version:
+                    conn.execute("ROLLBACK")
+                    return None
+            version = conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM kv WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, version) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), version)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def namespace_version(self, namespace: str) -> int:
+        row = self._connection().execute(
+            "SELECT COALESCE(MAX(version), 0) FROM kv WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return row[0]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def create_state_backend(kind: str, path: str = "data/state.db") -> Optional[StateBackend]:
+    """按配置创建共享状态后端
+
+    Args:
+        kind: 后端类型（memory/sqlite，为空表示不使用共享后端）
+        path: SQLite数据库文件路径
+
+    Returns:
+        状态后端，未配置时返回None
+
+    Raises:
+        ValueError: 未知的后端类型
+    """
+    if not kind:
+        return None
+    if kind == STATE_BACKEND_MEMORY:
+        return InMemoryStateBackend()
+    if kind == STATE_BACKEND_SQLITE:
+        return SQLiteStateBackend(path)
+    raise ValueError(f"未知的状态后端类型: {kind}")
@@ -1,9 +1,20 @@
 """状态管理服务"""
 import streamlit as st
+import threading
 import uuid
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional, TypeVar
 from dataclasses import dataclass, asdict
+from services.context_manager import ContextState
+from utils.constants import IDEMPOTENCY_KEY_LIMIT, STATE_COMMIT_RETRIES
+
+T = TypeVar('T')
+
+# 状态转换结果
+TRANSITION_APPLIED = "applied"  # 转换已生效
+TRANSITION_DUPLICATE = "duplicate"  # 幂等键已处理过，返回首次的结果
+TRANSITION_CONFLICT = "conflict"  # 待审核消息已被处理或修改（ID/版本号不符）
+TRANSITION_EMPTY = "empty"  # 没有待审核消息
 
 @dataclass
 class Message:
@@ -34,6 +45,9 @@ class PendingReview:
     edited_content: str
     timestamp: datetime
     user_message_id: str
+    version: int = 1  # 每次编辑加一，批准/拒绝时用于比较并交换
+    alternative: Optional[str] = None  # 后台预生成的备选回复
+    speculative: bool = False  # 当前内容是否来自备选回复
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
@@ -47,24 +61,173 @@ class PendingReview:
         data['timestamp'] = datetime.fromisoformat(data['timestamp'])
         return cls(**data)
 
+@dataclass
+class TransitionResult:
+    """状态转换结果（提交用户消息、批准、拒绝）"""
+    status: str
+    message: Optional[Message] = None
+    pending: Optional[Dict[str, Any]] = None
+    replacement: Optional[Dict[str, Any]] = None  # 拒绝后换入的备选回复
+    admission: Optional[Dict[str, Any]] = None  # 客户消息的准入决定（排队时含排队位置和提示）
+    
+    @property
+    def applied(self) -> bool:
+        """转换是否由本次调用生效"""
+        return self.status == TRANSITION_APPLIED
+
 class StateManager:
-    """状态管理器"""
+    """状态管理器
+    
+    默认读写当前浏览器的st.session_state；传入SessionStore中的会话状态时，
+    同一进程内的多个客户/监督者会话各自独立，并由会话锁保护并发访问。
+    会话状态来自共享状态后端时，读取前按版本号刷新，修改以比较并交换写回，
+    其他副本已修改该会话时重新读取后重试（批准/拒绝因此不会重复发送同一条回复）。
+    待审核消息带版本号，批准/拒绝/编辑可指定期望的消息ID和版本号；提交消息和审核操作
+    可携带幂等键，重复请求直接返回首次的结果。幂等记录与会话状态一起原子写入。
+    """
+    
+    def __init__(self, state=None):
+        """初始化状态管理器
+        
+        Args:
+            state: 会话状态（SessionState），默认使用st.session_state
+        """
+        self._state = state if state is not None else st.session_state
+        self._lock = getattr(state, 'lock', None) or threading.RLock()
+        self._transact(self._init_session_state)
     
-    def __init__(self):
-        self._init_session_state()
+    def get_session_id(self) -> Optional[str]:
+        """获取会话ID
+        
+        Returns:
+            会话ID或None
+        """
+        return getattr(self._state, 'session_id', None)
+    
+    def get_dify_user(self) -> Optional[str]:
+        """获取发送给Dify的用户标识
+        
+        Returns:
+            用户标识或None（使用服务默认值）
+        """
+        return getattr(self._state, 'dify_user', None)
+    
+    def _refresh(self):
+        """从共享后端读取最新状态（未使用共享后端时无操作）"""
+        refresh = getattr(self._state, 'refresh', None)
+        if refresh is not None and refresh():
+            self._init_session_state()
+    
+    def _transact(self, mutate: Callable[[], T]) -> T:
+        """在会话锁内修改状态并写回共享后端
+        
+        Args:
+            mutate: 修改状态的函数（版本冲突时会在重新读取后再次执行）
+            
+        Returns:
+            mutate的返回值
+            
+        Raises:
+            RuntimeError: 多次重试仍然冲突
+        """
+        commit = getattr(self._state, 'commit', None)
+        with self._lock:
+            for _ in range(STATE_COMMIT_RETRIES):
+                self._refresh()
+                result = mutate()
+                if commit is None or commit():
+                    return result
+        raise RuntimeError("会话状态写入冲突，请稍后重试")
     
     def _init_session_state(self):
         """初始化会话状态"""
-        if 'messages' not in st.session_state:
-            st.session_state.messages = []
-        if 'pending_review' not in st.session_state:
-            st.session_state.pending_review = None
-        if 'typing_status' not in st.session_state:
-            st.session_state.typing_status = False
-        if 'conversation_id' not in st.session_state:
-            st.session_state.conversation_id = None
-        if 'api_connected' not in st.session_state:
-            st.session_state.api_connected = False
+        if 'messages' not in self._state:
+            self._state.messages = []
+        if 'pending_review' not in self._state:
+            self._state.pending_review = None
+        if 'typing_status' not in self._state:
+            self._state.typing_status = False
+        if 'conversation_id' not in self._state:
+            self._state.conversation_id = None
+        if 'api_connected' not in self._state:
+            self._state.api_connected = False
+        if 'context_summary' not in self._state:
+            self._state.context_summary = ""
+        if 'context_base_index' not in self._state:
+            self._state.context_base_index = 0
+        if 'idempotency_keys' not in self._state:
+            self._state.idempotency_keys = {}
+    
+    def _recall(self, idempotency_key: Optional[str]) -> Optional[TransitionResult]:
+        """查找幂等键对应的首次结果（需在会话锁内调用）"""
+        if not idempotency_key:
+            return None
+        record = self._state.idempotency_keys.get(idempotency_key)
+        if record is None:
+            return None
+        message = Message.from_dict(dict(record['message'])) if record['message'] else None
+        return TransitionResult(TRANSITION_DUPLICATE, message, record['pending'])
+    
+    def _remember(self, idempotency_key: Optional[str], message: Optional[Message] = None,
+                  pending: Optional[Dict[str, Any]] = None):
+        """记录幂等键的结果（需在会话锁内调用）"""
+        if not idempotency_key:
+            return
+        keys = self._state.idempotency_keys
+        keys[idempotency_key] = {
+            'message': message.to_dict() if message else None,
+            'pending': pending
+        }
+        while len(keys) > IDEMPOTENCY_KEY_LIMIT:
+            del keys[next(iter(keys))]
+    
+    def get_idempotent_result(self, idempotency_key: str) -> Optional[TransitionResult]:
+        """查询幂等键是否已处理
+        
+        Args:
+            idempotency_key: 幂等键
+            
+        Returns:
+            首次处理的结果，未处理过时返回None
+        """
+        self._refresh()
+        with self._lock:
+            return self._recall(idempotency_key)
+    
+    def submit_user_message(self, content: str, idempotency_key: Optional[str] = None,
+                            exclusive: bool = False) -> TransitionResult:
+        """提交用户消息（幂等）
+        
+        Args:
+            content: 消息内容
+            idempotency_key: 幂等键（客户端重试时携带同一个键）
+            exclusive: 是否独占处理：上一条消息还在生成或等待审核时不提交，
+                提交成功时在同一次写入中标记为正在输入
+            
+        Returns:
+            转换结果，重复提交时状态为duplicate，message为首次创建的消息；
+            独占提交遇到处理中的消息时状态为conflict
+        """
+        def submit() -> TransitionResult:
+            previous = self._recall(idempotency_key)
+            if previous is not None:
+                return previous
+            if exclusive and (self._state.pending_review or self._state.typing_status):
+                return TransitionResult(TRANSITION_CONFLICT)
+            if exclusive:
+                self._state.typing_status = True
+            message = Message(
+                id=str(uuid.uuid4()),
+                content=content,
+                sender='user',
+                timestamp=datetime.now(),
+                status='sent'
+            )
+            self._state.messages.append(message.to_dict())
+            self._remember(idempotency_key, message=message)
+            return TransitionResult(TRANSITION_APPLIED, message)
+        
+        return self._transact(submit)
     
     def add_user_message(self, content: str) -> Message:
         """添加用户消息
@@ -75,15 +238,7 @@ class StateManager:
         Returns:
             创建的消息对象
         """
-        message = Message(
-            id=str(uuid.uuid4()),
-            content=content,
-            sender='user',
-            timestamp=datetime.now(),
-            status='sent'
-        )
-        st.session_state.messages.append(message.to_dict())
-        return message
+        return self.submit_user_message(content).message
     
     def set_typing_status(self, status: bool):
         """设置输入状态
@@ -91,7 +246,7 @@ class StateManager:
         Args:
             status: 是否正在输入
         """
-        st.session_state.typing_status = status
+        self._transact(lambda: setattr(self._state, 'typing_status', status))
     
     def set_pending_review(self, content: str, user_message_id: str) -> PendingReview:
         """设置待审核消息
@@ -110,50 +265,190 @@ class StateManager:
             timestamp=datetime.now(),
             user_message_id=user_message_id
         )
-        st.session_state.pending_review = pending.to_dict()
+        self._transact(lambda: setattr(self._state, 'pending_review', pending.to_dict()))
         return pending
     
-    def update_pending_content(self, content: str):
+    def update_pending_content(self, content: str,
+                               expected_version: Optional[int] = None) -> Optional[int]:
         """更新待审核消息的编辑内容
         
         Args:
             content: 编辑后的内容
+            expected_version: 编辑基于的版本号（不符时不更新）
+            
+        Returns:
+            更新后的版本号；没有待审核消息或版本号不符时返回None
         """
-        if st.session_state.pending_review:
-            st.session_state.pending_review['edited_content'] = content
+        def update() -> Optional[int]:
+            pending = self._state.pending_review
+            if not pending or (expected_version is not None
+                               and pending.get('version', 1) != expected_version):
+                return None
+            if pending['edited_content'] != content:
+                pending['edited_content'] = content
+                pending['version'] = pending.get('version', 1) + 1
+            return pending.get('version', 1)
+        
+        return self._transact(update)
     
-    def approve_message(self, final_content: Optional[str] = None) -> Optional[Message]:
-        """批准并发送消息
+    def _check_pending(self, expected_id: Optional[str],
+                       expected_version: Optional[int]) -> Optional[TransitionResult]:
+        """校验待审核消息是否仍是调用方看到的那一条（需在会话锁内调用）"""
+        pending = self._state.pending_review
+        if not pending:
+            return TransitionResult(TRANSITION_EMPTY if expected_id is None else TRANSITION_CONFLICT)
+        if ((expected_id is not None and pending['id'] != expected_id)
+                or (expected_version is not None and pending.get('version', 1) != expected_version)):
+            return TransitionResult(TRANSITION_CONFLICT, pending=dict(pending))
+        return None
+    
+    def approve_review(self, final_content: Optional[str] = None, expected_id: Optional[str] = None,
+                       expected_version: Optional[int] = None,
+                       idempotency_key: Optional[str] = None) -> TransitionResult:
+        """批准待审核消息（比较并交换）
         
         Args:
             final_content: 最终内容（如果为None则使用编辑后的内容）
+            expected_id: 期望的待审核消息ID
+            expected_version: 期望的待审核消息版本号
+            idempotency_key: 幂等键
             
         Returns:
-            创建的消息对象
+            转换结果，生效时附带发送的消息和被批准的待审核消息
         """
-        if not st.session_state.pending_review:
-            return None
+        def approve() -> TransitionResult:
+            previous = self._recall(idempotency_key)
+            if previous is not None:
+                return previous
+            conflict = self._check_pending(expected_id, expected_version)
+            if conflict is not None:
+                return conflict
+            
+            pending = dict(self._state.pending_review)
+            message = Message(
+                id=pending['id'],
+                content=final_content or pending['edited_content'],
+                sender='assistant',
+                timestamp=datetime.now(),
+                status='sent'
+            )
+            
+            self._state.messages.append(message.to_dict())
+            self._state.pending_review = None
+            self._state.typing_status = False
+            self._remember(idempotency_key, message=message, pending=pending)
+            return TransitionResult(TRANSITION_APPLIED, message, pending)
         
-        content = final_content or st.session_state.pending_review['edited_content']
+        return self._transact(approve)
+    
+    def reject_review(self, expected_id: Optional[str] = None, expected_version: Optional[int] = None,
+                      idempotency_key: Optional[str] = None,
+                      promote_alternative: bool = False) -> TransitionResult:
+        """拒绝待审核消息（比较并交换）
         
-        message = Message(
-            id=st.session_state.pending_review['id'],
-            content=content,
-            sender='assistant',
-            timestamp=datetime.now(),
-            status='sent'
-        )
+        Args:
+            expected_id: 期望的待审核消息ID
+            expected_version: 期望的待审核消息版本号
+            idempotency_key: 幂等键
+            promote_alternative: 有备选回复时将其换入为新的待审核消息
+            
+        Returns:
+            转换结果，生效时附带被拒绝的待审核消息，换入备选回复时replacement为新的待审核消息
+        """
+        def reject() -> TransitionResult:
+            previous = self._recall(idempotency_key)
+            if previous is not None:
+                return previous
+            conflict = self._check_pending(expected_id, expected_version)
+            if conflict is not None:
+                return conflict
+            
+            pending = dict(self._state.pending_review)
+            replacement = None
+            if promote_alternative and pending.get('alternative'):
+                replacement = PendingReview(
+                    id=str(uuid.uuid4()),
+                    original_content=pending['alternative'],
+                    edited_content=pending['alternative'],
+                    timestamp=datetime.now(),
+                    user_message_id=pending['user_message_id'],
+                    speculative=True
+                ).to_dict()
+            self._state.pending_review = replacement
+            self._state.typing_status = False
+            self._remember(idempotency_key, pending=pending)
+            return TransitionResult(TRANSITION_APPLIED, pending=pending, replacement=replacement)
+        
+        return self._transact(reject)
+    
+    def set_pending_alternative(self, pending_id: str, content: str) -> bool:
+        """为待审核消息附加备选回复
+        
+        Args:
+            pending_id: 生成备选回复时的待审核消息ID
+            content: 备选回复内容
+            
+        Returns:
+            是否已附加；该消息已被处理或已有备选回复时返回False
+        """
+        def update() -> bool:
+            pending = self._state.pending_review
+            if not pending or pending['id'] != pending_id or pending.get('alternative'):
+                return False
+            pending['alternative'] = content
+            return True
+        
+        return self._transact(update)
+    
+    def swap_alternative(self, expected_id: Optional[str] = None,
+                         expected_version: Optional[int] = None) -> TransitionResult:
+        """交换待审核消息的当前回复和备选回复（比较并交换）
+        
+        交换后编辑内容重置为新的当前回复，版本号加一；再次交换可切换回来。
+        
+        Args:
+            expected_id: 期望的待审核消息ID
+            expected_version: 期望的待审核消息版本号
+            
+        Returns:
+            转换结果，生效时pending为交换后的待审核消息；没有备选回复时状态为empty
+        """
+        def swap() -> TransitionResult:
+            conflict = self._check_pending(expected_id, expected_version)
+            if conflict is not None:
+                return conflict
+            
+            pending = self._state.pending_review
+            if not pending.get('alternative'):
+                return TransitionResult(TRANSITION_EMPTY, pending=dict(pending))
+            pending['original_content'], pending['alternative'] = (
+                pending['alternative'], pending['original_content']
+            )
+            pending['edited_content'] = pending['original_content']
+            pending['speculative'] = not pending.get('speculative', False)
+            pending['version'] = pending.get('version', 1) + 1
+            return TransitionResult(TRANSITION_APPLIED, pending=dict(pending))
         
-        st.session_state.messages.append(message.to_dict())
-        st.session_state.pending_review = None
-        st.session_state.typing_status = False
+        return self._transact(swap)
+    
+    def approve_message(self, final_content: Optional[str] = None) -> Optional[Message]:
+        """批准并发送消息
         
-        return message
+        Args:
+            final_content: 最终内容（如果为None则使用编辑后的内容）
+            
+        Returns:
+            创建的消息对象
+        """
+        return self.approve_review(final_content).message
     
-    def reject_message(self):
-        """拒绝消息"""
-        st.session_state.pending_review = None
-        st.session_state.typing_status = False
+    def reject_message(self) -> Optional[Dict[str, Any]]:
+        """拒绝消息
+        
+        Returns:
+            被拒绝的待审核消息（用于审计），没有待审核消息时返回None
+        """
+        return self.reject_review().pending
     
     def get_messages(self) -> List[Dict[str, Any]]:
         """获取消息列表
@@ -161,7 +456,8 @@ class StateManager:
         Returns:
             消息列表
         """
-        return st.session_state.messages
+        self._refresh()
+        return self._state.messages
     
     def get_pending_review(self) -> Optional[Dict[str, Any]]:
         """获取待审核消息
@@ -169,7 +465,8 @@ class StateManager:
         Returns:
             待审核消息或None
         """
-        return st.session_state.pending_review
+        self._refresh()
+        return self._state.pending_review
     
     def is_typing(self) -> bool:
         """检查是否正在输入
@@ -177,15 +474,16 @@ class StateManager:
         Returns:
             是否正在输入
         """
-        return st.session_state.typing_status
+        self._refresh()
+        return self._state.typing_status
     
-    def set_conversation_id(self, conversation_id: str):
+    def set_conversation_id(self, conversation_id: Optional[str]):
         """设置会话ID
         
         Args:
-            conversation_id: 会话ID
+            conversation_id: 会话ID（None表示下次调用开启新的Dify会话）
         """
-        st.session_state.conversation_id = conversation_id
+        self._transact(lambda: setattr(self._state, 'conversation_id', conversation_id))
     
     def get_conversation_id(self) -> Optional[str]:
         """获取会话ID
@@ -193,7 +491,32 @@ class StateManager:
         Returns:
             会话ID或None
         """
-        return st.session_state.conversation_id
+        self._refresh()
+        return self._state.conversation_id
+    
+    def get_context_state(self) -> ContextState:
+        """获取对话上下文状态
+        
+        Returns:
+            滚动摘要及当前Dify会话起始消息位置
+        """
+        self._refresh()
+        return ContextState(
+            summary=self._state.context_summary,
+            base_index=self._state.context_base_index
+        )
+    
+    def set_context_state(self, state: ContextState):
+        """设置对话上下文状态
+        
+        Args:
+            state: 上下文状态
+        """
+        def update():
+            self._state.context_summary = state.summary
+            self._state.context_base_index = state.base_index
+        
+        self._transact(update)
     
     def set_api_status(self, connected: bool):
         """设置API连接状态
@@ -201,7 +524,7 @@ class StateManager:
         Args:
             connected: 是否连接成功
         """
-        st.session_state.api_connected = connected
+        self._transact(lambda: setattr(self._state, 'api_connected', connected))
     
     def is_api_connected(self) -> bool:
         """检查API是否连接
@@ -209,14 +532,20 @@ class StateManager:
         Returns:
             API是否连接
         """
-        return st.session_state.api_connected
+        self._refresh()
+        return self._state.api_connected
     
     def clear_all(self):
         """清空所有数据"""
-        st.session_state.messages = []
-        st.session_state.pending_review = None
-        st.session_state.typing_status = False
-        st.session_state.conversation_id = None
+        def clear():
+            self._state.messages = []
+            self._state.pending_review = None
+            self._state.typing_status = False
+            self._state.conversation_id = None
+            self._state.context_summary = ""
+            self._state.context_base_index = 0
+        
+        self._transact(clear)
     
     def get_message_count(self) -> int:
         """获取消息总数
@@ -224,7 +553,8 @@ class StateManager:
         Returns:
             消息总数
         """
-        return len(st.session_state.messages)
+        self._refresh()
+        return len(self._state.messages)
     
     def get_pending_count(self) -> int:
         """获取待审核消息数量
@@ -232,4 +562,5 @@ class StateManager:
         Returns:
             待审核消息数量
         """
-        return 1 if st.session_state.pending_review else 0
\ No newline at end of file
+        self._refresh()
+        return 1 if self._state.pending_review else 0
\ No newline at end of file
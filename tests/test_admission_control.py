@@ -0,0 +1,195 @@
+"""入口准入控制（AIMD并发上限、排队与凭据归还）测试"""
+import asyncio
+
+import pytest
+
+from services.admission_control import (
+    AdmissionController, ADMISSION_ADMITTED, ADMISSION_QUEUED, ADMISSION_SHED,
+    REASON_BACKLOG, REASON_CONCURRENCY, REASON_REVIEW_QUEUE
+)
+from services.chat_pipeline import ChatPipeline
+from services.context_manager import ConversationContextManager
+from services.generation_registry import GenerationCancelled, CANCEL_CLEAR
+from services.session_store import SessionStore
+from services.state_manager import StateManager
+from utils.constants import ADMISSION_DECREASE
+
+class FakeDifyService:
+    """立即返回固定回复的Dify服务"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def chat_completion(self, message, conversation_id=None, inputs=None, user=None,
+                              lane=None, handle=None):
+        self.calls += 1
+        return {'success': True, 'content': f"回复: {message}", 'conversation_id': 'conv-1'}
+
+class FakeReviewMetrics:
+    """待审核队列长度可设置的审核指标，读取时检查没有持有准入锁"""
+
+    def __init__(self, controller_ref):
+        self.controller_ref = controller_ref
+        self.depth = 0
+
+    def queue_depth(self):
+        assert not self.controller_ref[0]._lock.locked()
+        return self.depth
+
+def make_pipeline(admission):
+    store = SessionStore()
+    pipeline = ChatPipeline(FakeDifyService(), ConversationContextManager(), store, admission=admission)
+    return pipeline, store
+
+def test_queue_positions_and_shed_when_backlog_full():
+    """达到并发上限后按顺序排队，排队满后不再受理"""
+    controller = AdmissionController(max_limit=1, max_waiting=2)
+
+    decisions = [controller.admit(10) for _ in range(4)]
+
+    assert [decision.action for decision in decisions] == [
+        ADMISSION_ADMITTED, ADMISSION_QUEUED, ADMISSION_QUEUED, ADMISSION_SHED
+    ]
+    assert [decision.position for decision in decisions[1:3]] == [1, 2]
+    assert decisions[1].reason == REASON_CONCURRENCY
+    assert decisions[3].reason == REASON_BACKLOG
+    assert decisions[3].ticket is None
+
+def test_release_grants_waiting_ticket_in_order():
+    """归还并发后按先来后到放行排队的消息"""
+    async def scenario():
+        controller = AdmissionController(max_limit=1, max_waiting=10)
+        first = controller.admit()
+        second = controller.admit()
+        third = controller.admit()
+        waiter = asyncio.create_task(controller.acquire(second.ticket))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        controller.release(first.ticket, 0.1, True)
+        await asyncio.wait_for(waiter, 1)
+        return controller, second, third
+
+    controller, second, third = asyncio.run(scenario())
+    assert second.ticket.granted
+    assert not third.ticket.granted
+    assert controller.stats()['inflight'] == 1
+    assert controller.stats()['waiting'] == 1
+
+def test_cancelled_acquire_withdraws_from_queue():
+    """等待中的生成被取消时撤出队列，重复撤回和归还没有效果"""
+    async def scenario():
+        controller = AdmissionController(max_limit=1)
+        first = controller.admit()
+        second = controller.admit()
+        waiter = asyncio.create_task(controller.acquire(second.ticket))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        controller.withdraw(second.ticket)
+        controller.release(second.ticket, 0.1, True)
+        return controller, first
+
+    controller, first = asyncio.run(scenario())
+    stats = controller.stats()
+    assert stats['waiting'] == 0
+    assert stats['withdrawn'] == 1
+    assert stats['inflight'] == 1
+    assert controller.admit().position == 1
+
+def test_review_queue_backlog_holds_messages():
+    """待审核队列加生成中草稿达到上限时排队，审核积压消化后放行；读取队列长度时不持有准入锁"""
+    controller_ref = []
+    metrics = FakeReviewMetrics(controller_ref)
+    controller = AdmissionController(max_limit=10, max_review_queue=3, review_metrics=metrics)
+    controller_ref.append(controller)
+    metrics.depth = 2
+
+    first = controller.admit()
+    second = controller.admit()
+    assert first.action == ADMISSION_ADMITTED
+    assert second.action == ADMISSION_QUEUED and second.reason == REASON_REVIEW_QUEUE
+
+    metrics.depth = 0
+    controller.release(first.ticket, 0.1, True)
+    assert second.ticket.granted
+    assert controller.stats()['review_queue'] == 0
+
+def test_aimd_adjusts_limit():
+    """延迟超标时乘性减少（同一延迟周期只减一次），快速成功时加性增加且不超过上限"""
+    controller = AdmissionController(max_limit=10, target_latency=1.0)
+
+    for _ in range(3):
+        controller.release(controller.admit().ticket, 2.0, True)
+    decreased = 10 * ADMISSION_DECREASE
+    assert controller.limit == pytest.approx(decreased)
+    assert controller.counters['decreased'] == 1
+
+    for _ in range(5):
+        controller.release(controller.admit().ticket, 0.1, True)
+    assert decreased < controller.limit < decreased + 1
+
+    for _ in range(200):
+        controller.release(controller.admit().ticket, 0.1, True)
+    assert controller.limit == pytest.approx(10.0)
+
+def test_pipeline_withdraws_ticket_when_generation_cancelled_before_start():
+    """草稿生成在开始前被取消时，排队的凭据也被撤回"""
+    controller = AdmissionController(max_limit=1)
+    pipeline, store = make_pipeline(controller)
+    first = StateManager(store.get_or_create('s1'))
+    second = StateManager(store.get_or_create('s2'))
+    pipeline.accept(first, "第一个问题")
+    result, _ = pipeline.accept(second, "第二个问题")
+    assert result.admission['status'] == ADMISSION_QUEUED
+
+    start = pipeline.generations.start
+
+    def start_cancelled(*args, **kwargs):
+        handle = start(*args, **kwargs)
+
+        async def run(awaitable, timeout=None):
+            # 取消发生在生成协程启动之前：协程被直接关闭
+            awaitable.close()
+            raise GenerationCancelled(CANCEL_CLEAR)
+
+        handle.run = run
+        return handle
+
+    pipeline.generations.start = start_cancelled
+    response = asyncio.run(pipeline.generate(second, result.message))
+
+    assert response['error'] == 'cancelled'
+    assert pipeline.dify_service.calls == 0
+    assert controller.stats()['waiting'] == 0
+    assert controller.stats()['inflight'] == 1
+
+def test_pipeline_withdraws_ticket_when_submit_fails():
+    """提交用户消息失败时撤回已取得的凭据"""
+    controller = AdmissionController(max_limit=1)
+    pipeline, store = make_pipeline(controller)
+    state_manager = StateManager(store.get_or_create('s1'))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("状态后端不可用")
+
+    state_manager.submit_user_message = fail
+    with pytest.raises(RuntimeError):
+        pipeline.accept(state_manager, "你好")
+
+    assert controller.stats()['inflight'] == 0
+    assert controller.stats()['withdrawn'] == 1
+
+def test_pipeline_releases_ticket_after_generation():
+    """草稿生成完成后归还并发"""
+    controller = AdmissionController(max_limit=1)
+    pipeline, store = make_pipeline(controller)
+    state_manager = StateManager(store.get_or_create('s1'))
+    result, _ = pipeline.accept(state_manager, "你好")
+
+    response = asyncio.run(pipeline.generate(state_manager, result.message))
+
+    assert response['success']
+    assert controller.stats()['inflight'] == 0
+    assert controller.stats()['completed'] == 1
@@ -0,0 +1,75 @@
+"""已批准回复知识库测试"""
+from services.answer_library import AnswerLibrary
+from services.audit_log import AUDIT_EVENT_APPROVE, AUDIT_EVENT_USER_MESSAGE
+from services.event_bus import EventBus, EVENT_APPROVED
+from services.state_backend import InMemoryStateBackend
+
+REFUND = "退款会在3到5个工作日内原路退回您的账户"
+LIMIT = "信用卡额度可以在App中申请临时提升"
+
+def test_add_dedupes_answers_and_skips_short_replies():
+    """相同回复只保留一个条目，不同问题都加入索引；过短的回复不收录"""
+    library = AnswerLibrary()
+    assert library.add("退款多久到账", REFUND)
+    assert not library.add("退款多久到账", REFUND)
+    assert library.add("退款什么时候能到", "  " + REFUND + "  ", edited=True)
+    assert not library.add("你好", "好的")
+    assert not library.add("", REFUND)
+
+    assert len(library) == 1
+    assert library.stats() == {'entries': 1, 'edited': 1, 'questions': 2}
+
+def test_suggest_similar_questions():
+    """按相似度返回已批准回复，每个条目只出现一次，不相关的问题不推荐"""
+    library = AnswerLibrary()
+    library.add("退款多久到账", REFUND)
+    library.add("退款一般几天到账", REFUND)
+    library.add("信用卡额度怎么提升", LIMIT)
+
+    matches = library.suggest("我的退款多久能到账")
+    assert [match.entry.answer for match in matches] == [REFUND]
+    assert matches[0].question == "退款多久到账"
+    assert [match.entry.answer for match in library.suggest("提升额度")] == [LIMIT]
+    assert library.suggest("今天天气怎么样") == []
+    assert library.suggest("") == []
+
+def test_removed_entry_not_suggested_or_readded():
+    """移出知识库的条目不再推荐，之后相同回复也不再收录"""
+    library = AnswerLibrary()
+    library.add("退款多久到账", REFUND)
+    entry_id = AnswerLibrary.entry_id(REFUND)
+    assert library.remove(entry_id)
+    assert not library.remove(entry_id)
+    assert library.suggest("退款多久到账") == []
+    assert not library.add("退款几天到账", REFUND)
+    assert len(library) == 0
+
+def test_approved_events_and_backfill():
+    """订阅批准事件收录（回复与草稿不同时记为修改过），从审计记录回填"""
+    library = AnswerLibrary()
+    event_bus = EventBus()
+    library.attach(event_bus)
+    event_bus.publish(EVENT_APPROVED, "s1", question="退款多久到账", draft="三天",
+                      message={'content': REFUND})
+    event_bus.publish(EVENT_APPROVED, "s1", message={'content': LIMIT})
+    assert library.stats() == {'entries': 1, 'edited': 1, 'questions': 1}
+
+    events = [
+        {'event': AUDIT_EVENT_USER_MESSAGE, 'message_id': "u1", 'content': "额度怎么提升"},
+        {'event': AUDIT_EVENT_APPROVE, 'user_message_id': "u1", 'final': LIMIT},
+        {'event': AUDIT_EVENT_APPROVE, 'user_message_id': "missing", 'final': "没有对应问题的回复内容"},
+    ]
+    assert library.backfill(events) == 1
+    assert library.stats()['entries'] == 2
+
+def test_replicas_share_entries_through_backend():
+    """配置共享后端时，副本收录和移除的条目在其他副本上可见"""
+    backend = InMemoryStateBackend()
+    first, second = AnswerLibrary(backend), AnswerLibrary(backend)
+    first.add("退款多久到账", REFUND)
+    assert [match.entry.answer for match in second.suggest("退款多久到账")] == [REFUND]
+
+    second.add("退款几天能到", REFUND)
+    second.remove(AnswerLibrary.entry_id(REFUND))
+    assert first.suggest("退款多久到账") == []
+    assert first.stats()['questions'] == 2
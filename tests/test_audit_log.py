@@ -0,0 +1,104 @@
+"""审计日志（组提交、索引、崩溃恢复与多进程段文件）测试"""
+import json
+import os
+
+from services import audit_log as audit_module
+from services.audit_log import AuditLog, AUDIT_EVENT_APPROVE, AUDIT_EVENT_DRAFT
+
+def write_records(log, count, conversation='c1', **data):
+    """追加记录并等待落盘，返回消息ID列表"""
+    ids = [f"{conversation}-m{index}" for index in range(count)]
+    for message_id in ids:
+        log.append(AUDIT_EVENT_DRAFT, conversation_id=conversation, message_id=message_id, **data)
+    assert log.wait_durable(timeout=5)
+    return ids
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".jsonl"))
+
+def test_index_lookup_and_scan(tmp_path):
+    """按会话/消息ID定位记录，按时间范围和事件类型扫描"""
+    log = AuditLog(str(tmp_path), commit_interval=0)
+    ids = write_records(log, 5)
+    log.append(AUDIT_EVENT_APPROVE, conversation_id='c2', message_id='c2-m0', final="好的")
+    log.close()
+
+    assert [record['message_id'] for record in log.get_by_conversation('c1')] == ids
+    assert log.get_by_message('c2-m0')[0]['final'] == "好的"
+    assert [record['message_id'] for record in log.scan(event=AUDIT_EVENT_APPROVE)] == ['c2-m0']
+    start = log.get_by_message(ids[2])[0]['ts']
+    assert [record['message_id'] for record in log.scan(start=start, event=AUDIT_EVENT_DRAFT)] == ids[2:]
+
+def test_rotation_and_reopen_rebuilds_index(tmp_path):
+    """段文件按大小轮转，重新打开后索引与原来一致"""
+    log = AuditLog(str(tmp_path), segment_max_bytes=600, commit_interval=0)
+    ids = write_records(log, 20, draft="x" * 50)
+    log.close()
+    assert len(segment_files(tmp_path)) > 1
+
+    reopened = AuditLog(str(tmp_path), read_only=True)
+
+    assert [record['message_id'] for record in reopened.get_by_conversation('c1')] == ids
+    assert [record['message_id'] for record in reopened.scan()] == ids
+
+def test_recovery_skips_torn_tail_and_corrupt_lines(tmp_path):
+    """崩溃留下的不完整尾部不纳入索引，中间损坏的行跳过并计数"""
+    log = AuditLog(str(tmp_path), commit_interval=0)
+    ids = write_records(log, 3)
+    log.close()
+    path = os.path.join(tmp_path, segment_files(tmp_path)[0])
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+    with open(path, 'wb') as f:
+        f.write(lines[0] + b"{not json\n" + b"".join(lines[1:]) + b'{"event": "dra')
+
+    reopened = AuditLog(str(tmp_path), commit_interval=0)
+    more = write_records(reopened, 1, conversation='c2')
+    reopened.close()
+
+    assert reopened.stats()['corrupt_lines'] == 1
+    assert [record['message_id'] for record in reopened.get_by_conversation('c1')] == ids
+    assert [record['message_id'] for record in reopened.scan()] == ids + more
+
+def test_each_writer_uses_own_segments(tmp_path):
+    """同一目录下的多个写入者各自写入自己的段文件，互不交错"""
+    first = AuditLog(str(tmp_path), commit_interval=0)
+    second = AuditLog(str(tmp_path), commit_interval=0)
+    a = write_records(first, 3, conversation='a')
+    b = write_records(second, 3, conversation='b')
+    first.close()
+    second.close()
+
+    assert len(segment_files(tmp_path)) == 2
+    for name in segment_files(tmp_path):
+        with open(os.path.join(tmp_path, name), 'rb') as f:
+            conversations = {json.loads(line)['conversation_id'] for line in f}
+        assert len(conversations) == 1
+
+    reopened = AuditLog(str(tmp_path), read_only=True)
+    assert [record['message_id'] for record in reopened.get_by_conversation('a')] == a
+    assert [record['message_id'] for record in reopened.get_by_conversation('b')] == b
+    records = list(reopened.scan())
+    assert [record['ts'] for record in records] == sorted(record['ts'] for record in records)
+
+def test_failed_write_requeues_only_unwritten_records(tmp_path, monkeypatch):
+    """一批记录写到一半失败时，只重新写入未落盘的记录，不产生重复"""
+    log = AuditLog(str(tmp_path), segment_max_bytes=400, commit_interval=0.1)
+    fsync = audit_module.os.fsync
+    calls = {'count': 0}
+
+    def flaky_fsync(fd):
+        calls['count'] += 1
+        if calls['count'] == 2:
+            raise OSError("磁盘已满")
+        fsync(fd)
+
+    monkeypatch.setattr(audit_module.os, 'fsync', flaky_fsync)
+    monkeypatch.setattr(audit_module.time, 'sleep', lambda seconds: None)
+    ids = write_records(log, 6, draft="y" * 60)
+    log.close()
+
+    assert calls['count'] > 2
+    assert [record['message_id'] for record in log.get_by_conversation('c1')] == ids
+    reopened = AuditLog(str(tmp_path), read_only=True)
+    assert [record['message_id'] for record in reopened.scan()] == ids
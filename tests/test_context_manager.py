@@ -0,0 +1,59 @@
+"""对话上下文窗口管理测试"""
+from services.context_manager import ContextState, ConversationContextManager
+from utils.constants import CONTEXT_RECENT_INPUT, CONTEXT_SUMMARY_INPUT
+
+def message(sender, index):
+    return {'sender': sender, 'content': f"第{index}条消息。" + "内容" * 20}
+
+def run_conversation(manager, turns):
+    """模拟多轮对话，返回每次压缩时的(消息列表, 上下文方案)"""
+    messages, state, compactions = [], ContextState(), []
+    for turn in range(turns):
+        messages.append(message('user', len(messages)))
+        plan = manager.prepare(messages, state)
+        if plan.compacted:
+            compactions.append((list(messages), plan))
+        state = plan.state
+        messages.append(message('assistant', len(messages)))
+    return compactions
+
+def test_no_compaction_within_budget():
+    """历史未超出预算时沿用当前会话"""
+    manager = ConversationContextManager(token_budget=10 ** 6)
+    messages = [message('user', 0), message('assistant', 1), message('user', 2)]
+    plan = manager.prepare(messages, ContextState())
+    assert not plan.compacted and plan.history_tokens > 0 and plan.state == ContextState()
+
+def test_every_turn_in_summary_or_recent_window():
+    """每次压缩后，当前消息之前的每一轮都在摘要或最近窗口中，不会丢失"""
+    manager = ConversationContextManager(token_budget=200, keep_turns=2, summary_max_chars=10 ** 6)
+    compactions = run_conversation(manager, 30)
+    assert len(compactions) >= 3
+
+    for messages, plan in compactions:
+        summary = plan.inputs[CONTEXT_SUMMARY_INPUT]
+        recent = plan.inputs[CONTEXT_RECENT_INPUT]
+        for index in range(len(messages) - 1):
+            marker = f"第{index}条消息。"
+            assert (marker in summary) != (marker in recent), index
+        # 最近K轮保留原文
+        assert recent.count("第") == manager.keep_turns * 2
+
+def test_recent_window_counted_after_compaction():
+    """压缩后最近K轮仍计入新会话的历史，备选草稿的完整上下文也包含它们"""
+    manager = ConversationContextManager(token_budget=200, keep_turns=2, summary_max_chars=10 ** 6)
+    messages, plan = run_conversation(manager, 30)[-1]
+    assert plan.state.base_index == len(messages) - 1 - manager.keep_turns * 2
+
+    messages = messages + [message('assistant', len(messages)), message('user', len(messages) + 1)]
+    follow_up = manager.prepare(messages, plan.state)
+    inputs = manager.standalone_inputs(messages, follow_up)
+    for index in range(len(messages) - 1):
+        marker = f"第{index}条消息。"
+        assert marker in inputs[CONTEXT_SUMMARY_INPUT] or marker in inputs[CONTEXT_RECENT_INPUT], index
+
+def test_summary_truncated_to_max_chars():
+    """摘要超长时丢弃最早的摘要行"""
+    manager = ConversationContextManager(token_budget=100, keep_turns=1, summary_max_chars=80)
+    for _, plan in run_conversation(manager, 20):
+        assert len(plan.inputs[CONTEXT_SUMMARY_INPUT]) <= 80
@@ -0,0 +1,99 @@
+"""对话记录流式导出测试"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.audit_log import AuditLog, AUDIT_EVENT_APPROVE, AUDIT_EVENT_DRAFT, AUDIT_EVENT_USER_MESSAGE
+from services.conversation_export import (
+    ExportFilter, export_records, export_to_spooled_file, iter_audit_messages, iter_session_messages, main
+)
+
+def record(timestamp, conversation_id="c1", status="sent"):
+    return {'conversation_id': conversation_id, 'message_id': "m", 'sender': "user",
+            'status': status, 'timestamp': timestamp, 'content': "你好"}
+
+@pytest.fixture
+def audit_dir(tmp_path):
+    audit_log = AuditLog(str(tmp_path), commit_interval=0)
+    for index in range(3):
+        for conversation_id in ("A", "B"):
+            message_id = f"{conversation_id}{index}"
+            audit_log.append(AUDIT_EVENT_USER_MESSAGE, conversation_id, message_id, content=f"问题{message_id}")
+            audit_log.append(AUDIT_EVENT_DRAFT, conversation_id, message_id, draft=f"草稿{message_id}")
+            audit_log.append(AUDIT_EVENT_APPROVE, conversation_id, message_id, final=f"回复{message_id}")
+    audit_log.wait_durable()
+    audit_log.close()
+    return str(tmp_path)
+
+def test_filter_mixes_naive_and_aware_timestamps():
+    """记录时间和过滤时间分别带或不带时区时按同一时刻比较，不会抛出TypeError"""
+    now = datetime.now()
+    aware_now = now.astimezone()
+    naive_record = record(now.isoformat())
+    aware_record = record(now.astimezone(timezone.utc).isoformat())
+
+    for item in (naive_record, aware_record):
+        assert ExportFilter(since=aware_now - timedelta(seconds=1)).match(item)
+        assert not ExportFilter(since=aware_now + timedelta(seconds=1)).match(item)
+        assert ExportFilter(until=now + timedelta(seconds=1)).match(item)
+        assert not ExportFilter(until=now - timedelta(seconds=1)).match(item)
+
+def test_filter_conversation_and_status():
+    """按会话和状态过滤"""
+    assert not ExportFilter(conversation_id="c2").match(record("2024-01-01T00:00:00"))
+    assert not ExportFilter(statuses={"draft"}).match(record("2024-01-01T00:00:00"))
+    assert ExportFilter(conversation_id="c1", statuses={"sent"}).match(record("2024-01-01T00:00:00"))
+
+def test_export_session_messages_formats():
+    """会话消息导出为JSON Lines和CSV"""
+    messages = [{'id': f"m{index}", 'sender': "user", 'status': "sent",
+                 'timestamp': "2024-01-01T00:00:00", 'content': f"消息,{index}"} for index in range(3)]
+    with export_to_spooled_file(iter_session_messages(messages, "c1"), 'jsonl') as export_file:
+        lines = export_file.read().decode("utf-8").splitlines()
+    assert [json.loads(line)['message_id'] for line in lines] == ["m0", "m1", "m2"]
+
+    target = io.BytesIO()
+    assert export_records(iter_session_messages(messages, "c1"), 'csv', target) == 3
+    rows = list(csv.DictReader(io.StringIO(target.getvalue().decode("utf-8"))))
+    assert [row['content'] for row in rows] == ["消息,0", "消息,1", "消息,2"]
+
+    with pytest.raises(ValueError):
+        export_records([], 'xml', io.BytesIO())
+
+def test_audit_messages_by_conversation_and_time(audit_dir):
+    """按会话索引读取或按时间范围扫描审计日志"""
+    audit_log = AuditLog(audit_dir, read_only=True)
+    try:
+        records = list(iter_audit_messages(audit_log, ExportFilter(conversation_id="B")))
+        assert [item['message_id'] for item in records if item['status'] == "sent" and item['sender'] == "user"] \
+            == ["B0", "B1", "B2"]
+        assert {item['status'] for item in records} == {"sent", "draft"}
+
+        future = datetime.now(timezone.utc) + timedelta(hours=1)
+        assert list(iter_audit_messages(audit_log, ExportFilter(since=future))) == []
+        grouped = list(iter_audit_messages(audit_log, group_by_conversation=True))
+        assert [item['conversation_id'] for item in grouped] == ["A"] * 9 + ["B"] * 9
+    finally:
+        audit_log.close()
+
+def test_cli_markdown_with_aware_since(audit_dir, tmp_path, capsys):
+    """命令行带时区的起始时间可以过滤本地时间记录，Markdown每个会话一个标题"""
+    output = str(tmp_path / "export.md")
+    since = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    main(['--audit-dir', audit_dir, '--format', 'markdown', '--output', output, '--since', since])
+
+    text = open(output, encoding="utf-8").read()
+    assert text.count("## 会话") == 2 and "**会话**" not in text
+    assert "消息总数: 18" in text
+    assert "已导出 18 条消息" in capsys.readouterr().out
+
+def test_parquet_export(tmp_path):
+    """安装pyarrow时可以导出Parquet"""
+    parquet = pytest.importorskip("pyarrow.parquet")
+    output = tmp_path / "export.parquet"
+    with open(output, 'wb') as target:
+        assert export_records([record("2024-01-01T00:00:00")] * 3, 'parquet', target) == 3
+    assert parquet.read_table(str(output)).num_rows == 3
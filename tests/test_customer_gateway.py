@@ -0,0 +1,155 @@
+"""客户接入端点（会话令牌、请求校验、线程池受理）测试"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("starlette")
+
+from services.chat_pipeline import ChatPipeline
+from services.context_manager import ConversationContextManager
+from services.customer_gateway import CustomerGateway, WS_CLOSE_UNKNOWN_SESSION
+from services.session_store import SESSION_ROLE_SUPERVISOR, SessionStore
+
+class FakeDifyService:
+    """立即返回固定回复的Dify服务"""
+
+    async def chat_completion(self, message, conversation_id=None, inputs=None, user=None,
+                              lane=None, handle=None):
+        return {'success': True, 'content': f"回复: {message}", 'conversation_id': 'conv-1'}
+
+def make_gateway(auto_approve=False):
+    store = SessionStore()
+    pipeline = ChatPipeline(FakeDifyService(), ConversationContextManager(), store)
+    gateway = CustomerGateway(pipeline, store, auto_approve=auto_approve, secret=b"test-secret")
+    return gateway, gateway.create_app()
+
+def scope(kind, path):
+    return {
+        'type': kind, 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+        'headers': [(b'content-type', b'application/json')], 'client': ('test', 1), 'server': ('test', 80),
+        'subprotocols': [],
+    }
+
+async def http(app, method, path, body=None):
+    """直接调用ASGI应用发起HTTP请求，返回(状态码, JSON响应)"""
+    raw = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b''
+    requests = [{'type': 'http.request', 'body': raw, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return requests.pop(0) if requests else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({**scope('http', path), 'method': method}, receive, send)
+    return sent[0]['status'], json.loads(b''.join(message.get('body', b'') for message in sent[1:]))
+
+class WebSocketClient:
+    """直接调用ASGI应用的WebSocket客户端"""
+
+    def __init__(self, app, path):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        self.incoming.put_nowait({'type': 'websocket.connect'})
+        self.task = asyncio.create_task(app(scope('websocket', path), self.incoming.get, self.outgoing.put))
+
+    async def receive(self):
+        return await asyncio.wait_for(self.outgoing.get(), 5)
+
+    async def receive_json(self):
+        message = await self.receive()
+        assert message['type'] == 'websocket.send', message
+        return json.loads(message['text'])
+
+    def send_text(self, text):
+        self.incoming.put_nowait({'type': 'websocket.receive', 'text': text})
+
+    async def close(self):
+        self.incoming.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 5)
+
+async def drain(gateway):
+    while gateway._tasks:
+        await asyncio.gather(*list(gateway._tasks))
+
+def test_token_signature():
+    """只接受本端点签发的令牌"""
+    gateway, _ = make_gateway()
+    token = gateway.issue_token("abc")
+    assert gateway.verify_token(token) == "abc"
+    assert gateway.verify_token("abc") is None
+    assert gateway.verify_token(token[:-1] + ("0" if token[-1] != "0" else "1")) is None
+    assert gateway.verify_token(CustomerGateway(gateway.pipeline, gateway.session_store,
+                                                secret=b"other").issue_token("abc")) is None
+
+def test_unknown_forged_and_supervisor_sessions_rejected():
+    """客户端自选的会话ID、已过期会话和监督者会话一律拒绝"""
+    async def scenario():
+        gateway, app = make_gateway()
+        gateway.session_store.get_or_create("supervisor-1", SESSION_ROLE_SUPERVISOR)
+        for session_id in ("my-own-id", gateway.issue_token("never-created"), gateway.issue_token("supervisor-1")):
+            status, body = await http(app, 'POST', f"/api/sessions/{session_id}/messages", {'content': "你好"})
+            assert status == 404, session_id
+            assert (await http(app, 'GET', f"/api/sessions/{session_id}/messages"))[0] == 404
+        assert gateway.session_store.get("my-own-id") is None
+        assert gateway.session_store.get("supervisor-1").get('messages') is None
+    asyncio.run(scenario())
+
+def test_post_message_validates_body_and_submits_in_threadpool():
+    """请求体不是JSON对象时返回400；受理在线程池中执行，不阻塞事件循环"""
+    async def scenario():
+        gateway, app = make_gateway()
+        status, body = await http(app, 'POST', "/api/sessions")
+        assert status == 201
+        path = f"/api/sessions/{body['session_id']}/messages"
+
+        for bad in (b"not json", [1, 2], "text", {'content': ["x"]}, {'content': "x", 'idempotency_key': 1}):
+            assert (await http(app, 'POST', path, bad))[0] == 400, bad
+
+        threads = []
+        accept = gateway.pipeline.accept
+        gateway.pipeline.accept = lambda *args: threads.append(threading.current_thread()) or accept(*args)
+        status, body = await http(app, 'POST', path, {'content': "你好", 'idempotency_key': "k1"})
+        assert status == 202 and body['message']['content'] == "你好"
+        assert threads and threads[0] is not threading.current_thread()
+
+        status, body = await http(app, 'POST', path, {'content': "你好", 'idempotency_key': "k1"})
+        assert status == 200 and body['duplicate']
+        await drain(gateway)
+        status, body = await http(app, 'GET', path)
+        assert status == 200 and [message['content'] for message in body['messages']] == ["你好"]
+    asyncio.run(scenario())
+
+def test_websocket_error_frames_and_reply():
+    """格式错误的消息回复错误帧且不断开连接，批准后的回复推送到连接"""
+    async def scenario():
+        gateway, app = make_gateway(auto_approve=True)
+        _, body = await http(app, 'POST', "/api/sessions")
+        client = WebSocketClient(app, f"/api/sessions/{body['session_id']}/ws")
+        assert (await client.receive())['type'] == 'websocket.accept'
+
+        for bad in ("not json", "[1, 2]", '{"content": 3}'):
+            client.send_text(bad)
+            assert (await client.receive_json())['type'] == 'error'
+
+        client.send_text(json.dumps({'content': "你好"}))
+        assert (await client.receive_json())['type'] == 'accepted'
+        reply = await client.receive_json()
+        assert reply['type'] == 'reply' and reply['message']['content'] == "回复: 你好"
+        await client.close()
+    asyncio.run(scenario())
+
+def test_websocket_unknown_session_closed():
+    """令牌无效时拒绝建立连接"""
+    async def scenario():
+        _, app = make_gateway()
+        client = WebSocketClient(app, "/api/sessions/forged/ws")
+        assert (await client.receive())['type'] == 'websocket.accept'
+        message = await client.receive()
+        assert message == {'type': 'websocket.close', 'code': WS_CLOSE_UNKNOWN_SESSION, 'reason': ''}
+        await asyncio.wait_for(client.task, 5)
+    asyncio.run(scenario())
@@ -0,0 +1,147 @@
+"""Dify传输层录制与回放测试"""
+import gzip
+import io
+import json
+import time
+
+import pytest
+import requests
+
+from services.dify_transport import (
+    RecordingTransport, ReplayTransport, TrafficArchive, archive_files, create_transport, load_archive,
+    request_key, scrub, summarize
+)
+
+BASE_URL = "http://dify.local/v1"
+API_KEY = "app-SECRETSECRETSECRET123"
+
+class FakeRaw:
+    """按分块返回的响应数据流"""
+
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+
+    def stream(self, amt=None, decode_content=None):
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            yield chunk
+
+    def read(self, amt=None, *args, **kwargs):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def close(self):
+        pass
+
+class FakeHTTP:
+    """返回固定响应或抛出异常的内层传输层"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if url.endswith("/timeout"):
+            raise requests.exceptions.ReadTimeout("read timed out")
+        response = requests.Response()
+        response.status_code = 200
+        response.encoding = 'utf-8'
+        if kwargs.get('stream'):
+            response.headers['Content-Type'] = 'text/event-stream'
+            # 多字节字符被拆在两个分块中
+            data = 'data: {"answer": "你好"}\n\n'.encode('utf-8')
+            response.raw = FakeRaw([data[:15], data[15:], f'data: {{"key": "{API_KEY}"}}\n\n'.encode()], 0.05)
+        else:
+            response.headers['Content-Type'] = 'application/json'
+            response._content = json.dumps({'answer': f"回复: {kwargs['json']['query']}",
+                                            'token': f"Bearer {API_KEY}"}).encode('utf-8')
+        return response
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def archive_dir(tmp_path):
+    """录制若干交互后的存档目录"""
+    directory = str(tmp_path / "archive")
+    transport = RecordingTransport(FakeHTTP(), TrafficArchive(directory), BASE_URL, [API_KEY])
+    for query in ("你好", "退款"):
+        transport.post(f"{BASE_URL}/chat-messages", json={'query': query, 'user': "u1", 'api_key': API_KEY},
+                       headers={'Authorization': f"Bearer {API_KEY}"})
+    response = transport.post(f"{BASE_URL}/chat-messages/stream", json={'query': "流式"}, stream=True)
+    assert b''.join(response.iter_content(None)).decode('utf-8').startswith('data: {"answer": "你好"}')
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        transport.post(f"{BASE_URL}/timeout", json={})
+    transport.close()
+    return directory
+
+def test_scrub_and_request_key():
+    """密钥字段、Bearer令牌和已知密钥值被替换；宽松匹配键忽略会话ID和用户"""
+    scrubbed = scrub({'api_key': "k", 'nested': [f"token {API_KEY}", "Bearer abc"], 'n': 1}, [API_KEY])
+    assert scrubbed == {'api_key': "[REDACTED]", 'nested': ["token [REDACTED]", "Bearer [REDACTED]"], 'n': 1}
+    assert scrub('{"auth": "Bearer abc.def"}') == '{"auth": "Bearer [REDACTED]"}'
+
+    first = {'query': "你好", 'user': "u1", 'conversation_id': "c1"}
+    second = {'query': "你好", 'user': "u2", 'conversation_id': ""}
+    assert request_key('post', "/chat-messages", first) != request_key('POST', "/chat-messages", second)
+    assert request_key('post', "/chat-messages", first, loose=True) == \
+        request_key('POST', "/chat-messages", second, loose=True)
+
+def test_archive_has_no_secrets(archive_dir):
+    """存档记录相对路径、状态、延迟和流式分块，不包含密钥"""
+    records = list(load_archive(archive_dir))
+    assert [record['path'] for record in records] == \
+        ["/chat-messages", "/chat-messages", "/chat-messages/stream", "/timeout"]
+    assert API_KEY not in json.dumps(records, ensure_ascii=False)
+    stream = records[2]
+    assert "".join(text for _, text in stream['chunks']).startswith('data: {"answer": "你好"}')
+    assert stream['duration'] >= stream['chunks'][-1][0] >= 0.1
+    assert records[3]['error'] == "ReadTimeout"
+    assert json.loads(records[0]['body'])['token'] == "Bearer [REDACTED]"
+    summary = summarize(records)
+    assert summary['POST /chat-messages']['requests'] == 2
+    assert summary['POST /timeout']['errors'] == 1
+
+def test_replay_matching_order(archive_dir):
+    """回放按精确、宽松、同路径轮流的顺序匹配；严格模式下找不到时报连接错误"""
+    replay = ReplayTransport(archive_dir, "http://other:1/v1", time_scale=0)
+    url = "http://other:1/v1/chat-messages"
+    assert replay.post(url, json={'query': "退款", 'user': "u1", 'api_key': API_KEY}).json()['answer'] == "回复: 退款"
+    assert replay.post(url, json={'query': "退款", 'user': "u2", 'api_key': "other"}).json()['answer'] == "回复: 退款"
+    assert replay.post(url, json={'query': "新问题"}).json()['answer'] == "回复: 你好"
+    assert replay.post(url, json={'query': "新问题"}).json()['answer'] == "回复: 退款"
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        replay.post("http://other:1/v1/timeout", json={})
+    assert replay.counters == {'exact': 2, 'loose': 1, 'fallback': 2, 'miss': 0}
+
+    strict = ReplayTransport(archive_dir, BASE_URL, time_scale=0, strict=True)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        strict.post(f"{BASE_URL}/chat-messages", json={'query': "新问题"})
+    assert strict.counters['miss'] == 1
+
+def test_replay_stream_keeps_chunk_timing(archive_dir):
+    """流式响应按录制的分块时间返回，time_scale缩放等待时间"""
+    for time_scale, minimum, maximum in ((1.0, 0.1, 1.0), (0.0, 0.0, 0.05)):
+        replay = create_transport("replay", archive_dir, BASE_URL, time_scale)
+        started = time.perf_counter()
+        response = replay.post(f"{BASE_URL}/chat-messages/stream", json={'query': "流式"}, stream=True)
+        lines = [line for line in response.iter_lines(decode_unicode=True) if line]
+        elapsed = time.perf_counter() - started
+        assert lines[0] == 'data: {"answer": "你好"}' and len(lines) == 2
+        assert minimum <= elapsed <= maximum
+
+def test_truncated_segment_readable(archive_dir, tmp_path):
+    """录制进程异常退出时，段文件读到截断处为止"""
+    data = gzip.open(archive_files(archive_dir)[0], 'rb').read()
+    buffer = io.BytesIO()
+    writer = gzip.GzipFile(fileobj=buffer, mode='wb')
+    writer.write(data + b'{"method": "POST", "pa')
+    writer.flush()
+    truncated = tmp_path / "truncated.jsonl.gz"
+    truncated.write_bytes(buffer.getvalue())  # 没有gzip结尾
+    assert len(list(load_archive(str(truncated)))) == 4
+
+def test_unknown_mode_rejected():
+    """不支持的传输模式报错"""
+    with pytest.raises(ValueError):
+        create_transport("proxy")
@@ -0,0 +1,107 @@
+"""会话事件总线与本地事件代理测试"""
+import socket
+import time
+from multiprocessing.connection import AuthenticationError, Client
+
+import pytest
+
+from config.settings import EventBusConfig
+from services.event_bus import (
+    EVENT_APPROVED, EVENT_DRAFT_READY, EVENT_MESSAGE_ADDED, Event, EventBroker, EventBus, main
+)
+
+AUTHKEY = b"test-authkey"
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+@pytest.fixture
+def broker():
+    broker = EventBroker("127.0.0.1", 0, AUTHKEY).start()
+    yield broker
+    broker.close()
+
+def test_publish_subscribe_and_versions():
+    """订阅者按类型收到事件，会话版本号随事件递增"""
+    bus = EventBus(history_size=10)
+    received = []
+    subscription = bus.subscribe(received.append, [EVENT_APPROVED])
+    bus.publish(EVENT_MESSAGE_ADDED, "s1", message_id="m1")
+    bus.publish(EVENT_APPROVED, "s1", message={'content': "好的"})
+    bus.publish(EVENT_DRAFT_READY, "s2")
+
+    assert [event.event_type for event in received] == [EVENT_APPROVED]
+    assert bus.version("s1") == 2 and bus.version("s2") == 3 and bus.version() == 3
+    assert [event.seq for event in bus.events_since(1, session_id="s1")] == [2]
+    bus.unsubscribe(subscription)
+    bus.publish(EVENT_APPROVED, "s1")
+    assert len(received) == 1
+
+def test_event_json_roundtrip():
+    """事件编码为JSON，非法内容解码时报ValueError"""
+    event = Event(1, EVENT_APPROVED, "s1", 1.5, {'message': {'content': "你好"}}, "node")
+    assert Event.decode(event.encode()) == event
+    for payload in (b"not json", b"[1]", b'{"seq": 1}', b'{"seq": 1, "evil": 2}'):
+        with pytest.raises(ValueError):
+            Event.decode(payload)
+
+def test_authkey_required(monkeypatch, capsys):
+    """代理、代理连接和命令行都不接受空密钥"""
+    with pytest.raises(ValueError):
+        EventBroker("127.0.0.1", 0, b"")
+    with pytest.raises(ValueError):
+        EventBus().attach_broker(("127.0.0.1", 1), b"")
+
+    monkeypatch.delenv("EVENT_BROKER_AUTHKEY", raising=False)
+    with pytest.raises(SystemExit):
+        main(["--address", "127.0.0.1:0"])
+    assert "EVENT_BROKER_AUTHKEY" in capsys.readouterr().err
+
+    with pytest.raises(ValueError):
+        EventBusConfig(broker_address="127.0.0.1:8610").validate()
+    EventBusConfig().validate()
+    EventBusConfig(broker_address="127.0.0.1:8610", broker_authkey="k").validate()
+
+def test_broker_relays_between_processes(broker):
+    """经代理转发的事件投递到其他总线，不回送给发布者"""
+    first, second = EventBus(), EventBus()
+    first.attach_broker(broker.address, AUTHKEY)
+    second.attach_broker(broker.address, AUTHKEY)
+    received = []
+    second.subscribe(received.append)
+    own = []
+    first.subscribe(own.append)
+    try:
+        wait_for(lambda: len(broker._connections) == 2 and first._bridge._conn and second._bridge._conn)
+        first.publish(EVENT_APPROVED, "s1", message={'content': "你好"})
+        wait_for(lambda: received)
+        assert received[0].data == {'message': {'content': "你好"}} and received[0].origin == first.node_id
+        assert len(own) == 1
+    finally:
+        first.close()
+        second.close()
+
+def test_broker_rejects_wrong_key_and_drops_malformed_events(broker):
+    """密钥错误的连接被拒绝；格式错误或pickle的内容不会被反序列化，后续事件照常投递"""
+    with pytest.raises(AuthenticationError):
+        Client(broker.address, authkey=b"wrong")
+    socket.create_connection(broker.address).close()  # 认证过程中断开
+
+    bus = EventBus()
+    bus.attach_broker(broker.address, AUTHKEY)
+    received = []
+    bus.subscribe(received.append)
+    sender = Client(broker.address, authkey=AUTHKEY)
+    try:
+        wait_for(lambda: len(broker._connections) == 2 and bus._bridge._conn)
+        sender.send_bytes(b"not json")
+        sender.send({'seq': 1, 'event_type': "x"})  # pickle编码
+        sender.send_bytes(Event(1, EVENT_APPROVED, "s1", 0.0, origin="other").encode())
+        wait_for(lambda: received)
+        assert [event.event_type for event in received] == [EVENT_APPROVED]
+    finally:
+        sender.close()
+        bus.close()
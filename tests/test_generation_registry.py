@@ -0,0 +1,148 @@
+"""草稿生成登记与取消测试"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.chat_pipeline import ChatPipeline
+from services.context_manager import ConversationContextManager
+from services.event_bus import EventBus, EVENT_CLEARED, EVENT_REJECTED
+from services.generation_registry import (
+    CANCEL_CLEAR, CANCEL_EVICTED, CANCEL_REJECT, CANCEL_SUPERSEDED, CANCEL_TIMEOUT,
+    GenerationCancelled, GenerationHandle, GenerationRegistry
+)
+from services.llm_scheduler import LANE_INTERACTIVE, LANE_REGENERATE
+from services.session_store import SessionStore
+from services.state_manager import StateManager
+
+class SlowDifyService:
+    """等待一段时间后返回回复的Dify服务，记录调用次数"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def chat_completion(self, message, conversation_id=None, inputs=None, user=None,
+                              lane=None, handle=None):
+        self.calls += 1
+        handle.dispatched = True
+        await asyncio.sleep(self.delay)
+        return {'success': True, 'content': f"回复: {message}", 'conversation_id': 'conv-1'}
+
+def make_pipeline(delay=0.0):
+    store = SessionStore()
+    dify = SlowDifyService(delay)
+    pipeline = ChatPipeline(dify, ConversationContextManager(), store)
+    return pipeline, store, dify
+
+def test_cancel_from_other_thread_wakes_waiter():
+    """其他线程取消时，等待结果的协程立即返回，生成协程被取消"""
+    handle = GenerationHandle("s1", "m1", LANE_INTERACTIVE)
+    cancelled = []
+
+    async def generation():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        threading.Timer(0.05, handle.cancel, args=(CANCEL_REJECT,)).start()
+        started = time.monotonic()
+        with pytest.raises(GenerationCancelled) as info:
+            await handle.run(generation())
+        await asyncio.sleep(0)
+        return info.value.reason, time.monotonic() - started
+
+    reason, elapsed = asyncio.run(scenario())
+    assert reason == CANCEL_REJECT and elapsed < 1 and cancelled == [True]
+    assert not handle.cancel(CANCEL_CLEAR) and handle.reason == CANCEL_REJECT
+
+def test_timeout_and_stop_after_bind():
+    """超过总超时时按超时取消；取消后才登记的流式任务立即调用停止接口"""
+    handle = GenerationHandle("s1", "m1", LANE_INTERACTIVE)
+    with pytest.raises(GenerationCancelled) as info:
+        asyncio.run(handle.run(asyncio.sleep(5), timeout=0.05))
+    assert info.value.reason == CANCEL_TIMEOUT
+
+    stopped = threading.Event()
+    handle.bind("task-1", stopped.set)
+    assert stopped.wait(1) and handle.stopped
+
+def test_registry_supersedes_and_counts_reclaimed_work():
+    """同一会话同一通道的新生成替代旧生成；统计区分排队中取消、已停止和已放弃的生成"""
+    registry = GenerationRegistry()
+    queued = registry.start("s1", "m1", LANE_INTERACTIVE, tokens=100)
+    regenerate = registry.start("s1", "m1", LANE_REGENERATE)
+    latest = registry.start("s1", "m2", LANE_INTERACTIVE)
+    assert queued.reason == CANCEL_SUPERSEDED and not regenerate.cancelled and not latest.cancelled
+    assert registry.active("s1") == 3
+
+    regenerate.dispatched = True
+    regenerate.bind("task-1", lambda: None)
+    latest.dispatched = True
+    assert registry.cancel("s1", CANCEL_REJECT) == 2
+    for handle in (queued, regenerate, latest):
+        registry.finish(handle)
+
+    stats = registry.stats()
+    assert (stats['reclaimed_queued'], stats['reclaimed_tokens'], stats['stopped'], stats['abandoned']) == \
+        (1, 100, 1, 1)
+    assert stats['reasons'] == {CANCEL_SUPERSEDED: 1, CANCEL_REJECT: 2} and stats['active'] == 0
+
+def test_events_and_eviction_cancel_session_generations():
+    """拒绝、清空事件和会话驱逐取消对应会话的生成，不影响其他会话"""
+    registry = GenerationRegistry()
+    event_bus = EventBus()
+    store = SessionStore(idle_timeout=100, eviction_interval=10 ** 9)
+    registry.attach(event_bus, store)
+    rejected = registry.start("s1", "m1", LANE_INTERACTIVE)
+    cleared = registry.start("s2", "m2", LANE_INTERACTIVE)
+    evicted = registry.start("s3", "m3", LANE_INTERACTIVE)
+    other = registry.start("s4", "m4", LANE_INTERACTIVE)
+
+    event_bus.publish(EVENT_REJECTED, "s1")
+    event_bus.publish(EVENT_CLEARED, "s2")
+    store.get_or_create("s3")
+    store.evict(time.time() + 200)
+    assert (rejected.reason, cleared.reason, evicted.reason) == (CANCEL_REJECT, CANCEL_CLEAR, CANCEL_EVICTED)
+    assert not other.cancelled
+
+def test_pipeline_rejects_message_while_previous_is_pending():
+    """上一条消息还在生成或等待审核时不受理新消息，不会白白调用Dify"""
+    pipeline, store, dify = make_pipeline()
+    state_manager = StateManager(store.get_or_create("s1"))
+    first, _ = pipeline.accept(state_manager, "第一个问题")
+    assert state_manager.is_typing()
+
+    result, error_msg = pipeline.accept(state_manager, "生成中再问")
+    assert result is None and "正在处理中" in error_msg
+
+    response = asyncio.run(pipeline.generate(state_manager, first.message))
+    assert response['success'] and state_manager.get_pending_review() is not None
+    result, error_msg = pipeline.accept(state_manager, "审核中再问")
+    assert result is None and "正在处理中" in error_msg
+    assert dify.calls == 1 and state_manager.get_message_count() == 1
+
+    pipeline.approve(state_manager, None)
+    result, _ = pipeline.accept(state_manager, "批准后再问")
+    assert result is not None and result.applied
+
+def test_pipeline_clear_cancels_generation():
+    """生成期间清空对话时取消生成，不写入待审核回复"""
+    pipeline, store, dify = make_pipeline(delay=5)
+    state_manager = StateManager(store.get_or_create("s1"))
+    result, _ = pipeline.accept(state_manager, "你好")
+
+    async def scenario():
+        task = asyncio.create_task(pipeline.generate(state_manager, result.message))
+        await asyncio.sleep(0.05)
+        pipeline.clear(state_manager)
+        return await asyncio.wait_for(task, 1)
+
+    response = asyncio.run(scenario())
+    assert response['error'] == 'cancelled' and response['reason'] == CANCEL_CLEAR
+    assert state_manager.get_pending_review() is None and not state_manager.is_typing()
+    assert pipeline.generations.stats()['abandoned'] == 1
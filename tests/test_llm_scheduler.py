@@ -0,0 +1,117 @@
+"""LLM请求调度器（加权公平排队）测试"""
+import asyncio
+
+import pytest
+
+from services.llm_scheduler import (
+    LLMScheduler, SchedulerTimeout, LANES, LANE_INTERACTIVE, LANE_REGENERATE, LANE_SPECULATIVE, LANE_BATCH
+)
+
+def make_scheduler(weights=None, batch_min_slots=0):
+    """单并发、不限通道并发和截止时间的调度器，便于观察分配顺序"""
+    return LLMScheduler(
+        max_concurrency=1,
+        weights=weights or {lane: 1 for lane in LANES},
+        cap_ratios={lane: 1.0 for lane in LANES},
+        deadlines={lane: 0 for lane in LANES},
+        batch_min_slots=batch_min_slots
+    )
+
+async def grant_order(scheduler, requests):
+    """占住唯一的并发后提交请求，释放后按分配顺序返回各请求的标签
+
+    Args:
+        scheduler: 调度器
+        requests: (标签, 通道, 代价)列表，按提交顺序
+
+    Returns:
+        标签列表（分配顺序）
+    """
+    order = []
+    holder = await scheduler.acquire(LANE_INTERACTIVE)
+
+    async def request(label, lane, cost):
+        async with scheduler.slot(lane, cost):
+            order.append(label)
+
+    tasks = []
+    for label, lane, cost in requests:
+        tasks.append(asyncio.create_task(request(label, lane, cost)))
+        await asyncio.sleep(0)
+    scheduler.release(holder)
+    await asyncio.gather(*tasks)
+    return order
+
+def test_weighted_share_follows_lane_weights():
+    """两个通道都积压时，分到的槽位与权重成正比"""
+    scheduler = make_scheduler(weights={LANE_INTERACTIVE: 3, LANE_REGENERATE: 1,
+                                        LANE_SPECULATIVE: 1, LANE_BATCH: 1})
+    requests = [(f"i{n}", LANE_INTERACTIVE, 1) for n in range(8)]
+    requests += [(f"r{n}", LANE_REGENERATE, 1) for n in range(8)]
+    order = asyncio.run(grant_order(scheduler, requests))
+
+    first = order[:8]
+    assert sum(label.startswith("i") for label in first) == 6
+    assert sum(label.startswith("r") for label in first) == 2
+    # 通道内保持先到先得
+    assert [label for label in order if label.startswith("i")] == [f"i{n}" for n in range(8)]
+
+def test_cost_counts_against_lane_share():
+    """代价（预计token数）大的请求占用更多份额"""
+    scheduler = make_scheduler()
+    requests = [("big", LANE_INTERACTIVE, 4), ("big2", LANE_INTERACTIVE, 4)]
+    requests += [(f"r{n}", LANE_REGENERATE, 1) for n in range(4)]
+    order = asyncio.run(grant_order(scheduler, requests))
+
+    assert order.index("big2") > order.index("r3")
+
+def test_background_lane_yields_to_interactive():
+    """有在线请求排队时，先排队的备选草稿预生成让出槽位"""
+    scheduler = make_scheduler()
+    requests = [("spec", LANE_SPECULATIVE, 1), ("batch", LANE_BATCH, 1), ("chat", LANE_INTERACTIVE, 1)]
+    order = asyncio.run(grant_order(scheduler, requests))
+
+    assert order[0] == "chat"
+    assert scheduler.stats()[LANE_SPECULATIVE]['preempted'] == 1
+
+def test_batch_keeps_minimum_slots():
+    """批量通道保留最少并发，不会被在线请求饿死"""
+    scheduler = make_scheduler(batch_min_slots=1)
+    requests = [("batch", LANE_BATCH, 1), ("chat", LANE_INTERACTIVE, 1)]
+    order = asyncio.run(grant_order(scheduler, requests))
+
+    assert order == ["batch", "chat"]
+
+def test_expired_request_fails_without_slot():
+    """排队超过截止时间的请求失败，并计入过期数"""
+    async def scenario():
+        scheduler = make_scheduler()
+        holder = await scheduler.acquire(LANE_INTERACTIVE)
+        with pytest.raises(SchedulerTimeout):
+            await scheduler.acquire(LANE_REGENERATE, deadline=0.05)
+        scheduler.release(holder)
+        return scheduler.stats()[LANE_REGENERATE]
+
+    stats = asyncio.run(scenario())
+    assert stats['expired'] == 1
+    assert stats['running'] == 0
+
+def test_cancel_after_grant_returns_slot():
+    """槽位送达后、等待方恢复前被取消时，槽位归还调度器而不是泄漏"""
+    async def scenario():
+        scheduler = make_scheduler()
+        holder = await scheduler.acquire(LANE_INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire(LANE_REGENERATE))
+        await asyncio.sleep(0)
+        scheduler.release(holder)
+        await asyncio.sleep(0)  # 槽位已送达，等待方尚未恢复
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        stats = scheduler.stats()[LANE_REGENERATE]
+        ticket = await asyncio.wait_for(scheduler.acquire(LANE_INTERACTIVE), 1)
+        scheduler.release(ticket)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats['running'] == 0 and stats['cancelled'] == 1
@@ -0,0 +1,145 @@
+"""营销文案模板缓存测试"""
+import asyncio
+import io
+import json
+import threading
+
+import pytest
+
+from services.marketing_template import (
+    TEMPLATE_NAMESPACE, TEMPLATE_STATUS_APPROVED, TEMPLATE_STATUS_PENDING, TEMPLATE_STATUS_REJECTED,
+    TemplateCache, abstract_event, check_placeholders, fill_placeholders, template_key
+)
+from services.signal_ingest import SignalIngestor
+from services.state_backend import InMemoryStateBackend, SQLiteStateBackend
+
+class FakeMarketingService:
+    """按顺序返回预设文案的营销服务"""
+
+    def __init__(self, *contents, on_call=None):
+        self.contents = list(contents)
+        self.prompts = []
+        self.on_call = on_call
+
+    async def generate_marketing_copy(self, prompt, user=None, lane=None):
+        self.prompts.append(json.loads(prompt))
+        if self.on_call:
+            self.on_call()
+        content = self.contents.pop(0) if self.contents else "到账{N1}元，欢迎办理"
+        return {'success': True, 'content': content}
+
+def work_set(*events, tags=("代发工资",)):
+    lines = [json.dumps({"tags": list(tags), "event": event}, ensure_ascii=False) for event in events]
+    return SignalIngestor().ingest(io.StringIO("\n".join(lines)))
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield InMemoryStateBackend()
+    else:
+        backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+        yield backend
+        backend.close()
+
+def test_placeholders():
+    """数值抽象为占位符，文案占位符缺失或多出时报错"""
+    assert abstract_event("工资到账6,000.50元，第2次") == ("工资到账{N1}元，第{N2}次", ("6,000.50", "2"))
+    assert fill_placeholders("到账{N1}元{N3}", ("6000",)) == "到账6000元{N3}"
+    assert check_placeholders("到账{N1}元", "到账{N1}元") == ""
+    assert check_placeholders("到账{N1}元", "到账{N2}元") == "缺少占位符 {N1}，出现未知占位符 {N2}"
+
+def test_template_key_does_not_collide_on_separators():
+    """标签或事件中含有分隔符时不同组合的键不同"""
+    keys = {
+        template_key(("a|b",), "c"),
+        template_key(("a", "b"), "c"),
+        template_key(("a",), "b#c"),
+        template_key(("a#b",), "c"),
+    }
+    assert len(keys) == 4
+    assert template_key(("a", "b"), "c") == template_key(("a", "b"), "c")
+
+def test_generate_once_per_group_and_retry_placeholders():
+    """数值不同的事件共用一个模板；缺少占位符的文案重新生成"""
+    service = FakeMarketingService("欢迎办理", "到账{N1}元，欢迎办理")
+    cache = TemplateCache()
+    signals = work_set("工资到账6000元", "工资到账8000元")
+
+    groups = asyncio.run(cache.generate(signals, service))
+
+    assert len(groups) == 1 and len(service.prompts) == 2
+    assert service.prompts[0]["placeholders"] == ["{N1}"]
+    assert groups[0].signal_count == 2 and groups[0].status == TEMPLATE_STATUS_PENDING
+    assert sorted(result['content'] for result in cache.results_for(signals).values()) == [
+        "到账6000元，欢迎办理", "到账8000元，欢迎办理"
+    ]
+
+    # 已有文案的分组不会重复调用
+    asyncio.run(cache.generate(work_set("工资到账100元"), service))
+    assert len(service.prompts) == 2
+
+def test_approval_required():
+    """开启审批后只使用审批通过的模板，拒绝后重新生成"""
+    cache = TemplateCache(require_approval=True)
+    signals = work_set("工资到账6000元")
+    asyncio.run(cache.generate(signals, FakeMarketingService()))
+    assert cache.results_for(signals) == {}
+
+    key = cache.pending_groups()[0].key
+    cache.approve(key, "入账{N1}元")
+    assert list(cache.results_for(signals).values())[0]['content'] == "入账6000元"
+
+    cache.reject(key)
+    assert cache.results_for(signals) == {} and cache.groups[key].status == TEMPLATE_STATUS_REJECTED
+    asyncio.run(cache.generate(signals, FakeMarketingService()))
+    assert cache.groups[key].status == TEMPLATE_STATUS_PENDING
+
+def test_kv_compare_and_swap(backend):
+    """键值写入带版本号时冲突返回None"""
+    assert backend.get_value(TEMPLATE_NAMESPACE, "k") == (None, 0)
+    version = backend.put_value(TEMPLATE_NAMESPACE, "k", {"v": 1}, 0)
+    assert version and backend.put_value(TEMPLATE_NAMESPACE, "k", {"v": 2}, 0) is None
+    assert backend.put_value(TEMPLATE_NAMESPACE, "k", {"v": 2}, version) > version
+    assert backend.get_value(TEMPLATE_NAMESPACE, "k")[0] == {"v": 2}
+    # 不带版本号时后写覆盖先写
+    assert backend.put_value(TEMPLATE_NAMESPACE, "k", {"v": 3}) is not None
+    assert backend.get_values(TEMPLATE_NAMESPACE) == {"k": {"v": 3}}
+
+def test_shared_backend_writes_do_not_overwrite(backend):
+    """并发的会话/副本：后生成的文案不覆盖已写入的文案，过期的缓存不会撤销审批"""
+    signals = work_set("工资到账6000元")
+    first, second = TemplateCache(True, backend), TemplateCache(True, backend)
+
+    def other_replica():
+        asyncio.run(first.generate(signals, FakeMarketingService("A{N1}")))
+        first.approve(first.pending_groups()[0].key)
+
+    def run_other_replica():
+        # 第二个缓存等待Dify期间，另一副本（另一线程）生成并审批了同一分组
+        thread = threading.Thread(target=other_replica)
+        thread.start()
+        thread.join()
+
+    service = FakeMarketingService("B{N1}", on_call=run_other_replica)
+    group, = asyncio.run(second.generate(signals, service))
+    assert len(service.prompts) == 1
+
+    stored, _ = backend.get_value(TEMPLATE_NAMESPACE, group.key)
+    assert stored['content'] == "A{N1}" and stored['status'] == TEMPLATE_STATUS_APPROVED
+    assert group.content == "A{N1}"
+    assert list(second.results_for(signals).values())[0]['content'] == "A6000"
+
+    # 过期的缓存拒绝后再批准不会批准空模板
+    first.reject(group.key)
+    second.approve(group.key)
+    assert backend.get_value(TEMPLATE_NAMESPACE, group.key)[0]['status'] == TEMPLATE_STATUS_REJECTED
+
+def test_legacy_keys_ignored(backend):
+    """旧版本按分隔符拼接的键不会出现在待审批列表中"""
+    backend.put_value(TEMPLATE_NAMESPACE, "代发工资#工资到账{N1}元", {
+        'key': "代发工资#工资到账{N1}元", 'tags': ["代发工资"], 'event_template': "工资到账{N1}元",
+        'signal_count': 1, 'customer_count': 1, 'content': "旧{N1}", 'status': TEMPLATE_STATUS_APPROVED,
+        'error': None,
+    })
+    cache = TemplateCache(True, backend)
+    assert cache.pending_groups() == [] and cache.results_for(work_set("工资到账1元")) == {}
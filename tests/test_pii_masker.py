@@ -0,0 +1,103 @@
+"""敏感信息脱敏（校验码识别与占位符还原）测试"""
+import pytest
+
+from utils.pii_masker import (
+    PIIMasker, PII_AMOUNT, PII_BANK_CARD, PII_ID_CARD, PII_PHONE, classify_number, id_card_valid, luhn_valid
+)
+
+# 校验码正确的示例号码
+ID_CARD = "11010519491231002X"
+BANK_CARD = "6222020200001234562"
+PHONE = "13800138000"
+
+def test_id_card_checksum():
+    """身份证号按GB 11643加权校验码识别"""
+    assert id_card_valid(ID_CARD)
+    assert not id_card_valid("110105194912310021")
+    assert not id_card_valid("11010519491231002")
+
+def test_luhn_checksum():
+    """银行卡号按Luhn算法校验"""
+    assert luhn_valid(BANK_CARD)
+    assert luhn_valid("4111111111111111")
+    assert not luhn_valid("6222020200001234563")
+
+def test_classify_number():
+    """按长度和校验码区分手机号、身份证号、银行卡号，校验失败的数字不脱敏"""
+    assert classify_number(PHONE)[0] == PII_PHONE
+    assert classify_number(ID_CARD)[0] == PII_ID_CARD
+    assert classify_number(BANK_CARD)[0] == PII_BANK_CARD
+    assert classify_number("6222020200001234563") is None
+    assert classify_number("20231019123456789") is None
+
+def test_mask_and_restore_round_trip():
+    """脱敏后不含原值，回复中的占位符还原为原值"""
+    masker = PIIMasker(secret=b"test")
+    text = f"我的手机{PHONE}，身份证{ID_CARD}，卡号{BANK_CARD}，转账5,000.50元"
+    found = {}
+
+    masked = masker.mask(text, found)
+
+    for value in (PHONE, ID_CARD, BANK_CARD, "5,000.50元"):
+        assert value not in masked
+    assert len(found) == 4
+    assert masker.restore(masked, found) == text
+    stats = masker.stats()
+    assert stats[PII_PHONE] == stats[PII_ID_CARD] == stats[PII_BANK_CARD] == stats[PII_AMOUNT] == 1
+
+def test_lowercase_id_card_check_code_masked():
+    """身份证号末位小写x同样识别"""
+    masker = PIIMasker(secret=b"test")
+
+    assert masker.mask(f"身份证{ID_CARD.lower()}") == f"身份证{masker.token(PII_ID_CARD, ID_CARD)}"
+
+def test_formatted_numbers_share_token():
+    """带空格、连字符或国家码的同一号码得到相同占位符"""
+    masker = PIIMasker(secret=b"test")
+
+    masked = masker.mask(f"手机号 +86 138-0013-8000 和 {PHONE}")
+
+    assert masked.count(masker.token(PII_PHONE, PHONE)) == 2
+
+def test_tokens_are_stable_per_secret():
+    """同一密钥下同一值的占位符相同，不同密钥不同"""
+    first = PIIMasker(secret=b"a")
+    second = PIIMasker(secret=b"a")
+    other = PIIMasker(secret=b"b")
+
+    assert first.mask(PHONE) == second.mask(PHONE)
+    assert first.mask(PHONE) != other.mask(PHONE)
+
+def test_restore_uses_vault_for_history_tokens():
+    """回复引用之前轮次的占位符时从进程内保留的映射还原，未知占位符保持原样"""
+    masker = PIIMasker(secret=b"test")
+    token = masker.mask(PHONE)
+    unknown = "[PHONE_0000000000]"
+
+    restored = masker.restore(f"已记录{token}，{unknown}")
+
+    assert restored == f"已记录{PHONE}，{unknown}"
+    assert masker.stats()['unresolved'] == 1
+
+def test_disabled_kinds_are_kept():
+    """未启用的类别不脱敏"""
+    masker = PIIMasker(kinds=[PII_PHONE], secret=b"test")
+
+    masked = masker.mask(f"{PHONE} 转账300元")
+
+    assert masked.endswith("转账300元")
+    assert PHONE not in masked
+
+def test_unknown_kind_rejected():
+    """未知的脱敏类别报错"""
+    with pytest.raises(ValueError):
+        PIIMasker(kinds=["email"])
+
+def test_mask_inputs_only_masks_strings():
+    """输入变量只脱敏字符串值"""
+    masker = PIIMasker(secret=b"test")
+
+    inputs = masker.mask_inputs({'history': f"手机{PHONE}", 'turns': 3})
+
+    assert PHONE not in inputs['history']
+    assert inputs['turns'] == 3
@@ -0,0 +1,94 @@
+"""监督审核效率指标测试"""
+from services.audit_log import AUDIT_EVENT_APPROVE, AUDIT_EVENT_DRAFT, AUDIT_EVENT_REJECT
+from services.event_bus import EventBus, EVENT_APPROVED, EVENT_DRAFT_READY, EVENT_REJECTED
+from services.review_metrics import (
+    REVIEW_APPROVED, REVIEW_REJECTED, RollingWindow, ReviewMetrics, bin_upper_bound, latency_bin
+)
+from utils.constants import METRICS_HISTORY_BUCKET_SECONDS, METRICS_LATENCY_GROWTH, METRICS_OPEN_REVIEW_TTL
+
+NOW = 1_699_999_200.0  # 整点，对齐窗口的槽
+
+def test_latency_percentile_within_bin_error():
+    """耗时分位数取分桶上界，相对误差不超过分桶增长率"""
+    for seconds in (0.2, 3.0, 47.0, 600.0):
+        upper = bin_upper_bound(latency_bin(seconds))
+        assert seconds <= upper <= max(seconds * METRICS_LATENCY_GROWTH, bin_upper_bound(0))
+
+    metrics = ReviewMetrics({'hour': 3600})
+    for index, latency in enumerate([1.0] * 9 + [100.0]):
+        metrics.record_review(REVIEW_APPROVED, f"r{index}", latency=latency, timestamp=NOW)
+    snapshot = metrics.snapshot('hour', NOW)
+    assert 1.0 <= snapshot.latency_p50 <= METRICS_LATENCY_GROWTH
+    assert 100.0 <= snapshot.latency_p99 <= 100.0 * METRICS_LATENCY_GROWTH
+    assert abs(snapshot.latency_mean - 10.9) < 1e-9
+
+def test_rolling_window_expires_old_slots():
+    """滑动窗口只统计窗口内的事件，过期的槽从总计中扣除，早于窗口的事件忽略"""
+    window = RollingWindow(600, slots=10)
+    window.count_draft(NOW, 1)
+    window.count_review(NOW + 300, REVIEW_APPROVED, "alice", False, 5.0, 0)
+    assert window.snapshot(NOW + 590).drafts == 1
+
+    total = window.snapshot(NOW + 660)
+    assert (total.drafts, total.approved, total.reviewers) == (0, 1, {'alice': 1})
+    window.count_draft(NOW, 1)
+    assert window.snapshot(NOW + 660).drafts == 0
+    assert window.snapshot(NOW + 2000).reviews == 0
+
+def test_queue_depth_latency_and_rates():
+    """草稿进入队列、审核完成离队；审核耗时按草稿时间计算，长期未处理的项不计入队列"""
+    metrics = ReviewMetrics({'hour': 3600})
+    metrics.record_draft("r1", NOW)
+    metrics.record_draft("r2", NOW + 1)
+    metrics.record_draft("r3", NOW + 2)
+    metrics.record_review(REVIEW_APPROVED, "r1", "alice", edited=True, timestamp=NOW + 10)
+    metrics.record_review(REVIEW_REJECTED, "r2", "bob", timestamp=NOW + 20)
+
+    snapshot = metrics.snapshot('hour', NOW + 30)
+    assert (snapshot.drafts, snapshot.reviews, snapshot.queue_depth, snapshot.queue_peak) == (3, 2, 1, 3)
+    assert snapshot.approval_rate == 0.5 and snapshot.edit_rate == 1.0 and snapshot.reject_rate == 0.5
+    assert snapshot.latency_mean == (10 + 19) / 2
+    assert snapshot.throughput == {'alice': 1.0, 'bob': 1.0}
+    assert metrics.snapshot('hour', NOW + METRICS_OPEN_REVIEW_TTL + 10).queue_depth == 0
+
+def test_events_and_backfill():
+    """订阅事件增量汇总，与从审计记录回填的结果一致"""
+    live = ReviewMetrics({'hour': 3600})
+    event_bus = EventBus()
+    live.attach(event_bus)
+    event_bus.publish(EVENT_DRAFT_READY, "s1", pending_id="p1")
+    event_bus.publish(EVENT_APPROVED, "s1", message={'id': "p1"}, reviewer="alice", edited=True,
+                      review_seconds=4.0)
+    event_bus.publish(EVENT_DRAFT_READY, "s1", pending_id="p2")
+    event_bus.publish(EVENT_REJECTED, "s1", pending_id="p2", reviewer="bob", review_seconds=2.0)
+
+    backfilled = ReviewMetrics({'hour': 3600})
+    now = event_bus.events_since(0)[-1].timestamp
+    records = [
+        {'event': AUDIT_EVENT_DRAFT, 'message_id': "p1", 'ts': now},
+        {'event': "user_message", 'message_id': "u1", 'ts': now},
+        {'event': AUDIT_EVENT_APPROVE, 'message_id': "p1", 'reviewer': "alice", 'edited': True,
+         'review_seconds': 4.0, 'ts': now},
+        {'event': AUDIT_EVENT_DRAFT, 'message_id': "p2", 'ts': now},
+        {'event': AUDIT_EVENT_REJECT, 'message_id': "p2", 'reviewer': "bob", 'review_seconds': 2.0, 'ts': now},
+    ]
+    assert backfilled.backfill(records) == 4
+
+    for metrics in (live, backfilled):
+        snapshot = metrics.snapshot('hour', now)
+        assert (snapshot.drafts, snapshot.approved, snapshot.edited, snapshot.rejected) == (2, 1, 1, 1)
+        assert snapshot.queue_depth == 0 and snapshot.latency_mean == 3.0
+
+def test_hourly_timeseries():
+    """历史指标按小时汇总，按时间升序返回最近几天"""
+    metrics = ReviewMetrics({'hour': 3600})
+    hour = METRICS_HISTORY_BUCKET_SECONDS
+    metrics.record_draft("r1", NOW - 2 * hour)
+    metrics.record_review(REVIEW_APPROVED, "r1", timestamp=NOW - 2 * hour + 60)
+    metrics.record_draft("r2", NOW)
+    metrics.record_draft("old", NOW - 30 * 86400)
+
+    series = metrics.timeseries(days=7, now=NOW)
+    assert [item['drafts'] for item in series] == [1, 1]
+    assert series[0]['approved'] == 1 and series[0]['hour'] < series[1]['hour']
+    assert metrics.stats()['history_buckets'] == 3
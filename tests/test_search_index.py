@@ -0,0 +1,93 @@
+"""对话历史全文检索测试"""
+from datetime import datetime
+
+from services.event_bus import EventBus, EVENT_APPROVED, EVENT_MESSAGE_ADDED
+from services.search_index import InvertedIndex, MessageSearchIndex, SearchQuery, tokenize
+
+def make_index():
+    index = MessageSearchIndex()
+    index.add("m1", "session-a", "user", "sent", "2024-01-01T09:00:00", "信用卡退款多久到账")
+    index.add("m2", "session-a", "assistant", "sent", "2024-01-01T09:01:00", "退款一般3到5个工作日到账")
+    index.add("m3", "session-b", "user", "sent", "2024-01-02T10:00:00", "如何申请信用卡")
+    index.add("m4", "session-b", "assistant", "rejected", "2024-01-02T10:01:00", "请联系客服申请退款")
+    return index
+
+def test_tokenize_bigrams_and_words():
+    """中文按二元组切分，建索引时附带单字；英文和数字整体作为词元"""
+    assert tokenize("退款") == ["退款"]
+    assert tokenize("信用卡") == ["信用", "用卡"]
+    assert tokenize("卡") == ["卡"]
+    assert tokenize("VIP 客户", unigrams=True) == ["vip", "客", "户", "客户"]
+
+def test_inverted_index_and_or_semantics():
+    """多词查询默认求交集，也可以按OR语义取并集"""
+    index = InvertedIndex()
+    first = index.add(["a", "b"])
+    second = index.add(["a"])
+    index.add(["c"])
+
+    ranked, total, truncated = index.search(["a", "b"])
+    assert [doc_id for _, doc_id in ranked] == [first] and total == 1 and not truncated
+    ranked, total, _ = index.search(["a", "c"], match_all=False)
+    assert total == 3 and second in [doc_id for _, doc_id in ranked]
+    assert index.search(["missing"]) == ([], 0, False)
+
+def test_search_ranks_and_dedupes():
+    """检索按BM25排序，同一消息ID和状态只索引一次"""
+    index = make_index()
+    assert not index.add("m1", "session-a", "user", "sent", datetime.now(), "信用卡退款多久到账")
+    assert len(index) == 4
+
+    result = index.search("退款 到账")
+    assert [hit.message.message_id for hit in result.hits] == ["m1", "m2"] and result.total == 2
+    assert all("退款" in hit.snippet for hit in result.hits)
+    assert result.hits[0].score > result.hits[1].score
+    assert [hit.message.message_id for hit in index.search("信用卡").hits] == ["m3", "m1"]
+    assert index.search("退款到账").total == 0
+
+def test_field_filters_and_phrases():
+    """字段过滤、会话前缀、日期范围和短语都作用于检索结果"""
+    index = make_index()
+    assert [hit.message.message_id for hit in index.search("退款 sender:user").hits] == ["m1"]
+    assert [hit.message.message_id for hit in index.search("退款 status:rejected").hits] == ["m4"]
+    assert [hit.message.message_id for hit in index.search("信用卡 session:session-b").hits] == ["m3"]
+    assert [hit.message.message_id for hit in index.search('"联系客服"').hits] == ["m4"]
+    assert [hit.message.message_id for hit in index.search("退款 after:2024-01-02").hits] == ["m4"]
+    assert {hit.message.message_id for hit in index.search("退款 before:2024-01-01").hits} == {"m1", "m2"}
+
+def test_filters_only_browse_latest_first():
+    """只有过滤条件时按时间倒序列出，空查询不返回结果"""
+    index = make_index()
+    result = index.search("sender:assistant")
+    assert [hit.message.message_id for hit in result.hits] == ["m4", "m2"] and result.total == 2
+    assert index.search("").hits == []
+
+def test_query_parse():
+    """日期过滤按整天计算，中英文引号都可以表示短语"""
+    query = SearchQuery.parse('退款 “工作日” "到账" before:2024-01-31 sender:user')
+    assert query.text == "退款" and query.phrases == ["工作日", "到账"] and query.sender == "user"
+    assert query.until == datetime(2024, 1, 31, 23, 59, 59).timestamp()
+    assert query.has_filters() and not SearchQuery.parse("退款").has_filters()
+
+def test_event_and_backfill_updates():
+    """订阅事件增量索引新消息，回填跳过空内容和已索引的消息"""
+    index = MessageSearchIndex()
+    event_bus = EventBus()
+    index.attach(event_bus)
+    message = {'id': "m1", 'sender': "user", 'status': "sent",
+               'timestamp': "2024-01-01T09:00:00", 'content': "账单分期手续费"}
+    event_bus.publish(EVENT_MESSAGE_ADDED, "s1", message=message)
+    event_bus.publish(EVENT_APPROVED, "s1", message={**message, 'id': "m2", 'sender': "assistant",
+                                                      'content': "分期手续费按月收取"})
+    assert index.search("手续费").total == 2
+
+    records = [
+        {'message_id': "m1", 'conversation_id': "s1", 'sender': "user", 'status': "sent",
+         'timestamp': "2024-01-01T09:00:00", 'content': "账单分期手续费"},
+        {'message_id': "m3", 'conversation_id': "s2", 'sender': "user", 'status': "sent",
+         'timestamp': "2024-01-01T09:00:00", 'content': ""},
+        {'message_id': "m4", 'conversation_id': "s2", 'sender': "assistant", 'status': "draft",
+         'timestamp': "2024-01-01T09:00:00", 'content': "手续费可以减免"},
+    ]
+    assert index.backfill(records) == 1
+    assert index.search("手续费 status:draft").hits[0].message.session_id == "s2"
@@ -0,0 +1,113 @@
+"""多会话状态存储（空闲驱逐、会话数与内存上限、共享后端过期）测试"""
+import os
+import time
+
+import pytest
+
+from services.session_store import (
+    SESSION_ROLE_CUSTOMER, SESSION_ROLE_SUPERVISOR, SessionState, SessionStore, estimate_size
+)
+from services.state_backend import InMemoryStateBackend, SQLiteStateBackend
+from services.state_manager import StateManager
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    """两种共享状态后端"""
+    if request.param == 'memory':
+        backend = InMemoryStateBackend()
+    else:
+        backend = SQLiteStateBackend(os.path.join(tmp_path, 'state.db'))
+    yield backend
+    backend.close()
+
+def make_store(**kwargs):
+    """驱逐只在测试中显式触发"""
+    kwargs.setdefault('eviction_interval', 10 ** 9)
+    return SessionStore(**kwargs)
+
+def test_session_state_attribute_access():
+    """状态键可按属性或键访问，元数据不计入状态"""
+    session = SessionState('s1')
+    session.messages = []
+    session['draft'] = "草稿"
+    assert session['messages'] == [] and session.draft == "草稿"
+    assert dict(session) == {'messages': [], 'draft': "草稿"}
+    assert session.dify_user == f"{SESSION_ROLE_CUSTOMER}-s1"
+    del session.draft
+    assert 'draft' not in session
+
+def test_idle_sessions_evicted_in_access_order():
+    """空闲超时的会话被驱逐，访问过的会话保留，驱逐回调收到被驱逐的会话"""
+    store = make_store(idle_timeout=100)
+    for session_id in ('a', 'b', 'c'):
+        store.get_or_create(session_id)
+    now = time.time()
+    store.get_or_create('a').last_access = now + 50
+
+    evicted_sessions = []
+    store.add_evict_listener(evicted_sessions.append)
+    assert store.evict(now + 120) == ['b', 'c']
+    assert [session.session_id for session in evicted_sessions] == ['b', 'c']
+    assert [session.session_id for session in store.list_sessions()] == ['a']
+    assert store.stats()['evicted_total'] == 2
+
+def test_pinned_session_kept_when_idle_but_not_over_limit():
+    """有待审核回复的会话不会因空闲被驱逐，超出会话数上限时仍按LRU驱逐"""
+    store = make_store(idle_timeout=100, max_sessions=2)
+    pinned = store.get_or_create('pinned')
+    pinned.pending_review = {'id': 'r1'}
+    store.get_or_create('idle')
+    now = time.time()
+    assert store.evict(now + 120) == ['idle']
+    assert store.get('pinned') is pinned
+
+    for session_id in ('x', 'y'):
+        store.get_or_create(session_id)
+    assert store.evict(now) == ['pinned']
+    assert [session.session_id for session in store.list_sessions()] == ['y', 'x']
+
+def test_max_sessions_evicts_least_recently_used():
+    """超出会话数上限时驱逐最久未访问的会话"""
+    store = make_store(max_sessions=2)
+    for session_id in ('a', 'b', 'c'):
+        store.get_or_create(session_id)
+    store.get_or_create('a')
+    assert store.evict() == ['b']
+    assert store.stats()['sessions'] == 2
+
+def test_memory_limit_uses_accounted_size():
+    """超出内存上限时按LRU驱逐，直到占用回到上限以下"""
+    store = make_store(max_memory_bytes=10 ** 9)
+    for session_id in ('a', 'b', 'c'):
+        session = store.get_or_create(session_id)
+        session.messages = ["消息" * 1000]
+        store.account(session)
+    big = estimate_size({'messages': ["消息" * 1000]})
+    assert store.stats()['memory_bytes'] == 3 * big
+
+    store.max_memory_bytes = 2 * big
+    assert store.evict() == ['a']
+    assert store.stats()['memory_bytes'] == 2 * big
+
+    store.remove('b')
+    assert store.stats()['memory_bytes'] == big
+
+def test_eviction_runs_on_access_after_interval():
+    """距离上次驱逐超过间隔后，访问会话时顺带驱逐"""
+    store = SessionStore(idle_timeout=100, eviction_interval=0)
+    store.get_or_create('old', SESSION_ROLE_SUPERVISOR).last_access -= 200
+    store.get_or_create('new')
+    assert [session.session_id for session in store.list_sessions()] == ['new']
+
+def test_expire_keeps_pending_review_and_recent_access(backend):
+    """空闲过期按最近访问时间判断，有待审核回复的会话不会过期"""
+    store = SessionStore(idle_timeout=100, backend=backend)
+    pending_session = StateManager(store.get_or_create('pending'))
+    pending_session.set_pending_review("草稿", pending_session.submit_user_message("你好").message.id)
+    store.get_or_create('idle')
+    store.get_or_create('supervisor')
+    now = backend.load('idle').accessed_at
+    backend.touch('supervisor', now + 150)
+
+    assert backend.expire(now + 120) == 1
+    assert sorted(session_id for session_id, _, _ in backend.list_sessions()) == ['pending', 'supervisor']
@@ -0,0 +1,73 @@
+"""营销信号导入测试"""
+import io
+import json
+
+from components.marketing_generator import format_batch_results_for_download
+from services.signal_ingest import SignalIngestor, canonical_key, normalize_tags, validate_signal
+
+def jsonl(*records):
+    return "\n".join(json.dumps(record, ensure_ascii=False) for record in records) + "\n"
+
+def test_validate_signal():
+    """模式校验：必填、类型、空值、长度"""
+    assert validate_signal({"tags": ["代发工资"], "event": "工资到账"}) == (True, "")
+    assert validate_signal([1, 2])[0] is False
+    assert validate_signal({"event": "工资到账"}) == (False, "缺少必填字段: tags")
+    assert validate_signal({"tags": [], "event": "x"}) == (False, "字段不能为空: tags")
+    assert validate_signal({"tags": ["a"], "event": "  "}) == (False, "字段不能为空: event")
+    assert validate_signal({"tags": ["a"], "event": "x" * 201}) == (False, "字段过长: event")
+    # bool不能当作int类型的客户ID
+    assert validate_signal({"tags": ["a"], "event": "x", "customer_id": True})[0] is False
+
+def test_normalize_tags_aliases_and_order():
+    """全角、空白、别名归一后去重排序，标签顺序不影响规范键"""
+    assert normalize_tags(["工资代发", " 代发工资 ", "ＶＩＰ", ""]) == ("VIP", "代发工资")
+    assert canonical_key(normalize_tags(["b", "a"]), "e") == canonical_key(normalize_tags(["a", "b"]), "e")
+    assert canonical_key(("a",), "b") != canonical_key(("a", "b"), "")
+
+def test_ingest_dedupes_and_counts_errors():
+    """重复信号只保留一份并记录客户ID，无效行计入错误样本"""
+    source = io.StringIO(
+        jsonl(
+            {"tags": ["代发工资", "无信用卡"], "event": "工资到账", "customer_id": "c1"},
+            {"tags": ["没有信用卡", "工资代发"], "event": " 工资到账 ", "customer_id": 2},
+            {"tags": ["个体户"], "event": "开户"},
+        ) + "not json\n\n" + json.dumps({"tags": ["a"]}) + "\n"
+    )
+    work_set = SignalIngestor(max_error_samples=1).ingest(source)
+
+    assert work_set.stats.to_dict() == {'total': 5, 'valid': 3, 'invalid': 2, 'duplicates': 1, 'unique': 2}
+    assert len(work_set.stats.errors) == 1 and work_set.stats.errors[0][0] == 4
+    signals = {signal.tags: signal for signal in work_set}
+    assert signals[("代发工资", "无信用卡")].count == 2
+    assert signals[("代发工资", "无信用卡")].customer_ids == ["c1", "2"]
+    assert signals[("个体工商户",)].customer_ids == []
+
+def test_binary_source_bad_encoding_only_skips_line():
+    """二进制文件中编码错误只影响所在行"""
+    source = io.BytesIO(
+        "\ufeff".encode("utf-8") + jsonl({"tags": ["a"], "event": "x"}).encode("utf-8")
+        + b"\xff\xfe\n" + jsonl({"tags": ["b"], "event": "y"}).encode("utf-8")
+    )
+    work_set = SignalIngestor().ingest(source)
+    assert len(work_set) == 2
+    assert work_set.stats.errors == [(2, "编码错误: 文件需为UTF-8编码")]
+
+def test_fan_out_and_download_stream():
+    """重新读取信号文件，每个有效行输出一条对应唯一信号的结果"""
+    source = io.BytesIO(jsonl(
+        {"tags": ["a"], "event": "x", "customer_id": "c1"},
+        {"tags": ["a"], "event": "x", "customer_id": "c2"},
+        {"tags": ["b"], "event": "y", "customer_id": "c3"},
+    ).encode("utf-8"))
+    work_set = SignalIngestor(keep_customer_ids=False).ingest(source)
+    key = canonical_key(("a",), "x")
+    results = {key: {'success': True, 'content': "文案"}}
+    assert [signal.customer_ids for signal in work_set] == [[], []]
+
+    with format_batch_results_for_download(source, results, max_memory=16) as download_file:
+        lines = download_file.read().decode("utf-8").splitlines()
+    assert [json.loads(line)['customer_id'] for line in lines] == ["c1", "c2"]
+    assert json.loads(lines[0]) == {
+        'customer_id': "c1", 'tags': ["a"], 'event': "x", 'success': True, 'content': "文案"
+    }
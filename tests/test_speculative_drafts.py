@@ -0,0 +1,127 @@
+"""备选草稿预生成测试"""
+import asyncio
+import time
+
+from services.chat_pipeline import ChatPipeline
+from services.context_manager import ConversationContextManager
+from services.event_bus import EventBus, EVENT_ALTERNATIVE_READY
+from services.generation_registry import CANCEL_APPROVED, GenerationRegistry
+from services.llm_scheduler import LLMScheduler, LANE_INTERACTIVE, LANE_SPECULATIVE
+from services.session_store import SessionStore
+from services.speculative_drafts import SpeculativeDrafter, OUTCOME_PROMOTED, OUTCOME_SHOWN
+from services.state_manager import StateManager, TRANSITION_APPLIED
+from utils.constants import SPECULATIVE_VARIANT_INPUT
+
+class FakeDifyService:
+    """在线草稿立即返回，预生成通道的请求按设定延迟返回并报告用量"""
+
+    def __init__(self, delay=0.0, usage=7):
+        self.delay = delay
+        self.usage = usage
+        self.speculative_calls = []
+
+    async def chat_completion(self, message, conversation_id=None, inputs=None, user=None,
+                              lane=None, handle=None):
+        if lane != LANE_SPECULATIVE:
+            return {'success': True, 'content': f"草稿: {message}", 'conversation_id': 'conv-1'}
+        self.speculative_calls.append({'conversation_id': conversation_id, 'inputs': inputs})
+        handle.dispatched = True
+        await asyncio.sleep(self.delay)
+        return {'success': True, 'content': f"备选: {message}", 'usage': {'total_tokens': self.usage}}
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+def make_pipeline(delay=0.0, token_budget=20000, scheduler=None):
+    store = SessionStore()
+    event_bus = EventBus()
+    generations = GenerationRegistry()
+    generations.attach(event_bus, store)
+    dify = FakeDifyService(delay)
+    drafter = SpeculativeDrafter(dify, generations, scheduler, token_budget=token_budget, variant="v2")
+    drafter.attach(event_bus)
+    pipeline = ChatPipeline(dify, ConversationContextManager(), store, event_bus=event_bus,
+                            generations=generations, speculator=drafter)
+    return pipeline, store, drafter, dify
+
+def draft(pipeline, store, session_id="s1", content="信用卡怎么还款"):
+    """提交客户消息并生成待审核草稿"""
+    state_manager = StateManager(store.get_or_create(session_id))
+    result, _ = pipeline.accept(state_manager, content)
+    assert asyncio.run(pipeline.generate(state_manager, result.message))['success']
+    return state_manager
+
+def test_alternative_attached_and_promoted_on_reject():
+    """备选回复不沿用Dify会话、携带提示词变体；就绪后附加到草稿，拒绝时换入"""
+    pipeline, store, drafter, dify = make_pipeline()
+    state_manager = draft(pipeline, store)
+    wait_for(lambda: state_manager.get_pending_review().get('alternative'))
+
+    call = dify.speculative_calls[0]
+    assert call['conversation_id'] is None and call['inputs'][SPECULATIVE_VARIANT_INPUT] == "v2"
+    assert [event.event_type for event in pipeline.event_bus.events_since(0, "s1")][-1] == EVENT_ALTERNATIVE_READY
+    wait_for(lambda: drafter.stats()['ready'] == 1)
+    assert drafter.stats()['spent'] == dify.usage
+
+    pending = state_manager.get_pending_review()
+    result = pipeline.reject(state_manager, "sup", pending['id'], pending['version'])
+    assert result.status == TRANSITION_APPLIED
+    replacement = state_manager.get_pending_review()
+    assert replacement['original_content'] == "备选: 信用卡怎么还款" and replacement['speculative']
+    assert replacement['id'] != pending['id']
+    assert drafter.stats()[OUTCOME_PROMOTED] == 1
+
+def test_show_alternative_swaps_contents():
+    """监督者切换查看时备选回复和原草稿互换"""
+    pipeline, store, drafter, _ = make_pipeline()
+    state_manager = draft(pipeline, store)
+    wait_for(lambda: state_manager.get_pending_review().get('alternative'))
+
+    pending = state_manager.get_pending_review()
+    assert pipeline.show_alternative(state_manager, pending['id'], pending['version']).status == TRANSITION_APPLIED
+    shown = state_manager.get_pending_review()
+    assert shown['original_content'] == "备选: 信用卡怎么还款" and shown['alternative'] == "草稿: 信用卡怎么还款"
+    assert drafter.stats()[OUTCOME_SHOWN] == 1
+
+def test_approve_cancels_in_flight_alternative():
+    """草稿被批准时取消仍在生成的备选回复，不再附加"""
+    pipeline, store, drafter, _ = make_pipeline(delay=5)
+    state_manager = draft(pipeline, store)
+    wait_for(lambda: pipeline.generations.active("s1") == 1)
+
+    pipeline.approve(state_manager, None, "sup")
+    wait_for(lambda: drafter.stats()['cancelled'] == 1)
+    assert pipeline.generations.stats()['reasons'] == {CANCEL_APPROVED: 1}
+    assert state_manager.get_pending_review() is None
+
+def test_budget_limits_speculation():
+    """统计周期内预算用完时跳过预生成，新周期重新计算"""
+    pipeline, store, drafter, _ = make_pipeline(token_budget=1)
+    draft(pipeline, store)
+    assert drafter.stats()['skipped_budget'] == 1 and drafter.stats()['scheduled'] == 0
+
+    drafter.token_budget = 10 ** 6
+    drafter.budget_window = 0
+    draft(pipeline, store, "s2")
+    assert drafter.stats()['scheduled'] == 1
+
+def test_pressure_skips_speculation():
+    """在线请求排队时跳过预生成"""
+    scheduler = LLMScheduler(max_concurrency=1)
+    pipeline, store, drafter, _ = make_pipeline(scheduler=scheduler)
+
+    async def scenario():
+        holder = await scheduler.acquire(LANE_INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire(LANE_INTERACTIVE))
+        await asyncio.sleep(0)
+        state_manager = StateManager(store.get_or_create("s1"))
+        result, _ = pipeline.accept(state_manager, "你好")
+        await pipeline.generate(state_manager, result.message)
+        scheduler.release(holder)
+        scheduler.release(await waiter)
+
+    asyncio.run(scenario())
+    assert drafter.stats()['skipped_pressure'] == 1 and drafter.stats()['scheduled'] == 0
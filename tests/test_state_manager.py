@@ -0,0 +1,90 @@
+"""会话状态管理（共享后端CAS写入、幂等提交与审核状态转换）测试"""
+import os
+import threading
+
+import pytest
+
+from services.session_store import SessionStore
+from services.state_backend import InMemoryStateBackend, SQLiteStateBackend
+from services.state_manager import (
+    StateManager, TRANSITION_APPLIED, TRANSITION_CONFLICT, TRANSITION_DUPLICATE
+)
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    """两种共享状态后端"""
+    if request.param == 'memory':
+        backend = InMemoryStateBackend()
+    else:
+        backend = SQLiteStateBackend(os.path.join(tmp_path, 'state.db'))
+    yield backend
+    backend.close()
+
+def replicas(backend, session_id='s1', count=2):
+    """模拟多个应用副本：各自的会话存储指向同一后端"""
+    return [StateManager(SessionStore(backend=backend).get_or_create(session_id)) for _ in range(count)]
+
+def test_backend_save_is_compare_and_swap(backend):
+    """只有版本号仍是最新时才写入成功"""
+    assert backend.save('s1', 'customer', 'u', '{}', 0) == 1
+    assert backend.save('s1', 'customer', 'u', '{}', 0) is None
+    assert backend.save('s1', 'customer', 'u', '{"a":1}', 1) == 2
+    assert backend.save('s1', 'customer', 'u', '{"a":2}', 1) is None
+    assert backend.load('s1').state == '{"a":1}'
+
+def test_duplicate_submit_returns_first_message(backend):
+    """同一幂等键在不同副本上重复提交，只保存一条消息"""
+    first, second = replicas(backend)
+
+    applied = first.submit_user_message("你好", "key-1")
+    duplicate = second.submit_user_message("你好", "key-1")
+
+    assert applied.status == TRANSITION_APPLIED
+    assert duplicate.status == TRANSITION_DUPLICATE
+    assert duplicate.message.id == applied.message.id
+    assert first.get_message_count() == 1
+
+def test_stale_edit_and_approve_conflict(backend):
+    """基于旧版本的编辑和批准不会覆盖其他副本的修改"""
+    first, second = replicas(backend)
+    message = first.submit_user_message("你好").message
+    pending = first.set_pending_review("草稿", message.id)
+
+    assert second.update_pending_content("副本B修改", 1) == 2
+    assert first.update_pending_content("副本A修改", 1) is None
+    assert first.approve_review(None, pending.id, 1).status == TRANSITION_CONFLICT
+    assert first.get_pending_review()['edited_content'] == "副本B修改"
+
+def test_concurrent_approve_applies_once(backend):
+    """多个副本同时批准同一条回复，只发送一次"""
+    managers = replicas(backend, count=4)
+    message = managers[0].submit_user_message("你好").message
+    pending = managers[0].set_pending_review("草稿", message.id)
+    results = []
+
+    def approve(manager):
+        results.append(manager.approve_review(None, pending.id, 1, f"approve:{pending.id}"))
+
+    threads = [threading.Thread(target=approve, args=(manager,)) for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    statuses = sorted(result.status for result in results)
+    assert statuses.count(TRANSITION_APPLIED) == 1
+    assert set(statuses) <= {TRANSITION_APPLIED, TRANSITION_DUPLICATE, TRANSITION_CONFLICT}
+    assert {result.message.id for result in results if result.message} == {
+        result.message.id for result in results if result.status == TRANSITION_APPLIED
+    }
+    assert [m['sender'] for m in managers[0].get_messages()] == ['user', 'assistant']
+    assert managers[0].get_pending_review() is None
+
+def test_reject_after_approve_conflicts(backend):
+    """已批准的回复不能再被拒绝"""
+    first, second = replicas(backend)
+    message = first.submit_user_message("你好").message
+    pending = first.set_pending_review("草稿", message.id)
+
+    assert first.approve_review(None, pending.id, 1, f"approve:{pending.id}").status == TRANSITION_APPLIED
+    assert second.reject_review(pending.id, 1, f"reject:{pending.id}").status == TRANSITION_CONFLICT
@@ -0,0 +1,84 @@
+"""字符级差异（Myers线性空间算法）测试"""
+import random
+
+from utils.text_diff import diff_opcodes, edit_distance, DELETE, EQUAL, INSERT, REPLACE
+
+def lcs_distance(a, b):
+    """动态规划求插入/删除编辑距离（对照实现）"""
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return len(a) + len(b) - 2 * previous[-1]
+
+def apply_opcodes(a, b, ops):
+    """按操作列表由原文重建新文，同时校验操作首尾相接覆盖全文"""
+    result = []
+    i = j = 0
+    for tag, i1, i2, j1, j2 in ops:
+        assert (i1, j1) == (i, j)
+        if tag == EQUAL:
+            assert a[i1:i2] == b[j1:j2]
+        elif tag == INSERT:
+            assert i1 == i2
+        elif tag == DELETE:
+            assert j1 == j2
+        result.append(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return "".join(result)
+
+def changed_chars(ops):
+    return sum((i2 - i1) + (j2 - j1) for tag, i1, i2, j1, j2 in ops if tag != EQUAL)
+
+def test_examples():
+    """常见修改：替换、插入、删除和相同文本"""
+    assert diff_opcodes("您好，请稍等", "您好，请稍等") == [(EQUAL, 0, 6, 0, 6)]
+    assert diff_opcodes("", "新增") == [(INSERT, 0, 0, 0, 2)]
+    assert diff_opcodes("删除", "") == [(DELETE, 0, 2, 0, 0)]
+    assert diff_opcodes("年费100元", "年费200元") == [
+        (EQUAL, 0, 2, 0, 2), (REPLACE, 2, 3, 2, 3), (EQUAL, 3, 6, 3, 6)
+    ]
+    assert edit_distance("年费100元", "年费200元") == 2
+
+def test_random_texts_match_reference():
+    """随机文本的编辑距离与动态规划一致，差异脚本最短且能重建新文"""
+    rng = random.Random(43)
+    for _ in range(300):
+        a = "".join(rng.choice("abc的了") for _ in range(rng.randint(0, 30)))
+        b = "".join(rng.choice("abc的了") for _ in range(rng.randint(0, 30)))
+        ops = diff_opcodes(a, b)
+        distance = lcs_distance(a, b)
+
+        assert edit_distance(a, b) == distance
+        assert changed_chars(ops) == distance
+        assert apply_opcodes(a, b, ops) == b
+
+def test_adjacent_changes_are_merged():
+    """相邻的删除和插入合并为一个替换，不出现连续的非相同操作"""
+    ops = diff_opcodes("abcdef", "axyzf")
+    tags = [tag for tag, *_ in ops]
+
+    assert all(not (tags[k] != EQUAL and tags[k + 1] != EQUAL) for k in range(len(tags) - 1))
+    assert apply_opcodes("abcdef", "axyzf", ops) == "axyzf"
+
+def test_long_texts_with_few_edits():
+    """长文本少量修改：差异只包含修改处"""
+    rng = random.Random(7)
+    a = "".join(rng.choice("营销文案客户经理回复审核") for _ in range(20000))
+    b = a[:5000] + "插入" + a[5000:12000] + a[12010:]
+    ops = diff_opcodes(a, b)
+
+    assert edit_distance(a, b) == 12
+    assert changed_chars(ops) == 12
+    assert apply_opcodes(a, b, ops) == b
+
+def test_completely_different_texts():
+    """完全不同的文本（编辑距离最大）整体替换"""
+    a = "甲" * 300
+    b = "乙" * 200
+
+    assert edit_distance(a, b) == 500
+    assert diff_opcodes(a, b) == [(REPLACE, 0, 300, 0, 200)]
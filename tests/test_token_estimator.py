@@ -0,0 +1,33 @@
+"""离线token估算测试"""
+from utils.constants import CHARS_PER_ASCII_TOKEN, DIGITS_PER_TOKEN, REQUEST_OVERHEAD_TOKENS
+from utils.token_estimator import cache_info, check_prompt_tokens, estimate_request_tokens, estimate_tokens
+
+def test_estimate_by_character_class():
+    """中文按字计，英文单词和数字串按长度折算，空白不计"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("工资到账，") == 5
+    assert estimate_tokens("a" * (CHARS_PER_ASCII_TOKEN + 1)) == 2
+    assert estimate_tokens("1" * DIGITS_PER_TOKEN * 2) == 2
+    assert estimate_tokens("  \n\t ") == 0
+    assert estimate_tokens("VIP客户 6000元!") == 1 + 2 + 2 + 1 + 1
+
+def test_estimate_is_cached():
+    """相同文本只计算一次"""
+    text = "缓存测试文本" * 3
+    estimate_tokens(text)
+    hits = cache_info().hits
+    estimate_tokens(text)
+    assert cache_info().hits == hits + 1
+
+def test_request_tokens_include_overhead_and_string_inputs():
+    """请求估算包含固定开销和字符串输入变量"""
+    assert estimate_request_tokens("你好") == REQUEST_OVERHEAD_TOKENS + 2
+    assert estimate_request_tokens("你好", {"history_summary": "摘要", "count": 3}) == REQUEST_OVERHEAD_TOKENS + 4
+
+def test_check_prompt_tokens_matches_displayed_estimate():
+    """超限检查与显示的预计token数一致：等于上限通过，超出一个拒绝"""
+    prompt = "营销文案" * 10
+    tokens = estimate_tokens(prompt)
+    assert check_prompt_tokens(prompt, tokens) == (True, "")
+    is_valid, error_msg = check_prompt_tokens(prompt, tokens - 1)
+    assert not is_valid and f"预计 {tokens} tokens" in error_msg
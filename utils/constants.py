@@ -161,4 +161,121 @@ ICONS = {
     "delete": "🗑️",
     "export": "📥",
     "settings": "⚙️",
-}
\ No newline at end of file
+}
+
+# 营销信号导入相关常量
+SIGNAL_SCHEMA = {
+    "tags": {"type": list, "required": True, "min_items": 1, "max_items": 20, "item_max_length": 32},
+    "event": {"type": str, "required": True, "max_length": 200},
+    "customer_id": {"type": (str, int), "required": False, "max_length": 64},
+}
+
+# 标签同义词归一化（别名 -> 标准标签）
+SIGNAL_TAG_ALIASES = {
+    "工资代发": "代发工资",
+    "代发薪": "代发工资",
+    "个体户": "个体工商户",
+    "没有信用卡": "无信用卡",
+    "无金融类产品": "无金融产品",
+}
+
+# 批量生成时对Dify的最大并发请求数
+MARKETING_BATCH_CONCURRENCY = 4
+
+# 模板文案缺少或多出占位符时最多生成的次数
+MARKETING_TEMPLATE_ATTEMPTS = 2
+
+# 导入错误样本最多保留条数
+SIGNAL_ERROR_SAMPLE_LIMIT = 100
+
+# 对话上下文管理相关常量
+CONTEXT_SUMMARY_INPUT = "history_summary"  # Dify应用中接收滚动摘要的输入变量
+CONTEXT_RECENT_INPUT = "recent_history"  # Dify应用中接收最近对话的输入变量
+CONTEXT_SUMMARY_LINE_LENGTH = 60
+
+# token估算相关常量
+TOKEN_CACHE_SIZE = 4096
+TOKENS_PER_CJK_CHAR = 1.0
+CHARS_PER_ASCII_TOKEN = 4
+DIGITS_PER_TOKEN = 3
+REQUEST_OVERHEAD_TOKENS = 20  # 单次请求的固定开销（角色标记、格式等）
+DEFAULT_MAX_PROMPT_TOKENS = 2000
+
+# 页面样式文件（static目录下，按顺序合并注入）
+STYLESHEETS = ["style.css", "marketing.css"]
+
+# 共享状态后端写入版本冲突时的最大重试次数
+STATE_COMMIT_RETRIES = 5
+
+# 共享状态后端中会话访问时间的最小更新间隔（秒），避免每次读取都写后端
+SESSION_TOUCH_INTERVAL = 30
+
+# 每个会话最多保留的幂等键数量（超出时丢弃最早的）
+IDEMPOTENCY_KEY_LIMIT = 200
+
+# 对话历史检索相关常量
+SEARCH_RESULT_LIMIT = 20
+SEARCH_MAX_CANDIDATES = 50000  # 单次查询最多评估的候选消息数（从最新的开始）
+SEARCH_SNIPPET_CHARS = 40
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 已批准回复知识库相关常量
+ANSWER_LIBRARY_SUGGESTION_LIMIT = 3
+ANSWER_LIBRARY_MIN_COVERAGE = 0.35  # 当前问题的词元至少有该比例出现在历史问题中才推荐
+ANSWER_LIBRARY_MIN_CHARS = 8  # 过短的回复（如"好的"）不收录
+
+# AI草稿修改分析相关常量
+EDIT_PHRASE_MERGE_GAP = 2  # 间隔不超过该字符数的修改合并为一个片段
+EDIT_PHRASE_MIN_CHARS = 2
+EDIT_PHRASE_MAX_CHARS = 30
+EDIT_PROMPT_KEY_CHARS = 40
+EDIT_REPORT_TOP = 20
+EDIT_REPORT_MIN_REVIEWS = 3
+EDIT_BATCH_CHUNK_SIZE = 512
+
+# 监督审核效率指标相关常量
+METRICS_WINDOWS = {"最近1小时": 3600, "最近24小时": 86400, "最近7天": 7 * 86400}
+METRICS_SIDEBAR_WINDOW = "最近24小时"
+METRICS_WINDOW_SLOTS = 60  # 每个滑动窗口划分的槽数（窗口精度为窗口长度的1/60）
+METRICS_HISTORY_BUCKET_SECONDS = 3600
+METRICS_RETENTION_DAYS = 90
+METRICS_LATENCY_MIN_SECONDS = 0.5  # 审核耗时直方图：第一个分桶的上界
+METRICS_LATENCY_GROWTH = 1.25  # 相邻分桶上界之比
+METRICS_LATENCY_BINS = 60
+METRICS_OPEN_REVIEW_TTL = 86400  # 超过该时长未处理的待审核项不再计入队列深度
+
+# LLM请求调度相关常量（按通道：interactive 在线客服、regenerate 监督者重新生成、
+# speculative 备选草稿预生成、batch 批量营销）
+LLM_LANE_WEIGHTS = {"interactive": 8, "regenerate": 4, "speculative": 2, "batch": 1}  # 加权公平排队的权重
+LLM_LANE_CAP_RATIOS = {"interactive": 1.0, "regenerate": 0.5, "speculative": 0.25,
+                       "batch": 0.5}  # 各通道最多占用的并发比例
+LLM_LANE_DEADLINES = {"interactive": 15, "regenerate": 30, "speculative": 20,
+                      "batch": 0}  # 最长排队秒数，0表示不限
+LLM_BATCH_MIN_SLOTS = 1  # 有在线请求排队时批量通道仍保留的并发数（避免饿死）
+LLM_WAIT_SAMPLES = 1024  # 每个通道保留最近多少次排队耗时用于计算分位数
+
+# 备选草稿预生成相关常量
+SPECULATIVE_VARIANT_INPUT = "draft_variant"  # Dify应用中接收提示词变体的输入变量
+SPECULATIVE_BUDGET_WINDOW = 3600  # token预算的统计周期（秒）
+SPECULATIVE_MAX_UTILIZATION = 0.75  # Dify并发占用超过该比例时不预生成
+
+# 敏感信息脱敏相关常量
+PII_KINDS = ("phone", "id_card", "bank_card", "amount")
+PII_TOKEN_HEX_DIGITS = 10  # 占位符中哈希的十六进制位数（同一值在不同请求中得到相同占位符）
+PII_VAULT_SIZE = 100000  # 进程内保留最近多少个占位符用于还原（回复中引用历史轮次的占位符）
+
+# 入口准入控制相关常量
+ADMISSION_MIN_LIMIT = 1  # 自适应并发上限的下限
+ADMISSION_DECREASE = 0.7  # 延迟超标或出错时并发上限乘以该系数
+ADMISSION_LATENCY_ALPHA = 0.2  # Dify延迟指数滑动平均的平滑系数
+ADMISSION_OUTCOME_SAMPLES = 50  # 按最近多少次Dify调用计算错误率
+ADMISSION_MAX_ERROR_RATE = 0.3  # 错误率超过该值时暂停后台任务
+ADMISSION_BACKGROUND_RATIO = 0.75  # 在线生成占用达到并发上限的该比例时暂停后台任务
+ADMISSION_TOKEN_WINDOW = 60  # token预算的统计周期（秒）
+ADMISSION_POLL_INTERVAL = 0.5  # 排队中的消息因审核积压或token预算等待时的重新检查间隔（秒）
+ADMISSION_NOTICES = {
+    "queued": "已收到您的消息。当前咨询人数较多，您排在第 {position} 位，客户经理会尽快为您回复。",
+    "shed": "当前咨询人数较多，暂时无法受理新消息，请稍后再试。",
+    "batch": "系统繁忙，批量任务已暂缓，请稍后重试",
+}
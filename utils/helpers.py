@@ -1,23 +1,53 @@
 """辅助函数"""
+import atexit
 import logging
+import platform
+import re
+import sys
+import threading
+import uuid
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 from typing import Any, Dict, Optional
 from datetime import datetime
+from utils.logging_pipeline import LoggingPipeline
 
-def setup_logging(level: str = "INFO"):
+# 预编译的正则表达式
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+_logging_pipeline: Optional[LoggingPipeline] = None
+_logging_lock = threading.Lock()
+
+def setup_logging(level: str = "INFO", config=None):
     """设置日志配置
     
+    日志经有界队列交给专用写入线程处理，请求路径上不做阻塞I/O。
+    Streamlit每次重新运行脚本都会调用本函数，管道在进程内只启动一次。
+    
     Args:
         level: 日志级别
+        config: 日志管道配置（LoggingConfig，可选）
     """
-    logging.basicConfig(
-        level=getattr(logging, level.upper()),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('app.log', encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
+    global _logging_pipeline
+    with _logging_lock:
+        if _logging_pipeline is not None:
+            return _logging_pipeline
+        
+        options = {}
+        if config is not None:
+            options = {
+                'log_file': config.log_file,
+                'max_bytes': config.max_bytes,
+                'backup_count': config.backup_count,
+                'rotate_interval': config.rotate_interval,
+                'sample_rate': config.sample_rate,
+                'queue_size': config.queue_size,
+                'json_format': config.json_format,
+            }
+        _logging_pipeline = LoggingPipeline(level, **options)
+        _logging_pipeline.start()
+        atexit.register(_logging_pipeline.stop)
+        return _logging_pipeline
 
 def handle_error(func):
     """错误处理装饰器
@@ -34,6 +64,16 @@ def handle_error(func):
             return None
     return wrapper
 
+def rerun_fragment():
+    """只重跑当前局部片段
+    
+    片段在整页运行中执行时Streamlit不允许片段级重跑，此时退回整页重跑。
+    """
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
 def safe_get_session_state(key: str, default: Any = None) -> Any:
     """安全获取session state值
     
@@ -153,7 +193,6 @@ def generate_session_id() -> str:
     Returns:
         会话ID
     """
-    import uuid
     return str(uuid.uuid4())
 
 def clean_text_input(text: str) -> str:
@@ -172,8 +211,7 @@ def clean_text_input(text: str) -> str:
     text = text.strip()
     
     # 替换多个连续空格为单个空格
-    import re
-    text = re.sub(r'\s+', ' ', text)
+    text = _WHITESPACE_PATTERN.sub(' ', text)
     
     return text
 
@@ -201,9 +239,6 @@ def get_system_info() -> Dict[str, Any]:
     Returns:
         系统信息字典
     """
-    import platform
-    import sys
-    
     return {
         'platform': platform.system(),
         'python_version': sys.version,
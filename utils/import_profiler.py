@@ -0,0 +1,99 @@
+"""模块导入耗时分析
+
+在子进程中以 `python -X importtime` 导入目标模块，解析解释器输出的导入耗时，
+列出累计耗时和自身耗时最高的模块，用于定位冷启动瓶颈。
+"""
+import argparse
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+_IMPORTTIME_PATTERN = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S.*)$')
+
+@dataclass
+class ImportTiming:
+    """单个模块的导入耗时"""
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """解析 -X importtime 的输出
+
+    Args:
+        output: 解释器写入stderr的内容
+
+    Returns:
+        按导入完成顺序排列的耗时记录
+    """
+    timings = []
+    for line in output.splitlines():
+        match = _IMPORTTIME_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            timings.append(ImportTiming(
+                module=module.strip(),
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(indent) - 1) // 2
+            ))
+    return timings
+
+def profile_imports(module: str, python: str = sys.executable) -> List[ImportTiming]:
+    """在独立子进程中导入模块并收集导入耗时
+
+    Args:
+        module: 模块名（如app）
+        python: Python解释器路径
+
+    Returns:
+        耗时记录
+
+    Raises:
+        RuntimeError: 模块导入失败
+    """
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True
+    )
+    timings = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(f"导入 {module} 失败: {errors[-1] if errors else result.returncode}")
+    return timings
+
+def format_report(timings: List[ImportTiming], top: int = 20) -> str:
+    """生成耗时报告
+
+    Args:
+        timings: 耗时记录
+        top: 每个榜单显示的模块数
+
+    Returns:
+        报告文本
+    """
+    total_us = sum(timing.cumulative_us for timing in timings if timing.depth == 0)
+    lines = [f"导入模块数: {len(timings)}  总耗时: {total_us / 1000:.1f}ms", ""]
+
+    for title, key in (("累计耗时最高", lambda t: t.cumulative_us), ("自身耗时最高", lambda t: t.self_us)):
+        lines.append(f"{title}（前{top}）:")
+        lines.append(f"{'累计(ms)':>10} {'自身(ms)':>10}  模块")
+        for timing in sorted(timings, key=key, reverse=True)[:top]:
+            lines.append(f"{timing.cumulative_us / 1000:>10.1f} {timing.self_us / 1000:>10.1f}  {timing.module}")
+        lines.append("")
+    return "\n".join(lines)
+
+def main(argv: Optional[List[str]] = None):
+    """导入耗时分析命令行入口"""
+    parser = argparse.ArgumentParser(description="分析模块导入耗时（基于 python -X importtime）")
+    parser.add_argument('module', nargs='?', default='app', help="要分析的模块")
+    parser.add_argument('--top', type=int, default=20, help="显示耗时最高的模块数")
+    args = parser.parse_args(argv)
+
+    print(format_report(profile_imports(args.module), args.top))
+
+if __name__ == "__main__":
+    main()
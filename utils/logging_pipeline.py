@@ -0,0 +1,183 @@
+"""异步日志管道"""
+import contextvars
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict
+
+# 当前请求的日志上下文（会话ID、关联ID）
+_log_context: contextvars.ContextVar = contextvars.ContextVar('log_context', default={})
+
+def set_log_context(**fields: Any):
+    """设置当前上下文的日志字段（如session_id、correlation_id）
+
+    Args:
+        **fields: 日志字段，值为None时移除该字段
+    """
+    context = dict(_log_context.get())
+    for key, value in fields.items():
+        if value is None:
+            context.pop(key, None)
+        else:
+            context[key] = value
+    _log_context.set(context)
+
+def get_log_context() -> Dict[str, Any]:
+    """获取当前上下文的日志字段
+
+    Returns:
+        日志字段字典
+    """
+    return _log_context.get()
+
+class ContextFilter(logging.Filter):
+    """在记录入队前附加日志上下文（写入线程中无法读取请求上下文）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """对高频INFO及以下级别日志按比例采样，WARNING及以上全部保留"""
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.interval = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.interval == 1:
+            return True
+        if self.interval == 0:
+            return False
+        with self._lock:
+            count = self._counters.get(record.name, 0)
+            self._counters[record.name] = count + 1
+        return count % self.interval == 0
+
+class JsonLineFormatter(logging.Formatter):
+    """结构化JSON Lines日志格式"""
+
+    # LogRecord的标准属性，其余属性视为结构化字段
+    _RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._RESERVED and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """按大小或时间轮转并gzip压缩历史文件的日志处理器"""
+
+    def __init__(self, filename: str, max_bytes: int = 0, backup_count: int = 0,
+                 rotate_interval: int = 0, encoding: str = 'utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding, delay=True)
+        self.rotate_interval = rotate_interval
+        self.rollover_at = time.time() + rotate_interval if rotate_interval else None
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        if self.rotate_interval:
+            self.rollover_at = time.time() + self.rotate_interval
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        """压缩轮转出的日志文件"""
+        if not os.path.exists(source):
+            return
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+class DroppingQueueHandler(QueueHandler):
+    """有界队列前端：队列满时丢弃日志而不是阻塞请求线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LoggingPipeline:
+    """基于队列的异步日志管道
+
+    请求线程只负责把日志记录放入有界队列，由专用写入线程完成格式化、
+    写文件（按大小/时间轮转并压缩）和控制台输出。
+    """
+
+    def __init__(self, level: str = "INFO", log_file: str = "app.log",
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 rotate_interval: int = 86400, sample_rate: float = 1.0,
+                 queue_size: int = 10000, json_format: bool = True):
+        self.level = getattr(logging, level.upper())
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        file_handler = CompressingRotatingFileHandler(
+            log_file, max_bytes=max_bytes, backup_count=backup_count,
+            rotate_interval=rotate_interval
+        )
+        stream_handler = logging.StreamHandler()
+        text_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        file_handler.setFormatter(JsonLineFormatter() if json_format else text_formatter)
+        stream_handler.setFormatter(text_formatter)
+
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.queue_handler.addFilter(SamplingFilter(sample_rate))
+        self.queue_handler.addFilter(ContextFilter())
+        self.listener = QueueListener(self.queue, file_handler, stream_handler,
+                                      respect_handler_level=True)
+
+    def start(self):
+        """启动写入线程并接管根日志记录器"""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+        self.listener.start()
+
+    def stop(self):
+        """停止写入线程并刷新剩余日志"""
+        logging.getLogger().removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def stats(self) -> Dict[str, int]:
+        """获取管道状态
+
+        Returns:
+            队列积压与丢弃条数
+        """
+        return {'queued': self.queue.qsize(), 'dropped': self.queue_handler.dropped}
@@ -0,0 +1,317 @@
+"""敏感信息脱敏工具"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, IO, Iterable, List, Optional, Tuple
+from utils.constants import PII_KINDS, PII_TOKEN_HEX_DIGITS, PII_VAULT_SIZE
+
+PII_PHONE = "phone"
+PII_ID_CARD = "id_card"
+PII_BANK_CARD = "bank_card"
+PII_AMOUNT = "amount"
+
+PII_LABELS = {
+    PII_PHONE: "手机号",
+    PII_ID_CARD: "身份证号",
+    PII_BANK_CARD: "银行卡号",
+    PII_AMOUNT: "金额",
+}
+
+# 占位符中的类别名，如 [PHONE_3f9a1c2b7d]
+_TOKEN_NAMES = {
+    PII_PHONE: "PHONE",
+    PII_ID_CARD: "IDCARD",
+    PII_BANK_CARD: "CARD",
+    PII_AMOUNT: "AMOUNT",
+}
+
+# 单次扫描的检测模式：金额（带货币符号或单位） / 号码（连续11-19位数字，或手机号、银行卡、
+# 身份证号的常见分隔写法）。号码的类别在回调中按长度和校验位判断，不合法的号码保持原样。
+# 开头的先行断言按首字符快速跳过不可能匹配的位置，避免在每个位置逐一尝试各分支
+_PII_PATTERN = re.compile(
+    r'(?=[\d¥￥RC+])(?:'
+    r'(?P<amount>(?:[¥￥]|(?<![A-Za-z])(?:RMB|CNY))\s?\d+(?:,\d{3})*(?:\.\d{1,2})?(?:\s?[万亿])?元?'
+    r'|(?<![0-9A-Za-z.,])\d+(?:,\d{3})*(?:\.\d{1,2})?\s?(?:万元|亿元|元|万|亿|块钱))'
+    r'|(?P<number>(?<![0-9A-Za-z+])(?:\+86[ -]?)?'
+    r'(?:\d{4}(?:[ -]\d{4}){2,3}(?:[ -]\d{1,3})?'
+    r'|1[3-9]\d[ -]\d{4}[ -]\d{4}'
+    r'|\d{6}[ -]\d{8}[ -]\d{3}[\dXx]'
+    r'|\d{11,19}[Xx]?)'
+    r'(?![0-9A-Za-z])))'
+)
+
+_HAS_DIGIT = re.compile(r'\d')
+_NUMBER_NOISE = re.compile(r'[ +-]')
+_ID_CARD_PATTERN = re.compile(
+    r'[1-9]\d{5}(?:18|19|20)\d{2}(?:0[1-9]|1[0-2])(?:0[1-9]|[12]\d|3[01])\d{3}[\dX]$'
+)
+_TOKEN_PATTERN = re.compile(
+    r'\[(?:%s)_[0-9a-f]{%d}\]' % ("|".join(_TOKEN_NAMES.values()), PII_TOKEN_HEX_DIGITS)
+)
+
+_ID_WEIGHTS = (7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2)
+_ID_CHECK_CODES = "10X98765432"
+_LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+def id_card_valid(number: str) -> bool:
+    """校验18位身份证号（出生日期格式与GB 11643校验码）
+
+    Args:
+        number: 身份证号（末位X需大写）
+    """
+    if not _ID_CARD_PATTERN.match(number):
+        return False
+    total = sum(int(digit) * weight for digit, weight in zip(number, _ID_WEIGHTS))
+    return _ID_CHECK_CODES[total % 11] == number[17]
+
+def luhn_valid(number: str) -> bool:
+    """Luhn校验（银行卡号）
+
+    Args:
+        number: 纯数字字符串
+    """
+    total = 0
+    for index, char in enumerate(reversed(number)):
+        digit = ord(char) - 48
+        total += _LUHN_DOUBLED[digit] if index & 1 else digit
+    return total % 10 == 0
+
+def classify_number(digits: str) -> Optional[Tuple[str, str]]:
+    """判断号码类别
+
+    Args:
+        digits: 去除空格、连字符和加号后的号码
+
+    Returns:
+        (类别, 规范值)；不是手机号、身份证号或银行卡号时返回None
+    """
+    length = len(digits)
+    if length == 13 and digits.startswith('86') and digits[2] == '1' and digits[3] in '3456789':
+        return PII_PHONE, digits[2:]
+    if length == 11 and digits[0] == '1' and digits[1] in '3456789':
+        return PII_PHONE, digits
+    if length == 18 and id_card_valid(digits):
+        return PII_ID_CARD, digits
+    if 13 <= length <= 19 and digits.isdigit() and luhn_valid(digits):
+        return PII_BANK_CARD, digits
+    return None
+
+class PIIMasker:
+    """敏感信息脱敏器
+
+    用一个预编译的正则单次扫描文本，识别手机号、身份证号（校验码）、银行卡号（Luhn）
+    和金额，替换为占位符后再发往Dify，回复中的占位符再还原为原值。
+    占位符由带密钥的哈希生成：同一个值在不同轮次、不同请求中得到相同的占位符，
+    Dify会话历史中的占位符前后一致，也不需要在会话中保存映射表；进程内保留最近的
+    占位符用于还原回复中引用的历史占位符。多进程部署或需要回放录制流量时应配置相同的密钥。
+    不含数字的文本直接跳过；Luhn校验对随机号码约有10%的误判，宁可多脱敏也不漏脱敏。
+    """
+
+    def __init__(self, kinds: Iterable[str] = PII_KINDS, secret: Optional[bytes] = None,
+                 vault_size: int = PII_VAULT_SIZE):
+        self.kinds = frozenset(kinds)
+        unknown = self.kinds - set(PII_LABELS)
+        if unknown:
+            raise ValueError(f"未知的脱敏类别: {', '.join(sorted(unknown))}")
+        self._secret = secret or os.urandom(16)
+        self._vault: 'OrderedDict[str, str]' = OrderedDict()
+        self._vault_size = vault_size
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {kind: 0 for kind in PII_LABELS}
+        self.counters.update(texts=0, restored=0, unresolved=0)
+
+    def token(self, kind: str, value: str) -> str:
+        """生成值对应的占位符"""
+        digest = hashlib.blake2s(value.encode('utf-8'), key=self._secret,
+                                 digest_size=(PII_TOKEN_HEX_DIGITS + 1) // 2).hexdigest()
+        return f"[{_TOKEN_NAMES[kind]}_{digest[:PII_TOKEN_HEX_DIGITS]}]"
+
+    def mask(self, text: str, found: Optional[Dict[str, str]] = None) -> str:
+        """脱敏文本
+
+        Args:
+            text: 原文
+            found: 可选的映射表，记录本次替换的 占位符 -> 原值（同一请求的多个字段可共用）
+
+        Returns:
+            脱敏后的文本
+        """
+        if not text or not _HAS_DIGIT.search(text):
+            return text
+        replaced: List[Tuple[str, str, str]] = []
+
+        def replace(match) -> str:
+            raw = match.group(0)
+            if match.lastgroup == 'amount':
+                kind, value = PII_AMOUNT, raw
+            else:
+                detected = classify_number(_NUMBER_NOISE.sub('', raw).upper())
+                if detected is None:
+                    return raw
+                kind, value = detected
+            if kind not in self.kinds:
+                return raw
+            token = self.token(kind, value)
+            replaced.append((kind, token, value))
+            return token
+
+        masked = _PII_PATTERN.sub(replace, text)
+        with self._lock:
+            self.counters['texts'] += 1
+            for kind, token, value in replaced:
+                self.counters[kind] += 1
+                if self._vault_size:
+                    self._vault[token] = value
+                    self._vault.move_to_end(token)
+            while len(self._vault) > self._vault_size:
+                self._vault.popitem(last=False)
+        if found is not None:
+            for _, token, value in replaced:
+                found[token] = value
+        return masked
+
+    def mask_inputs(self, inputs: Optional[Dict[str, Any]],
+                    found: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """脱敏Dify应用输入变量中的字符串值
+
+        Args:
+            inputs: 输入变量
+            found: 可选的映射表，记录本次替换
+
+        Returns:
+            脱敏后的输入变量（新字典）
+        """
+        return {key: self.mask(value, found) if isinstance(value, str) else value
+                for key, value in (inputs or {}).items()}
+
+    def restore(self, text: str, found: Optional[Dict[str, str]] = None) -> str:
+        """把回复中的占位符还原为原值
+
+        Args:
+            text: 含占位符的文本
+            found: 脱敏时记录的映射表（优先使用，其次查进程内保留的占位符）
+
+        Returns:
+            还原后的文本；无法还原的占位符保持原样
+        """
+        if not text or '[' not in text:
+            return text
+        counts = {'restored': 0, 'unresolved': 0}
+
+        def replace(match) -> str:
+            token = match.group(0)
+            value = found.get(token) if found else None
+            if value is None:
+                with self._lock:
+                    value = self._vault.get(token)
+            if value is None:
+                counts['unresolved'] += 1
+                return token
+            counts['restored'] += 1
+            return value
+
+        restored = _TOKEN_PATTERN.sub(replace, text)
+        if counts['restored'] or counts['unresolved']:
+            with self._lock:
+                self.counters['restored'] += counts['restored']
+                self.counters['unresolved'] += counts['unresolved']
+        return restored
+
+    def stats(self) -> Dict[str, int]:
+        """获取脱敏统计（各类别替换次数、扫描文本数、还原/未能还原的占位符数）"""
+        with self._lock:
+            result = dict(self.counters)
+            result['vault'] = len(self._vault)
+            return result
+
+def create_pii_masker(enabled: bool, kinds: Iterable[str] = PII_KINDS,
+                      secret: str = "") -> Optional[PIIMasker]:
+    """按配置创建脱敏器
+
+    Args:
+        enabled: 是否开启脱敏
+        kinds: 脱敏类别
+        secret: 占位符哈希密钥（为空时每个进程随机生成）
+
+    Returns:
+        脱敏器；未开启时返回None
+    """
+    if not enabled:
+        return None
+    return PIIMasker(kinds, secret.encode('utf-8') if secret else None)
+
+def mask_value(masker: PIIMasker, value: Any) -> Any:
+    """递归脱敏JSON值中的字符串（数字等其他类型保持原样）"""
+    if isinstance(value, str):
+        return masker.mask(value)
+    if isinstance(value, list):
+        return [mask_value(masker, item) for item in value]
+    if isinstance(value, dict):
+        return {key: mask_value(masker, item) for key, item in value.items()}
+    return value
+
+def mask_lines(masker: PIIMasker, lines: Iterable[str]) -> Iterable[str]:
+    """逐行脱敏文件（JSON Lines只处理字符串字段，其他行按文本处理）
+
+    Args:
+        masker: 脱敏器
+        lines: 文本行
+
+    Yields:
+        脱敏后的行（不含换行符）
+    """
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not _PII_PATTERN.search(line):
+            yield line
+        elif line.startswith('{'):
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                yield masker.mask(line)
+                continue
+            yield json.dumps(mask_value(masker, data), ensure_ascii=False, separators=(",", ":"))
+        else:
+            yield masker.mask(line)
+
+def main(argv: Optional[List[str]] = None):
+    """批量文件脱敏命令行入口"""
+    parser = argparse.ArgumentParser(description="脱敏营销信号等批量文件中的手机号、身份证号、银行卡号和金额")
+    parser.add_argument('input', help="输入文件（JSON Lines或纯文本，'-'为标准输入）")
+    parser.add_argument('-o', '--output', help="输出文件（默认标准输出）")
+    parser.add_argument('--kinds', default=",".join(PII_KINDS), help="脱敏类别，逗号分隔")
+    parser.add_argument('--secret', default=os.getenv('PII_TOKEN_SECRET', ''),
+                        help="占位符哈希密钥（相同密钥下同一值的占位符相同）")
+    args = parser.parse_args(argv)
+
+    masker = PIIMasker([kind.strip() for kind in args.kinds.split(",") if kind.strip()],
+                       args.secret.encode('utf-8') if args.secret else None, vault_size=0)
+    source: IO = (io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig') if args.input == '-'
+                  else open(args.input, encoding='utf-8-sig'))
+    target: IO = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    start = time.perf_counter()
+    rows = 0
+    try:
+        for line in mask_lines(masker, source):
+            target.write(line + "\n")
+            rows += 1
+    finally:
+        source.close()
+        if args.output:
+            target.close()
+    elapsed = time.perf_counter() - start
+
+    stats = masker.stats()
+    counts = "，".join(f"{PII_LABELS[kind]} {stats[kind]}" for kind in PII_LABELS)
+    print(f"脱敏完成: {rows} 行，耗时 {elapsed:.2f}s（{rows / elapsed if elapsed else 0:.0f} 行/秒）；{counts}",
+          file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
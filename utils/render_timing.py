@@ -0,0 +1,97 @@
+"""界面重绘耗时统计"""
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class _ScopeStats:
+    """单个重绘范围（整页或某个局部片段）的耗时统计"""
+
+    __slots__ = ('count', 'total', 'max', 'last', 'recent')
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+        self.recent.append(seconds)
+
+    def to_dict(self) -> Dict[str, float]:
+        recent = sorted(self.recent)
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': recent[len(recent) // 2] * 1000 if recent else 0.0,
+            'p95_ms': recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000 if recent else 0.0,
+            'max_ms': self.max * 1000,
+            'last_ms': self.last * 1000,
+        }
+
+_stats: Dict[str, _ScopeStats] = {}
+_lock = threading.Lock()
+_WINDOW = 200
+
+def record_render(scope: str, seconds: float):
+    """记录一次重绘耗时
+
+    Args:
+        scope: 重绘范围（app表示整页重跑，其余为局部片段名称）
+        seconds: 耗时（秒）
+    """
+    with _lock:
+        stats = _stats.get(scope)
+        if stats is None:
+            stats = _stats[scope] = _ScopeStats(_WINDOW)
+        stats.add(seconds)
+    logger.debug(f"重绘耗时 {scope}: {seconds * 1000:.1f}ms",
+                 extra={'render_scope': scope, 'duration_ms': round(seconds * 1000, 2)})
+
+def timed_render(scope: str) -> Callable:
+    """统计被装饰函数（整页或局部片段）每次执行耗时的装饰器
+
+    st.rerun()/st.stop()通过异常中断执行，同样计入耗时。
+
+    Args:
+        scope: 重绘范围名称
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_render(scope, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def get_render_stats(scope: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """获取重绘耗时统计
+
+    Args:
+        scope: 只返回指定范围（默认全部）
+
+    Returns:
+        范围 -> 次数、平均/p50/p95/最大/最近一次耗时(毫秒)
+    """
+    with _lock:
+        return {
+            name: stats.to_dict() for name, stats in _stats.items()
+            if scope is None or name == scope
+        }
+
+def reset_render_stats():
+    """清空统计"""
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,183 @@
+"""静态资源（CSS）缓存与注入"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = "static"
+BUILD_SUBDIR = "build"
+STATIC_URL_PREFIX = "app/static"
+
+STATIC_MODE_INLINE = "inline"
+STATIC_MODE_LINK = "link"
+
+_CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.S)
+_CSS_WHITESPACE_PATTERN = re.compile(r'\s+')
+_CSS_PUNCTUATION_PATTERN = re.compile(r'\s*([{}:;,>])\s*')
+_CSS_TRAILING_SEMICOLON_PATTERN = re.compile(r';}')
+
+def minify_css(css: str) -> str:
+    """压缩CSS：去除注释、多余空白和规则末尾的分号
+
+    Args:
+        css: CSS源码
+
+    Returns:
+        压缩后的CSS
+    """
+    css = _CSS_COMMENT_PATTERN.sub('', css)
+    css = _CSS_WHITESPACE_PATTERN.sub(' ', css)
+    css = _CSS_PUNCTUATION_PATTERN.sub(r'\1', css)
+    css = _CSS_TRAILING_SEMICOLON_PATTERN.sub('}', css)
+    return css.strip()
+
+@dataclass(frozen=True)
+class StaticAsset:
+    """已压缩并计算内容哈希的静态资源"""
+    name: str
+    content: str
+    digest: str
+    source_bytes: int
+
+    @property
+    def filename(self) -> str:
+        """带内容哈希的文件名（内容不变则文件名不变，可长期缓存）"""
+        stem, suffix = os.path.splitext(self.name)
+        return f"{stem}.{self.digest}{suffix}"
+
+    @property
+    def url(self) -> str:
+        """Streamlit静态文件服务下的相对URL"""
+        return f"{STATIC_URL_PREFIX}/{BUILD_SUBDIR}/{self.filename}"
+
+class StaticAssetRegistry:
+    """进程级静态资源缓存
+
+    每个CSS文件只在首次使用（或文件修改）时读取、压缩并计算哈希，之后的重跑
+    直接复用缓存；注入页面的HTML片段也按资源哈希缓存。link模式下压缩结果写入
+    static/build/（文件名带内容哈希），页面只注入一条@import，浏览器按HTTP缓存加载，
+    样式内容不再随每次重跑发送。
+    """
+
+    def __init__(self, static_dir: str = STATIC_DIR):
+        self.static_dir = static_dir
+        self._assets: Dict[str, Tuple[float, Optional[StaticAsset]]] = {}
+        self._published: Dict[str, str] = {}
+        self._snippets: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        """获取静态资源（文件不存在时返回None）
+
+        Args:
+            name: static目录下的文件名
+
+        Returns:
+            静态资源
+        """
+        path = os.path.join(self.static_dir, name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = -1.0
+
+        with self._lock:
+            cached = self._assets.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        asset = None
+        if mtime < 0:
+            logger.warning(f"静态资源不存在: {path}")
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                source = f.read()
+            content = minify_css(source) if name.endswith('.css') else source
+            asset = StaticAsset(
+                name=name,
+                content=content,
+                digest=hashlib.sha256(content.encode('utf-8')).hexdigest()[:12],
+                source_bytes=len(source.encode('utf-8'))
+            )
+        with self._lock:
+            self._assets[name] = (mtime, asset)
+        return asset
+
+    def publish(self, asset: StaticAsset) -> str:
+        """把压缩后的资源写入static/build/（同一内容只写一次）
+
+        Args:
+            asset: 静态资源
+
+        Returns:
+            资源URL
+        """
+        with self._lock:
+            if self._published.get(asset.name) == asset.digest:
+                return asset.url
+
+        build_dir = os.path.join(self.static_dir, BUILD_SUBDIR)
+        os.makedirs(build_dir, exist_ok=True)
+        path = os.path.join(build_dir, asset.filename)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(asset.content)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._published[asset.name] = asset.digest
+        return asset.url
+
+    def style_snippet(self, names: Sequence[str], mode: str = STATIC_MODE_INLINE) -> str:
+        """生成注入页面的<style>片段（按资源哈希缓存）
+
+        Args:
+            names: CSS文件名列表
+            mode: inline（内联压缩后的CSS）或link（@import静态文件URL）
+
+        Returns:
+            HTML片段，没有可用资源时为空字符串
+        """
+        assets = [asset for asset in (self.get(name) for name in names) if asset is not None]
+        key = (mode, tuple(asset.digest for asset in assets))
+        with self._lock:
+            snippet = self._snippets.get(key)
+        if snippet is not None:
+            return snippet
+
+        if not assets:
+            snippet = ""
+        elif mode == STATIC_MODE_LINK:
+            imports = "".join(f'@import url("{self.publish(asset)}");' for asset in assets)
+            snippet = f"<style>{imports}</style>"
+        else:
+            snippet = f"<style>{''.join(asset.content for asset in assets)}</style>"
+        with self._lock:
+            self._snippets[key] = snippet
+        return snippet
+
+    def stats(self) -> List[Dict[str, int]]:
+        """获取已缓存资源的压缩统计"""
+        with self._lock:
+            assets = [asset for _, asset in self._assets.values() if asset is not None]
+        return [
+            {'name': asset.name, 'source_bytes': asset.source_bytes,
+             'minified_bytes': len(asset.content.encode('utf-8'))}
+            for asset in assets
+        ]
+
+_registry: Optional[StaticAssetRegistry] = None
+_registry_lock = threading.Lock()
+
+def get_asset_registry() -> StaticAssetRegistry:
+    """获取进程级静态资源缓存"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = StaticAssetRegistry()
+        return _registry
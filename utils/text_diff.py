@@ -0,0 +1,169 @@
+"""字符级文本差异与编辑距离
+
+基于Myers的O(ND)差异算法：编辑距离D为把原文变为新文所需的最少插入+删除字符数，
+只保存一条对角线数组，空间与文本长度成线性关系；差异脚本用"中间蛇"分治求出，
+同样只需线性空间。AI草稿与监督者修改后的内容通常只有少量差异（D远小于文本长度），
+耗时接近线性。
+"""
+from typing import List, Sequence, Tuple
+
+EQUAL = "equal"
+INSERT = "insert"
+DELETE = "delete"
+REPLACE = "replace"
+
+# (操作, 原文起, 原文止, 新文起, 新文止)，与difflib.SequenceMatcher.get_opcodes格式一致
+Opcode = Tuple[str, int, int, int, int]
+
+def _trim(a: Sequence, b: Sequence) -> Tuple[int, int]:
+    """公共前缀和公共后缀的长度"""
+    limit = min(len(a), len(b))
+    prefix = 0
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[len(a) - 1 - suffix] == b[len(b) - 1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+def edit_distance(a: Sequence, b: Sequence) -> int:
+    """计算插入/删除编辑距离（替换一个字符计为删除+插入）
+
+    Args:
+        a: 原文
+        b: 新文
+
+    Returns:
+        最少的插入+删除字符数
+    """
+    prefix, suffix = _trim(a, b)
+    n, m = len(a) - prefix - suffix, len(b) - prefix - suffix
+    if n == 0 or m == 0:
+        return n + m
+
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    for d in range(n + m + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[prefix + x] == b[prefix + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return d
+    return n + m
+
+def _middle_snake(a: Sequence, a0: int, n: int, b: Sequence, b0: int,
+                  m: int) -> Tuple[int, int, int, int, int]:
+    """求最短编辑路径中间的一段对角线（"中间蛇"）
+
+    同时从两端按编辑次数递增搜索，两个方向的路径相遇处即为中间蛇。
+
+    Returns:
+        (编辑距离, 蛇起点x, 蛇起点y, 蛇终点x, 蛇终点y)，坐标相对于a0/b0
+    """
+    delta = n - m
+    odd = delta & 1
+    offset = n + m + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    for d in range((n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1):
+                if x + backward[offset + delta - k] >= n:
+                    return 2 * d - 1, start_x, start_y, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a0 + n - x - 1] == b[b0 + m - y - 1]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d:
+                if x + forward[offset + delta - k] >= n:
+                    return 2 * d, n - x, m - y, n - start_x, m - start_y
+    raise AssertionError("未找到中间蛇")
+
+def _diff(a: Sequence, a0: int, n: int, b: Sequence, b0: int, m: int, ops: List[Opcode]):
+    """分治求a[a0:a0+n]到b[b0:b0+m]的差异，按顺序追加到ops"""
+    if n == 0 or m == 0:
+        if n:
+            ops.append((DELETE, a0, a0 + n, b0, b0))
+        elif m:
+            ops.append((INSERT, a0, a0, b0, b0 + m))
+        return
+
+    d, x, y, u, v = _middle_snake(a, a0, n, b, b0, m)
+    if d > 1:
+        _diff(a, a0, x, b, b0, y, ops)
+        if u > x:
+            ops.append((EQUAL, a0 + x, a0 + u, b0 + y, b0 + v))
+        _diff(a, a0 + u, n - u, b, b0 + v, m - v, ops)
+        return
+
+    # 编辑距离不超过1：只差一个字符的插入或删除
+    prefix = 0
+    while prefix < min(n, m) and a[a0 + prefix] == b[b0 + prefix]:
+        prefix += 1
+    if prefix:
+        ops.append((EQUAL, a0, a0 + prefix, b0, b0 + prefix))
+    if n > m:
+        ops.append((DELETE, a0 + prefix, a0 + prefix + 1, b0 + prefix, b0 + prefix))
+        rest = prefix + 1, prefix
+    elif m > n:
+        ops.append((INSERT, a0 + prefix, a0 + prefix, b0 + prefix, b0 + prefix + 1))
+        rest = prefix, prefix + 1
+    else:
+        return
+    if rest[0] < n:
+        ops.append((EQUAL, a0 + rest[0], a0 + n, b0 + rest[1], b0 + m))
+
+def diff_opcodes(a: Sequence, b: Sequence) -> List[Opcode]:
+    """计算字符级差异
+
+    相邻的删除和插入合并为替换，输出格式与difflib.SequenceMatcher.get_opcodes一致。
+
+    Args:
+        a: 原文
+        b: 新文
+
+    Returns:
+        覆盖全文的操作列表
+    """
+    prefix, suffix = _trim(a, b)
+    raw: List[Opcode] = []
+    if prefix:
+        raw.append((EQUAL, 0, prefix, 0, prefix))
+    _diff(a, prefix, len(a) - prefix - suffix, b, prefix, len(b) - prefix - suffix, raw)
+    if suffix:
+        raw.append((EQUAL, len(a) - suffix, len(a), len(b) - suffix, len(b)))
+
+    ops: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in raw:
+        if ops:
+            last_tag, k1, k2, l1, l2 = ops[-1]
+            if last_tag == tag or (last_tag in (DELETE, INSERT, REPLACE) and tag in (DELETE, INSERT)):
+                merged = last_tag if last_tag == tag else REPLACE
+                ops[-1] = (merged, k1, i2, l1, j2)
+                continue
+        ops.append((tag, i1, i2, j1, j2))
+    return ops
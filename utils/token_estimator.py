@@ -0,0 +1,92 @@
+"""离线token估算工具"""
+import re
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+from utils.constants import (
+    TOKEN_CACHE_SIZE, TOKENS_PER_CJK_CHAR, CHARS_PER_ASCII_TOKEN,
+    DIGITS_PER_TOKEN, REQUEST_OVERHEAD_TOKENS
+)
+
+# 单次扫描的分词模式：中日韩字符 / 英文单词 / 数字串 / 空白 / 其他符号
+_TOKEN_PATTERN = re.compile(
+    r'(?P<cjk>[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff01-\uff60]+)'
+    r'|(?P<word>[A-Za-z]+)'
+    r'|(?P<digit>\d+)'
+    r'|(?P<space>\s+)'
+    r'|(?P<other>.)',
+    re.DOTALL
+)
+
+def _count_tokens(text: str) -> int:
+    """按字符类别估算token数（未缓存）"""
+    tokens = 0.0
+    for match in _TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        length = match.end() - match.start()
+        if kind == 'cjk':
+            tokens += length * TOKENS_PER_CJK_CHAR
+        elif kind == 'word':
+            tokens += -(-length // CHARS_PER_ASCII_TOKEN)
+        elif kind == 'digit':
+            tokens += -(-length // DIGITS_PER_TOKEN)
+        elif kind == 'other':
+            tokens += 1
+    return int(tokens + 0.5)
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数（按字符串缓存）
+
+    针对中文文本调优：中日韩字符及全角标点按字计，英文单词按约4个字母1个token计，
+    数字串按约3位1个token计，空白不计。结果偏保守，适合用于预算和超限拦截。
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return 0
+    return _count_tokens(text)
+
+def estimate_request_tokens(query: str, inputs: Optional[Dict[str, Any]] = None) -> int:
+    """估算一次Dify请求的输入token数
+
+    Args:
+        query: 查询内容
+        inputs: 应用输入变量
+
+    Returns:
+        估算的输入token数（含固定开销）
+    """
+    tokens = REQUEST_OVERHEAD_TOKENS + estimate_tokens(query)
+    for value in (inputs or {}).values():
+        if isinstance(value, str):
+            tokens += estimate_tokens(value)
+    return tokens
+
+def check_prompt_tokens(text: str, max_tokens: int) -> Tuple[bool, str]:
+    """检查提示词是否超出token上限
+
+    与estimate_tokens使用同一估算（不含请求固定开销），界面显示的预计token数应与之一致。
+
+    Args:
+        text: 提示词
+        max_tokens: token上限
+
+    Returns:
+        (是否有效, 错误信息)
+    """
+    tokens = estimate_tokens(text)
+    if tokens > max_tokens:
+        return False, f"内容过长：预计 {tokens} tokens，超过上限 {max_tokens} tokens"
+    return True, ""
+
+def cache_info():
+    """获取估算缓存的命中统计
+
+    Returns:
+        functools的缓存统计信息
+    """
+    return estimate_tokens.cache_info()